@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains an in-process embedded (Baum-Welch)
+    re-estimation engine that can be used instead of HERest: utterances
+    are split over worker processes which accumulate occupancy, mean
+    and variance statistics with forward-backward over the
+    concatenated phone HMMs, the parent reduces the accumulators and
+    writes the updated models ('macros' and 'hmmdefs') to the next
+    'hmm<N>' dir. No HTK tools are needed...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import codecs
+import logging
+import multiprocessing
+
+try:
+    import numpy as np
+except ImportError:
+    print("WARNING: Could not import numpy (necessary for native re-estimation)...")
+
+from speechlabels import parse_path
+
+from HALIGN_MMF import MMFModelSet
+from HALIGN_Features import read_htk_params
+from HALIGN_Viterbi import GaussianMixtureTable, distinct_states, build_network, combine_arcs, log_sum_exp
+
+log = logging.getLogger("HAlign.BaumWelch")
+
+#as in HERest...
+MIN_EXAMPLES = 3          #models with fewer examples are not updated ('-m')
+MIN_MIXWEIGHT = 1.0e-5    #HTK's MINMIX
+MIN_VARIANCE = 1.0e-6     #used if no 'varFloor1' macro is defined
+VARFLOOR_MACRO = "varFloor1"
+
+
+def read_mlf_labels(mlflocation):
+    """ Returns a dict of basename -> list of labels from an MLF
+        (times, scores and auxiliary labels are ignored)...
+    """
+    labels = {}
+    items = None
+    with codecs.open(mlflocation, encoding="utf-8") as infh:
+        for line in infh:
+            line = line.strip()
+            if not line or line == "#!MLF!#":
+                continue
+            if line.startswith('"'):
+                items = labels.setdefault(parse_path(line.strip('"'))[2], [])
+            elif line == ".":
+                items = None
+            else:
+                fields = line.split()
+                if len(fields) >= 3 and fields[0].isdigit() and fields[1].isdigit():
+                    items.append(fields[2])
+                else:
+                    items.append(fields[0])
+    return labels
+
+
+class Accumulators(object):
+    """ Sufficient statistics for one model set (indexed as in the
+        'GaussianMixtureTable' of its distinct states), summed over
+        utterances...
+    """
+
+    def __init__(self, table):
+        numstates, maxmixes, vecsize = table.precisions.shape
+        self.occ = np.zeros((numstates, maxmixes))
+        self.sumx = np.zeros((numstates, maxmixes, vecsize))
+        self.sumxsq = np.zeros((numstates, maxmixes, vecsize))
+        self.transcounts = {}   #physical model name -> counts matrix
+        self.examples = {}      #physical model name -> number of occurrences
+        self.totallogprob = 0.0
+        self.numframes = 0
+        self.failed = []
+
+
+    def add(self, other):
+        """ Reduce 'other' into these accumulators...
+        """
+        self.occ += other.occ
+        self.sumx += other.sumx
+        self.sumxsq += other.sumxsq
+        for name, counts in other.transcounts.items():
+            if name in self.transcounts:
+                self.transcounts[name] += counts
+            else:
+                self.transcounts[name] = counts
+        for name, count in other.examples.items():
+            self.examples[name] = self.examples.get(name, 0) + count
+        self.totallogprob += other.totallogprob
+        self.numframes += other.numframes
+        self.failed.extend(other.failed)
+
+
+def forward_backward(loglik, entrylp, exitlp, transitions, beam=None):
+    """ Log domain forward and backward passes over the banded network
+        (see 'HALIGN_Viterbi.combine_arcs'). Returns alpha, beta and the
+        total log likelihood. Forward probabilities further than
+        'beam' below the best at each frame are pruned...
+    """
+    numframes, numstates = loglik.shape
+    alpha = np.empty((numframes, numstates))
+    beta = np.empty((numframes, numstates))
+    alpha[0] = entrylp + loglik[0]
+    acc = np.empty(numstates)
+    for t in range(1, numframes):
+        acc.fill(-np.inf)
+        for offset, translp in transitions.items():
+            scores = alpha[t - 1] + translp
+            if offset >= 0:
+                acc[offset:] = np.logaddexp(acc[offset:], scores[:numstates - offset])
+            else:
+                acc[:numstates + offset] = np.logaddexp(acc[:numstates + offset], scores[-offset:])
+        alpha[t] = acc + loglik[t]
+        if beam is not None:
+            alpha[t][alpha[t] < np.max(alpha[t]) - beam] = -np.inf
+    totallogprob = np.logaddexp.reduce(alpha[-1] + exitlp)
+
+    beta[-1] = exitlp
+    for t in range(numframes - 2, -1, -1):
+        acc.fill(-np.inf)
+        nextscores = beta[t + 1] + loglik[t + 1]
+        for offset, translp in transitions.items():
+            if offset >= 0:
+                acc[:numstates - offset] = np.logaddexp(acc[:numstates - offset], translp[:numstates - offset] + nextscores[offset:])
+            else:
+                acc[-offset:] = np.logaddexp(acc[-offset:], translp[-offset:] + nextscores[:numstates + offset])
+        beta[t] = acc
+    return alpha, beta, totallogprob
+
+
+def accumulate_utterance(modelset, table, accs, feats, modelnames, beam=None):
+    """ Add the statistics of one utterance to 'accs'...
+    """
+    stateindices, offsets, arcs = build_network(modelset, table, modelnames)
+    entrylp, exitlp, transitions = combine_arcs(arcs, offsets[-1], np.logaddexp)
+    mixll = table.mixtureLogLikelihoods(feats, stateindices)
+    loglik = log_sum_exp(mixll, axis=2)
+    with np.errstate(invalid="ignore"):
+        alpha, beta, totallogprob = forward_backward(loglik, entrylp, exitlp, transitions, beam)
+    if not np.isfinite(totallogprob):
+        return False
+
+    #state and mixture occupancies...
+    with np.errstate(invalid="ignore", under="ignore"):
+        gamma = np.exp(alpha + beta - totallogprob)
+        mixgamma = np.nan_to_num(gamma[:, :, np.newaxis] * np.exp(mixll - loglik[:, :, np.newaxis]))
+    numframes, numstates, maxmixes = mixgamma.shape
+    flatgamma = mixgamma.reshape((numframes, -1)).T
+    feats = feats.astype(np.float64)
+    np.add.at(accs.occ, stateindices, mixgamma.sum(axis=0))
+    np.add.at(accs.sumx, stateindices, np.dot(flatgamma, feats).reshape((numstates, maxmixes, -1)))
+    np.add.at(accs.sumxsq, stateindices, np.dot(flatgamma, feats ** 2).reshape((numstates, maxmixes, -1)))
+
+    #expected transition counts: summed per network offset, then shared out to arcs and their components...
+    xi = {}
+    with np.errstate(invalid="ignore", under="ignore"):
+        nextscores = loglik[1:] + beta[1:]
+        for offset, translp in transitions.items():
+            xi[offset] = np.zeros(numstates)
+            if offset >= 0:
+                xi[offset][:numstates - offset] = np.exp(alpha[:-1, :numstates - offset] + translp[:numstates - offset] +
+                                                         nextscores[:, offset:] - totallogprob).sum(axis=0)
+            else:
+                xi[offset][-offset:] = np.exp(alpha[:-1, -offset:] + translp[-offset:] +
+                                              nextscores[:, :numstates + offset] - totallogprob).sum(axis=0)
+        for src, dst, lp, components in arcs:
+            if src is None:
+                count = gamma[0, dst] * np.exp(lp - entrylp[dst])
+            elif dst is None:
+                count = np.exp(alpha[-1, src] + lp - totallogprob)
+            else:
+                count = xi[dst - src][src] * np.exp(lp - transitions[dst - src][src])
+            for m, i, j in components:
+                name = modelset[modelnames[m]].name
+                if name not in accs.transcounts:
+                    accs.transcounts[name] = np.zeros(modelset.hmms[name].transp.shape)
+                accs.transcounts[name][i, j] += count
+
+    for name in modelnames:
+        name = modelset[name].name
+        accs.examples[name] = accs.examples.get(name, 0) + 1
+    accs.totallogprob += totallogprob
+    accs.numframes += numframes
+    return True
+
+
+def load_models(mmflocations, hmmlist):
+    """ Load MMFs keeping only the models in 'hmmlist'...
+    """
+    modelset = MMFModelSet(mmflocations)
+    for name in list(modelset.hmms):
+        if name not in hmmlist:
+            del modelset.hmms[name]
+    return modelset
+
+
+def _accumulate(args):
+    """ Worker: accumulate statistics over a list of (featlocation,
+        modelnames)...
+    """
+    mmflocations, hmmlist, utterances, beam = args
+    modelset = load_models(mmflocations, hmmlist)
+    table = GaussianMixtureTable(distinct_states(modelset))
+    accs = Accumulators(table)
+    for featlocation, modelnames in utterances:
+        feats, sampperiod, parmkind = read_htk_params(featlocation)
+        if not accumulate_utterance(modelset, table, accs, feats, modelnames, beam):
+            accs.failed.append(featlocation)
+    return accs
+
+
+def update_models(modelset, table, accs):
+    """ Re-estimate means, variances, mixture weights and transition
+        matrices of 'modelset' from 'accs' (in place)...
+    """
+    varfloor = modelset.variances.get(VARFLOOR_MACRO)
+    examples = {}
+    for name, hmm in modelset.hmms.items():
+        for state in hmm.emittingStates():
+            examples[id(state)] = examples.get(id(state), 0) + accs.examples.get(name, 0)
+
+    for q, state in enumerate(distinct_states(modelset)):
+        stateocc = accs.occ[q].sum()
+        if examples[id(state)] < MIN_EXAMPLES or stateocc <= 0.0:
+            continue
+        weights = []
+        for m, mixture in enumerate(state.mixtures):
+            occ = accs.occ[q, m]
+            if occ > 0.0:
+                mixture.mean = accs.sumx[q, m] / occ
+                variance = accs.sumxsq[q, m] / occ - mixture.mean ** 2
+                if varfloor is not None:
+                    mixture.variance = np.maximum(variance, varfloor)
+                else:
+                    mixture.variance = np.maximum(variance, MIN_VARIANCE)
+            weights.append(max(occ / stateocc, MIN_MIXWEIGHT))
+        for mixture, weight in zip(state.mixtures, weights):
+            mixture.weight = weight / sum(weights)
+
+    #tied transition matrices are updated once from the sum of their counts...
+    transpcounts = {}
+    for name, counts in accs.transcounts.items():
+        hmm = modelset.hmms[name]
+        if accs.examples.get(name, 0) < MIN_EXAMPLES:
+            continue
+        if id(hmm.transp) in transpcounts:
+            transpcounts[id(hmm.transp)][1] += counts
+        else:
+            transpcounts[id(hmm.transp)] = [hmm.transp, counts.copy()]
+    for transp, counts in transpcounts.values():
+        for i in range(len(transp) - 1):
+            rowcount = counts[i].sum()
+            if rowcount > 0.0:
+                transp[i] = counts[i] / rowcount
+
+
+def write_stats(modelset, accs, hmmlist, statslocation):
+    """ Write state occupation statistics in the format of HERest's
+        '-s' option (used by HHEd's 'RO' command)...
+    """
+    stateocc = accs.occ.sum(axis=1)
+    table_index = dict((id(state), q) for q, state in enumerate(distinct_states(modelset)))
+    with codecs.open(statslocation, "w", encoding="utf-8") as outfh:
+        for i, name in enumerate(hmmlist):
+            hmm = modelset[name]
+            occs = [stateocc[table_index[id(state)]] for state in hmm.emittingStates()]
+            outfh.write('%4d "%s" %4d ' % (i + 1, name, accs.examples.get(hmm.name, 0)) +
+                        " ".join("%10f" % occ for occ in occs) + "\n")
+
+
+def native_herest(featlocations, numprocs, mlflocation, prev_dir, output_dir, phonelistlocation,
+                  statslocation=None, beam=None):
+    """ Do one iteration of embedded re-estimation of the models in
+        'prev_dir' (restricted to those in 'phonelistlocation') using
+        'numprocs' worker processes and write the result to
+        'output_dir'. Returns the average log prob per frame...
+    """
+    with codecs.open(phonelistlocation, encoding="utf-8") as infh:
+        hmmlist = [line.strip() for line in infh if line.strip()]
+    mmflocations = [os.path.join(prev_dir, fn) for fn in ["macros", "hmmdefs"] if os.path.isfile(os.path.join(prev_dir, fn))]
+    modelset = load_models(mmflocations, hmmlist)
+    table = GaussianMixtureTable(distinct_states(modelset))
+
+    labels = read_mlf_labels(mlflocation)
+    utterances = []
+    for featlocation in featlocations:
+        basename = parse_path(featlocation)[2]
+        if basename not in labels:
+            raise Exception("No transcription for '%s' in '%s'" % (basename, mlflocation))
+        utterances.append((featlocation, labels[basename]))
+
+    #interleave so that shards are of similar size...
+    numprocs = max(1, min(numprocs, len(utterances)))
+    shards = [(mmflocations, hmmlist, utterances[i::numprocs], beam) for i in range(numprocs)]
+    if numprocs == 1:
+        results = [_accumulate(shards[0])]
+    else:
+        pool = multiprocessing.Pool(numprocs)
+        try:
+            results = pool.map(_accumulate, shards)
+        finally:
+            pool.close()
+            pool.join()
+
+    accs = Accumulators(table)
+    for result in results:
+        accs.add(result)
+    for featlocation in accs.failed:
+        log.warning("native_herest: no path through '%s' (utterance ignored)." % (featlocation))
+    if accs.numframes == 0:
+        raise Exception("native_herest: no utterances could be used for re-estimation...")
+
+    update_models(modelset, table, accs)
+    modelset.save(output_dir)
+    if statslocation is not None:
+        write_stats(modelset, accs, hmmlist, statslocation)
+
+    avglogprob_perframe = accs.totallogprob / accs.numframes
+    log.info("native_herest: %s utterances (%s frames), average log prob per frame: %f"
+             % (len(utterances) - len(accs.failed), accs.numframes, avglogprob_perframe))
+    return avglogprob_perframe
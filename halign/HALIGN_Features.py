@@ -13,11 +13,22 @@ import codecs
 import os
 import sys
 import logging
-import subprocess
+import struct
+import hashlib
+import binascii
+import wave
+import multiprocessing
 from tempfile import NamedTemporaryFile
+from multiprocessing.pool import ThreadPool
 from ConfigParser import ConfigParser
 
 from speechlabels import parse_path, type_files
+from HALIGN_Run import run_command, METRICS
+
+try:
+    import numpy as np
+except ImportError:
+    print("WARNING: Could not import numpy (necessary to read/write HTK parameter files in-process)...")
 
 #EXTs
 WAVE_EXT = "wav"
@@ -25,11 +36,335 @@ MFCC_EXT = "mfc"
 #PSMFCC_EXT = "psmfc"
 TIMES_EXT = "times"
 
+#FILENAMES
+CONFHASH_FN = "hcopy_config.md5"   #sidecar in feature dirs
+
 #BINs
 HCOPY_BIN = "HCopy"
 
+#HTK parameter kind qualifiers (see HTK book: "Parameter Kinds")
+HTK_HEADER_FMT = ">iihh"
+HTK_BASEMASK = 0o77
+HTK_COMPRESSED = 0o2000
+HTK_CRC = 0o10000
+HTK_MFCC = 6
+HTK_QUALIFIERS = {"E": 0o100,
+                  "N": 0o200,
+                  "D": 0o400,
+                  "A": 0o1000,
+                  "C": 0o2000,
+                  "Z": 0o4000,
+                  "K": 0o10000,
+                  "0": 0o20000}
+HTK_LZERO = -1.0e10           #log(0) as used by HTK
+HTK_MINLARG = 2.45e-308       #smallest argument to log
+
+#MFCC front-end defaults (as HCopy)
+MFCC_DEFAULTS = {"windowsize": "256000.0",
+                 "usehamming": "T",
+                 "preemcoef": "0.97",
+                 "numchans": "20",
+                 "ceplifter": "22",
+                 "numceps": "12",
+                 "lofreq": "-1.0",
+                 "hifreq": "-1.0",
+                 "usepower": "F",
+                 "zmeansource": "F",
+                 "rawenergy": "T",
+                 "enormalise": "T",
+                 "escale": "0.1",
+                 "silfloor": "50.0",
+                 "deltawindow": "2",
+                 "accwindow": "2",
+                 "savecompressed": "F",
+                 "savewithcrc": "T"}
+
 log = logging.getLogger("HAlign.Features")
 
+
+def read_htk_params(location):
+    """ Read an HTK parameter file (uncompressed or compressed, with or
+        without CRC) into a (numsamples, veclen) float32 array...
+
+        Returns (array, sampperiod, parmkind) with 'sampperiod' in
+        HTK time units (100ns)...
+    """
+    with open(location, "rb") as infh:
+        numsamples, sampperiod, sampsize, parmkind = struct.unpack(HTK_HEADER_FMT, infh.read(12))
+        data = infh.read()
+    if parmkind & HTK_BASEMASK in (0, 5, 10): #WAVEFORM, IREFC and DISCRETE are not float vectors
+        raise Exception("Unsupported parameter kind in '%s'" % (location))
+    if parmkind & HTK_COMPRESSED:
+        veclen = sampsize // 2
+        #scale and offset vectors are stored in place of the first 4 "samples"...
+        scale = np.frombuffer(data, dtype=">f4", count=veclen)
+        offset = np.frombuffer(data, dtype=">f4", count=veclen, offset=veclen * 4)
+        numsamples -= 4
+        shorts = np.frombuffer(data, dtype=">i2", count=numsamples * veclen, offset=veclen * 8)
+        params = (shorts.reshape((numsamples, veclen)) + offset) / scale
+    else:
+        veclen = sampsize // 4
+        params = np.frombuffer(data, dtype=">f4", count=numsamples * veclen).reshape((numsamples, veclen))
+    return params.astype(np.float32), sampperiod, parmkind & ~(HTK_COMPRESSED | HTK_CRC)
+
+
+
+def write_htk_params(location, params, sampperiod, parmkind, compressed=False, crc=False):
+    """ Write a (numsamples, veclen) array to an HTK parameter file
+        (optionally compressed and/or with CRC)...
+
+        Compression is done as in HTK (HParm) in single precision:
+        A = 2*32767/(xmax-xmin), B = (xmax+xmin)*32767/(xmax-xmin)
+        and x_short = short(A*x - B), i.e. truncated towards zero...
+    """
+    params = np.asarray(params, dtype=np.float32)
+    numsamples, veclen = params.shape
+    if compressed:
+        xmax = params.max(axis=0)
+        xmin = params.min(axis=0)
+        same = xmax == xmin
+        therange = np.where(same, np.float32(1.0), xmax - xmin)
+        scale = np.where(same, np.float32(1.0), np.float32(2 * 32767) / therange).astype(np.float32)
+        offset = np.where(same, xmax, (xmax + xmin) * np.float32(32767) / therange).astype(np.float32)
+        shorts = np.clip(np.trunc(params * scale - offset), -32767, 32767)
+        data = (scale.astype(">f4").tobytes() + offset.astype(">f4").tobytes() +
+                shorts.astype(">i2").tobytes())
+        header = struct.pack(HTK_HEADER_FMT, numsamples + 4, int(sampperiod), veclen * 2, parmkind | HTK_COMPRESSED)
+    else:
+        data = params.astype(">f4").tobytes()
+        header = struct.pack(HTK_HEADER_FMT, numsamples, int(sampperiod), veclen * 4, parmkind)
+    if crc:
+        header = header[:10] + struct.pack(">h", struct.unpack(">h", header[10:])[0] | HTK_CRC)
+        data += struct.pack(">H", binascii.crc_hqx(data, 0))
+    with open(location, "wb") as outfh:
+        outfh.write(header)
+        outfh.write(data)
+
+
+def read_wav(location):
+    """ Read 16-bit (mono) linear PCM samples from a wav file...
+
+        Returns (samples, sampperiod) with 'sampperiod' in HTK time
+        units (100ns)...
+    """
+    wavfh = wave.open(location, "rb")
+    try:
+        if wavfh.getsampwidth() != 2 or wavfh.getnchannels() != 1:
+            raise Exception("Only 16-bit mono wav files supported: '%s'" % (location))
+        sampperiod = 1.0e7 / wavfh.getframerate()
+        samples = np.frombuffer(wavfh.readframes(wavfh.getnframes()), dtype="<i2")
+    finally:
+        wavfh.close()
+    return samples.astype(np.float64), sampperiod
+
+
+def parse_targetkind(targetkind):
+    """ Returns the HTK parameter kind code for a TARGETKIND string
+        such as 'MFCC_0_D_A_Z'...
+    """
+    parts = targetkind.upper().split("_")
+    if parts[0] != "MFCC":
+        raise Exception("Unsupported TARGETKIND (only MFCC based kinds): '%s'" % (targetkind))
+    parmkind = HTK_MFCC
+    for qualifier in parts[1:]:
+        try:
+            parmkind |= HTK_QUALIFIERS[qualifier]
+        except KeyError:
+            raise Exception("Unsupported TARGETKIND qualifier: '_%s'" % (qualifier))
+    if parmkind & HTK_QUALIFIERS["N"] or (parmkind & HTK_QUALIFIERS["A"] and not parmkind & HTK_QUALIFIERS["D"]):
+        raise Exception("Unsupported TARGETKIND: '%s'" % (targetkind))
+    return parmkind
+
+
+def regression(params, window):
+    """ HTK regression coefficients (deltas) over 'window' frames on
+        each side, with the first/last frames replicated at the
+        edges...
+    """
+    numframes = len(params)
+    padded = np.concatenate([np.repeat(params[:1], window, axis=0),
+                             params,
+                             np.repeat(params[-1:], window, axis=0)])
+    deltas = np.zeros_like(params)
+    for theta in range(1, window + 1):
+        deltas += theta * (padded[window + theta: window + theta + numframes] -
+                           padded[window - theta: window - theta + numframes])
+    return deltas / (2.0 * sum(theta * theta for theta in range(1, window + 1)))
+
+
+class MFCCFrontEnd(object):
+    """ In-process equivalent of HCopy for MFCC based target kinds
+        (qualifiers _E, _0, _D, _A, _Z, _C and _K), reading the same
+        configuration keys... All frames of a file are processed
+        together (as arrays)...
+    """
+
+    def __init__(self, parms):
+        """ 'parms' is a list of (key, value) as read from the
+            [HCOPY] and [GLOBAL] sections...
+        """
+        conf = dict(MFCC_DEFAULTS)
+        conf.update([(k.lower(), v.strip()) for k, v in parms])
+        istrue = lambda key: conf[key].upper() in ["T", "TRUE"]
+
+        self.parmkind = parse_targetkind(conf["targetkind"])
+        self.targetrate = float(conf["targetrate"])
+        self.windowsize = float(conf["windowsize"])
+        self.usehamming = istrue("usehamming")
+        self.preemcoef = float(conf["preemcoef"])
+        self.numchans = int(conf["numchans"])
+        self.ceplifter = float(conf["ceplifter"])
+        self.numceps = int(conf["numceps"])
+        self.lofreq = float(conf["lofreq"])
+        self.hifreq = float(conf["hifreq"])
+        self.usepower = istrue("usepower")
+        self.zmeansource = istrue("zmeansource")
+        self.rawenergy = istrue("rawenergy")
+        self.enormalise = istrue("enormalise")
+        self.escale = float(conf["escale"])
+        self.silfloor = float(conf["silfloor"])
+        self.deltawindow = int(conf["deltawindow"])
+        self.accwindow = int(conf["accwindow"])
+        self.compressed = istrue("savecompressed") or bool(self.parmkind & HTK_COMPRESSED)
+        self.crc = istrue("savewithcrc") or bool(self.parmkind & HTK_CRC)
+        self.parmkind &= ~(HTK_COMPRESSED | HTK_CRC)
+        self._filterbanks = {}
+
+
+    def fromConfig(cls, location):
+        """ Load from a features config file...
+        """
+        with codecs.open(location, encoding="utf-8") as fh:
+            featcfp = ConfigParser()
+            featcfp.readfp(fh)
+        return cls(list(featcfp.items("HCOPY")) + list(featcfp.items("GLOBAL")))
+    fromConfig = classmethod(fromConfig)
+
+
+    def _filterbank(self, fftn, sampperiod):
+        """ Mel filterbank weights (fftn // 2 + 1, numchans) for the FFT
+            bins, as set up by HTK (HSigP: InitFBank)...
+        """
+        key = (fftn, sampperiod)
+        if key in self._filterbanks:
+            return self._filterbanks[key]
+        nby2 = fftn // 2
+        fres = 1.0e7 / (sampperiod * fftn * 700.0)
+        mel = lambda k: 1127.0 * np.log(1.0 + (k - 1.0) * fres)   #k is the (1-based) HTK bin
+        if self.lofreq < 0.0:
+            mlo, klo = 0.0, 2
+        else:
+            mlo = 1127.0 * np.log(1.0 + self.lofreq / 700.0)
+            klo = max(2, int(self.lofreq * sampperiod * 1.0e-7 * fftn + 2.5))
+        if self.hifreq < 0.0:
+            mhi, khi = mel(nby2 + 1), nby2
+        else:
+            mhi = 1127.0 * np.log(1.0 + self.hifreq / 700.0)
+            khi = min(nby2, int(self.hifreq * sampperiod * 1.0e-7 * fftn + 0.5))
+        #centre frequencies of channels 1..numchans+1 (index 0 unused)...
+        maxchan = self.numchans + 1
+        centres = np.zeros(maxchan + 1)
+        centres[1:] = mlo + (mhi - mlo) * np.arange(1, maxchan + 1) / float(maxchan)
+
+        weights = np.zeros((nby2 + 1, self.numchans))
+        ks = np.arange(klo, khi + 1)
+        melks = mel(ks)
+        #lower channel of each bin: number of centres below its mel frequency...
+        lochans = np.searchsorted(centres[1:], melks, side="left")
+        upper = np.where(lochans > 0, centres[np.minimum(lochans + 1, maxchan)], centres[1])
+        lower = np.where(lochans > 0, centres[np.maximum(lochans, 1)], mlo)
+        lowts = (upper - melks) / (upper - lower)
+        bins = ks - 1
+        haslo = lochans > 0
+        weights[bins[haslo], lochans[haslo] - 1] += lowts[haslo]
+        hashi = lochans < self.numchans
+        weights[bins[hashi], lochans[hashi]] += 1.0 - lowts[hashi]
+        self._filterbanks[key] = weights
+        return weights
+
+
+    def process(self, samples, sampperiod):
+        """ Convert waveform 'samples' (with 'sampperiod' in 100ns
+            units) to a (numframes, veclen) float32 parameter array...
+        """
+        framesize = int(round(self.windowsize / sampperiod))
+        framerate = int(round(self.targetrate / sampperiod))
+        numframes = (len(samples) - framesize) // framerate + 1
+        if numframes < 1:
+            raise Exception("Waveform too short for a single frame")
+        indices = np.arange(framesize)[np.newaxis, :] + framerate * np.arange(numframes)[:, np.newaxis]
+        frames = samples[indices]
+
+        if self.zmeansource:
+            frames = frames - frames.mean(axis=1)[:, np.newaxis]
+        rawenergies = (frames * frames).sum(axis=1)
+        if self.preemcoef > 0.0:
+            frames = np.concatenate([frames[:, :1] * (1.0 - self.preemcoef),
+                                     frames[:, 1:] - self.preemcoef * frames[:, :-1]], axis=1)
+        if self.usehamming:
+            frames = frames * (0.54 - 0.46 * np.cos(2.0 * np.pi * np.arange(framesize) / (framesize - 1)))
+        energies = rawenergies if self.rawenergy else (frames * frames).sum(axis=1)
+
+        #filterbank...
+        fftn = 2
+        while fftn < framesize:
+            fftn *= 2
+        spectrum = np.abs(np.fft.rfft(frames, n=fftn))
+        if self.usepower:
+            spectrum = spectrum * spectrum
+        fbank = np.log(np.maximum(np.dot(spectrum, self._filterbank(fftn, sampperiod)), 1.0))
+
+        #cepstra (DCT and liftering)...
+        mfnorm = np.sqrt(2.0 / self.numchans)
+        ceps = np.arange(1, self.numceps + 1)
+        dct = np.cos(np.pi * ceps[np.newaxis, :] / self.numchans *
+                     (np.arange(1, self.numchans + 1)[:, np.newaxis] - 0.5))
+        statics = [np.dot(fbank, dct) * mfnorm]
+        if self.ceplifter > 0.0:
+            statics[0] *= 1.0 + self.ceplifter / 2.0 * np.sin(ceps * np.pi / self.ceplifter)
+        if self.parmkind & HTK_QUALIFIERS["0"]:
+            statics.append(fbank.sum(axis=1)[:, np.newaxis] * mfnorm)
+        if self.parmkind & HTK_QUALIFIERS["Z"]:
+            statics = [s - s.mean(axis=0) for s in statics]
+        if self.parmkind & HTK_QUALIFIERS["E"]:
+            logenergies = np.where(energies < HTK_MINLARG, HTK_LZERO, np.log(np.maximum(energies, HTK_MINLARG)))
+            if self.enormalise:
+                maxe = logenergies.max()
+                logenergies = np.maximum(logenergies, maxe - self.silfloor * np.log(10.0) / 10.0)
+                logenergies = 1.0 - (maxe - logenergies) * self.escale
+            statics.append(logenergies[:, np.newaxis])
+        params = np.hstack(statics)
+
+        #dynamic coefficients...
+        if self.parmkind & HTK_QUALIFIERS["D"]:
+            deltas = regression(params, self.deltawindow)
+            if self.parmkind & HTK_QUALIFIERS["A"]:
+                params = np.hstack([params, deltas, regression(deltas, self.accwindow)])
+            else:
+                params = np.hstack([params, deltas])
+        return params.astype(np.float32)
+
+
+    def makeFeats(self, wavlocation, featlocation):
+        """ Convert a wav file to an HTK parameter file...
+        """
+        samples, sampperiod = read_wav(wavlocation)
+        params = self.process(samples, sampperiod)
+        write_htk_params(featlocation, params, self.targetrate, self.parmkind,
+                         compressed=self.compressed, crc=self.crc)
+        return len(params)
+
+
+def _native_hcopy(args):
+    """ Worker: make features for a list of (wavlocation, featlocation)
+        pairs with 'MFCCFrontEnd'...
+    """
+    parms, pairs = args
+    frontend = MFCCFrontEnd(parms)
+    for wavlocation, featlocation in pairs:
+        frontend.makeFeats(wavlocation, featlocation)
+    return len(pairs)
+
 class AudioFeatures(object):
     """ Manages audio and feature files...
     """
@@ -76,74 +411,169 @@ class AudioFeatures(object):
                     outfh.write(k.upper() + " = " + v + "\n")
 
 
-    def dumpSCP(self, f, targetdir):
-        """ Dump SCP to file...
+    def dumpSCP(self, f, targetdir, wavfilelist=None):
+        """ Dump SCP to file (for 'wavfilelist', by default all wav
+            files)...
         """
+        if wavfilelist is None:
+            wavfilelist = self.wavfilelist
         try:
-            for filename in self.wavfilelist:
+            for filename in wavfilelist:
                 f.write(os.path.join(self.wavlocation, filename) + " " + \
                         os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT])) + "\n")
             f.flush()
         except AttributeError:
             with codecs.open(f, "w", encoding="utf-8") as outfh:
-                for filename in self.wavfilelist:
+                for filename in wavfilelist:
                     outfh.write(os.path.join(self.wavlocation, filename) + " " + \
                                 os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT])) + "\n")
 
 
-    def makeFeats(self, targetdir):
-        """ Run HCopy to make features...
+    def getConfHash(self, frontend="hcopy"):
+        """ Hash of the HCopy configuration and front-end (to detect
+            features made differently)...
+        """
+        return hashlib.md5(repr([frontend] + sorted(self.hcopy_parms)).encode("utf-8")).hexdigest()
+
+
+    def outdatedFeats(self, targetdir, frontend="hcopy"):
+        """ Returns the wav files for which no up to date feature file
+            exists in 'targetdir': the feature file is missing, older
+            than the wav file or the HCopy configuration (recorded in
+            the sidecar file) differs...
+        """
+        try:
+            with codecs.open(os.path.join(targetdir, CONFHASH_FN), encoding="utf-8") as infh:
+                samecfg = infh.read().strip() == self.getConfHash(frontend)
+        except IOError:
+            samecfg = False
+        if not samecfg:
+            return self.wavfilelist[:]
+
+        outdated = []
+        for filename in self.wavfilelist:
+            featlocation = os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT]))
+            try:
+                if os.path.getmtime(featlocation) > os.path.getmtime(os.path.join(self.wavlocation, filename)):
+                    continue
+            except OSError:
+                pass
+            outdated.append(filename)
+        return outdated
+
+
+    def removeOrphanFeats(self, targetdir):
+        """ Remove feature files in 'targetdir' for which the wav file
+            no longer exists (the feature list used for training is
+            read from 'targetdir')... Returns the number removed.
+        """
+        basenames = set(parse_path(filename)[2] for filename in self.wavfilelist)
+        orphans = [filename for filename in type_files(os.listdir(targetdir), MFCC_EXT)
+                   if parse_path(filename)[2] not in basenames]
+        for filename in orphans:
+            os.remove(os.path.join(targetdir, filename))
+        if orphans:
+            log.info("makeFeats: removed %s feature files without wav files from '%s'." % (len(orphans), targetdir))
+        return len(orphans)
+
+
+    def makeFeats(self, targetdir, numprocs=1, frontend="hcopy"):
+        """ Run HCopy (or if 'frontend' is "native" the in-process
+            'MFCCFrontEnd') to make features... Only features which
+            are not up to date are made (see 'outdatedFeats') and
+            those without wav files are removed. If
+            'numprocs' > 1 then (at most) 'numprocs' processes are run
+            concurrently on shards of the files...
         """
         if not os.path.isdir(targetdir):
             raise Exception("'%s' is not an existing directory..." % targetdir)
-        elif len(os.listdir(targetdir)) != 0:
-            print("WARNING: Directory '%s' is not empty..." % targetdir)
-            #raise Exception("'%s' is not empty..." % targetdir)
         elif self.hcopy_parms is None:
             raise Exception("HCopy configuration not loaded...")
 
-        #write SCP...
-        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        self.dumpSCP(tempscpfh, targetdir)
+        self.removeOrphanFeats(targetdir)
+        wavfilelist = self.outdatedFeats(targetdir, frontend)
+        log.info("makeFeats: %s of %s feature files up to date in '%s'."
+                 % (len(self.wavfilelist) - len(wavfilelist), len(self.wavfilelist), targetdir))
+        METRICS.update(numfiles=len(wavfilelist))
+        if not wavfilelist:
+            return 0
+        #features made from here on are recorded as made with the current config only once done...
+        try:
+            os.remove(os.path.join(targetdir, CONFHASH_FN))
+        except OSError:
+            pass
+
+        if frontend == "native":
+            self._makeNativeFeats(targetdir, wavfilelist, numprocs)
+            with codecs.open(os.path.join(targetdir, CONFHASH_FN), "w", encoding="utf-8") as outfh:
+                outfh.write(self.getConfHash(frontend) + "\n")
+            return 0
 
         #write hcopy.conf
         tempconffh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
         self.dumpFeatConf(tempconffh)
 
+        #write SCPs (largest files spread over shards)...
+        wavfilelist.sort(key=lambda fn: os.path.getsize(os.path.join(self.wavlocation, fn)), reverse=True)
+        numshards = max(1, min(numprocs, len(wavfilelist)))
+        tempscpfhs = []
+        cmds = []
+        for i in range(numshards):
+            tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+            self.dumpSCP(tempscpfh, targetdir, wavfilelist[i::numshards])
+            tempscpfhs.append(tempscpfh)
+            cmds.append(" ".join([HCOPY_BIN,
+                                  "-A",
+                                  "-D",
+                                  "-V",
+                                  "-T",
+                                  "1",
+                                  "-C",
+                                  tempconffh.name,
+                                  "-S",
+                                  tempscpfh.name]))
+
         #execute HCopy...
-        p = subprocess.Popen(" ".join([HCOPY_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-C",
-                                       tempconffh.name,
-                                       "-S",
-                                       tempscpfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("makeFeats:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("makeFeats:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
-
-        tempscpfh.close()
-        tempconffh.close()
-
-        if returnval != 0:
-            raise Exception(HCOPY_BIN + " failed with code: " + unicode(returnval))
-
-        return returnval
+        pool = ThreadPool(numshards)
+        try:
+            results = pool.map(lambda args: run_command(*args),
+                               [(cmd, "makeFeats (shard %s/%s)" % (i + 1, numshards)) for i, cmd in enumerate(cmds)])
+        finally:
+            pool.close()
+            pool.join()
+            for tempscpfh in tempscpfhs:
+                tempscpfh.close()
+            tempconffh.close()
+
+        for i, (returnval, so, se) in enumerate(results):
+            if returnval != 0:
+                raise Exception(HCOPY_BIN + " failed on shard " + unicode(i + 1) + " with code: " + unicode(returnval))
+
+        with codecs.open(os.path.join(targetdir, CONFHASH_FN), "w", encoding="utf-8") as outfh:
+            outfh.write(self.getConfHash(frontend) + "\n")
+
+        return 0
+
+
+    def _makeNativeFeats(self, targetdir, wavfilelist, numprocs):
+        """ Make features for 'wavfilelist' with 'MFCCFrontEnd' in (at
+            most) 'numprocs' processes...
+        """
+        pairs = [(os.path.join(self.wavlocation, filename),
+                  os.path.join(targetdir, ".".join([parse_path(filename)[2], MFCC_EXT])))
+                 for filename in wavfilelist]
+        numshards = max(1, min(numprocs, len(pairs)))
+        shards = [(self.hcopy_parms, pairs[i::numshards]) for i in range(numshards)]
+        if numshards == 1:
+            _native_hcopy(shards[0])
+        else:
+            pool = multiprocessing.Pool(numshards)
+            try:
+                pool.map(_native_hcopy, shards)
+            finally:
+                pool.close()
+                pool.join()
+        log.info("makeFeats: made %s feature files in-process." % (len(pairs)))
         
 
 # try:
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains an in-process reader and writer for HTK
+    Master Macro Files (MMFs: 'macros' and 'hmmdefs' as written by
+    HERest/HHEd) with single stream, diagonal covariance Gaussian
+    mixture state output distributions...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import re
+import codecs
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    print("WARNING: Could not import numpy (necessary to load HTK models in-process)...")
+
+log = logging.getLogger("HAlign.MMF")
+
+#MMF files written by HERest/HHEd in a model dir...
+MACROS_FN = "macros"
+HMMDEFS_FN = "hmmdefs"
+
+#Tokens are: quoted strings, <KEYWORDS>, macro types (~x) or plain values
+TOKEN_RE = re.compile(r'"[^"]*"|<[^>]*>|~[a-zA-Z]|[^\s<>"~]+')
+UNSUPPORTED_KEYWORDS = ["<FULLC>", "<INVCOVAR>", "<LLTCOVAR>", "<XFORM>", "<DURATION>", "<TMIX>", "<DPROB>"]
+
+
+class Mixture(object):
+    """ Diagonal covariance Gaussian mixture component...
+    """
+    def __init__(self, weight, mean, variance, macro=None, meanmacro=None, variancemacro=None):
+        self.weight = weight
+        self.mean = mean
+        self.variance = variance
+        self.macro = macro                  #name if defined as a '~m' macro
+        self.meanmacro = meanmacro          #name if the mean is a '~u' macro
+        self.variancemacro = variancemacro  #name if the variance is a '~v' macro
+
+
+    def gconst(self):
+        """ HTK's GCONST: log((2pi)^n * prod(variance))...
+        """
+        return len(self.variance) * np.log(2 * np.pi) + np.sum(np.log(self.variance))
+
+
+class HMMState(object):
+    """ Emitting state (output distribution) that may be shared
+        between models (if defined as a '~s' macro)...
+    """
+    def __init__(self, mixtures, macro=None):
+        self.mixtures = mixtures
+        self.macro = macro
+
+
+class HMMDef(object):
+    """ A single HMM: 'states' maps HTK state numbers (2 to
+        numstates-1) to 'HMMState' objects and 'transp' is the full
+        (numstates x numstates) transition probability matrix (which
+        may be shared if defined as a '~t' macro)...
+    """
+    def __init__(self, name, numstates, states, transp, transpmacro=None):
+        self.name = name
+        self.numstates = numstates
+        self.states = states
+        self.transp = transp
+        self.transpmacro = transpmacro
+
+
+    def emittingStates(self):
+        """ List of 'HMMState' in state number order...
+        """
+        return [self.states[i] for i in range(2, self.numstates)]
+
+
+    def isTee(self):
+        """ A 'tee' model (e.g. 'sp') can be skipped without consuming
+            any frames...
+        """
+        return self.transp[0, self.numstates - 1] > 0.0
+
+
+class MMFModelSet(object):
+    """ A set of HMMs loaded from one or more MMF files, with tied
+        states and transition matrices kept shared...
+    """
+
+    def __init__(self, mmflocations=[], hmmlistlocation=None):
+        """ Load all MMF files in 'mmflocations' (in order, macros
+            first) and an optional HMM list (lines of 'logical
+            [physical]' names, e.g. a tied list)...
+        """
+        self.options = []       #global option tokens ('~o')
+        self.vecsize = None
+        self.parmkind = None
+        self.hmms = {}
+        self.states = {}        #'~s' macros
+        self.transps = {}       #'~t' macros
+        self.mixtures = {}      #'~m' macros
+        self.means = {}         #'~u' macros
+        self.variances = {}     #'~v' macros (includes 'varFloorN')
+        self.logical = {}
+        self.definitions = []   #(macrotype, name, MMF basename) in load order
+        for location in mmflocations:
+            self.load(location)
+        if hmmlistlocation is not None:
+            self.loadHMMList(hmmlistlocation)
+
+
+    def fromModelDir(cls, hmmdir, hmmlistlocation=None):
+        """ Load the 'macros' (if present) and 'hmmdefs' files in an
+            'hmm<N>' dir...
+        """
+        locations = [os.path.join(hmmdir, fn) for fn in [MACROS_FN, HMMDEFS_FN]]
+        return cls([location for location in locations if os.path.isfile(location)], hmmlistlocation)
+    fromModelDir = classmethod(fromModelDir)
+
+
+    def __getitem__(self, name):
+        """ Lookup HMM by logical (or physical) name...
+        """
+        return self.hmms[self.logical.get(name, name)]
+
+
+    def __contains__(self, name):
+        return self.logical.get(name, name) in self.hmms
+
+
+    def loadHMMList(self, location):
+        """ Load logical to physical model name mapping...
+        """
+        with codecs.open(location, encoding="utf-8") as infh:
+            for line in infh:
+                fields = line.split()
+                if len(fields) == 2:
+                    self.logical[fields[0]] = fields[1]
+                elif len(fields) == 1:
+                    self.logical[fields[0]] = fields[0]
+
+
+    def load(self, location):
+        """ Parse an MMF file adding all macros and models...
+        """
+        log.debug("Loading MMF '%s'." % (location))
+        with codecs.open(location, encoding="utf-8") as infh:
+            self._tokens = TOKEN_RE.findall(infh.read())
+        self._pos = 0
+        try:
+            while self._peek() is not None:
+                token = self._next()
+                if not token.startswith("~"):
+                    raise Exception("expected macro definition, found '%s'" % (token))
+                macrotype = token[1].lower()
+                if macrotype == "o":
+                    self.options = self._parseOptions()
+                    self.definitions.append(("o", None, os.path.basename(location)))
+                    continue
+                name = self._next().strip('"')
+                self.definitions.append((macrotype, name, os.path.basename(location)))
+                if macrotype == "h":
+                    self.hmms[name] = self._parseHMM(name)
+                elif macrotype == "s":
+                    self.states[name] = self._parseState(macro=name)
+                elif macrotype == "t":
+                    self.transps[name] = self._parseTransP()
+                elif macrotype == "m":
+                    self.mixtures[name] = self._parseMixPDF(1.0, macro=name)
+                elif macrotype == "u":
+                    self.means[name] = self._parseVector("<MEAN>")
+                elif macrotype == "v":
+                    self.variances[name] = self._parseVector("<VARIANCE>")
+                else:
+                    raise Exception("unsupported macro type '%s'" % (token))
+        except (IndexError, ValueError) as e:
+            raise Exception("Error parsing MMF '%s' near token %s: %s" % (location, self._pos, e))
+        finally:
+            del self._tokens
+
+
+    def _peek(self):
+        try:
+            token = self._tokens[self._pos]
+        except IndexError:
+            return None
+        if token.startswith("<"):
+            return token.upper()
+        return token
+
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise IndexError("unexpected end of file")
+        self._pos += 1
+        if token in UNSUPPORTED_KEYWORDS:
+            raise Exception("unsupported MMF keyword %s" % (token))
+        return token
+
+
+    def _expect(self, keyword):
+        token = self._next()
+        if token != keyword:
+            raise ValueError("expected %s, found '%s'" % (keyword, token))
+
+
+    def _parseOptions(self):
+        """ Global options (these may also appear inside an HMM
+            definition before <NUMSTATES>), returns the tokens...
+        """
+        options = []
+        while self._peek() is not None and self._peek().startswith("<") and \
+                self._peek() not in ["<BEGINHMM>", "<NUMSTATES>"]:
+            token = self._next()
+            options.append(token)
+            if token == "<VECSIZE>":
+                self.vecsize = int(self._next())
+                options.append(unicode(self.vecsize))
+            elif token == "<STREAMINFO>":
+                numstreams = int(self._next())
+                streaminfo = [self._next() for i in range(numstreams)]
+                if numstreams != 1:
+                    raise Exception("only single stream models are supported")
+                options.extend([unicode(numstreams)] + streaminfo)
+            elif token not in ["<DIAGC>", "<NULLD>", "<POISSOND>", "<GAMMAD>", "<GEND>"]:
+                self.parmkind = token.strip("<>")
+        return options
+
+
+    def _parseVector(self, keyword):
+        self._expect(keyword)
+        size = int(self._next())
+        return np.array([float(self._next()) for i in range(size)])
+
+
+    def _parseTransP(self):
+        self._expect("<TRANSP>")
+        size = int(self._next())
+        return np.array([float(self._next()) for i in range(size * size)]).reshape((size, size))
+
+
+    def _parseMixPDF(self, weight, macro=None):
+        if self._peek() == "~m":
+            self._next()
+            mixture = self.mixtures[self._next().strip('"')]
+            return Mixture(weight, mixture.mean, mixture.variance, mixture.macro,
+                           mixture.meanmacro, mixture.variancemacro)
+        if self._peek() == "<RCLASS>":
+            self._next()
+            self._next()
+        meanmacro = None
+        if self._peek() == "~u":
+            self._next()
+            meanmacro = self._next().strip('"')
+            mean = self.means[meanmacro]
+        else:
+            mean = self._parseVector("<MEAN>")
+        variancemacro = None
+        if self._peek() == "~v":
+            self._next()
+            variancemacro = self._next().strip('"')
+            variance = self.variances[variancemacro]
+        else:
+            variance = self._parseVector("<VARIANCE>")
+        if self._peek() == "<GCONST>":
+            self._next()
+            self._next()   #recomputed when needed...
+        return Mixture(weight, mean, variance, macro, meanmacro, variancemacro)
+
+
+    def _parseState(self, macro=None):
+        if self._peek() == "~s":
+            self._next()
+            return self.states[self._next().strip('"')]
+        if self._peek() == "<NUMMIXES>":
+            self._next()
+            self._next()
+        if self._peek() == "<SWEIGHTS>":
+            self._next()
+            for i in range(int(self._next())):
+                self._next()
+        if self._peek() == "<STREAM>":
+            self._next()
+            self._next()
+        mixtures = []
+        if self._peek() == "<MIXTURE>":
+            while self._peek() == "<MIXTURE>":
+                self._next()
+                self._next()
+                mixtures.append(self._parseMixPDF(float(self._next())))
+        else:
+            mixtures.append(self._parseMixPDF(1.0))
+        return HMMState(mixtures, macro)
+
+
+    def _parseHMM(self, name):
+        self._parseOptions()
+        self._expect("<BEGINHMM>")
+        self._parseOptions()
+        self._expect("<NUMSTATES>")
+        numstates = int(self._next())
+        states = {}
+        while self._peek() == "<STATE>":
+            self._next()
+            statenum = int(self._next())
+            states[statenum] = self._parseState()
+        transpmacro = None
+        if self._peek() == "~t":
+            self._next()
+            transpmacro = self._next().strip('"')
+            transp = self.transps[transpmacro]
+        else:
+            transp = self._parseTransP()
+        self._expect("<ENDHMM>")
+        if sorted(states) != list(range(2, numstates)) or transp.shape != (numstates, numstates):
+            raise ValueError("inconsistent definition of HMM '%s'" % (name))
+        return HMMDef(name, numstates, states, transp, transpmacro)
+
+
+    def save(self, hmmdir):
+        """ Write all definitions to MMF files with the same names
+            (e.g. 'macros' and 'hmmdefs') in 'hmmdir' in the order they
+            were loaded (models that were removed are skipped)...
+        """
+        outfhs = {}
+        try:
+            for macrotype, name, filename in self.definitions:
+                if filename not in outfhs:
+                    outfhs[filename] = codecs.open(os.path.join(hmmdir, filename), "w", encoding="utf-8")
+                outfh = outfhs[filename]
+                if macrotype == "o":
+                    outfh.write("~o\n" + self._formatOptions() + "\n")
+                elif macrotype == "h":
+                    if name in self.hmms:
+                        outfh.write('~h "%s"\n' % (name) + self._formatHMM(self.hmms[name]))
+                elif macrotype == "s":
+                    outfh.write('~s "%s"\n' % (name) + self._formatState(self.states[name]))
+                elif macrotype == "t":
+                    outfh.write('~t "%s"\n' % (name) + self._formatTransP(self.transps[name]))
+                elif macrotype == "m":
+                    outfh.write('~m "%s"\n' % (name) + self._formatMixPDF(self.mixtures[name]))
+                elif macrotype == "u":
+                    outfh.write('~u "%s"\n' % (name) + self._formatVector("<MEAN>", self.means[name]))
+                elif macrotype == "v":
+                    outfh.write('~v "%s"\n' % (name) + self._formatVector("<VARIANCE>", self.variances[name]))
+        finally:
+            for outfh in outfhs.values():
+                outfh.close()
+
+
+    def _formatOptions(self):
+        text = ""
+        for token in self.options:
+            if token in ["<STREAMINFO>", "<VECSIZE>"] and text:
+                text += "\n"
+            if token.startswith("<"):
+                text += token
+            else:
+                text += " " + token
+        return text
+
+
+    def _formatVector(self, keyword, vector):
+        return "%s %d\n" % (keyword, len(vector)) + "".join(" %e" % v for v in vector) + "\n"
+
+
+    def _formatTransP(self, transp):
+        return "<TRANSP> %d\n" % (len(transp)) + "".join("".join(" %e" % v for v in row) + "\n" for row in transp)
+
+
+    def _formatMixPDF(self, mixture):
+        """ Mixture component definition (shared means and variances are
+            written as macro references)...
+        """
+        if mixture.meanmacro is not None:
+            text = '~u "%s"\n' % (mixture.meanmacro)
+        else:
+            text = self._formatVector("<MEAN>", mixture.mean)
+        if mixture.variancemacro is not None:
+            text += '~v "%s"\n' % (mixture.variancemacro)
+        else:
+            text += self._formatVector("<VARIANCE>", mixture.variance)
+        return text + "<GCONST> %e\n" % (mixture.gconst())
+
+
+    def _formatMixRef(self, mixture):
+        """ Mixture component in a state: a reference if defined as a
+            '~m' macro...
+        """
+        if mixture.macro is not None:
+            return '~m "%s"\n' % (mixture.macro)
+        return self._formatMixPDF(mixture)
+
+
+    def _formatState(self, state):
+        if len(state.mixtures) == 1:
+            return self._formatMixRef(state.mixtures[0])
+        text = "<NUMMIXES> %d\n" % (len(state.mixtures))
+        for i, mixture in enumerate(state.mixtures):
+            text += "<MIXTURE> %d %e\n" % (i + 1, mixture.weight) + self._formatMixRef(mixture)
+        return text
+
+
+    def _formatHMM(self, hmm):
+        text = "<BEGINHMM>\n<NUMSTATES> %d\n" % (hmm.numstates)
+        for i in range(2, hmm.numstates):
+            text += "<STATE> %d\n" % (i)
+            if hmm.states[i].macro is not None:
+                text += '~s "%s"\n' % (hmm.states[i].macro)
+            else:
+                text += self._formatState(hmm.states[i])
+        if hmm.transpmacro is not None:
+            text += '~t "%s"\n' % (hmm.transpmacro)
+        else:
+            text += self._formatTransP(hmm.transp)
+        return text + "<ENDHMM>\n"
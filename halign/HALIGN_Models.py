@@ -13,17 +13,24 @@ import os
 import sys
 import re
 import logging
-import subprocess
 import shutil
+import struct
+import heapq
+import json
+import hashlib
+import inspect
 from tempfile import NamedTemporaryFile, mkdtemp
 import tarfile
+from multiprocessing.pool import ThreadPool
 from ConfigParser import ConfigParser
 
 from speechlabels import parse_path, type_files, triphone_2_monophone
+from HALIGN_Run import run_command, measured, METRICS, HEREST_KEEP, CommandGroup
 
 #EXTs
 WAVE_EXT = "wav"
 MFCC_EXT = "mfc"
+MLF_EXT = "mlf"
 
 #BINs
 HINIT_BIN = "HInit"
@@ -43,16 +50,674 @@ TB_THRESHOLD = "350.0"
 HEREST_PRUNING_PARM1 = "250.0"
 HEREST_PRUNING_PARM2 = "150.0"
 HEREST_PRUNING_PARM3 = "1000.0"
+#adaptive pruning: all utterances are processed with the first beam,
+#those that fail are retried with each wider beam (the last is the
+#ceiling, "0.0" disables HVite pruning)...
+HEREST_BEAMS = ["120.0", "250.0", "500.0", HEREST_PRUNING_PARM3]
+HVITE_BEAMS = ["150.0", "300.0", "600.0", "0.0"]
 
 #FILENAMES
 VFLOORS_FN = "vFloors"
 MACROS_FN = "macros"
 HMMDEFS_FN = "hmmdefs"
+MODELLIST_FN = "modellist"
+HEREST_ACC_FN = "HER%s.acc"
 
 
 log = logging.getLogger("HAlign.Models")
 
 
+def partition(lst, n):
+    """ Split 'lst' into 'n' consecutive parts of (nearly) equal length...
+    """
+    division = len(lst) / float(n)
+    return [lst[int(round(division * i)): int(round(division * (i + 1)))] for i in range(n)]
+
+
+def parse_herest_logprob(so):
+    """ Get the average log probability per frame and the number of
+        frames seen from HERest output (-T 1)... The number of frames
+        is None if it was not reported...
+    """
+    try:
+        avglogprob_perframe = float(re.findall(b"Reestimation complete.*", so)[0].split()[-1])
+    except IndexError:
+        return None, None
+    try:
+        numframes = float(re.findall(b"total frames seen.*", so)[0].split()[-1])
+    except IndexError:
+        numframes = None
+    return avglogprob_perframe, numframes
+
+
+def reestimate_until_converged(reestimate, stage, miniterations, maxiterations, threshold):
+    """ Call 'reestimate' (a pass of embedded re-estimation returning
+        the average log probability per frame) at most 'maxiterations'
+        times, stopping (after at least 'miniterations') when the
+        relative improvement drops below 'threshold'. A pass of which
+        the log probability is unknown (None) does not count as
+        converged... Returns the trajectory...
+    """
+    trajectory = []
+    for i in range(maxiterations):
+        avglogprob_perframe = reestimate()
+        trajectory.append(avglogprob_perframe)
+        if avglogprob_perframe is None:
+            log.warning("Re-estimation (%s) iteration %s: average log prob per frame unknown (HERest output not parsed)"
+                        % (stage, i + 1))
+        elif len(trajectory) > 1 and trajectory[-2] is not None:
+            improvement = (trajectory[-1] - trajectory[-2]) / abs(trajectory[-2])
+            log.info("Re-estimation (%s) iteration %s: average log prob per frame = %f (relative improvement = %e)"
+                     % (stage, i + 1, avglogprob_perframe, improvement))
+            if len(trajectory) >= miniterations and improvement < threshold:
+                break
+        else:
+            log.info("Re-estimation (%s) iteration %s: average log prob per frame = %f"
+                     % (stage, i + 1, avglogprob_perframe))
+
+    log.info("Re-estimation (%s) done after %s iterations, trajectory: %s"
+             % (stage, len(trajectory), ", ".join(["unknown" if x is None else "%f" % (x) for x in trajectory])))
+    return trajectory
+
+
+def mlf_label_counts(mlflocation):
+    """ Count the number of occurrences of each label in an MLF...
+    """
+    counts = {}
+    with codecs.open(mlflocation, encoding="utf-8") as infh:
+        for line in infh:
+            linelist = line.split()
+            if not linelist or linelist[0] in ["#!MLF!#", "."] or line.startswith('"'):
+                continue
+            counts[linelist[-1]] = counts.get(linelist[-1], 0) + 1
+    return counts
+
+
+def _bootstrap_phone(parms):
+    """ HInit followed by HRest for a single phone, returns the phone
+        and a list of (binname, returnval, stdout, stderr)...
+    """
+    phone = parms["phone"]
+    outputs = []
+    tempmlf = None
+    try:
+        if parms["transcriptionset"] is not None:
+            tempmlf = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+            parms["transcriptionset"].unmapMLF(parms["bootmlf_location"], tempmlf.name, phone)
+            tempmlf.flush()
+            mlf_location = tempmlf.name
+        else:
+            mlf_location = parms["bootmlf_location"]
+        #hinit
+        returnval, so, se = run_command(" ".join([HINIT_BIN,
+                                                  "-A",
+                                                  "-D",
+                                                  "-V",
+                                                  "-T",
+                                                  "1",
+                                                  "-l",
+                                                  '"'+phone+'"',
+                                                  "-o",
+                                                  '"'+phone+'"',
+                                                  "-I",
+                                                  mlf_location,
+                                                  "-M",
+                                                  parms["hinit_output_dir"],
+                                                  "-S",
+                                                  parms["scp_location"],
+                                                  parms["protofilelocation"]]),
+                                        caller="doBootstrapAll (%s: %s)" % (HINIT_BIN, phone),
+                                        group=parms["commands"])
+        outputs.append((HINIT_BIN, returnval, so, se))
+        if returnval != 0:
+            return phone, outputs
+        #hrest
+        returnval, so, se = run_command(" ".join([HREST_BIN,
+                                                  "-A",
+                                                  "-D",
+                                                  "-V",
+                                                  "-T",
+                                                  "1",
+                                                  "-l",
+                                                  '"'+phone+'"',
+                                                  "-I",
+                                                  mlf_location,
+                                                  "-M",
+                                                  parms["hrest_output_dir"],
+                                                  "-S",
+                                                  parms["scp_location"],
+                                                  os.path.join(parms["hinit_output_dir"], phone)]),
+                                        caller="doBootstrapAll (%s: %s)" % (HREST_BIN, phone),
+                                        group=parms["commands"])
+        outputs.append((HREST_BIN, returnval, so, se))
+    except Exception as e:
+        raise Exception("Bootstrapping failed for phone '%s': %s" % (phone, e))
+    finally:
+        if tempmlf is not None:
+            tempmlf.close()
+    return phone, outputs
+
+
+def bootstrap_phones(phonelist, numprocs, protofilelocation, bootmlf_location, scp_location,
+                     hinit_output_dir, hrest_output_dir, transcriptionset=None):
+    """ Runs HInit and HRest for all phones in 'phonelist' using a
+        pool of 'numprocs' workers. Phones with the most boot data
+        are scheduled first and the first failure is raised
+        (naming the phone) after killing the HInit/HRest commands
+        still running...
+    """
+    counts = mlf_label_counts(bootmlf_location)
+    commands = CommandGroup()
+    if transcriptionset is not None:
+        amount = lambda phone: counts.get(transcriptionset.phonemap[phone], 0)
+    else:
+        amount = lambda phone: counts.get(phone, 0)
+
+    parmslist = [{"phone": phone,
+                  "transcriptionset": transcriptionset,
+                  "bootmlf_location": bootmlf_location,
+                  "scp_location": scp_location,
+                  "protofilelocation": protofilelocation,
+                  "hinit_output_dir": hinit_output_dir,
+                  "hrest_output_dir": hrest_output_dir,
+                  "commands": commands}
+                 for phone in sorted(phonelist, key=amount, reverse=True)]
+
+    pool = ThreadPool(max(1, min(numprocs, len(parmslist))))
+    try:
+        for phone, outputs in pool.imap_unordered(_bootstrap_phone, parmslist):
+            for binname, returnval, so, se in outputs:
+                if returnval != 0:
+                    raise Exception(binname + " failed for phone '" + phone + "' with code: " + unicode(returnval))
+    finally:
+        #threads cannot be stopped: kill their tools so they return...
+        commands.kill()
+        pool.terminate()
+        pool.join()
+
+
+def htk_numframes(featlocation):
+    """ Number of frames (samples) in an HTK parameter file according
+        to its header...
+    """
+    with open(featlocation, "rb") as infh:
+        nsamples, sampperiod, sampsize, parmkind = struct.unpack(str(">iihh"), infh.read(12))
+    return nsamples
+
+
+def partition_by_frames(featlocations, n):
+    """ Split 'featlocations' into (at most) 'n' shards with roughly
+        equal total number of frames (longest files first, each
+        assigned to the currently lightest shard)...
+    """
+    heap = [(0, i, []) for i in range(min(n, len(featlocations)))]
+    for numframes, featlocation in sorted([(htk_numframes(featlocation), featlocation)
+                                           for featlocation in featlocations], reverse=True):
+        total, i, shard = heapq.heappop(heap)
+        shard.append(featlocation)
+        heapq.heappush(heap, (total + numframes, i, shard))
+    return [shard for total, i, shard in sorted(heap, key=lambda x: x[1])]
+
+
+def mlf_basenames(mlflocation):
+    """ Set of basenames with a label entry in 'mlflocation' (empty
+        if HVite did not write it)...
+    """
+    basenames = set()
+    if not os.path.isfile(mlflocation):
+        return basenames
+    with codecs.open(mlflocation, encoding="utf-8") as infh:
+        for line in infh:
+            if line.startswith('"'):
+                basenames.add(parse_path(line.strip().strip('"'))[2])
+    return basenames
+
+
+def hvite_label_location(options):
+    """ Directory ('-l') and extension ('-y', default 'rec') of the
+        label files written by HVite with 'options'. The directory is
+        None if labels go to an MLF ('-i')...
+    """
+    args = " ".join(options).split()
+    labeldir, labelext = None, "rec"
+    for opt, value in zip(args, args[1:]):
+        if opt == "-l" and value.strip('"') != "*":
+            labeldir = value
+        elif opt == "-y":
+            labelext = value
+    if "-i" in args:
+        labeldir = None
+    return labeldir, labelext
+
+
+def remove_hvite_outputs(featlocations, options):
+    """ Remove label files left in the '-l' directory by a previous
+        run for 'featlocations' so that they cannot hide a failure...
+    """
+    labeldir, labelext = hvite_label_location(options)
+    if labeldir is None:
+        return
+    for featlocation in featlocations:
+        lablocation = os.path.join(labeldir, ".".join([parse_path(featlocation)[2], labelext]))
+        if os.path.isfile(lablocation):
+            os.remove(lablocation)
+
+
+def missing_hvite_outputs(featlocations, options, outmlflocation=None):
+    """ Get the list of feature files for which HVite produced no
+        labels, i.e. those without an entry in 'outmlflocation' or
+        without a label file in the '-l' directory of 'options'
+        (HVite only reports these as warnings on stderr)...
+    """
+    if outmlflocation is not None:
+        found = mlf_basenames(outmlflocation)
+        return [featlocation for featlocation in featlocations
+                if parse_path(featlocation)[2] not in found]
+    labeldir, labelext = hvite_label_location(options)
+    if labeldir is None:
+        return []
+    return [featlocation for featlocation in featlocations
+            if not os.path.isfile(os.path.join(labeldir, ".".join([parse_path(featlocation)[2], labelext])))]
+
+
+def parse_pruned_utterances(output):
+    """ Get the list of feature files that HERest skipped because of
+        pruning errors ('bad data or over pruning' warnings)...
+    """
+    return [unicode(fn, encoding="utf-8") for fn in re.findall(b"File (\\S+) - bad data or over pruning", output)]
+
+
+def report_beam_retries(caller, widened, failed):
+    """ Log and record (in 'METRICS') the utterances that needed a wider
+        beam ('widened' maps them to the beam that succeeded) and those
+        that 'failed' at the widest beam...
+    """
+    if widened:
+        log.warning("%s: %s utterances needed a wider beam:\n\t%s" % (caller, len(widened),
+                                                                    "\n\t".join("%s (%s)" % (fn, widened[fn])
+                                                                                for fn in sorted(widened))))
+    if failed:
+        log.warning("%s: %s utterances failed with the widest beam:\n\t%s" % (caller, len(failed), "\n\t".join(failed)))
+    METRICS.update(failed=len(failed), widened=widened)
+
+
+def merge_mlfs(mlflocations, outmlflocation, order):
+    """ Concatenate MLFs into 'outmlflocation' with label entries
+        sorted according to the list of basenames in 'order'...
+    """
+    entries = {}
+    for mlflocation in mlflocations:
+        with codecs.open(mlflocation, encoding="utf-8") as infh:
+            for line in infh:
+                if line.startswith("#!MLF!#"):
+                    continue
+                if line.startswith('"'):
+                    key = parse_path(line.strip().strip('"'))[2]
+                    entries[key] = []
+                entries[key].append(line)
+    rank = dict((basename, i) for i, basename in enumerate(order))
+    with codecs.open(outmlflocation, "w", encoding="utf-8") as outfh:
+        outfh.write("#!MLF!#\n")
+        for key in sorted(entries, key=lambda k: rank.get(k, len(rank))):
+            outfh.writelines(entries[key])
+
+
+def sharded_hvite(featlocations, numprocs, options, trailing, outmlflocation=None, caller="HVite", beams=None):
+    """ Runs HVite concurrently on (at most) 'numprocs' shards of
+        'featlocations' balanced by total number of frames. 'options'
+        and 'trailing' are the HVite arguments before and after the
+        SCP... If 'outmlflocation' is given, each shard writes its own
+        MLF which are merged (in the order of 'featlocations') into
+        'outmlflocation'. If 'beams' are given, all utterances are
+        decoded with the first (tight) beam and those that fail are
+        decoded again with each wider beam in turn. Returns the list of
+        failed utterances (those without output labels)...
+    """
+    if beams is not None:
+        return _beam_retry_hvite(featlocations, numprocs, options, trailing, outmlflocation, caller, beams)
+
+    shards = partition_by_frames(featlocations, numprocs)
+    remove_hvite_outputs(featlocations, options)
+
+    tempfhs = []
+    shardmlfs = []
+    cmds = []
+    for shard in shards:
+        tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+        tempscpfh.writelines([featlocation + "\n" for featlocation in shard])
+        tempscpfh.flush()
+        tempfhs.append(tempscpfh)
+        args = [HVITE_BIN] + options + ["-S", tempscpfh.name]
+        if outmlflocation is not None:
+            tempmlffh = NamedTemporaryFile(mode="w+t", suffix="." + MLF_EXT)#, encoding="utf-8")
+            tempfhs.append(tempmlffh)
+            shardmlfs.append(tempmlffh.name)
+            args += ["-i", tempmlffh.name]
+        cmds.append(" ".join(args + trailing))
+    pool = ThreadPool(len(cmds))
+    try:
+        results = pool.map(lambda args: run_command(*args),
+                           [(cmd, "%s (shard %s/%s)" % (caller, i + 1, len(cmds)))
+                            for i, cmd in enumerate(cmds)])
+    finally:
+        pool.close()
+        pool.join()
+
+    allfailed = []
+    for i, (returnval, so, se) in enumerate(results):
+        if returnval != 0:
+            for tempfh in tempfhs:
+                tempfh.close()
+            raise Exception(HVITE_BIN + " failed on shard " + unicode(i + 1) + " with code: " + unicode(returnval))
+        failed = missing_hvite_outputs(shards[i], options, shardmlfs[i] if shardmlfs else None)
+        if failed:
+            log.warning("%s (shard %s/%s): %s utterances failed:\n\t%s" % (caller, i + 1, len(results), len(failed),
+                                                                          "\n\t".join(failed)))
+        allfailed.extend(failed)
+
+    if outmlflocation is not None:
+        merge_mlfs(shardmlfs, outmlflocation, [parse_path(featlocation)[2] for featlocation in featlocations])
+    for tempfh in tempfhs:
+        tempfh.close()
+
+    METRICS.update(failed=len(allfailed))
+    return allfailed
+
+
+def _beam_retry_hvite(featlocations, numprocs, options, trailing, outmlflocation, caller, beams):
+    """ Adaptive pruning for 'sharded_hvite' (each pass writes its own
+        MLF, later passes replace the entries of earlier passes)...
+    """
+    remaining = featlocations
+    widened = {}
+    tempmlffhs = []
+    try:
+        for i, beam in enumerate(beams):
+            passmlflocation = None
+            if outmlflocation is not None:
+                tempmlffh = NamedTemporaryFile(mode="w+t", suffix="." + MLF_EXT)#, encoding="utf-8")
+                tempmlffhs.append(tempmlffh)
+                passmlflocation = tempmlffh.name
+            failed = set(sharded_hvite(remaining, numprocs, options + ["-t", beam], trailing,
+                                       passmlflocation, "%s (beam %s)" % (caller, beam)))
+            if i > 0:
+                widened.update((featlocation, beam) for featlocation in remaining if featlocation not in failed)
+            remaining = [featlocation for featlocation in remaining if featlocation in failed]
+            if not remaining:
+                break
+        if outmlflocation is not None:
+            merge_mlfs([tempmlffh.name for tempmlffh in tempmlffhs], outmlflocation,
+                       [parse_path(featlocation)[2] for featlocation in featlocations])
+    finally:
+        for tempmlffh in tempmlffhs:
+            tempmlffh.close()
+
+    report_beam_retries(caller, widened, remaining)
+    return remaining
+
+
+def parallel_herest(featfilelist, numprocs, conflocation, mlflocation, prev_dir,
+                    output_dir, phonelistlocation, statslocation=None, beams=None):
+    """ Data parallel HERest: splits 'featfilelist' into 'numprocs'
+        shards which are accumulated concurrently ('HERest -p i')
+        followed by a single pass to merge the accumulators and
+        update the models ('HERest -p 0')... If 'beams' are given, the
+        shards are accumulated with the first (tight) beam and the
+        utterances with pruning errors are accumulated again with each
+        wider beam in turn. Returns the average log probability per
+        frame over all shards...
+    """
+    baseargs = [HEREST_BIN,
+                "-A",
+                "-D",
+                "-V",
+                "-T",
+                "1",
+                "-C",
+                conflocation,
+                "-H",
+                os.path.join(prev_dir, MACROS_FN),
+                "-H",
+                os.path.join(prev_dir, HMMDEFS_FN),
+                "-M",
+                output_dir]
+
+    def accumulate(shards, pruning, firstindex, caller):
+        """ Write shard SCPs and accumulate (accumulator numbers start
+            at 'firstindex')...
+        """
+        tempscpfhs = []
+        cmds = []
+        for i, shard in enumerate(shards):
+            tempscpfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+            tempscpfh.writelines([featfilename + "\n" for featfilename in shard])
+            tempscpfh.flush()
+            tempscpfhs.append(tempscpfh)
+            cmds.append(" ".join(baseargs + ["-t"] + pruning + ["-I",
+                                                                mlflocation,
+                                                                "-S",
+                                                                tempscpfh.name,
+                                                                "-p",
+                                                                unicode(firstindex + i),
+                                                                phonelistlocation]))
+        pool = ThreadPool(len(cmds))
+        try:
+            results = pool.map(lambda args: run_command(*args),
+                               [(cmd, "%s (shard %s/%s)" % (caller, i + 1, len(cmds)), HEREST_KEEP)
+                                for i, cmd in enumerate(cmds)])
+        finally:
+            pool.close()
+            pool.join()
+        for tempscpfh in tempscpfhs:
+            tempscpfh.close()
+        for i, (returnval, so, se) in enumerate(results):
+            if returnval != 0:
+                raise Exception(HEREST_BIN + " failed on shard " + unicode(i + 1) + " with code: " + unicode(returnval))
+        return results
+
+    shards = [shard for shard in partition(featfilelist, numprocs) if shard]
+    if beams is None:
+        results = accumulate(shards, [HEREST_PRUNING_PARM1, HEREST_PRUNING_PARM2, HEREST_PRUNING_PARM3],
+                             1, "doEmbeddedRest")
+    else:
+        results = accumulate(shards, [beams[0]], 1, "doEmbeddedRest (beam %s)" % (beams[0]))
+    numaccs = len(shards)
+    #shards in which all utterances failed report no statistics...
+    shardstats = [stats for stats in [parse_herest_logprob(so) for returnval, so, se in results] if stats[0] is not None]
+
+    if beams is not None:
+        failed = [fn for returnval, so, se in results for fn in parse_pruned_utterances(so + b"\n" + se)]
+        widened = {}
+        for beam in beams[1:]:
+            if not failed:
+                break
+            retryshards = [shard for shard in partition(failed, min(numprocs, len(failed))) if shard]
+            results = accumulate(retryshards, [beam], numaccs + 1, "doEmbeddedRest (beam %s)" % (beam))
+            numaccs += len(retryshards)
+            shardstats.extend(stats for stats in [parse_herest_logprob(so) for returnval, so, se in results]
+                              if stats[0] is not None)
+            stillfailed = set(fn for returnval, so, se in results for fn in parse_pruned_utterances(so + b"\n" + se))
+            widened.update((fn, beam) for fn in failed if fn not in stillfailed)
+            failed = [fn for fn in failed if fn in stillfailed]
+        report_beam_retries("doEmbeddedRest", widened, failed)
+
+    #merge accumulators and update models...
+    acclocations = [os.path.join(output_dir, HEREST_ACC_FN % (i + 1)) for i in range(numaccs)]
+    mergeargs = baseargs + ["-p", "0"]
+    if statslocation is not None:
+        mergeargs += ["-s", statslocation]
+    returnval, so, se = run_command(" ".join(mergeargs + [phonelistlocation] + acclocations),
+                                    "doEmbeddedRest (merge)", HEREST_KEEP)
+    if returnval != 0:
+        raise Exception(HEREST_BIN + " failed with code: " + unicode(returnval))
+
+    for acclocation in acclocations:
+        os.remove(acclocation)
+
+    #frame weighted average over shards (equivalent to serial HERest)...
+    if shardstats and all(numframes for avglogprob, numframes in shardstats):
+        totalframes = sum(numframes for avglogprob, numframes in shardstats)
+        avglogprob_perframe = sum(avglogprob * numframes for avglogprob, numframes in shardstats) / totalframes
+        METRICS.update(numframes=totalframes, avglogprob=avglogprob_perframe)
+        return avglogprob_perframe
+    avglogprob_perframe, numframes = parse_herest_logprob(so)
+    if avglogprob_perframe is None:
+        raise Exception("Could not determine average log probability from " + HEREST_BIN + " output...")
+    METRICS.update(numframes=numframes, avglogprob=avglogprob_perframe)
+    return avglogprob_perframe
+
+
+def file_digest(location):
+    """ MD5 hex digest of the contents of the file at 'location' (None if
+        it is not an existing file)...
+    """
+    if not os.path.isfile(location):
+        return None
+    md5 = hashlib.md5()
+    with open(location, "rb") as infh:
+        for chunk in iter(lambda: infh.read(1048576), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _hashable(value):
+    """ Convert 'value' into something with a stable JSON
+        representation (objects are represented by their phonemap if
+        they have one, else by their type name)...
+    """
+    if value is None or isinstance(value, (basestring, int, long, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_hashable(v) for v in value]
+    if isinstance(value, dict):
+        return sorted([unicode(k), _hashable(v)] for k, v in value.items())
+    if hasattr(value, "phonemap"):
+        return _hashable(value.phonemap)
+    return type(value).__name__
+
+
+def hash_inputs(inputs):
+    """ MD5 hex digest identifying a set of inputs...
+    """
+    return hashlib.md5(json.dumps(_hashable(inputs), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def remove_model_dirs(targetlocation, fromiteration):
+    """ Remove all 'hmm<N>' directories with N >= 'fromiteration'...
+    """
+    for dirname in os.listdir(targetlocation):
+        mo = re.match("^" + HMM_DIR + "([0-9]+)$", dirname)
+        if mo and int(mo.group(1)) >= fromiteration:
+            log.info("Removing invalidated model dir '%s'." % (dirname))
+            shutil.rmtree(os.path.join(targetlocation, dirname))
+
+
+class Checkpoints(object):
+    """ Manifest (in the working dir) of completed pipeline stages and
+        model operations in the order they were done. Each entry
+        records a name, a hash of its inputs, the HMM iteration after
+        completion and a (JSON serialisable) result. A resumed run
+        replays the pipeline: each step is matched against the next
+        entry and skipped if it matches. The first step that does not
+        match invalidates the rest of the manifest...
+    """
+
+    def __init__(self, location, resume=False):
+        self.location = location
+        self.entries = []
+        self.position = 0
+        if resume and os.path.isfile(location):
+            with codecs.open(location, encoding="utf-8") as infh:
+                self.entries = json.load(infh)["entries"]
+            log.info("Loaded %s checkpoints from '%s'." % (len(self.entries), location))
+        self._save()
+
+
+    def _save(self):
+        with codecs.open(self.location + ".tmp", "w", encoding="utf-8") as outfh:
+            outfh.write(json.dumps({"entries": self.entries}, indent=1, sort_keys=True))
+        os.rename(self.location + ".tmp", self.location)
+
+
+    def lookup(self, name, inputhash):
+        """ Returns the entry if the next entry matches 'name' and
+            'inputhash', else invalidates all remaining entries and
+            returns None...
+        """
+        if self.position < len(self.entries):
+            entry = self.entries[self.position]
+            if entry["name"] == name and entry["hash"] == inputhash:
+                self.position += 1
+                return entry
+            log.info("Checkpoint '%s' invalidated (%s later checkpoints discarded)."
+                     % (entry["name"], len(self.entries) - self.position))
+            del self.entries[self.position:]
+            self._save()
+        return None
+
+
+    def record(self, name, inputhash, iteration=None, result=None):
+        """ Append a completed step...
+        """
+        self.entries.append({"name": name,
+                             "hash": inputhash,
+                             "iteration": iteration,
+                             "result": result})
+        self.position += 1
+        self._save()
+
+
+    def clear(self):
+        """ Discard all entries...
+        """
+        self.entries = []
+        self.position = 0
+        self._save()
+
+
+def checkpointed(firstdir=1, infiles=()):
+    """ Decorator for HMMSet operations writing new 'hmm<N>'
+        directories: if 'self.checkpoints' shows that the operation
+        already completed (from the same iteration with the same
+        inputs) it is skipped, else stale model dirs (from
+        'iteration + firstdir' on) are removed before running it. The
+        contents of arguments named in 'infiles' are part of the
+        inputs...
+    """
+    def decorator(func):
+        def wrapper(self, *args, **kwargs):
+            if self.checkpoints is None or self.checkpointdepth > 0:
+                return func(self, *args, **kwargs)
+            callargs = inspect.getcallargs(func, self, *args, **kwargs)
+            del callargs["self"]
+            for argname in infiles:
+                if callargs[argname]:
+                    callargs[argname] = [callargs[argname], file_digest(callargs[argname])]
+            inputhash = hash_inputs([func.__name__,
+                                     self.iteration,
+                                     self.getModelSet(),
+                                     self.hvite_hcompv_parms,
+                                     file_digest(self.protofilelocation),
+                                     callargs])
+            entry = self.checkpoints.lookup(func.__name__, inputhash)
+            if entry is not None:
+                log.info("Resuming: '%s' already done (%s%s)." % (func.__name__, HMM_DIR, entry["iteration"]))
+                self.iteration = entry["iteration"]
+                return entry["result"]
+            remove_model_dirs(self.targetlocation, self.iteration + firstdir)
+            self.checkpointdepth += 1
+            try:
+                result = func(self, *args, **kwargs)
+            finally:
+                self.checkpointdepth -= 1
+            self.checkpoints.record(func.__name__, inputhash, self.iteration, result)
+            return result
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
 class HMMSet(object):
     """ Manages HMM models...
     """
@@ -63,8 +728,22 @@ class HMMSet(object):
                  silphone,
                  protofilelocation,
                  featsconflocation,
-                 featslocation):
-        """ Initialise...
+                 featslocation,
+                 numprocs=1,
+                 checkpoints=None,
+                 engine="herest",
+                 tying="hhed",
+                 pruning="fixed"):
+        """ Initialise... If 'numprocs' > 1 then HTK tools are run
+            in parallel... If 'checkpoints' are given, completed model
+            operations are recorded (and skipped when resuming)...
+            'engine' selects embedded re-estimation with HERest
+            ("herest") or in-process Baum-Welch ("native")...
+            'tying' selects decision tree state tying with HHEd
+            ("hhed") or in-process clustering ("native")... With
+            'pruning' set to "adaptive" HERest and HVite first use a tight
+            beam and rerun only the utterances that fail with wider
+            beams ("fixed" uses a single pass with wide beams)...
         """
 
         if not os.path.isdir(targetlocation):
@@ -81,6 +760,14 @@ class HMMSet(object):
         self.protofilelocation = protofilelocation
         self.numstates = self._getNumStatesFromProtofile()
         self.iteration = 0
+        self.numprocs = numprocs
+        self.checkpoints = checkpoints
+        self.checkpointdepth = 0
+        self.engine = engine
+        self.tying = tying
+        self.pruning = pruning
+        self.herest_beams = HEREST_BEAMS if pruning == "adaptive" else None
+        self.hvite_beams = HVITE_BEAMS if pruning == "adaptive" else None
         self.hvite_hcompv_parms = self._loadFeatConf(featsconflocation)
 
 
@@ -155,6 +842,8 @@ class HMMSet(object):
                 for phone in self.phonelist:
                     outfh.write(phone + "\n")
 
+    @measured
+    @checkpointed(infiles=("bootmodels_location",))
     def copyBootmodels(self, bootmodels_location, mapnames, transcriptionset=False):
         assert self.iteration == 0, "Can only do this as first training iteration..."
         tempdir = mkdtemp(prefix="halign_")
@@ -192,12 +881,41 @@ class HMMSet(object):
         self.iteration += 1
 
 
+    @measured
+    @checkpointed(infiles=("macroslocation", "hmmdefslocation"))
+    def importModels(self, macroslocation, hmmdefslocation):
+        """ Start from previously trained models (as written by
+            'exportModels') instead of initialising... The phonelist
+            given on construction should be the list of models these
+            were trained with...
+        """
+        assert self.iteration == 0, "Can only do this as first training iteration..."
+        hmmdir = os.path.join(self.targetlocation, HMM_DIR + unicode(self.iteration + 1)) #hmm1
+        os.makedirs(hmmdir)
+        shutil.copy(macroslocation, os.path.join(hmmdir, MACROS_FN))
+        shutil.copy(hmmdefslocation, os.path.join(hmmdir, HMMDEFS_FN))
+        self.iteration += 1
+
+
+    def exportModels(self, exportlocation):
+        """ Copy the latest models and list of models to
+            'exportlocation'...
+        """
+        latestmodels_dir = os.path.join(self.targetlocation,
+                                        HMM_DIR + unicode(self.iteration))
+        for fn in [MACROS_FN, HMMDEFS_FN]:
+            shutil.copy(os.path.join(latestmodels_dir, fn), os.path.join(exportlocation, fn))
+        self.dumpPhoneList(os.path.join(exportlocation, MODELLIST_FN))
+
+
     def mappedBootstrapAll(self, bootmlf_location, bootfeats_location, transcriptionset):
         """ calls doBootstrapAll for mapped bootstrapping...
         """
         self.doBootstrapAll(bootmlf_location, bootfeats_location, transcriptionset)
 
 
+    @measured
+    @checkpointed(firstdir=0, infiles=("bootmlf_location",))
     def doBootstrapAll(self, bootmlf_location, bootfeats_location, transcriptionset=None):
         """ Initialise HMMs using 'bootstrap' method...
             If transcriptionset is not None, then do mapped bootstrap...
@@ -221,87 +939,14 @@ class HMMSet(object):
         os.makedirs(os.path.join(hrest_output_dir))
         
 
-        for phone in self.phonelist:
-            #hinit
-            if transcriptionset is not None:
-                tempmlf = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-                transcriptionset.unmapMLF(bootmlf_location, tempmlf.name, phone)
-                tempmlf.flush()
-                mlf_location = tempmlf.name
-            else:
-                mlf_location = bootmlf_location
-                
-            p = subprocess.Popen(" ".join([HINIT_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-l",
-                                           '"'+phone+'"',
-                                           "-o",
-                                           '"'+phone+'"',
-                                           "-I",
-                                           mlf_location,
-                                           "-M",
-                                           hinit_output_dir,
-                                           "-S",
-                                           tempscpfh.name,
-                                           self.protofilelocation]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-            so, se = p.communicate()
-            log.info("doBootstrapAll:\n" +
-                     "================================================================================\n" +
-                     unicode(so, encoding="utf-8") + 
-                     "================================================================================\n")
-            if bool(se):
-                log.warning("doBootstrapAll:\n" +
-                            "================================================================================\n" +
-                            unicode(se, encoding="utf-8") +
-                            "================================================================================\n")
-            returnval = p.returncode
-            if returnval != 0:
-                raise Exception(HINIT_BIN + " failed with code: " + unicode(returnval))
-            #hrest
-            p = subprocess.Popen(" ".join([HREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-l",
-                                           '"'+phone+'"',
-                                           "-I",
-                                           mlf_location,
-                                           "-M",
-                                           hrest_output_dir,
-                                           "-S",
-                                           tempscpfh.name,
-                                           os.path.join(hinit_output_dir, phone)]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-            so, se = p.communicate()
-            log.info("doBootstrapAll:\n" +
-                     "================================================================================\n" +
-                     unicode(so, encoding="utf-8") + 
-                     "================================================================================\n")
-            if bool(se):
-                log.warning("doBootstrapAll:\n" +
-                            "================================================================================\n" +
-                            unicode(se, encoding="utf-8") +
-                            "================================================================================\n")
-            returnval = p.returncode
-            if returnval != 0:
-                raise Exception(HREST_BIN + " failed with code: " + unicode(returnval))
-
-            if transcriptionset is not None:
-                tempmlf.close()
-            
+        bootstrap_phones(self.phonelist,
+                         self.numprocs,
+                         self.protofilelocation,
+                         bootmlf_location,
+                         tempscpfh.name,
+                         hinit_output_dir,
+                         hrest_output_dir,
+                         transcriptionset)
         tempscpfh.close()
 
         ##create "macros" file
@@ -335,6 +980,8 @@ class HMMSet(object):
         self.iteration += 1
 
 
+    @measured
+    @checkpointed(firstdir=0)
     def doFlatStart(self):
         """ Initialise HMMs using 'flatstart' method...
         """        
@@ -354,37 +1001,23 @@ class HMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HCompV...
-        p = subprocess.Popen(" ".join([HCOMPV_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-C",
-                                       tempconffh.name,
-                                       "-f",
-                                       VFLOOR_VAL,
-                                       "-m",
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-M",
-                                       output_dir,
-                                       self.protofilelocation]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("doFlatStart:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doFlatStart:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HCOMPV_BIN,
+                        "-A",
+                        "-D",
+                        "-V",
+                        "-T",
+                        "1",
+                        "-C",
+                        tempconffh.name,
+                        "-f",
+                        VFLOOR_VAL,
+                        "-m",
+                        "-S",
+                        tempscpfh.name,
+                        "-M",
+                        output_dir,
+                        self.protofilelocation])
+        returnval, so, se = run_command(cmd, caller="doFlatStart")
         tempscpfh.close()
         tempconffh.close()
 
@@ -429,6 +1062,8 @@ class HMMSet(object):
         return returnval        
     
 
+    @measured
+    @checkpointed(infiles=("mlflocation",))
     def doEmbeddedRest(self, mlflocation, statslocation=None):
         """HERest...
         """
@@ -452,76 +1087,93 @@ class HMMSet(object):
                                   HMM_DIR + unicode(self.iteration + 1))
         os.makedirs(os.path.join(output_dir))
 
+        if self.engine == "native":
+            from HALIGN_BaumWelch import native_herest   #needs numpy
+            tempscpfh.close()
+            tempconffh.close()
+            avglogprob_perframe = native_herest([os.path.join(self.featslocation, filename)
+                                                 for filename in self.featfilelist],
+                                                self.numprocs,
+                                                mlflocation,
+                                                prev_dir,
+                                                output_dir,
+                                                tempphonesfh.name,
+                                                statslocation,
+                                                float(HEREST_PRUNING_PARM1))
+            METRICS.update(avglogprob=avglogprob_perframe)
+            tempphonesfh.close()
+            self.iteration += 1
+            return avglogprob_perframe
+
+        if self.numprocs > 1 or self.herest_beams is not None:
+            tempscpfh.close()
+            avglogprob_perframe = parallel_herest([os.path.join(self.featslocation, filename)
+                                                   for filename in self.featfilelist],
+                                                  self.numprocs,
+                                                  tempconffh.name,
+                                                  mlflocation,
+                                                  prev_dir,
+                                                  output_dir,
+                                                  tempphonesfh.name,
+                                                  statslocation,
+                                                  beams=self.herest_beams)
+            tempconffh.close()
+            tempphonesfh.close()
+            self.iteration += 1
+            return avglogprob_perframe
+
         #execute HERest...
         if statslocation is None:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
+            cmd = " ".join([HEREST_BIN,
+                            "-A",
+                            "-D",
+                            "-V",
+                            "-T",
+                            "1",
+                            "-C",
+                            tempconffh.name,
+                            "-I",
+                            mlflocation,
+                            "-t",
+                            HEREST_PRUNING_PARM1,
+                            HEREST_PRUNING_PARM2,
+                            HEREST_PRUNING_PARM3,
+                            "-S",
+                            tempscpfh.name,
+                            "-H",
+                            os.path.join(prev_dir, MACROS_FN),
+                            "-H",
+                            os.path.join(prev_dir, HMMDEFS_FN),
+                            "-M",
+                            output_dir,
+                            tempphonesfh.name])
         else:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-s",
-                                           statslocation,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        so, se = p.communicate()
-        log.info("doEmbeddedRest:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doEmbeddedRest:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+            cmd = " ".join([HEREST_BIN,
+                            "-A",
+                            "-D",
+                            "-V",
+                            "-T",
+                            "1",
+                            "-C",
+                            tempconffh.name,
+                            "-I",
+                            mlflocation,
+                            "-t",
+                            HEREST_PRUNING_PARM1,
+                            HEREST_PRUNING_PARM2,
+                            HEREST_PRUNING_PARM3,
+                            "-s",
+                            statslocation,
+                            "-S",
+                            tempscpfh.name,
+                            "-H",
+                            os.path.join(prev_dir, MACROS_FN),
+                            "-H",
+                            os.path.join(prev_dir, HMMDEFS_FN),
+                            "-M",
+                            output_dir,
+                            tempphonesfh.name])
+        returnval, so, se = run_command(cmd, caller="doEmbeddedRest", keep=HEREST_KEEP)
         tempscpfh.close()
         tempconffh.close()
         tempphonesfh.close()
@@ -532,7 +1184,8 @@ class HMMSet(object):
         #done!
         self.iteration += 1
 
-        avglogprob_perframe = float(re.findall(b"Reestimation complete.*", so)[0].split()[-1])
+        avglogprob_perframe, numframes = parse_herest_logprob(so)
+        METRICS.update(numframes=numframes, avglogprob=avglogprob_perframe)
         
         return avglogprob_perframe
         
@@ -613,7 +1266,10 @@ class HMMSet(object):
             #DEMITASSE: omitting this will only make hmmdefs larger (we're doing falignment..)
             #commands.append("CO \"%s\"\n" % (tiedlistfile))
             
-        self.doHHEd(commands)
+        if self.tying == "native":
+            self.doNativeTying(commands)
+        else:
+            self.doHHEd(commands)
 
         log.debug(unicode(self) + "HHEd commands:\n" + unicode(commands))
 
@@ -642,6 +1298,34 @@ class HMMSet(object):
         self.doHHEd(commands)
 
 
+    @measured
+    @checkpointed()
+    def doNativeTying(self, commands):
+        """ In-process equivalent of 'doHHEd' for the state tying
+            commands generated by 'tieStates'...
+        """
+        from HALIGN_Tying import native_tie_states   #needs numpy
+
+        #write phonelist...
+        tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+        self.dumpPhoneList(tempphonesfh)
+
+        #make dirs
+        prev_dir = os.path.join(self.targetlocation,
+                                  HMM_DIR + unicode(self.iteration))
+        output_dir = os.path.join(self.targetlocation,
+                                  HMM_DIR + unicode(self.iteration + 1))
+        os.makedirs(os.path.join(output_dir))
+
+        native_tie_states(prev_dir, output_dir, tempphonesfh.name, commands, self.numprocs)
+        tempphonesfh.close()
+
+        #done!
+        self.iteration += 1
+
+
+    @measured
+    @checkpointed()
     def doHHEd(self, commands):
         """ HHEd...
         """
@@ -663,35 +1347,21 @@ class HMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HHEd...
-        p = subprocess.Popen(" ".join([HHED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-H",
-                                       os.path.join(prev_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(prev_dir, HMMDEFS_FN),
-                                       "-M",
-                                       output_dir,
-                                       tempcmdfh.name,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("doHHEd:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doHHEd:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HHED_BIN,
+                        "-A",
+                        "-D",
+                        "-V",
+                        "-T",
+                        "1",
+                        "-H",
+                        os.path.join(prev_dir, MACROS_FN),
+                        "-H",
+                        os.path.join(prev_dir, HMMDEFS_FN),
+                        "-M",
+                        output_dir,
+                        tempcmdfh.name,
+                        tempphonesfh.name])
+        returnval, so, se = run_command(cmd, caller="doHHEd")
         tempcmdfh.close()
         tempphonesfh.close()
 
@@ -704,8 +1374,12 @@ class HMMSet(object):
         return returnval
 
 
-    def reAlignment(self, mlflocation, dictlocation, outmlflocation):
-        """ Do realignment given dictionary with multiple entries...
+    @measured
+    def reAlignment(self, mlflocation, dictlocation, outmlflocation, subset=None):
+        """ Do realignment given dictionary with multiple entries... If
+            'subset' (utterance names) is given only these utterances
+            are realigned and their entries replace those in the
+            existing 'outmlflocation'...
         """
         
         #write featconf
@@ -724,49 +1398,68 @@ class HMMSet(object):
         latestmodels_dir = os.path.join(self.targetlocation,
                                         HMM_DIR + unicode(self.iteration))
 
+        options = ["-A",
+                   "-D",
+                   "-V",
+                   "-T",
+                   "1",
+                   "-a",
+                   "-y lab",
+                   "-o",
+                   "SWT",
+#                   "-b",
+#                   silword,
+                   "-m",
+                   "-l",
+                   '"*"',
+                   "-I",
+                   mlflocation,
+                   "-H",
+                   os.path.join(latestmodels_dir, MACROS_FN),
+                   "-H",
+                   os.path.join(latestmodels_dir, HMMDEFS_FN)]
+        trailing = [dictlocation, tempphonesfh.name]
+
+        if subset is not None:
+            tempscpfh.close()
+            subset = set(subset)
+            featlocations = [os.path.join(self.featslocation, filename) for filename in self.featfilelist
+                             if parse_path(filename)[2] in subset]
+            log.info(unicode(self) + " realigning %s of %s utterances." % (len(featlocations), len(self.featfilelist)))
+            if featlocations:
+                tempmlffh = NamedTemporaryFile(mode="w+t", suffix="." + MLF_EXT)#, encoding="utf-8")
+                sharded_hvite(featlocations,
+                              self.numprocs,
+                              options,
+                              trailing,
+                              tempmlffh.name,
+                              caller="reAlignment",
+                              beams=self.hvite_beams)
+                #splice (utterances that failed keep their entries)...
+                merge_mlfs([outmlflocation, tempmlffh.name], outmlflocation,
+                           [parse_path(filename)[2] for filename in self.featfilelist])
+                tempmlffh.close()
+            tempphonesfh.close()
+            return 0
+
+        if self.numprocs > 1 or self.hvite_beams is not None:
+            tempscpfh.close()
+            sharded_hvite([os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                          self.numprocs,
+                          options,
+                          trailing,
+                          outmlflocation,
+                          caller="reAlignment",
+                          beams=self.hvite_beams)
+            tempphonesfh.close()
+            return 0
+
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-y lab",
-                                       "-o",
-                                       "SWT",
-#                                       "-b",
-#                                       silword,
-                                       "-m",
-                                       "-l",
-                                       '"*"',
-                                       "-I",
-                                       mlflocation,
-                                       "-i",
-                                       outmlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("reAlignment:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("reAlignment:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HVITE_BIN] + options + ["-i", outmlflocation, "-S", tempscpfh.name] + trailing)
+        returnval, so, se = run_command(cmd, caller="reAlignment")
+        METRICS.update(failed=len(missing_hvite_outputs([os.path.join(self.featslocation, filename)
+                                                         for filename in self.featfilelist],
+                                                        options, outmlflocation)))
         tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
@@ -777,6 +1470,7 @@ class HMMSet(object):
         return returnval
 
 
+    @measured
     def forcedAlignment(self, mlflocation, dictlocation, outputlocation):
         """ Apply forced alignment towards labeling...
         """
@@ -797,43 +1491,42 @@ class HMMSet(object):
         latestmodels_dir = os.path.join(self.targetlocation,
                                         HMM_DIR + unicode(self.iteration))
 
+        options = ["-A",
+                   "-D",
+                   "-V",
+                   "-T",
+                   "1",
+                   "-a",
+                   "-o",
+                   "N",
+                   "-f",
+                   "-m",
+                   "-l",
+                   outputlocation,
+                   "-I",
+                   mlflocation,
+                   "-H",
+                   os.path.join(latestmodels_dir, HMMDEFS_FN)]
+        trailing = [dictlocation, tempphonesfh.name]
+
+        if self.numprocs > 1 or self.hvite_beams is not None:
+            tempscpfh.close()
+            sharded_hvite([os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                          self.numprocs,
+                          options,
+                          trailing,
+                          None,
+                          caller="forcedAlignment",
+                          beams=self.hvite_beams)
+            tempphonesfh.close()
+            return 0
+
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-o",
-                                       "N",
-                                       "-f",
-                                       "-m",
-                                       "-l",
-                                       outputlocation,
-                                       "-I",
-                                       mlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("forcedAlignment:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("forcedAlignment:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        featlocations = [os.path.join(self.featslocation, filename) for filename in self.featfilelist]
+        remove_hvite_outputs(featlocations, options)
+        cmd = " ".join([HVITE_BIN] + options + ["-S", tempscpfh.name] + trailing)
+        returnval, so, se = run_command(cmd, caller="forcedAlignment")
+        METRICS.update(failed=len(missing_hvite_outputs(featlocations, options)))
         tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
@@ -859,8 +1552,22 @@ class ASRHMMSet(object):
                  spphone,
                  protofilelocation,
                  featsconflocation,
-                 featslocation):
-        """ Initialise...
+                 featslocation,
+                 numprocs=1,
+                 checkpoints=None,
+                 engine="herest",
+                 tying="hhed",
+                 pruning="fixed"):
+        """ Initialise... If 'numprocs' > 1 then HTK tools are run
+            in parallel... If 'checkpoints' are given, completed model
+            operations are recorded (and skipped when resuming)...
+            'engine' selects embedded re-estimation with HERest
+            ("herest") or in-process Baum-Welch ("native")...
+            'tying' selects decision tree state tying with HHEd
+            ("hhed") or in-process clustering ("native")... With
+            'pruning' set to "adaptive" HERest and HVite first use a tight
+            beam and rerun only the utterances that fail with wider
+            beams ("fixed" uses a single pass with wide beams)...
         """
 
         if not os.path.isdir(targetlocation):
@@ -879,6 +1586,14 @@ class ASRHMMSet(object):
         self.protofilelocation = protofilelocation
         self.numstates = self._getNumStatesFromProtofile()
         self.iteration = 0
+        self.numprocs = numprocs
+        self.checkpoints = checkpoints
+        self.checkpointdepth = 0
+        self.engine = engine
+        self.tying = tying
+        self.pruning = pruning
+        self.herest_beams = HEREST_BEAMS if pruning == "adaptive" else None
+        self.hvite_beams = HVITE_BEAMS if pruning == "adaptive" else None
         self.hvite_hcompv_parms = self._loadFeatConf(featsconflocation)
 
 
@@ -967,6 +1682,8 @@ class ASRHMMSet(object):
         self.doBootstrapAll(bootmlf_location, bootfeats_location, transcriptionset)
 
 
+    @measured
+    @checkpointed(firstdir=0, infiles=("bootmlf_location",))
     def doBootstrapAll(self, bootmlf_location, bootfeats_location, transcriptionset=None):
         """ Initialise HMMs using 'bootstrap' method...
             If transcriptionset is not None, then do mapped bootstrap...
@@ -990,87 +1707,14 @@ class ASRHMMSet(object):
         os.makedirs(os.path.join(hrest_output_dir))
         
 
-        for phone in self.phonelist0:
-            #hinit
-            if transcriptionset is not None:
-                tempmlf = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-                transcriptionset.unmapMLF(bootmlf_location, tempmlf.name, phone)
-                tempmlf.flush()
-                mlf_location = tempmlf.name
-            else:
-                mlf_location = bootmlf_location
-                
-            p = subprocess.Popen(" ".join([HINIT_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-l",
-                                           '"'+phone+'"',
-                                           "-o",
-                                           '"'+phone+'"',
-                                           "-I",
-                                           mlf_location,
-                                           "-M",
-                                           hinit_output_dir,
-                                           "-S",
-                                           tempscpfh.name,
-                                           self.protofilelocation]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-            so, se = p.communicate()
-            log.info("doBootstrapAll:\n" +
-                     "================================================================================\n" +
-                     unicode(so, encoding="utf-8") + 
-                     "================================================================================\n")
-            if bool(se):
-                log.warning("doBootstrapAll:\n" +
-                            "================================================================================\n" +
-                            unicode(se, encoding="utf-8") +
-                            "================================================================================\n")
-            returnval = p.returncode
-            if returnval != 0:
-                raise Exception(HINIT_BIN + " failed with code: " + unicode(returnval))
-            #hrest
-            p = subprocess.Popen(" ".join([HREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-l",
-                                           '"'+phone+'"',
-                                           "-I",
-                                           mlf_location,
-                                           "-M",
-                                           hrest_output_dir,
-                                           "-S",
-                                           tempscpfh.name,
-                                           os.path.join(hinit_output_dir, phone)]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-            so, se = p.communicate()
-            log.info("doBootstrapAll:\n" +
-                     "================================================================================\n" +
-                     unicode(so, encoding="utf-8") + 
-                     "================================================================================\n")
-            if bool(se):
-                log.warning("doBootstrapAll:\n" +
-                            "================================================================================\n" +
-                            unicode(se, encoding="utf-8") +
-                            "================================================================================\n")
-            returnval = p.returncode
-            if returnval != 0:
-                raise Exception(HREST_BIN + " failed with code: " + unicode(returnval))
-
-            if transcriptionset is not None:
-                tempmlf.close()
-            
+        bootstrap_phones(self.phonelist0,
+                         self.numprocs,
+                         self.protofilelocation,
+                         bootmlf_location,
+                         tempscpfh.name,
+                         hinit_output_dir,
+                         hrest_output_dir,
+                         transcriptionset)
         tempscpfh.close()
 
         ##create "macros" file
@@ -1104,6 +1748,8 @@ class ASRHMMSet(object):
         self.iteration += 1
 
 
+    @measured
+    @checkpointed(firstdir=0)
     def doFlatStart(self):
         """ Initialise HMMs using 'flatstart' method...
         """        
@@ -1123,37 +1769,23 @@ class ASRHMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HCompV...
-        p = subprocess.Popen(" ".join([HCOMPV_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-C",
-                                       tempconffh.name,
-                                       "-f",
-                                       VFLOOR_VAL,
-                                       "-m",
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-M",
-                                       output_dir,
-                                       self.protofilelocation]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("doFlatStart:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doFlatStart:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HCOMPV_BIN,
+                        "-A",
+                        "-D",
+                        "-V",
+                        "-T",
+                        "1",
+                        "-C",
+                        tempconffh.name,
+                        "-f",
+                        VFLOOR_VAL,
+                        "-m",
+                        "-S",
+                        tempscpfh.name,
+                        "-M",
+                        output_dir,
+                        self.protofilelocation])
+        returnval, so, se = run_command(cmd, caller="doFlatStart")
         tempscpfh.close()
         tempconffh.close()
 
@@ -1198,6 +1830,8 @@ class ASRHMMSet(object):
         return returnval        
     
 
+    @measured
+    @checkpointed(infiles=("mlflocation",))
     def doEmbeddedRest(self, mlflocation, statslocation=None, withsp=False):
         """HERest...
         """
@@ -1221,76 +1855,93 @@ class ASRHMMSet(object):
                                   HMM_DIR + unicode(self.iteration + 1))
         os.makedirs(os.path.join(output_dir))
 
+        if self.engine == "native":
+            from HALIGN_BaumWelch import native_herest   #needs numpy
+            tempscpfh.close()
+            tempconffh.close()
+            avglogprob_perframe = native_herest([os.path.join(self.featslocation, filename)
+                                                 for filename in self.featfilelist],
+                                                self.numprocs,
+                                                mlflocation,
+                                                prev_dir,
+                                                output_dir,
+                                                tempphonesfh.name,
+                                                statslocation,
+                                                float(HEREST_PRUNING_PARM1))
+            METRICS.update(avglogprob=avglogprob_perframe)
+            tempphonesfh.close()
+            self.iteration += 1
+            return avglogprob_perframe
+
+        if self.numprocs > 1 or self.herest_beams is not None:
+            tempscpfh.close()
+            avglogprob_perframe = parallel_herest([os.path.join(self.featslocation, filename)
+                                                   for filename in self.featfilelist],
+                                                  self.numprocs,
+                                                  tempconffh.name,
+                                                  mlflocation,
+                                                  prev_dir,
+                                                  output_dir,
+                                                  tempphonesfh.name,
+                                                  statslocation,
+                                                  beams=self.herest_beams)
+            tempconffh.close()
+            tempphonesfh.close()
+            self.iteration += 1
+            return avglogprob_perframe
+
         #execute HERest...
         if statslocation is None:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
+            cmd = " ".join([HEREST_BIN,
+                            "-A",
+                            "-D",
+                            "-V",
+                            "-T",
+                            "1",
+                            "-C",
+                            tempconffh.name,
+                            "-I",
+                            mlflocation,
+                            "-t",
+                            HEREST_PRUNING_PARM1,
+                            HEREST_PRUNING_PARM2,
+                            HEREST_PRUNING_PARM3,
+                            "-S",
+                            tempscpfh.name,
+                            "-H",
+                            os.path.join(prev_dir, MACROS_FN),
+                            "-H",
+                            os.path.join(prev_dir, HMMDEFS_FN),
+                            "-M",
+                            output_dir,
+                            tempphonesfh.name])
         else:
-            p = subprocess.Popen(" ".join([HEREST_BIN,
-                                           "-A",
-                                           "-D",
-                                           "-V",
-                                           "-T",
-                                           "1",
-                                           "-C",
-                                           tempconffh.name,
-                                           "-I",
-                                           mlflocation,
-                                           "-t",
-                                           HEREST_PRUNING_PARM1,
-                                           HEREST_PRUNING_PARM2,
-                                           HEREST_PRUNING_PARM3,
-                                           "-s",
-                                           statslocation,
-                                           "-S",
-                                           tempscpfh.name,
-                                           "-H",
-                                           os.path.join(prev_dir, MACROS_FN),
-                                           "-H",
-                                           os.path.join(prev_dir, HMMDEFS_FN),
-                                           "-M",
-                                           output_dir,
-                                           tempphonesfh.name]),
-                                 stdout = subprocess.PIPE,
-                                 stderr = subprocess.PIPE,
-                                 close_fds = True,
-                                 shell = True)
-        so, se = p.communicate()
-        log.info("doEmbeddedRest:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doEmbeddedRest:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+            cmd = " ".join([HEREST_BIN,
+                            "-A",
+                            "-D",
+                            "-V",
+                            "-T",
+                            "1",
+                            "-C",
+                            tempconffh.name,
+                            "-I",
+                            mlflocation,
+                            "-t",
+                            HEREST_PRUNING_PARM1,
+                            HEREST_PRUNING_PARM2,
+                            HEREST_PRUNING_PARM3,
+                            "-s",
+                            statslocation,
+                            "-S",
+                            tempscpfh.name,
+                            "-H",
+                            os.path.join(prev_dir, MACROS_FN),
+                            "-H",
+                            os.path.join(prev_dir, HMMDEFS_FN),
+                            "-M",
+                            output_dir,
+                            tempphonesfh.name])
+        returnval, so, se = run_command(cmd, caller="doEmbeddedRest", keep=HEREST_KEEP)
         tempscpfh.close()
         tempconffh.close()
         tempphonesfh.close()
@@ -1301,11 +1952,14 @@ class ASRHMMSet(object):
         #done!
         self.iteration += 1
 
-        avglogprob_perframe = float(re.findall(b"Reestimation complete.*", so)[0].split()[-1])
+        avglogprob_perframe, numframes = parse_herest_logprob(so)
+        METRICS.update(numframes=numframes, avglogprob=avglogprob_perframe)
         
         return avglogprob_perframe
         
     
+    @measured
+    @checkpointed()
     def fixSilModels(self):
         """ creates ShortSil model and adds extra transitions to SIL
             model...
@@ -1415,7 +2069,10 @@ class ASRHMMSet(object):
             commands.append("AU \"%s\"\n" % (triphonelistfile))
             #commands.append("CO \"%s\"\n" % (tiedlistfile))
             
-        self.doHHEd(commands)
+        if self.tying == "native":
+            self.doNativeTying(commands)
+        else:
+            self.doHHEd(commands)
 
         log.debug(unicode(self) + "HHEd commands:\n" + unicode(commands))
 
@@ -1444,6 +2101,34 @@ class ASRHMMSet(object):
         self.doHHEd(commands)
 
 
+    @measured
+    @checkpointed()
+    def doNativeTying(self, commands, withsp=False):
+        """ In-process equivalent of 'doHHEd' for the state tying
+            commands generated by 'tieStates'...
+        """
+        from HALIGN_Tying import native_tie_states   #needs numpy
+
+        #write phonelist...
+        tempphonesfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+        self.dumpPhoneList(tempphonesfh, withsp)
+
+        #make dirs
+        prev_dir = os.path.join(self.targetlocation,
+                                  HMM_DIR + unicode(self.iteration))
+        output_dir = os.path.join(self.targetlocation,
+                                  HMM_DIR + unicode(self.iteration + 1))
+        os.makedirs(os.path.join(output_dir))
+
+        native_tie_states(prev_dir, output_dir, tempphonesfh.name, commands, self.numprocs)
+        tempphonesfh.close()
+
+        #done!
+        self.iteration += 1
+
+
+    @measured
+    @checkpointed()
     def doHHEd(self, commands, withsp=False):
         """ HHEd...
         """
@@ -1465,35 +2150,21 @@ class ASRHMMSet(object):
         os.makedirs(os.path.join(output_dir))
 
         #execute HHEd...
-        p = subprocess.Popen(" ".join([HHED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-H",
-                                       os.path.join(prev_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(prev_dir, HMMDEFS_FN),
-                                       "-M",
-                                       output_dir,
-                                       tempcmdfh.name,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("doHHEd:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("doHHEd:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HHED_BIN,
+                        "-A",
+                        "-D",
+                        "-V",
+                        "-T",
+                        "1",
+                        "-H",
+                        os.path.join(prev_dir, MACROS_FN),
+                        "-H",
+                        os.path.join(prev_dir, HMMDEFS_FN),
+                        "-M",
+                        output_dir,
+                        tempcmdfh.name,
+                        tempphonesfh.name])
+        returnval, so, se = run_command(cmd, caller="doHHEd")
         tempcmdfh.close()
         tempphonesfh.close()
 
@@ -1506,6 +2177,7 @@ class ASRHMMSet(object):
         return returnval
 
 
+    @measured
     def forcedAlignment(self, mlflocation, dictlocation, outputlocation, withsp=False):
         """ Apply forced alignment towards labeling...
         """
@@ -1526,43 +2198,42 @@ class ASRHMMSet(object):
         latestmodels_dir = os.path.join(self.targetlocation,
                                         HMM_DIR + unicode(self.iteration))
 
+        options = ["-A",
+                   "-D",
+                   "-V",
+                   "-T",
+                   "1",
+                   "-a",
+                   "-o",
+                   "N",
+                   "-f",
+                   "-m",
+                   "-l",
+                   outputlocation,
+                   "-I",
+                   mlflocation,
+                   "-H",
+                   os.path.join(latestmodels_dir, HMMDEFS_FN)]
+        trailing = [dictlocation, tempphonesfh.name]
+
+        if self.numprocs > 1 or self.hvite_beams is not None:
+            tempscpfh.close()
+            sharded_hvite([os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                          self.numprocs,
+                          options,
+                          trailing,
+                          None,
+                          caller="forcedAlignment",
+                          beams=self.hvite_beams)
+            tempphonesfh.close()
+            return 0
+
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-o",
-                                       "N",
-                                       "-f",
-                                       "-m",
-                                       "-l",
-                                       outputlocation,
-                                       "-I",
-                                       mlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("forcedAlignment:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("forcedAlignment:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        featlocations = [os.path.join(self.featslocation, filename) for filename in self.featfilelist]
+        remove_hvite_outputs(featlocations, options)
+        cmd = " ".join([HVITE_BIN] + options + ["-S", tempscpfh.name] + trailing)
+        returnval, so, se = run_command(cmd, caller="forcedAlignment")
+        METRICS.update(failed=len(missing_hvite_outputs(featlocations, options)))
         tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
@@ -1573,6 +2244,7 @@ class ASRHMMSet(object):
         return returnval
 
 
+    @measured
     def reAlignment(self, mlflocation, dictlocation, silword, outmlflocation, withsp=False):
         """ Do realignment given dictionary with multiple entries...
         """
@@ -1593,49 +2265,46 @@ class ASRHMMSet(object):
         latestmodels_dir = os.path.join(self.targetlocation,
                                         HMM_DIR + unicode(self.iteration))
 
+        options = ["-A",
+                   "-D",
+                   "-V",
+                   "-T",
+                   "1",
+                   "-a",
+                   "-y lab",
+                   "-o",
+                   "SWT",
+                   "-b",
+                   silword,
+                   "-m",
+                   "-l",
+                   '"*"',
+                   "-I",
+                   mlflocation,
+                   "-H",
+                   os.path.join(latestmodels_dir, MACROS_FN),
+                   "-H",
+                   os.path.join(latestmodels_dir, HMMDEFS_FN)]
+        trailing = [dictlocation, tempphonesfh.name]
+
+        if self.numprocs > 1 or self.hvite_beams is not None:
+            tempscpfh.close()
+            sharded_hvite([os.path.join(self.featslocation, filename) for filename in self.featfilelist],
+                          self.numprocs,
+                          options,
+                          trailing,
+                          outmlflocation,
+                          caller="reAlignment",
+                          beams=self.hvite_beams)
+            tempphonesfh.close()
+            return 0
+
         #execute HVite...
-        p = subprocess.Popen(" ".join([HVITE_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-a",
-                                       "-y lab",
-                                       "-o",
-                                       "SWT",
-                                       "-b",
-                                       silword,
-                                       "-m",
-                                       "-l",
-                                       '"*"',
-                                       "-I",
-                                       mlflocation,
-                                       "-i",
-                                       outmlflocation,
-                                       "-S",
-                                       tempscpfh.name,
-                                       "-H",
-                                       os.path.join(latestmodels_dir, MACROS_FN),
-                                       "-H",
-                                       os.path.join(latestmodels_dir, HMMDEFS_FN),
-                                       dictlocation,
-                                       tempphonesfh.name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("reAlignment:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("reAlignment:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HVITE_BIN] + options + ["-i", outmlflocation, "-S", tempscpfh.name] + trailing)
+        returnval, so, se = run_command(cmd, caller="reAlignment")
+        METRICS.update(failed=len(missing_hvite_outputs([os.path.join(self.featslocation, filename)
+                                                         for filename in self.featfilelist],
+                                                        options, outmlflocation)))
         tempscpfh.close()
         #tempconffh.close()
         tempphonesfh.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains the runner shared by all HTK tool
+    invocations (output is streamed to the log line by line while the
+    tool runs) and the collection of per-stage metrics (wall time,
+    child CPU time, peak RSS, frames, log likelihood and failed
+    utterances) which can be saved as a JSON report...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import re
+import json
+import signal
+import logging
+import subprocess
+import threading
+from time import time
+
+try:
+    import resource
+except ImportError:
+    resource = None      #no resource usage on this platform...
+
+log = logging.getLogger("HAlign.Run")
+
+#lines of tool output (-T 1) needed by callers...
+HEREST_KEEP = re.compile(b"Reestimation complete|total frames seen|over pruning")
+
+
+def _wait(p):
+    """ Wait for 'p' to terminate, returns its resource usage (or
+        None)...
+    """
+    if resource is None:
+        p.wait()
+        return None
+    pid, status, rusage = os.wait4(p.pid, 0)
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+class CommandGroup(object):
+    """ Commands run concurrently (by 'run_command') which can be
+        killed together, e.g. when one of them failed... Commands
+        started after 'kill' are killed immediately.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.killed = False
+
+
+    def _kill(self, p):
+        #the shell and the tool it started (own process group)...
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(p.pid, signal.SIGKILL)
+            else:
+                p.kill()
+        except OSError:
+            pass
+
+
+    def add(self, p):
+        with self.lock:
+            self.processes.add(p)
+            killed = self.killed
+        if killed:
+            self._kill(p)
+
+
+    def discard(self, p):
+        with self.lock:
+            self.processes.discard(p)
+
+
+    def kill(self):
+        """ Kill all running commands...
+        """
+        with self.lock:
+            self.killed = True
+            processes = list(self.processes)
+        for p in processes:
+            self._kill(p)
+
+
+def run_command(cmd, caller="", keep=None, group=None):
+    """ Run 'cmd' in a shell, logging each line of output as it is
+        produced (prefixed with 'caller'). Returns (returncode,
+        stdout, stderr) where 'stdout' only contains the lines
+        matching 'keep' (compiled regex) to avoid holding large
+        traces in memory... The resources used are added to
+        'METRICS'. If a 'CommandGroup' is given the command is run in
+        its own process group so that it can be killed with the
+        group...
+    """
+    starttime = time()
+    p = subprocess.Popen(cmd,
+                         stdout = subprocess.PIPE,
+                         stderr = subprocess.PIPE,
+                         close_fds = True,
+                         shell = True,
+                         preexec_fn = os.setsid if group is not None and hasattr(os, "setsid") else None)
+    if group is not None:
+        group.add(p)
+    errlines = []
+    def readerr():
+        for line in iter(p.stderr.readline, b""):
+            errlines.append(line)
+            log.warning("%s: %s" % (caller, unicode(line, encoding="utf-8", errors="replace").rstrip()))
+    errthread = threading.Thread(target=readerr)
+    errthread.daemon = True
+    errthread.start()
+
+    keptlines = []
+    for line in iter(p.stdout.readline, b""):
+        log.info("%s: %s" % (caller, unicode(line, encoding="utf-8", errors="replace").rstrip()))
+        if keep is not None and keep.search(line):
+            keptlines.append(line)
+    errthread.join()
+    p.stdout.close()
+    p.stderr.close()
+    try:
+        rusage = _wait(p)
+    finally:
+        if group is not None:
+            group.discard(p)
+
+    METRICS.addCommand(cmd.split(None, 1)[0], time() - starttime, rusage)
+    return p.returncode, b"".join(keptlines), b"".join(errlines)
+
+
+class RunMetrics(object):
+    """ Collects metrics for the stages of a process and the model
+        operations (with their iterations) within each stage...
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.stages = []
+            self.openstage = None
+            self.openoperation = None
+            self.depth = {"stage": 0, "operation": 0}
+
+
+    def _usage(self):
+        """ Cumulative (self CPU, child CPU) times...
+        """
+        if resource is None:
+            return 0.0, 0.0
+        selfusage = resource.getrusage(resource.RUSAGE_SELF)
+        childusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (selfusage.ru_utime + selfusage.ru_stime,
+                childusage.ru_utime + childusage.ru_stime)
+
+
+    def _open(self, name, iteration=None):
+        selfcpu, childcpu = self._usage()
+        return {"name": name,
+                "iteration": iteration,
+                "start": (time(), selfcpu, childcpu),
+                "commands": 0,
+                "peakrss_kb": None}
+
+
+    def _close(self, record):
+        starttime, startselfcpu, startchildcpu = record.pop("start")
+        selfcpu, childcpu = self._usage()
+        record["walltime"] = time() - starttime
+        record["selfcputime"] = selfcpu - startselfcpu
+        record["childcputime"] = childcpu - startchildcpu
+        if resource is not None:
+            #in-process work (e.g. native engines) counts towards peak RSS...
+            record["selfpeakrss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+    def startStage(self, name):
+        """ Start recording stage 'name' (nested stages are part of the
+            outer stage)...
+        """
+        with self.lock:
+            self.depth["stage"] += 1
+            if self.depth["stage"] == 1:
+                self.openstage = self._open(name)
+                self.openstage["operations"] = []
+
+
+    def endStage(self):
+        """ Returns True if the outermost stage was closed...
+        """
+        with self.lock:
+            self.depth["stage"] -= 1
+            if self.depth["stage"] == 0 and self.openstage is not None:
+                self._close(self.openstage)
+                self.stages.append(self.openstage)
+                self.openstage = None
+                return True
+            return False
+
+
+    def startOperation(self, name, iteration=None):
+        """ Start recording model operation 'name' (nested operations
+            are part of the outer operation)...
+        """
+        with self.lock:
+            self.depth["operation"] += 1
+            if self.depth["operation"] == 1:
+                self.openoperation = self._open(name, iteration)
+
+
+    def endOperation(self, iteration=None):
+        """ 'iteration' is that of the models after the operation...
+        """
+        with self.lock:
+            self.depth["operation"] -= 1
+            if self.depth["operation"] == 0 and self.openoperation is not None:
+                self._close(self.openoperation)
+                if iteration is not None:
+                    self.openoperation["iteration"] = iteration
+                if self.openstage is not None:
+                    self.openstage["operations"].append(self.openoperation)
+                else:
+                    self.stages.append(self.openoperation)
+                self.openoperation = None
+
+
+    def update(self, **values):
+        """ Add values (e.g. 'numframes', 'avglogprob', 'failed') to
+            the current operation (or stage)...
+        """
+        with self.lock:
+            record = self.openoperation or self.openstage
+            if record is not None:
+                record.update(values)
+
+
+    def addCommand(self, tool, walltime, rusage=None):
+        """ Account for a finished tool invocation...
+        """
+        with self.lock:
+            for record in [self.openoperation, self.openstage]:
+                if record is None:
+                    continue
+                record["commands"] += 1
+                if rusage is not None:
+                    record["peakrss_kb"] = max(record["peakrss_kb"] or 0, rusage.ru_maxrss)
+            log.debug("%s finished in %.1f seconds." % (tool, walltime))
+
+
+    def save(self, location):
+        """ Write the report (JSON) to 'location'...
+        """
+        with self.lock:
+            with open(location + ".tmp", "w") as outfh:
+                json.dump({"stages": self.stages}, outfh, indent=1)
+            os.rename(location + ".tmp", location)
+
+
+#shared by all HAlign modules in a process...
+METRICS = RunMetrics()
+
+
+def measured(func):
+    """ Decorator recording a model operation ('self.iteration' is
+        recorded with it) in 'METRICS'...
+    """
+    def wrapper(self, *args, **kwargs):
+        METRICS.startOperation(func.__name__, getattr(self, "iteration", None))
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            METRICS.endOperation(getattr(self, "iteration", None))
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def stage(func):
+    """ Decorator recording a process stage in 'METRICS', the report is
+        saved to 'self.metrics_location' (if set) after each stage...
+    """
+    def wrapper(self, *args, **kwargs):
+        METRICS.startStage(func.__name__)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            closed = METRICS.endStage()
+            location = getattr(self, "metrics_location", None)
+            if closed and location is not None:
+                METRICS.save(location)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
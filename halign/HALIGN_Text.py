@@ -15,11 +15,18 @@ import sys
 import codecs
 import logging
 import re
+import mmap
+import struct
 import string
-import subprocess
+from array import array
 from tempfile import NamedTemporaryFile
+try:
+    from collections.abc import MutableMapping, MutableSequence
+except ImportError: #Py2
+    from collections import MutableMapping, MutableSequence
 
 from speechlabels import parse_path, type_files, Utterance, float_to_htk_int
+from HALIGN_Run import run_command
 
 SCM_EXT = "scm"
 LAB_EXT = "lab"
@@ -27,12 +34,498 @@ REC_EXT = "rec"
 TEXTGRID_EXT = "TextGrid"
 MLF_EXT = "mlf"
 DICT_EXT = "dict"   # simple pronunciation dictionary format...
+CDICT_EXT = "cdict" # compact (binary) pronunciation dictionary format...
+
+#compact dictionary file: header followed by (4 byte aligned) sections:
+#word offsets, word bytes (UTF-8, sorted), phone offsets, phone bytes,
+#variant offsets (per word), pronunciation offsets and phone ids...
+CDICT_MAGIC = b"HALIGNCD"
+CDICT_VERSION = 1
+CDICT_HEADER = struct.Struct(str("<8s7I"))
 
 HLED_BIN = "HLEd"
-HDMAN_BIN = "HDMan"
 
 log = logging.getLogger("HAlign.Text")
 
+
+#In-process equivalents of the HLEd/HDMan edits used by HAlign...
+################################################################################
+def expand_labels(labels, dictionary, delete=()):
+    """ HLEd 'EX': replaces each word in 'labels' with its first
+        pronunciation in 'dictionary' (PronunciationDictionary), then
+        'DE' removes all phones in 'delete'...
+    """
+    phones = []
+    for word in labels:
+        try:
+            phones.extend(dictionary[word][0])
+        except KeyError:
+            raise Exception("Word '%s' not found in dictionary..." % (word))
+    if delete:
+        phones = [phone for phone in phones if phone not in delete]
+    return phones
+
+
+def triphone_labels(labels, boundaries=(), noboundaries=()):
+    """ HLEd 'TC' (also HDMan 'TC'): converts 'labels' to triphones
+        ('l-p+r'). Labels in 'boundaries' ('WB') are not converted and
+        no context extends across them, labels in 'noboundaries' ('NB')
+        are skipped when finding the context of neighbouring labels...
+    """
+    leftcontexts = []
+    context = None
+    for label in labels:
+        leftcontexts.append(context)
+        if label not in noboundaries:
+            context = label
+    rightcontexts = []
+    context = None
+    for label in reversed(labels):
+        rightcontexts.append(context)
+        if label not in noboundaries:
+            context = label
+    rightcontexts.reverse()
+
+    triphones = []
+    for label, left, right in zip(labels, leftcontexts, rightcontexts):
+        if label not in boundaries:
+            if left is not None and left not in boundaries:
+                label = left + "-" + label
+            if right is not None and right not in boundaries:
+                label = label + "+" + right
+        triphones.append(label)
+    return triphones
+
+
+def _array_to_bytes(a):
+    """ Little endian bytes of array 'a'...
+    """
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    try:
+        return a.tobytes()
+    except AttributeError: #Py2
+        return a.tostring()
+
+
+def _pack_strings(strings):
+    """ UTF-8 encoded 'strings' concatenated with their offsets...
+    """
+    encoded = [item.encode("utf-8") for item in strings]
+    offsets = array(str("I"), [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    return offsets, b"".join(encoded)
+
+
+def _unpack_strings(offsets, blob):
+    return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+class _MappedArray(object):
+    """ Read-only sequence of 'length' little endian items of
+        'typecode' at 'pos' in 'buf' (unpacked when accessed)...
+    """
+    def __init__(self, buf, pos, typecode, length):
+        self.buf = buf
+        self.pos = pos
+        self.typecode = typecode
+        self.length = length
+        self.item = struct.Struct(str("<" + typecode))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("index out of range")
+        return self.item.unpack_from(self.buf, self.pos + i * self.item.size)[0]
+
+    def slice(self, start, stop):
+        return struct.unpack_from(str("<%d%s" % (stop - start, self.typecode)),
+                                  self.buf, self.pos + start * self.item.size)
+
+
+class _CompactFile(object):
+    """ A compact dictionary file (see
+        'PronunciationDictionary.writeCompact') mapped into memory for
+        as long as it is referenced: words are found by binary search
+        of the sorted word table and only the words and
+        pronunciations asked for are decoded...
+    """
+    def __init__(self, filepath):
+        with open(filepath, "rb") as infh:
+            self.mm = mmap.mmap(infh.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, numwords, numphones, numpronuns, numtokens,
+         wordbyteslen, phonebyteslen) = CDICT_HEADER.unpack_from(self.mm, 0)
+        if magic != CDICT_MAGIC or version != CDICT_VERSION:
+            self.mm.close()
+            raise Exception("'%s' is not a compact dictionary (version %s)..." % (filepath, CDICT_VERSION))
+        sections = []
+        pos = CDICT_HEADER.size
+        for typecode, length in [("I", numwords + 1), (None, wordbyteslen),
+                                 ("I", numphones + 1), (None, phonebyteslen),
+                                 ("I", numwords + 1), ("I", numpronuns + 1), ("H", numtokens)]:
+            if typecode is None:
+                sections.append(pos)
+                size = length
+            else:
+                sections.append(_MappedArray(self.mm, pos, typecode, length))
+                size = length * sections[-1].item.size
+            pos += size + (-size % 4)
+        (self.wordoffsets, self.wordpos, phoneoffsets, phonepos,
+         self.variantoffsets, self.pronunoffsets, self.tokens) = sections
+        self.numwords = numwords
+        self.numpronuns = numpronuns
+        #the phone inventory is small, decode it once...
+        self.phones = _unpack_strings(phoneoffsets.slice(0, numphones + 1),
+                                      self.mm[phonepos:phonepos + phonebyteslen])
+
+    def wordbytes(self, i):
+        return self.mm[self.wordpos + self.wordoffsets[i]:self.wordpos + self.wordoffsets[i + 1]]
+
+    def word(self, i):
+        return self.wordbytes(i).decode("utf-8")
+
+    def find(self, word):
+        """ Index of 'word' in the word table (or -1). Words are stored
+            sorted and UTF-8 preserves code point order...
+        """
+        key = word.encode("utf-8")
+        lo, hi = 0, self.numwords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.wordbytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.numwords and self.wordbytes(lo) == key:
+            return lo
+        return -1
+
+    def pronuns(self, i):
+        phones, offsets = self.phones, self.pronunoffsets
+        return [[phones[token] for token in self.tokens.slice(offsets[j], offsets[j + 1])]
+                for j in range(self.variantoffsets[i], self.variantoffsets[i + 1])]
+
+
+class _CompactEntries(MutableMapping):
+    """ 'PronunciationDictionary.entries' for a dictionary loaded from
+        the compact format: pronunciations are looked up in the mapped
+        file and decoded when first accessed, changes are kept
+        separately...
+    """
+    def __init__(self, cfile):
+        self.cfile = cfile
+        self.phones = cfile.phones
+        self.decoded = {}
+        self.added = set()      #words not in the file
+        self.deleted = set()    #words in the file
+        self.untouched = True   #no pronunciations handed out or changed...
+
+    def __getitem__(self, word):
+        try:
+            return self.decoded[word]
+        except KeyError:
+            pass
+        i = -1 if word in self.deleted else self.cfile.find(word)
+        if i < 0:
+            raise KeyError(word)
+        self.untouched = False
+        self.decoded[word] = self.cfile.pronuns(i)
+        return self.decoded[word]
+
+    def __setitem__(self, word, pronuns):
+        self.untouched = False
+        if word in self.deleted:
+            self.deleted.remove(word)
+        elif word not in self.decoded and self.cfile.find(word) < 0:
+            self.added.add(word)
+        self.decoded[word] = pronuns
+
+    def __delitem__(self, word):
+        if word not in self:
+            raise KeyError(word)
+        self.untouched = False
+        self.decoded.pop(word, None)
+        if word in self.added:
+            self.added.remove(word)
+        else:
+            self.deleted.add(word)
+
+    def __contains__(self, word):
+        return word in self.decoded or (word not in self.deleted and self.cfile.find(word) >= 0)
+
+    def __iter__(self):
+        added = list(self.added)
+        for i in range(self.cfile.numwords):
+            word = self.cfile.word(i)
+            if word not in self.deleted:
+                yield word
+        for word in added:
+            yield word
+
+    def __len__(self):
+        return self.cfile.numwords - len(self.deleted) + len(self.added)
+
+
+class _CompactNames(MutableSequence):
+    """ 'PronunciationDictionary.entrynames' for a dictionary loaded
+        from the compact format: names in the mapped file are decoded
+        when accessed, appended names are kept separately and other
+        changes turn it into a plain list...
+    """
+    def __init__(self, cfile):
+        self.cfile = cfile
+        self.names = None
+        self.appended = []
+
+    def _list(self):
+        if self.names is None:
+            self.names = [self.cfile.word(i) for i in range(self.cfile.numwords)] + self.appended
+            self.appended = None
+        return self.names
+
+    def __len__(self):
+        if self.names is not None:
+            return len(self.names)
+        return self.cfile.numwords + len(self.appended)
+
+    def __getitem__(self, i):
+        if self.names is not None:
+            return self.names[i]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("index out of range")
+        if i < self.cfile.numwords:
+            return self.cfile.word(i)
+        return self.appended[i - self.cfile.numwords]
+
+    def __iter__(self):
+        if self.names is not None:
+            return iter(self.names)
+        return (self[i] for i in range(len(self)))
+
+    def __setitem__(self, i, name):
+        self._list()[i] = name
+
+    def __delitem__(self, i):
+        del self._list()[i]
+
+    def insert(self, i, name):
+        self._list().insert(i, name)
+
+    def append(self, name):
+        if self.names is not None:
+            self.names.append(name)
+        else:
+            self.appended.append(name)
+
+    def sort(self, key=None, reverse=False):
+        self._list().sort(key=key, reverse=reverse)
+
+
+def write_pseudo_dict(location, phones):
+    """ Writes a 'dictionary' mapping each of 'phones' to itself...
+    """
+    with codecs.open(location, "w", encoding="utf-8") as outfh:
+        outfh.write("".join(phone + " " + phone + "\n" for phone in sorted(phones)))
+
+
+class TranscriptionStore(object):
+    """ Compact store of label sequences (keyed by utterance name):
+        labels are encoded as indices into a symbol table and
+        concatenated into one int32 array with per-utterance offsets,
+        start and end times (HTK units) are kept in parallel arrays when
+        available... Behaves like a read-only dict mapping keys to space
+        joined label strings (in insertion order)...
+    """
+    NOTIME = -1.0
+
+    def __init__(self):
+        self.symbols = []       #symbol table (every symbol is used)
+        self.symbolids = {}
+        self.names = []
+        self.nameids = {}
+        self.tokens = array(str("i"))
+        self.offsets = array(str("i"), [0])
+        self.starts = None      #created with the first timed entry...
+        self.ends = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, key):
+        return key in self.nameids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, key):
+        return " ".join(self.labels(key))
+
+    def keys(self):
+        return list(self.names)
+
+    def values(self):
+        return [self[key] for key in self.names]
+
+    def items(self):
+        return [(key, self[key]) for key in self.names]
+
+
+    def encode(self, symbol):
+        """ Index of 'symbol' (added to the symbol table if new)...
+        """
+        try:
+            return self.symbolids[symbol]
+        except KeyError:
+            self.symbolids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.symbolids[symbol]
+
+
+    def append(self, key, labels, starts=None, ends=None):
+        """ Add the sequence 'labels' (with optional 'starts' and 'ends'
+            times) for 'key'...
+        """
+        if key in self.nameids:
+            raise Exception("Non unique names present...")
+        numtokens = len(self.tokens)
+        encode = self.encode
+        self.tokens.extend(encode(label) for label in labels)
+        numlabels = len(self.tokens) - numtokens
+        if self.starts is None and (starts is not None or ends is not None):
+            self.starts = array(str("d"), [self.NOTIME]) * numtokens
+            self.ends = array(str("d"), [self.NOTIME]) * numtokens
+        if self.starts is not None:
+            self.starts.extend(starts or [self.NOTIME] * numlabels)
+            self.ends.extend(ends or [self.NOTIME] * numlabels)
+        self.nameids[key] = len(self.names)
+        self.names.append(key)
+        self.offsets.append(len(self.tokens))
+
+
+    def labels(self, key):
+        """ List of labels for 'key'...
+        """
+        i = self.nameids[key]
+        symbols = self.symbols
+        return [symbols[token] for token in self.tokens[self.offsets[i]:self.offsets[i + 1]]]
+
+
+    def times(self, key):
+        """ Lists of start and end times for 'key' (None if not
+            available)...
+        """
+        if self.starts is None:
+            return None
+        i = self.nameids[key]
+        begin, end = self.offsets[i], self.offsets[i + 1]
+        starts, ends = self.starts[begin:end].tolist(), self.ends[begin:end].tolist()
+        if self.NOTIME in starts or self.NOTIME in ends:
+            return None
+        return starts, ends
+
+
+    def keysWith(self, symbols):
+        """ Keys of the entries containing any of 'symbols'...
+        """
+        wanted = set(self.symbolids[symbol] for symbol in symbols if symbol in self.symbolids)
+        if not wanted:
+            return []
+        tokens, offsets = self.tokens, self.offsets
+        return [key for i, key in enumerate(self.names)
+                if not wanted.isdisjoint(tokens[offsets[i]:offsets[i + 1]])]
+
+
+    def rewrite(self, func):
+        """ Returns a new store with every label replaced by the list of
+            labels 'func(label)' (evaluated once per symbol, times are
+            not kept)...
+        """
+        store = TranscriptionStore()
+        replacements = [array(str("i"), [store.encode(label) for label in func(symbol)]) for symbol in self.symbols]
+        for i, key in enumerate(self.names):
+            for token in self.tokens[self.offsets[i]:self.offsets[i + 1]]:
+                store.tokens.extend(replacements[token])
+            store.nameids[key] = i
+            store.names.append(key)
+            store.offsets.append(len(store.tokens))
+        return store
+
+
+    def fromMLF(cls, location):
+        """ Loads HTK MLF (label names and times)...
+        """
+        store = cls()
+        key = None
+        with codecs.open(location, encoding="utf-8") as infh:
+            lines = infh.read().splitlines()
+        for line in lines:
+            if not line or line == "#!MLF!#":
+                continue
+            if line[0] == '"':          #new label...
+                key = parse_path(line.strip().strip('"'))[2]
+                labels, starts, ends = [], [], []
+                timed = True
+            elif line.rstrip() == ".":  #end of label...
+                if timed and labels:
+                    store.append(key, labels, starts, ends)
+                else:
+                    store.append(key, labels)
+            else:                       #'[start [end]] name [score]'...
+                tokens = line.split()
+                if len(tokens) > 2 and tokens[0].isdigit() and tokens[1].isdigit():
+                    starts.append(float(tokens[0]))
+                    ends.append(float(tokens[1]))
+                    labels.append(tokens[2])
+                else:
+                    timed = False
+                    labels.append(tokens[1] if len(tokens) > 1 and tokens[0].isdigit() else tokens[0])
+        return store
+    fromMLF = classmethod(fromMLF)
+
+
+    def writeMLF(self, location, keys=None, times=False, symbolmap=None, pad=None, append=False):
+        """ Writes HTK MLF (in one write) for 'keys' (default: all in
+            insertion order), with times if 'times'. Labels are mapped
+            through 'symbolmap' (dict) if given and 'pad' is added at the
+            start and end of each sequence where not present...
+        """
+        symbols = self.symbols
+        if symbolmap is not None:
+            symbols = [symbolmap[symbol] for symbol in symbols]
+        if keys is None:
+            keys = self.names
+
+        lines = [] if append else ["#!MLF!#\n"]
+        for key in keys:
+            i = self.nameids[key]
+            labels = [symbols[token] for token in self.tokens[self.offsets[i]:self.offsets[i + 1]]]
+            lines.append("\"*/%s.%s\"\n" % (key, LAB_EXT))
+            if times:
+                spans = self.times(key)
+                if spans is None:
+                    raise Exception("No times available for '%s'..." % (key))
+                lines.extend("%d %d %s\n" % (start, end, label) for start, end, label in zip(spans[0], spans[1], labels))
+            else:
+                if pad is not None:
+                    if not labels or labels[0] != pad:
+                        labels.insert(0, pad)
+                    if labels[-1] != pad:
+                        labels.append(pad)
+                lines.extend(label + "\n" for label in labels)
+            lines.append(".\n")
+        with codecs.open(location, "a" if append else "w", encoding="utf-8") as outfh:
+            outfh.write("".join(lines))
+
 class MultitierTranscriptionSet(object):
     """ To manage multitier transcriptions to generate [wordlevel +
         dictionary] for use with HTK process...
@@ -40,7 +533,9 @@ class MultitierTranscriptionSet(object):
     pass
 
 class TranscriptionSet(object):
-    """ Manages transcriptions...
+    """ Manages transcriptions... 'wordlevel' and 'phonelevel' are
+        TranscriptionStores (times are kept in 'phonelevel' when
+        available)...
     """
     #from string.punctuation except 'apostrophy' and 'dash'
     PUNCTUATION = "!\"#$%&()*+,./:;<=>?@[\\]^_`{|}~" 
@@ -50,7 +545,6 @@ class TranscriptionSet(object):
         """
         self.wordlevel = None
         self.phonelevel = None
-        self.boundaries = None
         self.type = type    # This can be 'WORD' or 'PHONE'...
 
         if self.type == "WORD":
@@ -61,7 +555,7 @@ class TranscriptionSet(object):
                 if (location.lower().endswith(SCM_EXT)):
                     self.wordlevel = self._load_schemefile(location)
                 elif (location.lower().endswith(MLF_EXT)):
-                    self.wordlevel = self._load_mlffile(location)
+                    self.wordlevel = TranscriptionStore.fromMLF(location)
                 else:
                     raise Exception("Could not identify transcription source...")
             else:
@@ -69,10 +563,10 @@ class TranscriptionSet(object):
         elif self.type == "PHONE":
             log.debug(unicode(self) + " loading phone level transcriptions from '%s'." % (location))
             if os.path.isdir(location):
-                self.phonelevel, self.boundaries = self._loadpath_phone(location)
+                self.phonelevel = self._loadpath_phone(location)
             elif os.path.isfile(location):
                 if (location.lower().endswith(MLF_EXT)):
-                    self.phonelevel = self._load_mlffile(location)
+                    self.phonelevel = TranscriptionStore.fromMLF(location)
             else:
                 raise Exception("location must be a directory containing label files...")
         else:
@@ -83,9 +577,9 @@ class TranscriptionSet(object):
         """
         log.debug(unicode(self) + " loading transcriptions from multiple files.")
 
-        wordlevel = {}
+        wordlevel = TranscriptionStore()
 
-        for filename in type_files(os.listdir(path), LAB_EXT):
+        for filename in sorted(type_files(os.listdir(path), LAB_EXT)):
 
             with codecs.open(os.path.join(path, filename), encoding="utf-8") as infh:
                 text = infh.read()
@@ -100,7 +594,7 @@ class TranscriptionSet(object):
             key = parse_path(filename)[2]
             if key in wordlevel:
                 raise Exception("basename '%s' is not unique..." % (key))
-            wordlevel[key] = " ".join(wordlist)
+            wordlevel.append(key, wordlist)
 
         if len(wordlevel) == 0:
             raise Exception("No transcriptions found in '%s'..."
@@ -113,8 +607,7 @@ class TranscriptionSet(object):
         """
         log.debug(unicode(self) + " loading transcriptions from multiple files.")
 
-        phonelevel = {}
-        boundaries = {}
+        phonelevel = TranscriptionStore()
 
         filenames = []
         try:
@@ -131,14 +624,14 @@ class TranscriptionSet(object):
         for filename in filenames:
             key = parse_path(filename)[2]
             utt = Utterance(os.path.join(path, filename))
-            phonelevel[key] = " ".join([entry[1] for entry in utt.entries])
+            labels = [entry[1] for entry in utt.entries]
             b = [float_to_htk_int(entry[0]) for entry in utt.entries]
             if all(b) == False:
-                boundaries[key] = None
+                phonelevel.append(key, labels)
             else:
-                boundaries[key] = b
+                phonelevel.append(key, labels, [0] + b[:-1], b)
 
-        return phonelevel, boundaries
+        return phonelevel
 
 
     def _load_schemefile(self, filepath):
@@ -149,7 +642,7 @@ class TranscriptionSet(object):
         quoted = re.compile('".*"')
         bracketed = re.compile('\(.*\)')
 
-        wordlevel = {}
+        wordlevel = TranscriptionStore()
 
         with codecs.open(filepath, encoding="utf-8") as infh:
             lines = infh.readlines()
@@ -158,40 +651,11 @@ class TranscriptionSet(object):
             transcr = quoted.search(line).group().strip("\"")
             whatsleft = re.sub(quoted, "", line)
             key = bracketed.search(whatsleft).group().strip("(").strip(")").strip()
-            if key in wordlevel:
-                raise Exception("Non unique names present...")
-            wordlevel[key] = transcr
+            wordlevel.append(key, transcr.split())
 
         return wordlevel
 
     
-    def _load_mlffile(self, filepath):
-        """ Load from HTK MLF style transcriptions file...
-            TODO: Also read time information...
-        """
-        log.debug(unicode(self) + " loading transcriptions from mlf file.")
-
-        quoted = re.compile('".*"')
-        dot = re.compile('\.\n')
-
-        t_items = {}
-        items = []
-
-        with codecs.open(filepath, encoding="utf-8") as infh:
-            for line in infh:
-                if re.match(quoted, line): #new label...
-                    items = []
-                    key = parse_path(line.strip().strip('"'))[2]
-                    if key in t_items:
-                        raise Exception("Non unique names present...")
-                elif re.match(dot, line):  #end of label...
-                    t_items[key] = " ".join(items)
-                else:                      #item on line...
-                    items.append(line.split()[-1])   #ignores time information at present
-        
-        return t_items
-    
-
     def loadMap(self, map_location):
         """ Load phonetic mapping from simple text file...
         """
@@ -220,23 +684,7 @@ class TranscriptionSet(object):
         """
         log.debug(unicode(self) + " writing word level mlf to '%s'." % (outfilepath))
 
-        with codecs.open(outfilepath, "w", encoding="utf-8") as outfh:
-            outfh.write("#!MLF!#\n")
-            for key in sorted(self.wordlevel.keys()):
-                outfh.write("\"*/%s.%s\"\n" % (key, LAB_EXT))
-                if silword == "":
-                    for word in self.wordlevel[key].split():
-                        outfh.write(word + "\n")
-                    outfh.write(".\n")
-                else:
-                    wordlist = self.wordlevel[key].split()
-                    if wordlist[0] != silword:
-                        wordlist = [silword] + wordlist
-                    if wordlist[-1] != silword:
-                        wordlist += [silword]
-                    for word in wordlist:
-                        outfh.write(word + "\n")
-                    outfh.write(".\n")
+        self.wordlevel.writeMLF(outfilepath, keys=sorted(self.wordlevel), pad=silword or None)
 
 
     def writePhoneMLF(self, outfilepath, silphone=None, write_boundaries=False, map=False, append=False):
@@ -250,44 +698,12 @@ class TranscriptionSet(object):
         if write_boundaries and silphone is not None:
             raise Exception("When writing boundaries, we cannot insert silphone...")
 
-        if append:
-            mode = "a"
-        else:
-            mode = "w"
-
-        with codecs.open(outfilepath, mode, encoding="utf-8") as outfh:
-            if not append:
-                outfh.write("#!MLF!#\n")
-            for key in sorted(self.phonelevel.keys()):
-                outfh.write("\"*/%s.%s\"\n" % (key, LAB_EXT))
-                if silphone is None:
-                    if write_boundaries:
-                        time_pos = 0
-                        for phone, boundary in zip(self.phonelevel[key].split(), self.boundaries[key]):
-                            if map:
-                                outfh.write(unicode(time_pos) + " " + unicode(boundary) + " " + self.phonemap[phone] + "\n")
-                            else:
-                                outfh.write(unicode(time_pos) + " " + unicode(boundary) + " " + phone + "\n")
-                            time_pos = boundary
-                    else:
-                        for phone in self.phonelevel[key].split():
-                            if map:
-                                outfh.write(self.phonemap[phone] + "\n")
-                            else:
-                                outfh.write(phone + "\n")
-                    outfh.write(".\n")
-                else:
-                    phonelist = self.phonelevel[key].split()
-                    if phonelist[0] != silphone:
-                        phonelist = [silphone] + phonelist
-                    if phonelist[-1] != silphone:
-                        phonelist += [silphone]
-                    for phone in phonelist:
-                        if map:
-                            outfh.write(self.phonemap[phone] + "\n")
-                        else:
-                            outfh.write(phone + "\n")
-                    outfh.write(".\n")
+        self.phonelevel.writeMLF(outfilepath,
+                                 keys=sorted(self.phonelevel),
+                                 times=write_boundaries,
+                                 symbolmap=self.phonemap if map else None,
+                                 pad=silphone,
+                                 append=append)
 
 
     def removePunctuation(self):
@@ -296,13 +712,8 @@ class TranscriptionSet(object):
         """
         log.debug(unicode(self) + " punctuation removed from word level transcriptions.")
 
-        for key in self.wordlevel:
-            tempstr = self.wordlevel[key]
-            tempstr = tempstr.translate(
-                          string.maketrans(
-                              TranscriptionSet.PUNCTUATION,
-                              ' ' * len(TranscriptionSet.PUNCTUATION)))
-            self.wordlevel[key] = " ".join(tempstr.split())
+        table = dict((ord(char), " ") for char in TranscriptionSet.PUNCTUATION)
+        self.wordlevel = self.wordlevel.rewrite(lambda word: word.translate(table).split())
 
 
     def forceLower(self):
@@ -310,8 +721,7 @@ class TranscriptionSet(object):
         """
         log.debug(unicode(self) + " word level transcriptions forced to lower case.")
 
-        for key in self.wordlevel:
-            self.wordlevel[key] = self.wordlevel[key].lower()
+        self.wordlevel = self.wordlevel.rewrite(lambda word: [word.lower()])
 
 
     def normalise(self):
@@ -325,34 +735,28 @@ class TranscriptionSet(object):
         """ Returns a sorted unique list of words contained in
             the transcriptions...
         """
-        wordset = set()
-
-        for key in self.wordlevel:
-            wordset.update(self.wordlevel[key].split())
-
-        return sorted(wordset)
+        return sorted(self.wordlevel.symbols)
 
     def getPhoneSet(self):
         """ Returns a sorted unique list of phones (can be triphones)
             containes in the transcriptions...
         """
-        phoneset = set()
-        
-        for key in self.phonelevel:
-            phoneset.update(self.phonelevel[key].split())
-        
-        return sorted(phoneset)
+        return sorted(self.phonelevel.symbols)
+
+    def variantUtterances(self, dictionary):
+        """ Returns the names of utterances containing words with more
+            than one pronunciation in 'dictionary' (only these can
+            change when realigning)...
+        """
+        variants = [word for word in self.wordlevel.symbols if word in dictionary and len(dictionary[word]) > 1]
+        return self.wordlevel.keysWith(variants)
 
     def writePseudoDict(self, outfile_location):
         """ Writes a 'dictionary' based on phonelist...
         """
         log.debug(unicode(self) + " writing 'pseudo' dictionary to '%s'." % (outfile_location))
 
-        phones = self.getPhoneSet()
-
-        with codecs.open(outfile_location, "w", encoding="utf-8") as outfh:
-            for phone in phones:
-                outfh.write(phone + " " + phone + "\n")
+        write_pseudo_dict(outfile_location, self.getPhoneSet())
 
 
     def unmapMLF(self, inmlf_location, outmlf_location, targetphone):
@@ -367,33 +771,19 @@ class TranscriptionSet(object):
         tempfh.write("RE %s %s\n" % (targetphone, fromcat))
         tempfh.flush()
         
-        p = subprocess.Popen(" ".join([HLED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-l",
-                                       "'*'",
-                                       "-i",
-                                       outmlf_location,
-                                       tempfh.name,
-                                       inmlf_location]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("unmapMLF:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") + 
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("unmapMLF:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        cmd = " ".join([HLED_BIN,
+                        "-A",
+                        "-D",
+                        "-V",
+                        "-T",
+                        "1",
+                        "-l",
+                        "'*'",
+                        "-i",
+                        outmlf_location,
+                        tempfh.name,
+                        inmlf_location])
+        returnval, so, se = run_command(cmd, caller="unmapMLF")
 
         tempfh.close()
 
@@ -403,98 +793,40 @@ class TranscriptionSet(object):
         return returnval
 
 
-    def wordToPhoneMLF(cls, inmlf_name, dict_name, outmlf_name):
-        """ Runs HLEd to convert a word level MLF to phone level MLF...
+    def wordToPhoneMLF(cls, inmlf_name, dict_name, outmlf_name, dictionary=None):
+        """ Converts a word level MLF to phone level MLF (as HLEd 'EX'),
+            'dictionary' (if given) is used instead of loading
+            'dict_name'... Returns the set of phones written...
         """
-        #write temp file - HLEd commands...
-        tempfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        tempfh.write("EX\n")
-        tempfh.flush()
-        
-        p = subprocess.Popen(" ".join([HLED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-l",
-                                       "'*'",
-                                       "-d",
-                                       dict_name,
-                                       "-i",
-                                       outmlf_name,
-                                       tempfh.name,
-                                       inmlf_name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("wordToPhoneMLF:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") +
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("wordToPhoneMLF:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
-
-        tempfh.close()
+        log.debug("Converting word level mlf '%s' to phone level mlf '%s'." % (inmlf_name, outmlf_name))
 
-        if returnval != 0:
-            raise Exception(HLED_BIN + " failed with code: " + unicode(returnval))
+        if dictionary is None:
+            dictionary = PronunciationDictionary(dict_name)
+        phones = TranscriptionStore.fromMLF(inmlf_name).rewrite(lambda word: expand_labels([word], dictionary))
+        phones.writeMLF(outmlf_name)
 
-        return returnval
+        return set(phones.symbols)
     wordToPhoneMLF = classmethod(wordToPhoneMLF)
 
 
     def monophoneToTriphoneMLF(cls, inmlf_name, outmlf_name, silphone, spphone=None):
-        """ Runs HLEd to convert a monophone based MLF to a triphone based MLF...
+        """ Converts a monophone based MLF to a triphone based MLF (as
+            HLEd 'WB silphone', ['WB spphone', 'NB spphone'], 'TC')...
+            Returns the set of triphones written...
         """
-        #write temp file - HLEd commands...
-        tempfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
+        log.debug("Converting monophone mlf '%s' to triphone mlf '%s'." % (inmlf_name, outmlf_name))
+
         if spphone is None:
-            tempfh.write("WB %s\nTC\n" % (silphone))
+            boundaries, noboundaries = (silphone,), ()
         else:
-            tempfh.write("WB %s\nWB %s\nNB %s\nTC\n" % (silphone, spphone, spphone))
-        tempfh.flush()
-        
-        p = subprocess.Popen(" ".join([HLED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-l",
-                                       "'*'",
-                                       "-i",
-                                       outmlf_name,
-                                       tempfh.name,
-                                       inmlf_name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("monophoneToTriphoneMLF:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") +
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("monophoneToTriphoneMLF:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
-
-        tempfh.close()
-
-        if returnval != 0:
-            raise Exception(HLED_BIN + " failed with code: " + unicode(returnval))
-
-        return returnval
+            boundaries, noboundaries = (silphone, spphone), (spphone,)
+        monophones = TranscriptionStore.fromMLF(inmlf_name)
+        triphones = TranscriptionStore()
+        for key in monophones:
+            triphones.append(key, triphone_labels(monophones.labels(key), boundaries, noboundaries))
+        triphones.writeMLF(outmlf_name)
+
+        return set(triphones.symbols)
     monophoneToTriphoneMLF = classmethod(monophoneToTriphoneMLF)
 
 
@@ -504,9 +836,9 @@ class TranscriptionSet(object):
         """
         missinglabels = []
         if self.wordlevel is not None:
-            translabels = list(self.wordlevel.keys())
+            translabels = self.wordlevel
         else:
-            translabels = list(self.phonelevel.keys())
+            translabels = self.phonelevel
         filelabels = [parse_path(filename)[2] \
                       for filename in audiofeats.getWavFilelist()]
 
@@ -534,7 +866,7 @@ class TranscriptionSet(object):
 
         for key in self.phonelevel:
             try:
-                if self.phonelevel[key] != transcriptionset.phonelevel[key]:
+                if self.phonelevel.labels(key) != transcriptionset.phonelevel.labels(key):
                     return False
             except KeyError:
                 raise Exception("Transcription sets are missmatched...")
@@ -549,60 +881,22 @@ class ASRTranscriptionSet(TranscriptionSet):
         """
         log.debug(unicode(self) + " writing word level mlf to '%s'." % (outfilepath))
 
-        with codecs.open(outfilepath, "w", encoding="utf-8") as outfh:
-            outfh.write("#!MLF!#\n")
-            for key in sorted(self.wordlevel.keys()):
-                outfh.write("\"*/%s.%s\"\n" % (key, LAB_EXT))
-                for word in self.wordlevel[key].split():
-                    outfh.write(word + "\n")
-                outfh.write(".\n")
+        self.wordlevel.writeMLF(outfilepath, keys=sorted(self.wordlevel))
 
 
-    def wordToPhoneMLF(cls, inmlf_name, dict_name, outmlf_name, silphone, spphone):
-        """ Runs HLEd to convert a word level MLF to phone level MLF...
+    def wordToPhoneMLF(cls, inmlf_name, dict_name, outmlf_name, silphone, spphone, dictionary=None):
+        """ Converts a word level MLF to phone level MLF without
+            'spphone' (as HLEd 'EX', 'DE spphone')... Returns the set of
+            phones written...
         """
-        #write temp file - HLEd commands...
-        tempfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        tempfh.write("EX\n")
-        tempfh.write("DE %s\n" % (spphone))
-        tempfh.flush()
-        
-        p = subprocess.Popen(" ".join([HLED_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       "-l",
-                                       "'*'",
-                                       "-d",
-                                       dict_name,
-                                       "-i",
-                                       outmlf_name,
-                                       tempfh.name,
-                                       inmlf_name]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("wordToPhoneMLF:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") +
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("wordToPhoneMLF:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
+        log.debug("Converting word level mlf '%s' to phone level mlf '%s'." % (inmlf_name, outmlf_name))
 
-        tempfh.close()
+        if dictionary is None:
+            dictionary = PronunciationDictionary(dict_name)
+        phones = TranscriptionStore.fromMLF(inmlf_name).rewrite(lambda word: expand_labels([word], dictionary, delete=(spphone,)))
+        phones.writeMLF(outmlf_name)
 
-        if returnval != 0:
-            raise Exception(HLED_BIN + " failed with code: " + unicode(returnval))
-
-        return returnval
+        return set(phones.symbols)
     wordToPhoneMLF = classmethod(wordToPhoneMLF)
 
 
@@ -615,6 +909,10 @@ class PronunciationDictionary(object):
         the ordering of items and a dictionary that maps these names
         to lists defining pronunciations.... thus ordering of
         pronunciations are also preserved...
+
+        Phone and word inventories are cached, pronunciations should
+        therefore be changed through '__setitem__'/'__delitem__' once
+        the inventories have been requested...
     """
     
     ALLOWABLE_CHARS = string.ascii_letters + string.digits + '@#'
@@ -626,10 +924,14 @@ class PronunciationDictionary(object):
         self.entries = {}
         self.entrynames = []
         self.entrycount = 0
+        self._phoneset = None
+        self._wordset = None
 
         if os.path.isfile(location):
             log.debug(unicode(self) + " loading dictionary from '%s'." % (location))
-            if (location.lower().endswith(SCM_EXT)):
+            if (location.lower().endswith(CDICT_EXT)):
+                self._load_compactfile(location)
+            elif (location.lower().endswith(SCM_EXT)):
                 self._load_schemefile(location)
             elif (location.lower().endswith(DICT_EXT)):
                 self._load_simpledict(location)
@@ -651,14 +953,17 @@ class PronunciationDictionary(object):
             entry name and 'phones' is an iterable representing a
             phone sequence...
         """
-        log.debug(unicode(self) + " adding entry to dictionary ('%s' '%s')." % (entryname, phones))
+        #called per entry when loading (avoid formatting unless logged)...
+        log.debug("%s adding entry to dictionary ('%s' '%s').", self, entryname, phones)
         
-        if entryname in self.entrynames:
+        self._phoneset = None
+        self._wordset = None
+        if entryname in self.entries:
             pronun = list(phones)
             if not pronun in self.entries[entryname]:
                 self.entries[entryname].append(pronun)
             else:
-                log.debug(unicode(self) + " trying to add duplicate entry into dictionary ('%s' '%s')." % (entryname, phones))
+                log.debug("%s trying to add duplicate entry into dictionary ('%s' '%s').", self, entryname, phones)
                 self.entrycount -= 1
         else:
             self.entrynames.append(entryname)
@@ -672,6 +977,8 @@ class PronunciationDictionary(object):
         self.entrynames.remove(entryname)
         self.entrycount -= len(self.entries[entryname])
         del self.entries[entryname]
+        self._phoneset = None
+        self._wordset = None
 
 
     def __contains__(self, entryname):
@@ -744,6 +1051,52 @@ class PronunciationDictionary(object):
         print("\t%s entries parsed from %s input lines" % (len(self), i+1))
 
 
+    def _load_compactfile(self, filepath):
+        """ Loads dictionary from compact format (see 'writeCompact')...
+        """
+        log.debug(unicode(self) + " loading dictionary from compact file.")
+
+        cfile = _CompactFile(filepath)
+        self.entries = _CompactEntries(cfile)
+        self.entrynames = _CompactNames(cfile)
+        self.entrycount = cfile.numpronuns
+
+
+    def writeCompact(self, outfilepath):
+        """ Writes compact (binary) dictionary: sorted word table,
+            pronunciations as phone ids and variant offsets in one
+            memory-mappable file...
+        """
+        log.debug(unicode(self) + " writing compact dictionary to '%s'." % (outfilepath))
+
+        words = self.getWordSet()
+        phones = self.getPhoneSet()
+        if len(phones) > 0xFFFF:
+            raise Exception("Too many phones for compact dictionary...")
+        phoneids = dict((phone, i) for i, phone in enumerate(phones))
+
+        variantoffsets = array(str("I"), [0])
+        pronunoffsets = array(str("I"), [0])
+        tokens = array(str("H"))
+        for word in words:
+            for pronun in self.entries[word]:
+                tokens.extend(phoneids[phone] for phone in pronun)
+                pronunoffsets.append(len(tokens))
+            variantoffsets.append(len(pronunoffsets) - 1)
+        wordoffsets, wordbytes = _pack_strings(words)
+        phoneoffsets, phonebytes = _pack_strings(phones)
+
+        chunks = [CDICT_HEADER.pack(CDICT_MAGIC, CDICT_VERSION, len(words), len(phones), len(pronunoffsets) - 1,
+                                    len(tokens), len(wordbytes), len(phonebytes))]
+        for section in [wordoffsets, wordbytes, phoneoffsets, phonebytes, variantoffsets, pronunoffsets, tokens]:
+            if isinstance(section, array):
+                section = _array_to_bytes(section)
+            chunks.append(section + b"\0" * (-len(section) % 4))
+        with open(outfilepath + ".tmp", "wb") as outfh:
+            outfh.write(b"".join(chunks))
+        os.rename(outfilepath + ".tmp", outfilepath)
+
+
     def sort(self, key=None, reverse=False):
         self.entrynames.sort(key=key, reverse=reverse)
 
@@ -764,28 +1117,34 @@ class PronunciationDictionary(object):
         """ Returns a sorted unique list of phones contained in
             the dictionary...
         """
-        phoneset = set()
-
-        for pronuns in self.entries.values():
-            for pronun in pronuns:
-                phoneset.update(pronun)
+        if self._phoneset is None:
+            if isinstance(self.entries, _CompactEntries) and self.entries.untouched:
+                self._phoneset = list(self.entries.phones)    #stored sorted...
+            else:
+                phoneset = set()
+                for pronuns in self.entries.values():
+                    for pronun in pronuns:
+                        phoneset.update(pronun)
+                self._phoneset = sorted(phoneset)
 
-        return sorted(phoneset)
+        return list(self._phoneset)
 
     def getWordSet(self):
         """ Returns a sorted unique list of words contained in
             the dictionary...
         """
-        return sorted(set(self.entrynames))
+        if self._wordset is None:
+            self._wordset = sorted(self.entries)
+
+        return list(self._wordset)
 
     def allWordsInDict(self, transcriptionset):
         """ Go through words in transcriptions, checking whether all words
             are present in the dictionary....
         """
         missingwords = []
-        dict_wordlist = self.getWordSet()
         for word in transcriptionset.getWordSet():  #this coupling is bad and unnecessary
-            if word not in dict_wordlist:
+            if word not in self.entries:
                 missingwords.append(word)
         if len(missingwords) > 0:
             print("MISSING WORDS:")
@@ -795,53 +1154,32 @@ class PronunciationDictionary(object):
         else:
             return True
         
-    def monophoneToTriphoneDict(cls, inputdictlocation, outputdictlocation, spphone=None):
-        """ Run HDMan to create a triphone dictionary...
+    def monophoneToTriphoneDict(cls, inputdictlocation, outputdictlocation, spphone=None, dictionary=None):
+        """ Creates a word internal triphone dictionary (as HDMan 'TC'
+            with boundary symbol 'spphone'), 'dictionary' (if given) is
+            used instead of loading 'inputdictlocation'... Returns the
+            set of triphones written...
         """
-        
-        #write temp file - HDMan commands...
-        tempfh = NamedTemporaryFile(mode="w+t")#, encoding="utf-8")
-        tempfh.write("TC\n")
-        tempfh.flush()
-        
+        log.debug("Converting dictionary '%s' to triphone dictionary '%s'." % (inputdictlocation, outputdictlocation))
+
+        if dictionary is None:
+            dictionary = cls(inputdictlocation)
         if spphone is None:
-            spoption = ""
+            boundaries = ()
         else:
-            spoption = "-b %s" % (spphone)
-
-        p = subprocess.Popen(" ".join([HDMAN_BIN,
-                                       "-A",
-                                       "-D",
-                                       "-V",
-                                       "-T",
-                                       "1",
-                                       spoption,
-                                       "-g",
-                                       tempfh.name,
-                                       outputdictlocation,
-                                       inputdictlocation]),
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.PIPE,
-                             close_fds = True,
-                             shell = True)
-        so, se = p.communicate()
-        log.info("monophoneToTriphoneDict:\n" +
-                 "================================================================================\n" +
-                 unicode(so, encoding="utf-8") +
-                 "================================================================================\n")
-        if bool(se):
-            log.warning("monophoneToTriphoneDict:\n" +
-                        "================================================================================\n" +
-                        unicode(se, encoding="utf-8") +
-                        "================================================================================\n")
-        returnval = p.returncode
-
-        tempfh.close()
-
-        if returnval != 0:
-            raise Exception(HDMAN_BIN + " failed with code: " + unicode(returnval))
-
-        return returnval
+            boundaries = (spphone,)
+
+        lines = []
+        triphoneset = set()
+        for entryname in dictionary:
+            for pronun in dictionary[entryname]:
+                triphones = triphone_labels(pronun, boundaries)
+                triphoneset.update(triphones)
+                lines.append(entryname + " " + " ".join(triphones) + "\n")
+        with codecs.open(outputdictlocation, "w", encoding="utf-8") as outfh:
+            outfh.write("".join(lines))
+
+        return triphoneset
     monophoneToTriphoneDict = classmethod(monophoneToTriphoneDict)
 
     
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains an in-process decision tree state clustering
+    engine that can be used instead of HHEd for the commands generated
+    by 'tieStates' ('RO', 'QS', 'TB', 'AU' and 'CO'): the occupancies
+    from the HERest statistics and the state means and variances from
+    the MMF are pooled into sufficient statistics, the likelihood gain
+    of all questions is evaluated at once for each node and the trees
+    (one per 'TB' command) are grown in parallel worker processes...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import re
+import codecs
+import logging
+import multiprocessing
+
+try:
+    import numpy as np
+except ImportError:
+    print("WARNING: Could not import numpy (necessary for native state tying)...")
+
+from speechlabels import triphone_2_monophone
+
+from HALIGN_MMF import MMFModelSet, HMMDef, HMMState, Mixture
+
+log = logging.getLogger("HAlign.Tying")
+
+#Tokens in HHEd commands: quoted strings, item lists or plain values
+COMMAND_RE = re.compile(r'"[^"]*"|\{[^}]*\}|[^\s"{}]+')
+IGNORED_COMMANDS = ["TR"]
+MIN_VARIANCE = 1.0e-6     #used if no 'varFloor1' macro is defined
+VARFLOOR_MACRO = "varFloor1"
+
+
+def parse_hed(commands):
+    """ Returns list of (command, arguments) from lines of an HHEd
+        script...
+    """
+    parsed = []
+    for line in commands:
+        tokens = COMMAND_RE.findall(line)
+        if tokens:
+            parsed.append((tokens[0].upper(), [token.strip('"') for token in tokens[1:]]))
+    return parsed
+
+
+def parse_itemlist(itemlist):
+    """ Returns a compiled regex matching the model names and the list
+        of state numbers (None if no state is given) in an HTK item list
+        such as '{ *+a }' or '{(a,*-a+*).state[2]}' ('*' and '?' are the
+        only wildcards)...
+    """
+    itemlist = itemlist.strip().strip("{}").strip()
+    statenums = None
+    if ".state[" in itemlist:
+        itemlist, statespec = itemlist.split(".state[", 1)
+        statenums = []
+        for span in statespec.split("]")[0].split(","):
+            bounds = [int(bound) for bound in span.split("-")]
+            statenums.extend(range(bounds[0], bounds[-1] + 1))
+    patterns = [pattern.strip().strip('"') for pattern in itemlist.strip("()").split(",")]
+    regex = "|".join(re.escape(pattern).replace("\\*", ".*").replace("\\?", ".") for pattern in patterns)
+    return re.compile("^(?:%s)$" % (regex), re.UNICODE), statenums
+
+
+def read_stats(location):
+    """ Returns dict of model name -> list of state occupancies from a
+        HERest statistics file ('-s')...
+    """
+    occupancies = {}
+    with codecs.open(location, encoding="utf-8") as infh:
+        for line in infh:
+            fields = COMMAND_RE.findall(line)
+            if len(fields) > 3:
+                occupancies[fields[1].strip('"')] = [float(field) for field in fields[3:]]
+    return occupancies
+
+
+def state_moments(state):
+    """ Mean and second order moment of a (mixture) state output
+        distribution...
+    """
+    first = sum(mixture.weight * mixture.mean for mixture in state.mixtures)
+    second = sum(mixture.weight * (mixture.variance + mixture.mean ** 2) for mixture in state.mixtures)
+    return first, second
+
+
+def log_likelihood(occ, first, second, varfloor):
+    """ Log likelihood of data with occupancies 'occ' (and occupancy
+        weighted first and second order sums) under a single diagonal
+        Gaussian (as used by HHEd's clustering), vectorised over leading
+        dimensions...
+    """
+    occ = np.asarray(occ, dtype=np.float64)
+    safeocc = np.maximum(occ, 1.0e-10)[..., np.newaxis]
+    mean = first / safeocc
+    variance = np.maximum(second / safeocc - mean ** 2, varfloor)
+    dims = first.shape[-1]
+    loglik = -0.5 * occ * (dims * (1.0 + np.log(2.0 * np.pi)) + np.sum(np.log(variance), axis=-1))
+    return np.where(occ > 0.0, loglik, 0.0)
+
+
+def _grow_tree(args):
+    """ Grow a tree over the states with occupancies 'occ' and weighted
+        sums 'first' and 'second' using the boolean question 'answers'
+        (questions x states): every node with a split gaining at least
+        'threshold' (and children with at least 'minocc' occupancy) is
+        split with its best question. Returns the nodes as lists of
+        [members, question, gain, yes, no]...
+    """
+    occ, first, second, answers, minocc, threshold, varfloor = args
+    answers = answers.astype(np.float64)
+
+    def best_split(members):
+        occs, firsts, seconds = occ[members], first[members], second[members]
+        totals = occs.sum(), firsts.sum(axis=0), seconds.sum(axis=0)
+        memberanswers = answers[:, members]
+        yes = memberanswers.dot(occs), memberanswers.dot(firsts), memberanswers.dot(seconds)
+        no = totals[0] - yes[0], totals[1] - yes[1], totals[2] - yes[2]
+        valid = (yes[0] >= minocc) & (no[0] >= minocc) & (yes[0] > 0.0) & (no[0] > 0.0)
+        if not valid.any():
+            return None, 0.0
+        gains = log_likelihood(*(yes + (varfloor,))) + log_likelihood(*(no + (varfloor,))) - \
+                log_likelihood(*(totals + (varfloor,)))
+        gains[~valid] = -np.inf
+        question = int(np.argmax(gains))
+        return question, float(gains[question])
+
+    #which nodes are split does not depend on the order of splitting...
+    nodes = [[np.arange(len(occ)), None, 0.0, None, None]]
+    stack = [0]
+    while stack:
+        node = nodes[stack.pop()]
+        question, gain = best_split(node[0])
+        if question is None or gain < threshold:
+            continue
+        isyes = answers[question, node[0]] > 0.0
+        node[1:] = [question, gain, len(nodes), len(nodes) + 1]
+        nodes.append([node[0][isyes], None, 0.0, None, None])
+        nodes.append([node[0][~isyes], None, 0.0, None, None])
+        stack.extend([node[3], node[4]])
+    return nodes
+
+
+class StateTree(object):
+    """ Decision tree for the states pooled by one 'TB' command. The
+        tree is grown once: clusters for any threshold at least as large
+        as the growing threshold are found by cutting the tree (without
+        regrowing it) which makes threshold sweeps cheap...
+    """
+    def __init__(self, macrobase, itemregex, statenums, items, questions, nodes, occ, first, second, varfloor):
+        self.macrobase = macrobase
+        self.itemregex = itemregex
+        self.statenums = statenums
+        self.items = items            #[(model name, state number), ...] sharing each tree state
+        self.questions = questions    #[(name, compiled regex), ...]
+        self.nodes = nodes
+        self.occ = occ
+        self.first = first
+        self.second = second
+        self.varfloor = varfloor
+        self.macros = {}              #tree state -> tied state macro name
+
+
+    def sums(self, members):
+        """ Pooled (occupancy, first, second) statistics of 'members'...
+        """
+        return self.occ[members].sum(), self.first[members].sum(axis=0), self.second[members].sum(axis=0)
+
+
+    def leaves(self, threshold):
+        """ Leaf nodes when splits gaining less than 'threshold' are not
+            made...
+        """
+        leaves = []
+        stack = [0]
+        while stack:
+            node = self.nodes[stack.pop()]
+            if node[1] is not None and node[2] >= threshold:
+                stack.extend([node[4], node[3]])
+            else:
+                leaves.append(node)
+        return leaves
+
+
+    def clusters(self, threshold):
+        """ Lists of tree states tied together: leaves are found with
+            'threshold' after which pairs of leaves whose merging
+            decreases the likelihood by less than 'threshold' are merged
+            (as HHEd). The decreases of all pairs are kept in a matrix
+            of which only the row (and column) of the merged cluster is
+            recomputed after each merge...
+        """
+        leaves = self.leaves(threshold)
+        clusters = [list(leaf[0]) for leaf in leaves]
+        sums = [self.sums(leaf[0]) for leaf in leaves]
+        occ = np.array([s[0] for s in sums], dtype=np.float64)
+        first = np.array([s[1] for s in sums], dtype=np.float64)
+        second = np.array([s[2] for s in sums], dtype=np.float64)
+        logliks = log_likelihood(occ, first, second, self.varfloor)
+        active = np.ones(len(clusters), dtype=bool)
+
+        def decreases(i):
+            """ Likelihood decrease of merging cluster 'i' with each
+                cluster (inactive clusters and 'i' itself excluded)...
+            """
+            merged = log_likelihood(occ[i] + occ, first[i] + first, second[i] + second, self.varfloor)
+            row = logliks[i] + logliks - merged
+            row[~active] = np.inf
+            row[i] = np.inf
+            return row
+
+        costs = np.array([decreases(i) for i in range(len(clusters))])
+        while True:
+            #first minimum in row major order (as the pairwise search order)...
+            i, j = divmod(int(np.argmin(costs)), len(clusters))
+            if not costs[i, j] < threshold:
+                break
+            i, j = min(i, j), max(i, j)
+            occ[i] += occ[j]
+            first[i] += first[j]
+            second[i] += second[j]
+            logliks[i] = log_likelihood(occ[i], first[i], second[i], self.varfloor)
+            clusters[i].extend(clusters[j])
+            active[j] = False
+            costs[j, :] = np.inf
+            costs[:, j] = np.inf
+            costs[i, :] = costs[:, i] = decreases(i)
+        return [cluster for cluster, isactive in zip(clusters, active) if isactive]
+
+
+    def classify(self, name, threshold):
+        """ Members of the leaf node reached by model 'name'...
+        """
+        node = self.nodes[0]
+        while node[1] is not None and node[2] >= threshold:
+            if self.questions[node[1]][1].match(name):
+                node = self.nodes[node[3]]
+            else:
+                node = self.nodes[node[4]]
+        return node[0]
+
+
+def _build_trees(modelset, hmmlist, pending, questions, occupancies, minocc, varfloor, numprocs):
+    """ Grow trees for the 'TB' commands in 'pending' (in parallel) and
+        tie the states in each cluster. Returns [(tree, threshold), ...]...
+    """
+    jobs = []
+    for threshold, macrobase, itemlist in pending:
+        itemregex, statenums = parse_itemlist(itemlist)
+        owners = {}
+        items = []
+        for name in hmmlist:
+            if name not in modelset.hmms or not itemregex.match(name):
+                continue
+            hmm = modelset.hmms[name]
+            for statenum in statenums or range(2, hmm.numstates):
+                state = hmm.states[statenum]
+                if id(state) not in owners:
+                    owners[id(state)] = []
+                    items.append(owners[id(state)])
+                owners[id(state)].append((name, statenum))
+        if not items:
+            log.warning("TB %s: no states matched %s..." % (macrobase, itemlist))
+            continue
+
+        occ = np.zeros(len(items), dtype=np.float64)
+        for i, owner in enumerate(items):
+            for name, statenum in owner:
+                if name in occupancies and statenum - 2 < len(occupancies[name]):
+                    occ[i] += occupancies[name][statenum - 2]
+        moments = [state_moments(modelset.hmms[owner[0][0]].states[owner[0][1]]) for owner in items]
+        first = occ[:, np.newaxis] * np.array([moment[0] for moment in moments])
+        second = occ[:, np.newaxis] * np.array([moment[1] for moment in moments])
+        answers = np.zeros((len(questions), len(items)), dtype=bool)
+        for q, (qname, qregex) in enumerate(questions):
+            answers[q] = [bool(qregex.match(owner[0][0])) for owner in items]
+        tree = StateTree(macrobase, itemregex, statenums, items, questions, None, occ, first, second, varfloor)
+        jobs.append((tree, threshold, (occ, first, second, answers, minocc, threshold, varfloor)))
+
+    numprocs = max(1, min(numprocs, len(jobs)))
+    if numprocs == 1:
+        results = [_grow_tree(job[2]) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(numprocs)
+        try:
+            results = pool.map(_grow_tree, [job[2] for job in jobs])
+        finally:
+            pool.close()
+            pool.join()
+
+    trees = []
+    for (tree, threshold, args), nodes in zip(jobs, results):
+        tree.nodes = nodes
+        _tie_clusters(modelset, tree, threshold)
+        trees.append((tree, threshold))
+    return trees
+
+
+def _tie_clusters(modelset, tree, threshold):
+    """ Replace the states in each cluster of 'tree' by a new state
+        macro (single Gaussian with the pooled statistics)...
+    """
+    firsthmm = [i for i, definition in enumerate(modelset.definitions) if definition[0] == "h"][0]
+    mmffilename = modelset.definitions[firsthmm][2]
+    clusters = tree.clusters(threshold)
+    for k, cluster in enumerate(clusters):
+        macroname = "%s%d" % (tree.macrobase, k + 1)
+        occ, first, second = tree.sums(cluster)
+        if occ <= 0.0:    #no data: average of the states...
+            moments = [state_moments(modelset.hmms[tree.items[member][0][0]].states[tree.items[member][0][1]])
+                       for member in cluster]
+            occ, first, second = len(moments), sum(m[0] for m in moments), sum(m[1] for m in moments)
+        mean = first / occ
+        variance = np.maximum(second / occ - mean ** 2, tree.varfloor)
+        state = HMMState([Mixture(1.0, mean, variance)], macro=macroname)
+        modelset.states[macroname] = state
+        modelset.definitions.insert(firsthmm, ("s", macroname, mmffilename))
+        firsthmm += 1
+        for member in cluster:
+            tree.macros[member] = macroname
+            for name, statenum in tree.items[member]:
+                modelset.hmms[name].states[statenum] = state
+    log.info("TB %s: %d states tied to %d clusters." % (tree.macrobase, len(tree.items), len(clusters)))
+
+
+def _add_unseen(modelset, trees, listlocation):
+    """ 'AU': synthesise models in the list at 'listlocation' that are
+        not in 'modelset' using the trees (and the transition matrix of
+        a model with the same centre phone)... Returns the list...
+    """
+    with codecs.open(listlocation, encoding="utf-8") as infh:
+        names = [line.split()[0] for line in infh if line.strip()]
+    mmffilename = [definition[2] for definition in modelset.definitions if definition[0] == "h"][0]
+    templates = {}
+    for name in sorted(modelset.hmms):
+        templates.setdefault(triphone_2_monophone(name), modelset.hmms[name])
+
+    numadded = 0
+    for name in names:
+        if name in modelset.hmms:
+            continue
+        try:
+            template = templates[triphone_2_monophone(name)]
+        except KeyError:
+            raise Exception("AU: no model with centre phone of '%s'..." % (name))
+        states = {}
+        for tree, threshold in trees:
+            if tree.itemregex.match(name):
+                macroname = tree.macros[tree.classify(name, threshold)[0]]
+                for statenum in tree.statenums or range(2, template.numstates):
+                    states[statenum] = modelset.states[macroname]
+        if sorted(states) != list(range(2, template.numstates)):
+            raise Exception("AU: no trees for all states of '%s'..." % (name))
+        modelset.hmms[name] = HMMDef(name, template.numstates, states, template.transp, template.transpmacro)
+        modelset.definitions.append(("h", name, mmffilename))
+        modelset.logical[name] = name
+        numadded += 1
+    log.info("AU: %d unseen models synthesised." % (numadded))
+    return names
+
+
+def _compact(modelset, hmmlist, tiedlistlocation):
+    """ 'CO': models with identical states and transition matrix are
+        merged, the (logical physical) list is written to
+        'tiedlistlocation'...
+    """
+    physical = {}
+    lines = []
+    for name in hmmlist:
+        hmm = modelset[name]
+        key = (tuple(id(state) for state in hmm.emittingStates()), id(hmm.transp))
+        physical.setdefault(key, hmm.name)
+        if physical[key] == name:
+            lines.append(name + "\n")
+        else:
+            lines.append(name + " " + physical[key] + "\n")
+            modelset.logical[name] = physical[key]
+    for name in set(hmmlist) - set(physical.values()):
+        modelset.hmms.pop(name, None)
+    with codecs.open(tiedlistlocation, "w", encoding="utf-8") as outfh:
+        outfh.writelines(lines)
+    log.info("CO: %d logical models, %d physical models." % (len(hmmlist), len(physical)))
+
+
+def native_tie_states(prev_dir, output_dir, phonelistlocation, commands, numprocs=1):
+    """ Apply the HHEd 'commands' ('RO', 'QS', 'TB', 'AU', 'CO' and
+        'TR') to the models in 'prev_dir' (those in 'phonelistlocation'
+        are clustered) and write the tied models to 'output_dir'...
+    """
+    with codecs.open(phonelistlocation, encoding="utf-8") as infh:
+        hmmlist = [line.split()[0] for line in infh if line.strip()]
+    modelset = MMFModelSet.fromModelDir(prev_dir, phonelistlocation)
+    varfloor = modelset.variances.get(VARFLOOR_MACRO, MIN_VARIANCE)
+
+    minocc = 0.0
+    occupancies = {}
+    questions = []
+    pending = []
+    trees = []
+    for command, args in parse_hed(commands) + [(None, [])]:
+        if command != "TB" and pending:
+            trees.extend(_build_trees(modelset, hmmlist, pending, questions, occupancies, minocc, varfloor, numprocs))
+            pending = []
+        if command == "RO":
+            minocc = float(args[0])
+            if len(args) > 1:
+                occupancies = read_stats(args[1])
+        elif command == "QS":
+            questions.append((args[0], parse_itemlist(args[1])[0]))
+        elif command == "TB":
+            pending.append((float(args[0]), args[1], args[2]))
+        elif command == "AU":
+            hmmlist = _add_unseen(modelset, trees, args[0])
+        elif command == "CO":
+            _compact(modelset, hmmlist, args[0])
+        elif command is not None and command not in IGNORED_COMMANDS:
+            raise Exception("HHEd command '%s' is not supported by native state tying..." % (command))
+
+    modelset.save(output_dir)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" This module contains an in-process (log domain) Viterbi forced
+    aligner using HTK models loaded with 'HALIGN_MMF'. Models are
+    loaded once and kept resident so that single utterances can be
+    (re)aligned quickly without running HVite. Output is equivalent
+    to that of HVite with '-o N -f -m' (i.e. what
+    'speechlabels.Utterance.readRec' expects)...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import codecs
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    print("WARNING: Could not import numpy (necessary for in-process alignment)...")
+
+from HALIGN_MMF import MMFModelSet
+from HALIGN_Features import read_htk_params
+
+log = logging.getLogger("HAlign.Viterbi")
+
+
+def log_prob(a):
+    """ Elementwise log with log(0) = -inf (without warnings)...
+    """
+    a = np.asarray(a, dtype=np.float64)
+    out = np.empty_like(a)
+    out.fill(-np.inf)
+    np.log(a, out=out, where=a > 0.0)
+    return out
+
+
+def log_sum_exp(a, axis):
+    """ Numerically stable log(sum(exp(a))) along 'axis'...
+    """
+    amax = np.max(a, axis=axis, keepdims=True)
+    amax[~np.isfinite(amax)] = 0.0
+    with np.errstate(divide="ignore"):
+        return np.log(np.sum(np.exp(a - amax), axis=axis)) + np.squeeze(amax, axis=axis)
+
+
+class GaussianMixtureTable(object):
+    """ All distinct states in a model set packed into arrays so that
+        output log likelihoods of any subset of states can be computed
+        for a whole utterance with a few matrix products...
+    """
+
+    def __init__(self, states):
+        self.index = {}
+        maxmixes = max(len(state.mixtures) for state in states)
+        vecsize = len(states[0].mixtures[0].mean)
+        shape = (len(states), maxmixes, vecsize)
+        self.precisions = np.zeros(shape)
+        self.scaledmeans = np.zeros(shape)
+        #log(weight) - 0.5 * (gconst + sum(mean^2/var)); padding mixtures have -inf
+        self.consts = np.empty(shape[:2])
+        self.consts.fill(-np.inf)
+        for i, state in enumerate(states):
+            self.index[id(state)] = i
+            for j, mixture in enumerate(state.mixtures):
+                if mixture.weight <= 0.0:
+                    continue
+                precision = 1.0 / mixture.variance
+                self.precisions[i, j] = precision
+                self.scaledmeans[i, j] = mixture.mean * precision
+                self.consts[i, j] = np.log(mixture.weight) - 0.5 * (mixture.gconst() + np.dot(mixture.mean ** 2, precision))
+
+
+    def mixtureLogLikelihoods(self, feats, stateindices):
+        """ Returns a (numframes x len(stateindices) x maxmixes) array
+            of weighted mixture component log likelihoods...
+        """
+        numstates = len(stateindices)
+        precisions = self.precisions[stateindices].reshape((-1, feats.shape[1]))
+        scaledmeans = self.scaledmeans[stateindices].reshape((-1, feats.shape[1]))
+        feats = feats.astype(np.float64)
+        mixll = np.dot(feats, scaledmeans.T) - 0.5 * np.dot(feats ** 2, precisions.T)
+        mixll += self.consts[stateindices].reshape(-1)
+        return mixll.reshape((len(feats), numstates, -1))
+
+
+    def logLikelihoods(self, feats, stateindices):
+        """ Returns a (numframes x len(stateindices)) array of output
+            log likelihoods...
+        """
+        return log_sum_exp(self.mixtureLogLikelihoods(feats, stateindices), axis=2)
+
+
+def distinct_states(modelset):
+    """ All distinct (i.e. tied states only once) 'HMMState's in a
+        model set in a fixed order...
+    """
+    states = []
+    seen = set()
+    for name in sorted(modelset.hmms):
+        for state in modelset.hmms[name].emittingStates():
+            if id(state) not in seen:
+                seen.add(id(state))
+                states.append(state)
+    return states
+
+
+def build_network(modelset, table, modelnames):
+    """ Concatenate models into a left-to-right network of emitting
+        states. Returns the 'table' indices of network states, the
+        network state offset of each model and a list of arcs: (src,
+        dst, logprob, components) with src None for network entry and
+        dst None for network exit. Paths through skippable ('tee')
+        models become direct arcs and 'components' lists the (model
+        position, i, j) transition matrix entries that each arc is
+        made of...
+    """
+    hmms = [modelset[name] for name in modelnames]
+    offsets = [0]
+    for hmm in hmms:
+        offsets.append(offsets[-1] + hmm.numstates - 2)
+    stateindices = np.array([table.index[id(state)] for hmm in hmms for state in hmm.emittingStates()], dtype=np.int64)
+    logtransps = [log_prob(hmm.transp) for hmm in hmms]
+
+    #reach[m]: [(target state or None for network exit, logprob, components)] from the entry of model m
+    reach = [None] * len(hmms) + [[(None, 0.0, [])]]
+    for m in range(len(hmms) - 1, -1, -1):
+        logtransp = logtransps[m]
+        n = hmms[m].numstates
+        reach[m] = [(offsets[m] + j - 1, logtransp[0, j], [(m, 0, j)]) for j in range(1, n - 1) if logtransp[0, j] > -np.inf]
+        if logtransp[0, n - 1] > -np.inf:
+            reach[m].extend([(target, lp + logtransp[0, n - 1], [(m, 0, n - 1)] + components)
+                             for target, lp, components in reach[m + 1]])
+
+    arcs = []
+    for target, lp, components in reach[0]:
+        if target is None:
+            raise Exception("Network can be traversed without consuming frames...")
+        arcs.append((None, target, lp, components))
+    for m, hmm in enumerate(hmms):
+        logtransp = logtransps[m]
+        n = hmm.numstates
+        for i in range(1, n - 1):
+            src = offsets[m] + i - 1
+            for j in range(1, n - 1):
+                if logtransp[i, j] > -np.inf:
+                    arcs.append((src, offsets[m] + j - 1, logtransp[i, j], [(m, i, j)]))
+            if logtransp[i, n - 1] > -np.inf:
+                for target, lp, components in reach[m + 1]:
+                    arcs.append((src, target, lp + logtransp[i, n - 1], [(m, i, n - 1)] + components))
+    return stateindices, offsets, arcs
+
+
+def combine_arcs(arcs, numstates, combine):
+    """ Collect arcs into entry and exit log prob vectors and a dict
+        of transitions: offset -> per-source-state log probs. Parallel
+        arcs are merged with 'combine' (e.g. 'np.maximum' for Viterbi,
+        'np.logaddexp' for forward-backward)...
+    """
+    entrylp = np.empty(numstates)
+    entrylp.fill(-np.inf)
+    exitlp = np.empty(numstates)
+    exitlp.fill(-np.inf)
+    transitions = {}
+    for src, dst, lp, components in arcs:
+        if src is None:
+            entrylp[dst] = combine(entrylp[dst], lp)
+        elif dst is None:
+            exitlp[src] = combine(exitlp[src], lp)
+        else:
+            if dst - src not in transitions:
+                transitions[dst - src] = np.empty(numstates)
+                transitions[dst - src].fill(-np.inf)
+            transitions[dst - src][src] = combine(transitions[dst - src][src], lp)
+    return entrylp, exitlp, transitions
+
+
+class ViterbiAligner(object):
+    """ Forced alignment of feature matrices to word/phone sequences
+        using a resident model set...
+    """
+
+    def __init__(self, modelset, beam=None):
+        """ 'modelset' is an 'MMFModelSet', 'beam' is an optional
+            pruning threshold (log domain) relative to the best
+            partial path at each frame...
+        """
+        self.modelset = modelset
+        self.beam = beam
+        states = distinct_states(modelset)
+        self.table = GaussianMixtureTable(states)
+        log.debug("Loaded %s models with %s distinct states." % (len(modelset.hmms), len(states)))
+
+
+    def fromModelDir(cls, hmmdir, hmmlistlocation=None, beam=None):
+        """ Load models from an 'hmm<N>' dir (e.g. from
+            'HMMSet.targetlocation')...
+        """
+        return cls(MMFModelSet.fromModelDir(hmmdir, hmmlistlocation), beam)
+    fromModelDir = classmethod(fromModelDir)
+
+
+    def _buildNetwork(self, modelnames):
+        """ Network for 'modelnames' with alternative paths (through
+            skippable models) combined by taking the best...
+        """
+        stateindices, offsets, arcs = build_network(self.modelset, self.table, modelnames)
+        entrylp, exitlp, transitions = combine_arcs(arcs, offsets[-1], np.maximum)
+        return stateindices, offsets, entrylp, exitlp, transitions
+
+
+    def _viterbi(self, loglik, entrylp, exitlp, transitions):
+        """ Returns best state sequence (one network state per frame)
+            and per-frame log probs (transition + output)...
+        """
+        numframes, numstates = loglik.shape
+        offsets = sorted(transitions)
+        backptrs = np.zeros((numframes, numstates), dtype=np.int32)
+        delta = entrylp + loglik[0]
+        candidates = np.empty((len(offsets), numstates))
+        for t in range(1, numframes):
+            candidates.fill(-np.inf)
+            for k, offset in enumerate(offsets):
+                scores = delta + transitions[offset]
+                if offset >= 0:
+                    candidates[k, offset:] = scores[:numstates - offset]
+                else:
+                    candidates[k, :numstates + offset] = scores[-offset:]
+            best = np.argmax(candidates, axis=0)
+            delta = candidates[best, np.arange(numstates)] + loglik[t]
+            backptrs[t] = np.arange(numstates) - np.array(offsets)[best]
+            if self.beam is not None:
+                delta[delta < np.max(delta) - self.beam] = -np.inf
+        final = delta + exitlp
+        laststate = int(np.argmax(final))
+        if final[laststate] == -np.inf:
+            raise Exception("No path through network (utterance too short for transcription?)...")
+
+        path = np.empty(numframes, dtype=np.int32)
+        path[-1] = laststate
+        for t in range(numframes - 1, 0, -1):
+            path[t - 1] = backptrs[t, path[t]]
+
+        #recompute per frame scores along the path...
+        framescores = loglik[np.arange(numframes), path]
+        framescores[0] += entrylp[path[0]]
+        for t in range(1, numframes):
+            framescores[t] += transitions[path[t] - path[t - 1]][path[t - 1]]
+        framescores[-1] += exitlp[path[-1]]
+        return path, framescores
+
+
+    def align(self, feats, words, sampperiod=50000):
+        """ Align 'feats' (numframes x vecsize array, or the location
+            of an HTK parameter file) to 'words': a list of (word,
+            [modelname, ...]) pairs (e.g. pronunciations of words
+            using the first dictionary entry, or (phone, [phone]) for
+            phonetic transcriptions). 'sampperiod' is the frame period
+            in HTK units (taken from the file if a location is given).
+
+            Returns a list of entries equivalent to HVite '-o N -f -m'
+            output lines: [start, end, state, statescore, (model,
+            modelscore, (word))] with times in 100ns units and scores
+            normalised by duration...
+        """
+        if not hasattr(feats, "shape"):
+            feats, sampperiod, parmkind = read_htk_params(feats)
+        modelnames = []
+        wordstarts = {}
+        for word, pronun in words:
+            wordstarts[len(modelnames)] = word
+            modelnames.extend(pronun)
+
+        stateindices, offsets, entrylp, exitlp, transitions = self._buildNetwork(modelnames)
+        loglik = self.table.logLikelihoods(feats, stateindices)
+        path, framescores = self._viterbi(loglik, entrylp, exitlp, transitions)
+
+        #network state -> (model position, HTK state number)
+        modelpos = np.searchsorted(offsets, np.arange(offsets[-1]), side="right") - 1
+        runstarts = np.concatenate([[0], np.flatnonzero(np.diff(path)) + 1])
+        runends = np.concatenate([runstarts[1:], [len(path)]])
+
+        #model level runs...
+        modelruns = {}
+        for start, end in zip(runstarts, runends):
+            m = modelpos[path[start]]
+            if m in modelruns:
+                modelruns[m][1] = end
+            else:
+                modelruns[m] = [start, end]
+
+        entries = []
+        prevmodel = None
+        pendingword = None
+        for start, end in zip(runstarts, runends):
+            state = path[start]
+            m = modelpos[state]
+            entry = [int(start) * sampperiod,
+                     int(end) * sampperiod,
+                     "s%d" % (state - offsets[m] + 2),
+                     float(np.mean(framescores[start:end]))]
+            if m != prevmodel:
+                mstart, mend = modelruns[m]
+                entry.extend([modelnames[m], float(np.mean(framescores[mstart:mend]))])
+                #words of skipped (tee) models are attached to the next model...
+                for k in range(prevmodel + 1 if prevmodel is not None else 0, m + 1):
+                    if k in wordstarts:
+                        pendingword = wordstarts[k]
+                if pendingword is not None:
+                    entry.append(pendingword)
+                    pendingword = None
+                prevmodel = m
+            entries.append(entry)
+        return entries
+
+
+    def writeRec(self, entries, location):
+        """ Write entries (from 'align') as an HTK .rec file...
+        """
+        with codecs.open(location, "w", encoding="utf-8") as outfh:
+            for entry in entries:
+                fields = ["%d" % entry[0], "%d" % entry[1], entry[2], "%f" % entry[3]]
+                if len(entry) > 4:
+                    fields.extend([entry[4], "%f" % entry[5]])
+                if len(entry) > 6:
+                    fields.append(entry[6])
+                outfh.write(" ".join(fields) + "\n")
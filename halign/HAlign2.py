@@ -23,12 +23,14 @@ import logging
 from time import time, strftime
 import shutil
 import pprint
+import multiprocessing
 from optparse import OptionParser
 from ConfigParser import ConfigParser
 
 from HALIGN_Text import *
 from HALIGN_Features import *
 from HALIGN_Models import *
+from HALIGN_Run import METRICS, stage
 
 import speechlabels as sl
 
@@ -38,7 +40,23 @@ DEF_CONF = "halign.conf"
 DEF_LOGLEVEL = 20          #'INFO'
 ALLOWED_LOGLEVELS = [0, 10, 20, 30, 40, 50]
 DEF_METHOD = "GenHAlign"
-ALLOWED_METHODS = ["GenHAlign", "GenHAlignRealign", "GenTrainASR"]
+ALLOWED_METHODS = ["GenHAlign", "GenHAlignRealign", "GenHAlignIncremental", "GenTrainASR"]
+DEF_REEST_ENGINE = "herest"
+ALLOWED_REEST_ENGINES = ["herest", "native"]
+DEF_FEAT_FRONTEND = "hcopy"
+ALLOWED_FEAT_FRONTENDS = ["hcopy", "native"]
+DEF_TYING_ENGINE = "hhed"
+ALLOWED_TYING_ENGINES = ["hhed", "native"]
+DEF_PRUNING_MODE = "fixed"
+ALLOWED_PRUNING_MODES = ["fixed", "adaptive"]
+DEF_REEST_SCHEDULE = "fixed"
+ALLOWED_REEST_SCHEDULES = ["fixed", "converge"]
+DEF_CONVERGENCE_THRESHOLD = "0.001"   #relative improvement in avg. log prob per frame
+DEF_MIN_ITERATIONS = "2"
+DEF_MAX_ITERATIONS = "8"
+DEF_ADAPTATION_ITERATIONS = "0"
+DEF_REALIGNMENT = "full"
+ALLOWED_REALIGNMENTS = ["full", "variants"]
 
 #instantiate 'root' logger...
 log = logging.getLogger(NAME)
@@ -63,6 +81,7 @@ class GenHAlign(object):
     BOOTFEAT_DIR = "bootfeats"
     OUTPUT_DIR = "labels"
     TEXTGRID_DIR = "textgrids"
+    FINALMODELS_DIR = "finalmodels"
 
     #EXTS
     MLF_EXT = "mlf"
@@ -71,6 +90,7 @@ class GenHAlign(object):
 
     #FILENAMES
     MAINDICT_BN = "main"
+    MERGEDDICT_BN = "merged"
     TRIDICT_BN = "tri"
     WORDTRANSCR_BN = "words"
     PHONETRANSCR_BN = "phones"
@@ -83,13 +103,20 @@ class GenHAlign(object):
     TIEDTRIPHONESET_FN = "tiedtriphoneset"
     MONOPHONESET_FN = "phoneset"
     HERESTSTATS_FN = "hereststats"
+    CHECKPOINTS_FN = "checkpoints.json"
+    METRICS_FN = "metrics.json"
+    FEATCONF_FN = "feats.conf"
 
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, resume=False):
         """Initialises process (reads from config and sets switches/variables...)...
+           If 'resume' then stages completed in a previous run in the
+           same working dir (as recorded in the checkpoints manifest)
+           are skipped...
         """
         
         self.overrides = overrides
+        self.resume = resume
         self.configfile_dir = os.path.dirname(configfile_location)
         with codecs.open(configfile_location, encoding="utf-8") as conffh:
             self.config = ConfigParser()
@@ -114,6 +141,10 @@ class GenHAlign(object):
         #copy configuration file for the record (if possible)...and log configuration...
         log.info("Configuration file used: '%s'" % configfile_location)
         log.info("Overrides defined:\n%s" % pprint.pformat(self.overrides))
+        self.checkpoints = Checkpoints(os.path.join(self.working_dir, GenHAlign.CHECKPOINTS_FN), resume=self.resume)
+        METRICS.reset()
+        self.metrics_location = os.path.join(self.working_dir, GenHAlign.METRICS_FN)
+        self.stagehashes = {}
         try:
             shutil.copy(configfile_location, self.working_dir)
         except shutil.Error:
@@ -160,6 +191,23 @@ class GenHAlign(object):
         self.mappedbootstrap = self.getParm("SWITCHES", "MAPPEDBOOTSTRAP", boolean=True)
         self.textgrid_output = self.getParm("SWITCHES", "TEXTGRID_OUTPUT", boolean=True)
         self.postcleanup = self.getParm("SWITCHES", "POSTCLEANUP", boolean=True)
+        self.numprocs = int(self.getParm("PARMS", "NUM_PROCESSES", default="1"))
+        if self.numprocs < 1:
+            self.numprocs = multiprocessing.cpu_count()
+        self.reest_engine = self.getParm("PARMS", "REESTIMATION_ENGINE", default=DEF_REEST_ENGINE).lower()
+        assert self.reest_engine in ALLOWED_REEST_ENGINES, "Unsupported REESTIMATION_ENGINE: %s" % (self.reest_engine)
+        self.tying_engine = self.getParm("PARMS", "TYING_ENGINE", default=DEF_TYING_ENGINE).lower()
+        assert self.tying_engine in ALLOWED_TYING_ENGINES, "Unsupported TYING_ENGINE: %s" % (self.tying_engine)
+        self.pruning_mode = self.getParm("PARMS", "PRUNING_MODE", default=DEF_PRUNING_MODE).lower()
+        assert self.pruning_mode in ALLOWED_PRUNING_MODES, "Unsupported PRUNING_MODE: %s" % (self.pruning_mode)
+        self.feat_frontend = self.getParm("PARMS", "FEATURE_FRONTEND", default=DEF_FEAT_FRONTEND).lower()
+        assert self.feat_frontend in ALLOWED_FEAT_FRONTENDS, "Unsupported FEATURE_FRONTEND: %s" % (self.feat_frontend)
+        self.reest_schedule = self.getParm("PARMS", "REESTIMATION_SCHEDULE", default=DEF_REEST_SCHEDULE).lower()
+        assert self.reest_schedule in ALLOWED_REEST_SCHEDULES, "Unsupported REESTIMATION_SCHEDULE: %s" % (self.reest_schedule)
+        self.convergence_threshold = float(self.getParm("PARMS", "CONVERGENCE_THRESHOLD", default=DEF_CONVERGENCE_THRESHOLD))
+        self.min_iterations = int(self.getParm("PARMS", "MIN_ITERATIONS", default=DEF_MIN_ITERATIONS))
+        self.max_iterations = int(self.getParm("PARMS", "MAX_ITERATIONS", default=DEF_MAX_ITERATIONS))
+        self.logprob_trajectories = []
 
         if bool(self.orthographic_location) and bool(self.pronundict_location):
             self.have_ortho_and_pronundict = True
@@ -201,6 +249,7 @@ class GenHAlign(object):
         self.makeFeats()
         self.initModels()
         self.trainModels()
+        self.exportModels()
         self.doAlignment()
         if self.textgrid_output: self.doTextgridOutput()
         if self.postcleanup: self.doCleanup()
@@ -208,9 +257,10 @@ class GenHAlign(object):
         log.info("Process Done (in %.0f seconds)." % (endtime - starttime))
 
         
-    def getParm(self, sectionkey, key, boolean=False, path=False):
+    def getParm(self, sectionkey, key, boolean=False, path=False, default=None):
         """Try to get specific parameter firstly from 'self.overrides' else
-           fall back to 'self.config'...
+           fall back to 'self.config'... If 'default' is given, it is
+           returned when the parameter is not defined at all...
         """
         booldict = {"true" : True,
                     "false" : False,
@@ -222,6 +272,8 @@ class GenHAlign(object):
         overridekey = ":".join([sectionkey, key])
 
         if overridekey not in self.overrides:
+            if default is not None and not self.config.has_option(sectionkey, key):
+                return default
             if boolean:
                 return self.config.getboolean(sectionkey, key)
             elif path:
@@ -242,6 +294,30 @@ class GenHAlign(object):
                 return self.overrides[overridekey]
 
 
+    def reestimate(self, stage, numiterations, mlflocation, upperbound=False, **kwargs):
+        """Runs 'numiterations' passes of embedded re-estimation, or if
+           the 'converge' schedule is selected: iterates until the
+           relative improvement in average log probability per frame
+           drops below 'self.convergence_threshold' (bounded by
+           'self.min_iterations' and 'self.max_iterations', or by
+           'numiterations' if 'upperbound' i.e. for explicitly
+           configured counts)... The likelihood trajectory is logged
+           and kept in 'self.logprob_trajectories'...
+        """
+        if self.reest_schedule == "converge" and upperbound:
+            miniterations, maxiterations = min(self.min_iterations, numiterations), numiterations
+        elif self.reest_schedule == "converge":
+            miniterations, maxiterations = self.min_iterations, self.max_iterations
+        else:
+            miniterations, maxiterations = numiterations, numiterations
+
+        trajectory = reestimate_until_converged(lambda: self.models.doEmbeddedRest(mlflocation, **kwargs), stage,
+                                                miniterations, maxiterations, self.convergence_threshold)
+        self.logprob_trajectories.append([stage, trajectory])
+        return trajectory
+
+
+    @stage
     def doCleanup(self):
         """Remove 'feats', 'bootfeats' and 'models' trees...
         """
@@ -253,7 +329,49 @@ class GenHAlign(object):
         except OSError:
             pass
         shutil.rmtree(self.models_dir)
-        
+        #completed stages can no longer be resumed from...
+        self.checkpoints.clear()
+
+
+    @stage
+    def exportModels(self):
+        """ Keep the final models, list of models, dictionaries and
+            feature config outside of the 'models' tree (which is
+            removed during cleanup) for use by 'GenHAlignIncremental'...
+        """
+        log.info("Exporting final models to '%s'." % (self.finalmodels_dir))
+
+        if os.path.isdir(self.finalmodels_dir):
+            shutil.rmtree(self.finalmodels_dir)
+        os.makedirs(self.finalmodels_dir)
+        self.models.exportModels(self.finalmodels_dir)
+        for location in [self.dict_location, self.monophoneset_location, getattr(self, "tridict_location", None)]:
+            if location:
+                shutil.copy(location, self.finalmodels_dir)
+        shutil.copy(self.featconf_location, os.path.join(self.finalmodels_dir, GenHAlign.FEATCONF_FN))
+
+
+    def stageDone(self, stage, inputs):
+        """ Returns True if 'stage' was completed (with the same
+            'inputs') in the run being resumed, else the stage should
+            be done and followed by a call to 'self.stageCompleted'...
+        """
+        self.stagehashes[stage] = hash_inputs(inputs)
+        if self.checkpoints.lookup(stage, self.stagehashes[stage]) is not None:
+            log.info("Resuming: stage '%s' already done." % (stage))
+            return True
+        return False
+
+
+    def stageCompleted(self, stage):
+        """ Record completion of 'stage' in the checkpoints manifest...
+        """
+        try:
+            iteration = self.models.iteration
+        except AttributeError:
+            iteration = None
+        self.checkpoints.record(stage, self.stagehashes[stage], iteration)
+
 
     def makeDirs(self):
         """Make 'working' directory structure...
@@ -266,22 +384,26 @@ class GenHAlign(object):
         self.output_dir = os.path.join(self.working_dir, GenHAlign.OUTPUT_DIR)
         self.bootfeats_dir = os.path.join(self.working_dir, GenHAlign.BOOTFEAT_DIR)
         self.textgrid_dir = os.path.join(self.working_dir, GenHAlign.TEXTGRID_DIR)
+        self.finalmodels_dir = os.path.join(self.working_dir, GenHAlign.FINALMODELS_DIR)
         try:
             os.makedirs(self.working_dir)
         except OSError:
             print("WARNING: Working dir '%s' already existed..." % self.working_dir)
-        os.makedirs(self.etc_dir)
-        os.makedirs(self.feats_dir)
-        os.makedirs(self.models_dir)
-        os.makedirs(self.output_dir)
-        os.makedirs(self.bootfeats_dir)
-        os.makedirs(self.textgrid_dir)
+        for dirlocation in [self.etc_dir, self.feats_dir, self.models_dir,
+                            self.output_dir, self.bootfeats_dir, self.textgrid_dir]:
+            if self.resume and os.path.isdir(dirlocation):
+                continue
+            os.makedirs(dirlocation)
 
     
+    @stage
     def doTextgridOutput(self):
         """ Clean up and convert .rec files to .TextGrid files...
         """
 
+        if self.stageDone("doTextgridOutput", [self.models.iteration]):
+            return
+
         c = sl.Corpus(self.output_dir)
         
         for u in c.utterances:
@@ -291,8 +413,10 @@ class GenHAlign(object):
             for i in range(len(u.tiers['word'])):
                 u.tiers['word'][i][1] = u.tiers['word'][i][1].split("_")[0]
             u.saveTextgrid(os.path.join(self.textgrid_dir, ".".join([u.name, GenHAlign.TEXTGRID_EXT])))
+        self.stageCompleted("doTextgridOutput")
 
 
+    @stage
     def organiseTranscriptions(self):
         """Prepare transcriptions into MLF and dictionaries...
         """
@@ -308,6 +432,12 @@ class GenHAlign(object):
         if not self.have_bootmodels and self.have_bootdata:
             self.makeBootTranscriptions()
 
+        #always redone (cheap), but changes invalidate all later stages...
+        transcrfiles = [getattr(self, attr, None) for attr in ["dict_location", "wordmlf_location",
+                                                                "phonemlf_location", "bootmlf_location"]]
+        if not self.stageDone("organiseTranscriptions", [file_digest(fn) for fn in transcrfiles if fn]):
+            self.stageCompleted("organiseTranscriptions")
+
 
     def makeFromOrthographic(self):
         """Prepare transcriptions from orthography, using a pronunciation dictionary...
@@ -344,7 +474,7 @@ class GenHAlign(object):
         #write dict, MLFs and phoneset...
         self.dict.writeDict(self.dict_location)
         self.transcr.writeWordMLF(self.wordmlf_location, self.silword)
-        TranscriptionSet.wordToPhoneMLF(self.wordmlf_location, self.dict_location, self.phonemlf_location)
+        TranscriptionSet.wordToPhoneMLF(self.wordmlf_location, self.dict_location, self.phonemlf_location, dictionary=self.dict)
         self.phonetranscr = TranscriptionSet(self.phonemlf_location, "PHONE")
         
         if self.have_transmap:
@@ -412,6 +542,7 @@ class GenHAlign(object):
         self.boottranscr.writePhoneMLF(self.bootmlf_location, write_boundaries=True, map=self.mappedbootstrap) #map if required..
 
 
+    @stage
     def makeFeats(self):
         """Perform feature extraction on the necessary audio files...
         """
@@ -422,24 +553,46 @@ class GenHAlign(object):
         self.featconf_location = self.getParm("SOURCE", "FEATS_CONFIG", path=True)
         
         self.audiofeats = AudioFeatures(self.source_audio_location, self.featconf_location)
+        self.selectAudio()
         
         #check all labels in transcriptionset...
         if not self.transcr.allLabelsInTranscr(self.audiofeats):
             log.error("Transcription set does not cover all audio files.")
             raise Exception("Transcription set does not cover all audio files....")
 
-        #make features...
-        self.audiofeats.makeFeats(self.feats_dir)
-
-        if not self.have_bootmodels and self.have_bootdata:
-            log.info("Making boot feats.")
+        dobootfeats = not self.have_bootmodels and self.have_bootdata
+        if dobootfeats:
             self.bootfeats = AudioFeatures(self.bootaudio_location, self.featconf_location)
             if not self.boottranscr.allLabelsInTranscr(self.bootfeats):
                 log.error("Boot transcription set does not cover all boot audio files.")
                 raise Exception("Some labels not found in boottranscriptionset....")
-            self.bootfeats.makeFeats(self.bootfeats_dir)
+
+        #audio files (name, size, mtime) and feature config define the features...
+        inputs = [file_digest(self.featconf_location)]
+        for audiofeats in [self.audiofeats] + ([self.bootfeats] if dobootfeats else []):
+            for fn in sorted(audiofeats.wavfilelist):
+                st = os.stat(os.path.join(audiofeats.wavlocation, fn))
+                inputs.append([fn, st.st_size, st.st_mtime])
+        if self.stageDone("makeFeats", inputs):
+            return
+
+        #make features...
+        self.audiofeats.makeFeats(self.feats_dir, self.numprocs, self.feat_frontend)
+
+        if dobootfeats:
+            log.info("Making boot feats.")
+            self.bootfeats.makeFeats(self.bootfeats_dir, self.numprocs, self.feat_frontend)
+        self.stageCompleted("makeFeats")
+
+
+    def selectAudio(self):
+        """Hook to select which of the audio files in 'self.audiofeats'
+           are to be processed (all by default)...
+        """
+        pass
 
 
+    @stage
     def initModels(self):
         """Initialise HMMs through either 'flatstart' or bootstrapping and defining
            the silence model properly...
@@ -454,7 +607,12 @@ class GenHAlign(object):
                              self.silphone,
                              self.protofile_location,
                              self.featconf_location,
-                             self.feats_dir)
+                             self.feats_dir,
+                             self.numprocs,
+                             checkpoints=self.checkpoints,
+                             engine=self.reest_engine,
+                             tying=self.tying_engine,
+                             pruning=self.pruning_mode)
     
         if self.have_bootmodels:
             print("COPYING BOOTSTRAP MODELS...(NO VARIANCE FLOOR SET...)")
@@ -478,20 +636,19 @@ class GenHAlign(object):
             print("FLATSTART....")
             log.info("Performing 'flatstart' initialisation.")
             self.models.doFlatStart()
-            for i in range(3):
-                self.models.doEmbeddedRest(self.phonemlf_location)
+            self.reestimate("flatstart", 3, self.phonemlf_location)
     
         #fix silence model
         self.models.addStandardSilTransitions()
 
     
+    @stage
     def trainModels(self):
         """Performs training procedure...
         """
 
         print("RE-ESTIMATING....")
-        for i in range(5):
-            self.models.doEmbeddedRest(self.phonemlf_location)
+        self.reestimate("monophones", 5, self.phonemlf_location)
 
         if self.cdhmms:
             self.makeTriphones()
@@ -531,20 +688,19 @@ class GenHAlign(object):
         self.tridict_location = os.path.join(self.etc_dir, fnjoin(GenHAlign.TRIDICT_BN, GenHAlign.DICT_EXT))
 
         #make triphone transcriptions
-        TranscriptionSet.monophoneToTriphoneMLF(self.phonemlf_location, self.triphonemlf_location, self.silphone)
-        triphonetranscr = TranscriptionSet(self.triphonemlf_location, "PHONE")
+        mlftriphones = TranscriptionSet.monophoneToTriphoneMLF(self.phonemlf_location, self.triphonemlf_location, self.silphone)
 
         #make triphone dictionary
         if self.have_ortho_and_pronundict:
-            PronunciationDictionary.monophoneToTriphoneDict(self.dict_location, self.tridict_location)
+            dicttriphones = PronunciationDictionary.monophoneToTriphoneDict(self.dict_location, self.tridict_location,
+                                                                            dictionary=self.dict)
         elif self.have_phonetic:
-            triphonetranscr.writePseudoDict(self.tridict_location)
+            write_pseudo_dict(self.tridict_location, mlftriphones)
+            dicttriphones = mlftriphones
         self.tridict = PronunciationDictionary(self.tridict_location)
 
         #make list of triphones by combining triphones in dictionary and transcriptions...
-        triphoneset1 = self.tridict.getPhoneSet()
-        triphoneset2 = triphonetranscr.getPhoneSet()
-        triphoneset = [triphone + "\n" for triphone in sorted(set(triphoneset1 + triphoneset2))]
+        triphoneset = [triphone + "\n" for triphone in sorted(mlftriphones | dicttriphones)]
         #write triphoneset to file
         with codecs.open(self.triphoneset_location, "w", encoding="utf-8") as outfh:
             outfh.writelines(triphoneset)
@@ -556,10 +712,10 @@ class GenHAlign(object):
 
         #tie states via decision tree clustering...
         self.models.tieStates(self.hereststats_location, self.triphoneset_location)
-        for i in range(2):
-            self.models.doEmbeddedRest(self.triphonemlf_location)
+        self.reestimate("tiedtriphones", 2, self.triphonemlf_location)
 
 
+    @stage
     def doAlignment(self):
         """Do forced alignment using the correct resources...
         """
@@ -568,14 +724,21 @@ class GenHAlign(object):
 
         if self.have_ortho_and_pronundict:
             log.info("Performing alignment (from orthography).")
-            self.models.forcedAlignment(self.wordmlf_location, self.dict_location, self.output_dir)
+            mlflocation, dictlocation = self.wordmlf_location, self.dict_location
         elif self.have_phonetic:
             if self.cdhmms:
                 log.info("Performing alignment (from triphones).")
-                self.models.forcedAlignment(self.triphonemlf_location, self.tridict_location, self.output_dir)
+                mlflocation, dictlocation = self.triphonemlf_location, self.tridict_location
             else:
                 log.info("Performing alignment (from monophones).")
-                self.models.forcedAlignment(self.phonemlf_location, self.dict_location, self.output_dir)
+                mlflocation, dictlocation = self.phonemlf_location, self.dict_location
+        else:
+            return
+
+        if self.stageDone("doAlignment", [self.models.iteration, file_digest(mlflocation), file_digest(dictlocation)]):
+            return
+        self.models.forcedAlignment(mlflocation, dictlocation, self.output_dir)
+        self.stageCompleted("doAlignment")
 
 
 class GenHAlignRealign(GenHAlign):
@@ -583,11 +746,14 @@ class GenHAlignRealign(GenHAlign):
     alternate pronunciations in the source_dictinoary and tries to
     catch unforeseen SILs between words...
     """
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, resume=False):
         """ Inherit...
         """
         
-        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True)
+        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True, resume=resume)
+
+        self.realignment = self.getParm("PARMS", "REALIGNMENT", default=DEF_REALIGNMENT).lower()
+        assert self.realignment in ALLOWED_REALIGNMENTS, "Unsupported REALIGNMENT: %s" % (self.realignment)
 
         log.info("Process: 'GenHAlignRealign'")
 
@@ -600,6 +766,7 @@ class GenHAlignRealign(GenHAlign):
         self.makeFeats()
         self.initModels()
         self.trainModels()
+        self.exportModels()
         self.doAlignment()
         if self.textgrid_output: self.doTextgridOutput()
         if self.postcleanup: self.doCleanup()
@@ -607,13 +774,13 @@ class GenHAlignRealign(GenHAlign):
         log.info("Process Done (in %.0f seconds)." % (endtime - starttime))
 
 
+    @stage
     def trainModels(self):
         """Performs training procedure with realignment stage...
         """
 
         print("RE-ESTIMATING....")
-        for i in range(2):
-            self.models.doEmbeddedRest(self.phonemlf_location)
+        self.reestimate("monophones", 2, self.phonemlf_location)
 
         #here we add entries to the dict with SIL phones at the start
         #of all words not neigbouring or being SIL with the hope that
@@ -640,13 +807,17 @@ class GenHAlignRealign(GenHAlign):
                     
 
         if self.have_ortho_and_pronundict:
-            self.models.reAlignment(self.wordmlf_location, self.dict_location, self.phonemlf_location)
+            if self.realignment == "variants":
+                #only utterances with alternative pronunciations can change...
+                self.models.reAlignment(self.wordmlf_location, self.dict_location, self.phonemlf_location,
+                                        subset=self.transcr.variantUtterances(self.dict))
+            else:
+                self.models.reAlignment(self.wordmlf_location, self.dict_location, self.phonemlf_location)
             #prune audio data that did not make it through realignment?
         else:
             print("WARNING: Realignment not possible when labelling from phonetic...")
 
-        for i in range(2):
-            self.models.doEmbeddedRest(self.phonemlf_location)
+        self.reestimate("realigned", 2, self.phonemlf_location)
 
 
         if self.cdhmms:
@@ -661,15 +832,174 @@ class GenHAlignRealign(GenHAlign):
             pass
     
 
+class GenHAlignIncremental(GenHAlign):
+    """ Aligns newly added recordings using the models exported by a
+        previous GenHAlign(Realign) run (SOURCE:PREVIOUS_MODELS),
+        optionally adapting these on the new data first
+        (PARMS:ADAPTATION_ITERATIONS)... Audio files which already
+        have a TextGrid in SOURCE:EXISTING_TEXTGRIDS are skipped...
+    """
+    def __init__(self, configfile_location, overrides={}, setup_only=False, resume=False):
+        """ Inherit...
+        """
+
+        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True, resume=resume)
+
+        self.previous_models_location = self.getParm("SOURCE", "PREVIOUS_MODELS", path=True)
+        self.existing_textgrids_location = self.getParm("SOURCE", "EXISTING_TEXTGRIDS", default="")
+        if self.existing_textgrids_location:
+            self.existing_textgrids_location = self.getParm("SOURCE", "EXISTING_TEXTGRIDS", path=True)
+        self.adaptation_iterations = int(self.getParm("PARMS", "ADAPTATION_ITERATIONS", default=DEF_ADAPTATION_ITERATIONS))
+
+        if not os.path.isfile(os.path.join(self.previous_models_location, MODELLIST_FN)):
+            log.error("No exported models found at '%s'." % (self.previous_models_location))
+            raise Exception("Previous models not found...")
+        #features must be computed as for the previous models...
+        if (file_digest(self.getParm("SOURCE", "FEATS_CONFIG", path=True)) !=
+            file_digest(os.path.join(self.previous_models_location, GenHAlign.FEATCONF_FN))):
+            log.error("Feature configuration differs from the one used for the previous models.")
+            raise Exception("Feature configuration does not match previous models...")
+
+        log.info("Process: 'GenHAlignIncremental'")
+
+        #break here if the procedure will be manually called...
+        if setup_only: return
+
+        log.info("Starting Process.") 
+        starttime = time()
+        self.organiseTranscriptions()
+        self.makeFeats()
+        self.initModels()
+        self.trainModels()
+        self.exportModels()
+        self.doAlignment()
+        if self.textgrid_output: self.doTextgridOutput()
+        if self.postcleanup: self.doCleanup()
+        endtime = time()
+        log.info("Process Done (in %.0f seconds)." % (endtime - starttime))
+
+
+    @stage
+    def organiseTranscriptions(self):
+        """Prepare transcriptions and check that the previous models
+           cover all phones...
+        """
+
+        GenHAlign.organiseTranscriptions(self)
+
+        with codecs.open(os.path.join(self.previous_models_location, GenHAlign.MONOPHONESET_FN), encoding="utf-8") as infh:
+            previousphoneset = set([line.strip() for line in infh if line.strip()])
+        unknownphones = sorted(set(self.dict.getPhoneSet()) - previousphoneset)
+        if unknownphones:
+            log.error("Phones not covered by previous models: %s" % (" ".join(unknownphones)))
+            raise Exception("Previous models do not cover all phones...")
+
+
+    def makeFromOrthographic(self):
+        """Prepare transcriptions from orthography, using the
+           dictionary of the previous run extended with (and for
+           common words overridden by) the source dictionary...
+        """
+
+        previousdict = PronunciationDictionary(os.path.join(self.previous_models_location,
+                                                            fnjoin(GenHAlign.MAINDICT_BN, GenHAlign.DICT_EXT)))
+        sourcedict = PronunciationDictionary(self.pronundict_location)
+        for word in sourcedict:
+            if word in previousdict:
+                del previousdict[word]
+            for pronun in sourcedict[word]:
+                previousdict[word] = pronun
+        self.pronundict_location = os.path.join(self.etc_dir, fnjoin(GenHAlign.MERGEDDICT_BN, GenHAlign.DICT_EXT))
+        previousdict.writeDict(self.pronundict_location)
+
+        GenHAlign.makeFromOrthographic(self)
+
+
+    def selectAudio(self):
+        """Skip audio files already aligned (having a TextGrid in
+           'self.existing_textgrids_location')...
+        """
+
+        if not self.existing_textgrids_location:
+            return
+        aligned = set([sl.parse_path(fn)[2] for fn in sl.type_files(os.listdir(self.existing_textgrids_location),
+                                                                     GenHAlign.TEXTGRID_EXT)])
+        numaudio = len(self.audiofeats.wavfilelist)
+        self.audiofeats.wavfilelist = [fn for fn in self.audiofeats.wavfilelist
+                                       if sl.parse_path(fn)[2] not in aligned]
+        log.info("Selected %s new audio files (%s already aligned)."
+                 % (len(self.audiofeats.wavfilelist), numaudio - len(self.audiofeats.wavfilelist)))
+        if not self.audiofeats.wavfilelist:
+            log.error("No new audio files in '%s'." % (self.source_audio_location))
+            raise Exception("No new audio files to align...")
+
+
+    @stage
+    def initModels(self):
+        """Start from the previous models...
+        """
+
+        print("LOADING PREVIOUS MODELS...")
+
+        self.protofile_location = self.getParm("SOURCE", "HMM_PROTOTYPE", path=True)
+
+        with codecs.open(os.path.join(self.previous_models_location, MODELLIST_FN), encoding="utf-8") as infh:
+            modellist = [line.strip() for line in infh if line.strip()]
+
+        self.models = HMMSet(self.models_dir,
+                             modellist,
+                             self.silphone,
+                             self.protofile_location,
+                             self.featconf_location,
+                             self.feats_dir,
+                             self.numprocs,
+                             checkpoints=self.checkpoints,
+                             engine=self.reest_engine,
+                             tying=self.tying_engine,
+                             pruning=self.pruning_mode)
+        self.models.importModels(os.path.join(self.previous_models_location, MACROS_FN),
+                                 os.path.join(self.previous_models_location, HMMDEFS_FN))
+
+
+    @stage
+    def trainModels(self):
+        """Adaptation of the previous models on the new data only...
+        """
+
+        if self.cdhmms:
+            self.triphonemlf_location = os.path.join(self.etc_dir, fnjoin(GenHAlign.TRIPHONETRANSCR_BN, MLF_EXT))
+            mlftriphones = TranscriptionSet.monophoneToTriphoneMLF(self.phonemlf_location, self.triphonemlf_location, self.silphone)
+            if self.have_phonetic:
+                self.tridict_location = os.path.join(self.etc_dir, fnjoin(GenHAlign.TRIDICT_BN, GenHAlign.DICT_EXT))
+                write_pseudo_dict(self.tridict_location, mlftriphones)
+            #the trees of the previous run are not kept, so unseen
+            #triphones cannot be synthesised (HHEd 'AU')...
+            unseen = sorted(mlftriphones - set(self.models.getModelSet()))
+            if unseen:
+                log.error("Triphones not in the previous models: %s" % (" ".join(unseen)))
+                raise Exception("Previous models do not cover all triphones (retrain with GenHAlign)...")
+            mlflocation = self.triphonemlf_location
+        else:
+            mlflocation = self.phonemlf_location
+
+        if self.adaptation_iterations > 0:
+            print("ADAPTING....")
+            self.reestimate("adaptation", self.adaptation_iterations, mlflocation, upperbound=True)
+
+
 class GenTrainASR(GenHAlign):
     """ Defines a process to train HMMs for general ASR usage...
     """
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, resume=False):
         """Initialises process (reads from config and sets switches/variables...)...
+           If 'resume' then stages completed in a previous run in the
+           same working dir (as recorded in the checkpoints manifest)
+           are skipped...
         """
         
         self.overrides = overrides
+        self.resume = resume
         self.configfile_dir = os.path.dirname(configfile_location)
         with codecs.open(configfile_location, encoding="utf-8") as conffh:
             self.config = ConfigParser()
@@ -694,6 +1024,10 @@ class GenTrainASR(GenHAlign):
         #copy configuration file for the record (if possible)...and log configuration...
         log.info("Configuration file used: '%s'" % configfile_location)
         log.info("Overrides defined:\n%s" % pprint.pformat(self.overrides))
+        self.checkpoints = Checkpoints(os.path.join(self.working_dir, GenHAlign.CHECKPOINTS_FN), resume=self.resume)
+        METRICS.reset()
+        self.metrics_location = os.path.join(self.working_dir, GenHAlign.METRICS_FN)
+        self.stagehashes = {}
         try:
             shutil.copy(configfile_location, self.working_dir)
         except shutil.Error:
@@ -715,6 +1049,23 @@ class GenTrainASR(GenHAlign):
         self.nummixs = self.getParm("SWITCHES", "MIXTURES_PER_STATE")
         self.mappedbootstrap = self.getParm("SWITCHES", "MAPPEDBOOTSTRAP", boolean=True)
         self.postcleanup = self.getParm("SWITCHES", "POSTCLEANUP", boolean=True)
+        self.numprocs = int(self.getParm("PARMS", "NUM_PROCESSES", default="1"))
+        if self.numprocs < 1:
+            self.numprocs = multiprocessing.cpu_count()
+        self.reest_engine = self.getParm("PARMS", "REESTIMATION_ENGINE", default=DEF_REEST_ENGINE).lower()
+        assert self.reest_engine in ALLOWED_REEST_ENGINES, "Unsupported REESTIMATION_ENGINE: %s" % (self.reest_engine)
+        self.tying_engine = self.getParm("PARMS", "TYING_ENGINE", default=DEF_TYING_ENGINE).lower()
+        assert self.tying_engine in ALLOWED_TYING_ENGINES, "Unsupported TYING_ENGINE: %s" % (self.tying_engine)
+        self.pruning_mode = self.getParm("PARMS", "PRUNING_MODE", default=DEF_PRUNING_MODE).lower()
+        assert self.pruning_mode in ALLOWED_PRUNING_MODES, "Unsupported PRUNING_MODE: %s" % (self.pruning_mode)
+        self.feat_frontend = self.getParm("PARMS", "FEATURE_FRONTEND", default=DEF_FEAT_FRONTEND).lower()
+        assert self.feat_frontend in ALLOWED_FEAT_FRONTENDS, "Unsupported FEATURE_FRONTEND: %s" % (self.feat_frontend)
+        self.reest_schedule = self.getParm("PARMS", "REESTIMATION_SCHEDULE", default=DEF_REEST_SCHEDULE).lower()
+        assert self.reest_schedule in ALLOWED_REEST_SCHEDULES, "Unsupported REESTIMATION_SCHEDULE: %s" % (self.reest_schedule)
+        self.convergence_threshold = float(self.getParm("PARMS", "CONVERGENCE_THRESHOLD", default=DEF_CONVERGENCE_THRESHOLD))
+        self.min_iterations = int(self.getParm("PARMS", "MIN_ITERATIONS", default=DEF_MIN_ITERATIONS))
+        self.max_iterations = int(self.getParm("PARMS", "MAX_ITERATIONS", default=DEF_MAX_ITERATIONS))
+        self.logprob_trajectories = []
 
         if bool(self.orthographic_location) and bool(self.pronundict_location):
             self.have_ortho_and_pronundict = True
@@ -770,10 +1121,10 @@ class GenTrainASR(GenHAlign):
             os.makedirs(self.working_dir)
         except OSError:
             print("WARNING: Working dir '%s' already existed..." % self.working_dir)
-        os.makedirs(self.etc_dir)
-        os.makedirs(self.feats_dir)
-        os.makedirs(self.models_dir)
-        os.makedirs(self.bootfeats_dir)
+        for dirlocation in [self.etc_dir, self.feats_dir, self.models_dir, self.bootfeats_dir]:
+            if self.resume and os.path.isdir(dirlocation):
+                continue
+            os.makedirs(dirlocation)
 
 
 
@@ -818,7 +1169,8 @@ class GenTrainASR(GenHAlign):
         #write dict, MLFs and phoneset...
         self.dict.writeDict(self.dict_location)
         self.transcr.writeWordMLF(self.wordmlf_location)
-        ASRTranscriptionSet.wordToPhoneMLF(self.wordmlf_location, self.dict_location, self.phonemlf_location, self.silphone, self.spphone)
+        ASRTranscriptionSet.wordToPhoneMLF(self.wordmlf_location, self.dict_location, self.phonemlf_location, self.silphone, self.spphone,
+                                           dictionary=self.dict)
         self.phonetranscr = ASRTranscriptionSet(self.phonemlf_location, "PHONE")
         
         if self.have_transmap:
@@ -840,6 +1192,7 @@ class GenTrainASR(GenHAlign):
                 raise Exception("Phone MLF does not match phonetic transcriptions...")
 
 
+    @stage
     def initModels(self):
         """Initialise HMMs through either 'flatstart' or bootstrapping and defining
            the silence model properly...
@@ -855,7 +1208,12 @@ class GenTrainASR(GenHAlign):
                                 self.spphone,
                                 self.protofile_location,
                                 self.featconf_location,
-                                self.feats_dir)
+                                self.feats_dir,
+                                self.numprocs,
+                                checkpoints=self.checkpoints,
+                                engine=self.reest_engine,
+                                tying=self.tying_engine,
+                                pruning=self.pruning_mode)
     
         if self.have_bootdata:
             print("BOOTSTRAP...(NO VARIANCE FLOOR SET...)")
@@ -871,28 +1229,26 @@ class GenTrainASR(GenHAlign):
             print("FLATSTART....")
             log.info("Performing 'flatstart' initialisation.")
             self.models.doFlatStart()
-            for i in range(3):
-                self.models.doEmbeddedRest(self.phonemlf_location)
+            self.reestimate("flatstart", 3, self.phonemlf_location)
     
         #fix silence model
         self.models.fixSilModels()
 
 
+    @stage
     def trainModels(self):
         """Performs training procedure...
         """
 
         print("RE-ESTIMATING....")
-        for i in range(2):
-            self.models.doEmbeddedRest(self.phonemlf_location, withsp=True)
+        self.reestimate("monophones", 2, self.phonemlf_location, withsp=True)
 
         if self.have_ortho_and_pronundict:
             self.models.reAlignment(self.wordmlf_location, self.dict_location, self.silword, self.phonemlf_location, withsp=True)
             #prune audio data that did not make it through realignment:
             
 
-        for i in range(2):
-            self.models.doEmbeddedRest(self.phonemlf_location, withsp=True)
+        self.reestimate("realigned", 2, self.phonemlf_location, withsp=True)
 
 
         if self.cdhmms:
@@ -921,20 +1277,19 @@ class GenTrainASR(GenHAlign):
         self.tridict_location = os.path.join(self.etc_dir, fnjoin(GenHAlign.TRIDICT_BN, GenHAlign.DICT_EXT))
 
         #make triphone transcriptions
-        ASRTranscriptionSet.monophoneToTriphoneMLF(self.phonemlf_location, self.triphonemlf_location, self.silphone, self.spphone)
-        triphonetranscr = ASRTranscriptionSet(self.triphonemlf_location, "PHONE")
+        mlftriphones = ASRTranscriptionSet.monophoneToTriphoneMLF(self.phonemlf_location, self.triphonemlf_location, self.silphone, self.spphone)
 
         #make triphone dictionary
         if self.have_ortho_and_pronundict:
-            PronunciationDictionary.monophoneToTriphoneDict(self.dict_location, self.tridict_location, self.spphone)
+            dicttriphones = PronunciationDictionary.monophoneToTriphoneDict(self.dict_location, self.tridict_location, self.spphone,
+                                                                            dictionary=self.dict)
         elif self.have_phonetic:
-            triphonetranscr.writePseudoDict(self.tridict_location)
+            write_pseudo_dict(self.tridict_location, mlftriphones)
+            dicttriphones = mlftriphones
         self.tridict = PronunciationDictionary(self.tridict_location)
 
         #make list of triphones by combining triphones in dictionary and transcriptions...
-        triphoneset1 = self.tridict.getPhoneSet()
-        triphoneset2 = triphonetranscr.getPhoneSet()
-        triphoneset = [triphone + "\n" for triphone in sorted(set(triphoneset1 + triphoneset2))]
+        triphoneset = [triphone + "\n" for triphone in sorted(mlftriphones | dicttriphones)]
         #write triphoneset to file
         with codecs.open(self.triphoneset_location, "w", encoding="utf-8") as outfh:
             outfh.writelines(triphoneset)
@@ -947,8 +1302,7 @@ class GenTrainASR(GenHAlign):
         #tie states via decision tree clustering...
         self.tiedtriphoneset_location = os.path.join(self.etc_dir, GenHAlign.TIEDTRIPHONESET_FN)
         self.models.tieStates(self.hereststats_location, self.triphoneset_location, self.tiedtriphoneset_location)
-        for i in range(2):
-            self.models.doEmbeddedRest(self.triphonemlf_location)
+        self.reestimate("tiedtriphones", 2, self.triphonemlf_location)
 
 
     def doIncrementMixtures(self, num):
@@ -970,11 +1324,11 @@ class PS_GenHAlign(GenHAlign):
         forced alignment using pitch synchronous features...
     """
 
-    def __init__(self, configfile_location, overrides={}, setup_only=False):
+    def __init__(self, configfile_location, overrides={}, setup_only=False, resume=False):
         """ Inherit...
         """
 
-        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True)
+        GenHAlign.__init__(self, configfile_location, overrides=overrides, setup_only=True, resume=resume)
 
         log.info("Process: 'PS_GenHAlign'")
 
@@ -1015,6 +1369,7 @@ class PS_GenHAlign(GenHAlign):
         tempmlf.close()
 
 
+    @stage
     def makeFeats(self):
         """Perform feature extraction on the necessary audio files...
         """
@@ -1033,6 +1388,7 @@ class PS_GenHAlign(GenHAlign):
             self.bootfeats.makeFeats(self.bootfeats_dir)
 
 
+    @stage
     def crossCheckAudioTranscriptions(self):
         """ Sanity check: Transcriptions cover audio data?
         """
@@ -1048,6 +1404,7 @@ class PS_GenHAlign(GenHAlign):
                 raise Exception("Some labels not found in boottranscriptionset....")
 
 
+    @stage
     def translateAlignments(self):
         """ Translate HTK times in output labels to actual times...
         """
@@ -1087,6 +1444,12 @@ def setopts():
                       default=DEF_METHOD,
                       help="specify which method to use [%default]",
                       metavar="METHOD")
+    parser.add_option("-r",
+                      "--resume",
+                      action="store_true",
+                      dest="resume",
+                      default=False,
+                      help="resume an interrupted run in the same working dir, skipping completed stages")
     return parser
 
 
@@ -1111,11 +1474,13 @@ def main():
         raise Exception("Error parsing overrides...")
 
     if opts.method == "GenHAlign":
-        process = GenHAlign(configfile, overrides)
+        process = GenHAlign(configfile, overrides, resume=opts.resume)
+    elif opts.method == "GenHAlignIncremental":
+        process = GenHAlignIncremental(configfile, overrides, resume=opts.resume)
     elif opts.method == "PS_GenHAlign":
-        process = PS_GenHAlign(configfile, overrides)
+        process = PS_GenHAlign(configfile, overrides, resume=opts.resume)
     elif opts.method == "GenTrainASR":
-        process = GenTrainASR(configfile, overrides)    
+        process = GenTrainASR(configfile, overrides, resume=opts.resume)    
     else:
         #shouldn't get here...
         pass
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Convert a pronunciation dictionary (HTK '.dict' or festival scheme
+    '.scm') to the compact format ('.cdict') which can be used in place
+    of the source dictionary in HAlign configurations...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+
+from HALIGN_Text import PronunciationDictionary, CDICT_EXT
+
+if __name__ == '__main__':
+    try:
+        infn = sys.argv[1]
+    except IndexError:
+        print("USAGE: HAlignCompactDict.py DICTFNAME [CDICTFNAME]")
+        sys.exit()
+    try:
+        outfn = sys.argv[2]
+    except IndexError:
+        outfn = ".".join(infn.split(".")[:-1] + [CDICT_EXT])
+
+    pronundict = PronunciationDictionary(infn)
+    pronundict.writeCompact(outfn)
+    print("\t%s entries (%s words, %s phones) written to %s" % (len(pronundict),
+                                                              len(pronundict.getWordSet()),
+                                                              len(pronundict.getPhoneSet()),
+                                                              outfn))
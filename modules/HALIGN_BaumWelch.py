@@ -0,0 +1 @@
+../halign/HALIGN_BaumWelch.py
\ No newline at end of file
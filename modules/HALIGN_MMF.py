@@ -0,0 +1 @@
+../halign/HALIGN_MMF.py
\ No newline at end of file
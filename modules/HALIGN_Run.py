@@ -0,0 +1 @@
+../halign/HALIGN_Run.py
\ No newline at end of file
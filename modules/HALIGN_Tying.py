@@ -0,0 +1 @@
+../halign/HALIGN_Tying.py
\ No newline at end of file
@@ -0,0 +1 @@
+../halign/HALIGN_Viterbi.py
\ No newline at end of file
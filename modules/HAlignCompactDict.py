@@ -0,0 +1 @@
+../halign/HAlignCompactDict.py
\ No newline at end of file
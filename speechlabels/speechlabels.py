@@ -18,13 +18,37 @@ __email__ = "dvn.demitasse@gmail.com"
 import sys
 import os
 
-import math
 import re
-import copy
 import codecs
+import multiprocessing
+from array import array
+from bisect import bisect_right
 from collections import defaultdict, OrderedDict
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence        #Py2
 from math import sqrt
-from pprint import pprint
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import numpy as np
+except ImportError:
+    np = None        #only needed for corpus comparisons...
+
+HTK_TIME_UNITS = 10000000.0    #100ns units per second
+CORPUS_CACHE = ".speechlabels.cache"   #parse cache kept in corpus directories (if enabled)
+CORPUS_CACHE_VERSION = 1
+MIN_POOL_FILES = 64     #fewer files are parsed in-process (not worth starting a pool)
+#strings, numbers and flags in Praat text files (long or short format,
+#i.e. ignoring keys and indices)...
+TEXTGRID_TOKEN_REGEX = re.compile(r'"((?:[^"]|"")*)"|(?<![\w\[.])([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w\]])|<(exists|absent)>')
+LAB_TIME_REGEX = re.compile('[0-9]+.[0-9]+')
+HTK_ESCAPE_REGEX = re.compile(br"\\([0-7]{3})")   #octal escaped bytes in HTK output
+TIME_TYPECODE = str("q") if sys.version_info[0] > 2 else str("l")   #int64 (on LP64 platforms for Py2)
 
 ### FUNCTONS ###
 def parse_path(fullpath):
@@ -108,6 +132,26 @@ def cdname_2_cdcategory(name, mapping):
     return mapped
 
 
+#labels are interned in a table shared by all utterances...
+_LABELS = []
+_LABELIDS = {}
+
+def intern_label(label):
+    """ Returns the id of 'label' in the shared label table...
+    """
+    try:
+        return _LABELIDS[label]
+    except KeyError:
+        _LABELIDS[label] = len(_LABELS)
+        _LABELS.append(label)
+        return _LABELIDS[label]
+
+def label_name(labelid):
+    """ Returns the label with id 'labelid'...
+    """
+    return _LABELS[labelid]
+
+
 def fixutf8(s):
     replacements = [["\\" + ss, chr(int(ss.strip("\\"), base=8))] for ss in re.findall(r"\\[0-9][0-9][0-9]", s)]
     for rep in replacements:
@@ -117,6 +161,34 @@ def fixutf8(s):
 
 ### CLASSES ###
 
+class RecordView(Sequence):
+    """ Read-only sequence of 'length' records (dicts) built by
+        'build(i)' when item 'i' is accessed. Nothing is kept: each
+        access returns a new dict so changes to it are not stored in
+        the utterance...
+    """
+    __slots__ = ["_length", "_build"]
+
+    def __init__(self, length, build):
+        self._length = length
+        self._build = build
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._build(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("record index out of range")
+        return self._build(i)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class IncompleteMapError(Exception):
     pass
 
@@ -138,7 +210,22 @@ class ApplesWithPearsError(Exception):
 
 class Utterance(object):
     """ Maintains segments, boundaries particular to a single utterance...
+
+        Segments are stored as int64 arrays of start and stop times
+        (HTK units) with interned label ids. 'segments' and
+        'boundaries' (and 'states' and 'words' for .rec files) are
+        read-only sequence views of which each dict is built when it
+        is accessed (changes to these dicts are not kept). 'tiers' and
+        'entries' are built on first access and kept (so that they can
+        be modified)...
     """
+    __slots__ = ["filepath", "dirname", "filename", "name", "ext", "maintier",
+                 "segment_comparisons", "boundary_comparisons",
+                 "_labels", "_starttimes", "_stoptimes",
+                 "_modelnames", "_scores", "_stateoffsets",      #.rec only...
+                 "_statelabels", "_statestarttimes", "_statestoptimes", "_statescores",
+                 "_wordlabels", "_wordstarttimes", "_wordstoptimes",
+                 "_tiernames", "_tiertimes", "_tierlabels", "_tiers"]
 
     LAB_EXT = "lab"
     REC_EXT = "rec"
@@ -158,28 +245,54 @@ class Utterance(object):
         
         self.filepath = filepath
         self.dirname, self.filename, self.name, self.ext = parse_path(self.filepath)
+        self.maintier = maintier
         self.segment_comparisons = {}
         self.boundary_comparisons = {}
+        self._modelnames = None
+        self._tiers = None
         
         #load utterance from file appropriately...
         if self.ext.lower() == Utterance.LAB_EXT.lower():
-            self.tiers, self.entries = Utterance.readLab(self.filepath)
-            self._loadFromEntries()
+            self._loadFromArrays(OrderedDict([("segment", Utterance.parseLab(self.filepath))]), "segment")
         elif self.ext.lower() == Utterance.TEXTGRID_EXT.lower():
-            self.tiers, self.entries = Utterance.readTextgrid(self.filepath, maintier=maintier)
-            self._loadFromEntries()
+            self._loadFromArrays(Utterance.parseTextgrid(self.filepath), maintier)
         elif self.ext.lower() == Utterance.REC_EXT.lower():
             self._loadFromRec()
         elif self.ext.lower() == Utterance.TXT_EXT.lower():
-            self.tiers, self.entries = self._read_txt(self.filepath)
-            self._loadFromEntries()
+            self._loadFromEntries(*self._read_txt(self.filepath))
         else:
             raise UnknownLabelfileFormatError("Did not recognise the extension: " + self.ext)
             
     def __len__(self):
         """Returns the number of segments...
         """
-        return len(self.segments)
+        return len(self._labels)
+
+    #label ids are only valid within a process, so labels are pickled...
+    _LABEL_SLOTS = ["_labels", "_modelnames", "_statelabels", "_wordlabels"]
+
+    def __getstate__(self):
+        state = {}
+        for slot in Utterance.__slots__:
+            value = getattr(self, slot, None)
+            if value is not None and slot in Utterance._LABEL_SLOTS:
+                value = [_LABELS[labelid] for labelid in value]
+            elif value is not None and slot == "_tierlabels":
+                value = [[_LABELS[labelid] for labelid in labelids] for labelids in value]
+            state[slot] = value
+        if self._modelnames is None:
+            state["_labels"] = None    #the main tier labels...
+        return state
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            if value is not None and slot in Utterance._LABEL_SLOTS:
+                value = array(str("i"), [intern_label(label) for label in value])
+            elif value is not None and slot == "_tierlabels":
+                value = [array(str("i"), [intern_label(label) for label in labels]) for labels in value]
+            setattr(self, slot, value)
+        if self._modelnames is None:
+            self._labels = self._tierlabels[self._tiernames.index(self.maintier)]
 
     def _read_txt(cls, filepath, tiername='segment'):
         with open(filepath) as infh:
@@ -192,204 +305,101 @@ class Utterance(object):
         """ Read a Festival (ESPS) format label file and returns a list of entries...
         """
 
-        entries = []
-        # the digits match (regex)
-        p = re.compile('[0-9]+.[0-9]+')
+        times, labels = Utterance.parseLab(filepath)
+        entries = [[repr(time), label] for time, label in zip(times, labels)]
+
+        tiers = {tiername: entries}
+
+        return tiers, entries
+    readLab = classmethod(readLab)
+
+
+    def parseLab(cls, filepath):
+        """ Single pass parser for Festival (ESPS) format label files,
+            returns the segment end times (seconds) as an array and the
+            list of labels...
+        """
+
+        times = array(str("d"))
+        labels = []
 
         with open(filepath) as fh:
             try:
                 for line in fh:
                     linelist = line.split()
-                    if p.match(linelist[0]):          #if the first token is a real number...
-                        entries.append([linelist[0], linelist[2]])
-            except IndexError:
+                    if LAB_TIME_REGEX.match(linelist[0]):          #if the first token is a real number...
+                        times.append(float(linelist[0]))
+                        labels.append(linelist[2])
+            except (IndexError, ValueError):
                 raise FileParseError("Could not parse file: '%s'" % (filepath))
 
-        tiers = {tiername: entries}
-
-        return tiers, entries
-    readLab = classmethod(readLab)
+        return times, labels
+    parseLab = classmethod(parseLab)
 
 
     def readTextgrid(cls, filepath, maintier='segment', discard_empty=False):
         """ Read a Praat format TextGrid file and return a list of
-            tiers...  Written by: Aby Louw (jalouw@csir.co.za)
+            tiers...
         """
-        
-        fh = codecs.open(filepath, encoding="utf-8")
-        try:
-            textgridfile = fh.readlines()
-        except UnicodeDecodeError:
-            print(filepath)
-            raise
-        fh.close()
-        x = len(textgridfile)
-        counter = 0
 
         tiers = OrderedDict()
-        tiername = ""
-        entries = []
-
-        expected_nintervals = {}
-
-        # setup some regex's
-        size_regex = re.compile('size = ([0-9]+)')
-        name_regex = re.compile('name = \"(\w+)\"')
-        intervals_regex = re.compile('intervals \[([0-9]+)\]:')
-        time_regex = re.compile('xmax = ([0-9]+\.*[0-9]*)')
-        text_regex = re.compile('text = \"(.*)\"')
-        #text_regex = re.compile('text = \"(\S*)\"')
-        #text_regex = re.compile('text = \"((\w*\s*[@]*)*)\"')
-        num_intervals = re.compile('intervals: size = ([0-9]+)')
-        header_end_regex = re.compile('item \[\]:')
-        new_tier_regex = re.compile('item \[([0-9]+)\]:')
-
-        header = []
-        for i in range(counter,x):
-            lines = textgridfile[i]
-            lines = lines.strip()
-            header.append(lines)
-
-            # check for size of tiers
-            m = size_regex.match(lines)
-            if m:
-                size = int(m.group(1))
-
-            # header ends at "item []:"
-            m = header_end_regex.match(lines)
-            if m:
-                counter = i + 1
-                break
-
-        running = True
-        end_item = False
-        end_interval = False
-        end_file = False
-
-        items = 0
-
-        watchdog = 0
-
-        # extract each tier
-        while running:
-            lines = textgridfile[counter]
-            lines = lines.strip()
-
-            watchdog += 1
-            if watchdog > 1000:
-                print(filepath, ":", lines)
-
-            # test for a new tier
-            m = new_tier_regex.match(lines)
-            if m:
-                items = int(m.group(1))
-
-                if items == size:
-                    end_item = True
-
-                if items > size:
-                    raise FileParseError("Could not parse file: '%s' \
-                                          (more tiers than expected...)" \
-                                             % (filepath))
-
-                else:
-
-                    # if we have data then add to tier variable
-                    if tiername != "":
-                        tiers[tiername] = entries
-                        entries = []
-
-                    # read tier header
-                    counter = counter + 1
-                    header_end = False
-                    while not(header_end):
-                        lines = textgridfile[counter]
-                        lines = lines.strip()
-
-                        # check for name of tier
-                        m = name_regex.match(lines)
-                        if m:
-                            tiername = m.group(1)
-
-                        # check for number of intervals in tier
-                        m = num_intervals.match(lines)
-                        if m:
-                            n_intervals = int(m.group(1))
-                            expected_nintervals[tiername] = n_intervals
-                            header_end = True
-
-                        counter = counter + 1
-
-
-            # check for interval number
-            m = intervals_regex.match(lines)
-            if m:
-                i_number = int(m.group(1))
-
-                if i_number > n_intervals:
-                    raise FileParseError("Could not parse file: '%s' \
-                                          (more intervals than expected...)" \
-                                             % (filepath))
-
-                # read interval data
-                counter = counter + 1
-                end_interval = False
-                interval = []
-                while not(end_interval):
-                    lines = textgridfile[counter]
-                    lines = lines.strip()
-                    interval.append(lines)
-
-                    if counter == x-1:
-                        end_file = True
-
-                    # check for new interval
-                    m = intervals_regex.match(lines)
-                    p = new_tier_regex.match(lines)
-
-                    if m or p:
-                        end_interval = True
-
-                    if end_interval or end_file:
-                        # ok, reached end, extract data
-                        #interval_data = ""
-                        interval_data = "".join(interval)
-
-                        # check for time
-                        m = time_regex.search(interval_data)
-                        if m:
-                            time = m.group(1)
-
-                        # check for text
-                        m = text_regex.search(interval_data)
-                        if m:
-                            text = m.group(1)
-                            text = text.strip()
-                            if not discard_empty:
-                                entries.append([time,text])
-                            else:
-                                if text != "":
-                                    entries.append([time,text])
-
-                            if end_file:
-                                running = False
-                                tiers[tiername] = entries
-                        break
-                    else:
-                        counter = counter + 1
+        for tiername, (times, labels) in Utterance.parseTextgrid(filepath, discard_empty).items():
+            tiers[tiername] = [[repr(time), label] for time, label in zip(times, labels)]
 
-            
+        return tiers, tiers[maintier]
+    readTextgrid = classmethod(readTextgrid)
 
-        counter = counter + 1
-        if end_interval and end_item:
-            running = False
 
-        for tiername in tiers:
-            if len(tiers[tiername]) != expected_nintervals[tiername]:
-                print("WARNING: some intervals in '%s' tier were discarded..." % (tiername))
+    def parseTextgrid(cls, filepath, discard_empty=False):
+        """ Single pass parser for Praat TextGrid files (long or short
+            text format). Returns an OrderedDict of tiers, each a tuple
+            of the interval end (or point) times as an array and the
+            list of labels...
+        """
 
-        return tiers, tiers[maintier]
-    readTextgrid = classmethod(readTextgrid)
+        with codecs.open(filepath, encoding="utf-8") as fh:
+            try:
+                text = fh.read()
+            except UnicodeDecodeError:
+                print(filepath)
+                raise
+
+        #the values in file order: strings, numbers and flags...
+        values = [number or flag or string.replace('""', '"')
+                  for string, number, flag in TEXTGRID_TOKEN_REGEX.findall(text)]
+
+        tiers = OrderedDict()
+        try:
+            if values[:2] != ["ooTextFile", "TextGrid"]:
+                raise FileParseError("Could not parse file: '%s' (not a TextGrid)" % (filepath))
+            #skip xmin, xmax...
+            if values[4] == "exists":
+                numtiers = int(values[5])
+                pos = 6
+            else:
+                numtiers = 0
+            for tiernum in range(numtiers):
+                tierclass, tiername, numitems = values[pos], values[pos + 1], int(values[pos + 4])
+                pos += 5
+                #intervals are (xmin, xmax, text) and points (number, mark)...
+                width = 3 if tierclass == "IntervalTier" else 2
+                items = values[pos:pos + numitems * width]
+                pos += numitems * width
+                if len(items) != numitems * width:
+                    raise FileParseError("Could not parse file: '%s' (fewer items than expected...)" % (filepath))
+                times = array(str("d"), [float(time) for time in items[width - 2::width]])
+                labels = [label.strip() for label in items[width - 1::width]]
+                if discard_empty and "" in labels:
+                    keep = [i for i, label in enumerate(labels) if label != ""]
+                    times = array(str("d"), [times[i] for i in keep])
+                    labels = [labels[i] for i in keep]
+                    print("WARNING: some intervals in '%s' tier were discarded..." % (tiername))
+                tiers[tiername] = (times, labels)
+        except (IndexError, ValueError):
+            raise FileParseError("Could not parse file: '%s'" % (filepath))
+
+        return tiers
+    parseTextgrid = classmethod(parseTextgrid)
 
 
     def readRec(cls, filepath):
@@ -415,127 +425,57 @@ class Utterance(object):
                 16050000 16200000 s4 -74.617661
         """
 
-        with open(filepath) as infh:
-            recfile = infh.readlines()
-
-        states = []
-        segments = []
-        words = []
-
-        endpos = 0
-
-        currentword = ""
-        currentsegment = ""
-
-
-        for line in recfile:
-            #parse
-            line = fixutf8(line)
-            linelist = line.split()
-
-            # #check time continuity...
-            # startpos = int(linelist[0])
-            # if startpos != endpos:                 #DEMITASSE: Eish (autofix off by 1)!
-            #     print(startpos - endpos)
-            #     if (startpos + 1) == endpos:
-            #         startpos += 1
-            #     elif (startpos - 1) == endpos:
-            #         startpos -= 1
-            #     else:
-            #         raise FileParseError("discontinuity in times in file '%s'." % (self.filepath))
-
-            #     endpos = int(linelist[1])
-            # else:
-            startpos = int(linelist[0])
-            endpos = int(linelist[1])
-
-            if len(linelist) == 7:    #new word, segment, state...
-                if currentword != "":
-                    words.append([str(htk_int_to_float(startpos)), currentword])
-                if currentsegment != "":
-                    segments.append([str(htk_int_to_float(startpos)), currentsegment])
-                    #print(currentsegment)
-
-                currentword = unicode(linelist[6], "utf-8")
-                currentsegment = unicode(linelist[4], "utf-8")
-                states.append([str(htk_int_to_float(endpos)), "_".join([currentsegment, linelist[2]])])
-
-            elif len(linelist) == 6:  #new segment, state...
-                if currentsegment != "":
-                    segments.append([str(htk_int_to_float(startpos)), currentsegment])
-                    #print(currentsegment)
-
-                currentsegment = unicode(linelist[4], "utf-8")
-                states.append([str(htk_int_to_float(endpos)), "_".join([currentsegment, linelist[2]])])
-
-            elif len(linelist) == 4:  #new state...
-                states.append([str(htk_int_to_float(endpos)), "_".join([currentsegment, linelist[2]])])
-
-            else:
-                raise FileParseError("cannot parse line:\n\t%s\nin file '%s'." % (line, filepath))
-
-            if line is recfile[-1]:
-                words.append([str(htk_int_to_float(endpos)), currentword])
-                segments.append([str(htk_int_to_float(endpos)), currentsegment])
-                #print(currentsegment)
+        utt = Utterance(filepath)
 
+        return utt.tiers, utt.entries
+    readRec = classmethod(readRec)
 
-        tiers = OrderedDict({"state" : states, "segment" : segments, "word" : words})
 
-        return tiers, segments
-    readRec = classmethod(readRec)
+    def _loadFromEntries(self, tiers, entries):
+        """ This method uses information in 'tiers' and 'entries' (the
+            main tier) to setup the compact tiers and segment
+            arrays...
+        """
+        
+        arraytiers = OrderedDict()
+        maintier = self.maintier
+        for tiername in tiers:
+            arraytiers[tiername] = (array(str("d"), [float(entry[0]) for entry in tiers[tiername]]),
+                                    [entry[1] for entry in tiers[tiername]])
+            if tiers[tiername] is entries:
+                maintier = tiername
+        self._loadFromArrays(arraytiers, maintier)
 
 
-    def _loadFromEntries(self):
-        """ This method uses information in self.entries to setup basic required (non-optional)
-            structures (i.e. 'self.segments' and 'self.boundaries')...
+    def _loadFromArrays(self, tiers, maintier):
+        """ Setup the compact tiers and segment arrays from 'tiers'
+            (tuples of end time array and labels), segments are taken
+            from 'maintier'...
 
             TODO: later this function should instead use all segments in 'self.tiers', currently
             this is unimplemented...
         """
-        
-        self.segments = []
-        self.boundaries = []
-
-        currentpos = 0.0
-        for i in range(len(self.entries)):
-            # get all segment info...
-            segname = self.entries[i][1]
-            segstarttime = float_to_htk_int(currentpos)
-            segstoptime = float_to_htk_int(self.entries[i][0])
-            segduration = segstoptime - segstarttime
-            #make cdname...
-            segcdname = segname
-            if i != 0:
-                segcdname = self.entries[i-1][1] + "-" + segcdname
-            try:
-                segcdname = segcdname + "+" + self.entries[i+1][1]
-            except:
-                pass
-            #append segment info...
-            self.segments.append({"name" : segname,
-                                  "starttime" : segstarttime,
-                                  "stoptime" : segstoptime,
-                                  "duration" : segduration,
-                                  "cdname" : segcdname})
-
-            if i < len(self.entries) - 1:
-                # get all boundary info...
-                boundname = self.entries[i][1]+"_"+self.entries[i+1][1]
-                boundtime = float_to_htk_int(self.entries[i][0])
-                #append boundary info
-                self.boundaries.append({"name" : boundname,
-                                        "time" : boundtime})
-
-            currentpos = float(self.entries[i][0])
-    
+
+        maintimes = tiers[maintier][0]
+        self.maintier = maintier
+        self._tiernames = list(tiers.keys())
+        self._tiertimes = []
+        self._tierlabels = []
+        for tiername in self._tiernames:
+            times, labels = tiers[tiername]
+            self._tiertimes.append(times)
+            self._tierlabels.append(array(str("i"), [intern_label(label) for label in labels]))
+        self._labels = self._tierlabels[self._tiernames.index(maintier)]
+
+        stoptimes = [float_to_htk_int(time) for time in maintimes]
+        self._stoptimes = array(TIME_TYPECODE, stoptimes)
+        self._starttimes = array(TIME_TYPECODE, [0] + stoptimes[:-1])
 
 
     def _loadFromRec(self):
         """ This method uses information from an HTK style label file
-            (Output from HVite with '-o N -f -m' switches) to setup basic
-            structures (i.e. 'self.segments' and 'self.boundaries' and now
-            also 'self.states' and 'self.words')...
+            (Output from HVite with '-o N -f -m' switches) to setup the
+            segment, state and word arrays...
 
             e.g. of format:
                 0 50000 s2 -60.699875 SIL -56.921608 SILENCE
@@ -554,283 +494,276 @@ class Utterance(object):
                 16050000 16200000 s4 -74.617661
         """
 
-        self.entries = []
-        self.segments = []
-        self.boundaries = []
-        self.states = []
-        self.words = []
-
-        with open(self.filepath) as infh:
-            recfile = infh.readlines()
-
-        endpos = 0
-        currentword = ""
-        currentwordstarttime = 0
-        previoussegment = ""
-        currentsegment = ""
-        currentsegmentscore = 0.0
-        currentsegmentstarttime = 0
-
-
-        for i, line in enumerate(recfile):
-            line = fixutf8(line)
-            #parse
-            linelist = line.split()
-
-            # #check time continuity...
-            # startpos = int(linelist[0])
-            # if startpos != endpos:                 #DEMITASSE: Eish!
-            #     print(startpos - endpos)
-            #     if (startpos + 1) == endpos:
-            #         startpos += 1
-            #     elif (startpos - 1) == endpos:
-            #         startpos -= 1
-            #     else:
-            #         raise FileParseError("discontinuity in times in file '%s' at line: %s" % (self.filepath, i+1))
-
-            #     endpos = int(linelist[1])
-            # else:
-            startpos = int(linelist[0])
-            endpos = int(linelist[1])
-
-            if len(linelist) == 7:    #new word, segment, state...
-                if currentword != "":
-                    self.words.append({"name" : currentword,
-                                       "starttime" : currentwordstarttime,
-                                       "stoptime" : startpos,
-                                       "duration" : startpos - currentwordstarttime})
-
-                if currentsegment != "":
-                    segcdname = triphone_2_monophone(currentsegment)
-                    if previoussegment: segcdname = triphone_2_monophone(previoussegment) + "-" + segcdname
-                    segcdname = segcdname + "+" + triphone_2_monophone(linelist[4])
-                    self.segments.append({"name" : triphone_2_monophone(currentsegment),
-                                          "cdname" : segcdname,
-                                          "modelname" : currentsegment,
-                                          "starttime" : currentsegmentstarttime,
-                                          "stoptime" : startpos,
-                                          "duration" : startpos - currentsegmentstarttime,
-                                          "score" : currentsegmentscore,
-                                          "states" : currentstates})
-
-                    self.boundaries.append({"name" : triphone_2_monophone(currentsegment) + "_" + \
-                                                     triphone_2_monophone(linelist[4]),
-                                            "time" : startpos,
-                                            "simplescore" : (currentsegmentscore + float(linelist[5])) / 2.0})
-
-                currentword = unicode(linelist[6], "utf-8")
-                currentwordstarttime = startpos
-                previoussegment = currentsegment
-                currentsegment = unicode(linelist[4], "utf-8")
-                currentsegmentscore = float(linelist[5])
-                currentsegmentstarttime = startpos
-                currentstates = []
-                #print(linelist)
-                #print(len(self.segments))
-                currentstates.append({"name" : "_".join([currentsegment, linelist[2]]),
-                                      "starttime" : startpos,
-                                      "stoptime" : endpos,
-                                      "duration" : endpos - startpos,
-                                      "score" : float(linelist[3])})
-
-            elif len(linelist) == 6:  #new segment, state...
-                if currentsegment != "":
-                    segcdname = triphone_2_monophone(currentsegment)
-                    if previoussegment: segcdname = triphone_2_monophone(previoussegment) + "-" + segcdname
-                    segcdname = segcdname + "+" + triphone_2_monophone(linelist[4])
-                    self.segments.append({"name" : triphone_2_monophone(currentsegment),
-                                          "modelname" : currentsegment,
-                                          "starttime" : currentsegmentstarttime,
-                                          "stoptime" : startpos,
-                                          "duration" : startpos - currentsegmentstarttime,
-                                          "score" : currentsegmentscore,
-                                          "states" : currentstates})
-                    
-                    self.boundaries.append({"name" : triphone_2_monophone(currentsegment) + "_" + \
-                                                triphone_2_monophone(linelist[4]),
-                                            "time" : startpos,
-                                            "simplescore" : (currentsegmentscore + float(linelist[5])) / 2.0})
-
-
-                previoussegment = currentsegment
-                currentsegment = linelist[4]
-                currentsegmentscore = float(linelist[5])
-                currentsegmentstarttime = startpos
-                currentstates = []
-
-                currentstates.append({"name" : "_".join([currentsegment, linelist[2]]),
-                                      "starttime" : startpos,
-                                      "stoptime" : endpos,
-                                      "duration" : endpos - startpos,
-                                      "score" : float(linelist[3])})
-
-            elif len(linelist) == 4:  #new state...
-                currentstates.append({"name" : "_".join([currentsegment, linelist[2]]),
-                                      "starttime" : startpos,
-                                      "stoptime" : endpos,
-                                      "duration" : endpos - startpos,
-                                      "score" : float(linelist[3])})
-
-            else:
-                raise FileParseError("cannot parse line:\n\t%s\nin file '%s'." % (line, self.filepath))
-
-            if line is recfile[-1]:
-                self.words.append({"name" : currentword,
-                                   "starttime" : currentwordstarttime,
-                                   "stoptime" : endpos,
-                                   "duration" : endpos - currentwordstarttime})
-                segcdname = triphone_2_monophone(currentsegment)
-                segcdname = triphone_2_monophone(previoussegment) + "-" + segcdname
-                self.segments.append({"name" : triphone_2_monophone(currentsegment),
-                                      "cdname" : segcdname,
-                                      "modelname" : currentsegment,
-                                      "starttime" : currentsegmentstarttime,
-                                      "stoptime" : endpos,
-                                      "duration" : endpos - currentsegmentstarttime,
-                                      "score" : currentsegmentscore,
-                                      "states": currentstates})
-
-        self.tiers, self.entries = Utterance.readRec(self.filepath)
-    
-    
-    def saveLab(self, filepath=None):
-        """ Save local segment data to a Festival format (ESPS)
-            label file.
-            Author: Aby Louw (jalouw@csir.co.za)
+        self.maintier = "segment"
+        self._tiernames = None
+
+        #HTK escapes non-ASCII bytes (e.g. '\305\241'), unescape
+        #before decoding...
+        with open(self.filepath, "rb") as infh:
+            recfile = infh.read()
+        if b"\\" in recfile:
+            recfile = HTK_ESCAPE_REGEX.sub(lambda m: bytes(bytearray([int(m.group(1), 8)])), recfile)
+        recfile = recfile.decode("utf-8")
+
+        #one list of fields per (non-empty) line: states, the first
+        #state of a segment has 6 fields and of a word 7...
+        lines = [linelist for linelist in [line.split() for line in recfile.splitlines()] if linelist]
+        for linelist in lines:
+            if len(linelist) not in (4, 6, 7):
+                raise FileParseError("cannot parse line:\n\t%s\nin file '%s'." % (" ".join(linelist), self.filepath))
+        segmentlines = [i for i, linelist in enumerate(lines) if len(linelist) >= 6]
+        wordlines = [i for i, linelist in enumerate(lines) if len(linelist) == 7]
+
+        self._statelabels = array(str("i"), [intern_label(linelist[2]) for linelist in lines])
+        self._statestarttimes = array(TIME_TYPECODE, [int(linelist[0]) for linelist in lines])
+        self._statestoptimes = array(TIME_TYPECODE, [int(linelist[1]) for linelist in lines])
+        self._statescores = array(str("d"), [float(linelist[3]) for linelist in lines])
+
+        modelnames = [lines[i][4] for i in segmentlines]
+        self._labels = array(str("i"), [intern_label(triphone_2_monophone(modelname)) for modelname in modelnames])
+        self._modelnames = array(str("i"), [intern_label(modelname) for modelname in modelnames])
+        self._scores = array(str("d"), [float(lines[i][5]) for i in segmentlines])
+        self._stateoffsets = array(str("i"), segmentlines + [len(lines)])
+        self._starttimes = array(TIME_TYPECODE, [self._statestarttimes[i] for i in segmentlines])
+
+        self._wordlabels = array(str("i"), [intern_label(lines[i][6]) for i in wordlines])
+        self._wordstarttimes = array(TIME_TYPECODE, [self._statestarttimes[i] for i in wordlines])
+
+        #segments (and words) end where the next one starts...
+        self._stoptimes = self._starttimes[1:]
+        self._wordstoptimes = self._wordstarttimes[1:]
+        if lines:
+            self._stoptimes.append(self._statestoptimes[-1])
+            self._wordstoptimes.append(self._statestoptimes[-1])
+
+
+    def parseRec(cls, filepath):
+        """ Parse an HTK style label file (Output from HVite with '-o N
+            -f -m' switches) into NumPy arrays (see 'recArrays')...
         """
-
-        entries = self.entries
-
-        if filepath is None:
-            fh = open(self.name + "." + Utterance.LAB_EXT, "w")
-        else:
-            fh = open(filepath, "w")
-
-        # write header
-        string = 'signal ' + self.name + '\n'
-        fh.writelines(string.encode("utf-8"))
-
-        string = 'nfields 1\n'
-        fh.writelines(string.encode("utf-8"))
-
-        string = '#\n'
-        fh.writelines(string.encode("utf-8"))
-
-        # now write the data
-        x = len(entries)
-
-        for i in range(0,x):
-            string = "\t%f\t100\t%s\n" %(float(entries[i][0]),entries[i][1])
-            fh.writelines(string.encode("utf-8"))
-
-        fh.close()
-
-    def saveTextgrid(self, filepath=None):
-        """ Save local segment data to a Praat TextGrid format
-            label file.
-            Author: Aby Louw (jalouw@csir.co.za)
+        return Utterance(filepath).recArrays()
+    parseRec = classmethod(parseRec)
+
+
+    def recArrays(self):
+        """ Returns the alignment (.rec only) as a dict of NumPy arrays
+            for states, segments and words: start and stop times and
+            durations (HTK units), scores (per-frame log likelihoods
+            from the file) and label ids (see 'label_name'). Segment
+            and word scores are also given as duration-weighted means
+            of their state scores ('weightedscores') and
+            'stateoffsets' index the first state of each segment or
+            word...
         """
-        
-        tiers = self.tiers
-    
-        if filepath is None:
-            f = open(self.name + "." + Utterance.TEXTGRID_EXT, "w")
-        else:
-            f = open(filepath, "w")
-
-        # header first
-        string = "File type = \"ooTextFile\"\n"
-        f.writelines(string.encode("utf-8"))
-
-        string = "Object class = \"TextGrid\"\n\n"
-        f.writelines(string.encode("utf-8"))
-
-
-        string = "xmin = 0\n"
-        f.writelines(string.encode("utf-8"))
-
-        xmax = 0
-
-        # loop through tiers and look for max x
-        for k, v in tiers.items():
-            entries = v
-            x = len(entries)
-            if xmax < float(entries[x-1][0]):
-                xmax = float(entries[x-1][0])
-
-        string = "xmax = %f\n" % (xmax,)
-        f.writelines(string.encode("utf-8"))
+        if np is None:
+            raise ImportError("NumPy is needed for rec arrays...")
+        if self._modelnames is None:
+            raise AttributeError("rec arrays are only available for utterances loaded from .rec files")
+
+        def view(values, dtype):
+            if len(values) == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.frombuffer(values, dtype=dtype)
+
+        def weighted(scores, durations, offsets):
+            if len(offsets) == 0:
+                return np.zeros(0)
+            return np.add.reduceat(scores * durations, offsets) / np.maximum(np.add.reduceat(durations, offsets), 1)
+
+        arrays = {"state_starttimes" : view(self._statestarttimes, np.int64),
+                  "state_stoptimes" : view(self._statestoptimes, np.int64),
+                  "state_scores" : view(self._statescores, np.float64),
+                  "state_labels" : view(self._statelabels, np.int32),
+                  "segment_starttimes" : view(self._starttimes, np.int64),
+                  "segment_stoptimes" : view(self._stoptimes, np.int64),
+                  "segment_scores" : view(self._scores, np.float64),
+                  "segment_labels" : view(self._labels, np.int32),
+                  "segment_models" : view(self._modelnames, np.int32),
+                  "segment_stateoffsets" : view(self._stateoffsets, np.int32)[:-1],
+                  "word_starttimes" : view(self._wordstarttimes, np.int64),
+                  "word_stoptimes" : view(self._wordstoptimes, np.int64),
+                  "word_labels" : view(self._wordlabels, np.int32)}
+        for level in ["state", "segment", "word"]:
+            arrays[level + "_durations"] = arrays[level + "_stoptimes"] - arrays[level + "_starttimes"]
+        arrays["word_stateoffsets"] = np.searchsorted(arrays["state_starttimes"], arrays["word_starttimes"])
+        for level in ["segment", "word"]:
+            arrays[level + "_weightedscores"] = weighted(arrays["state_scores"],
+                                                         arrays["state_durations"],
+                                                         arrays[level + "_stateoffsets"])
+        return arrays
+
+
+    def cdname(self, i, names=None):
+        """ Context dependent name (LC-P+RC form) of segment 'i'...
+        """
+        if names is None:
+            names = self.segmentNames()
+        cdname = names[i]
+        if i != 0:
+            cdname = names[i - 1] + "-" + cdname
+        if i < len(names) - 1:
+            cdname = cdname + "+" + names[i + 1]
+        return cdname
+
+
+    def segmentNames(self):
+        """ Returns the list of segment names...
+        """
+        return [_LABELS[labelid] for labelid in self._labels]
 
-        string = "tiers? <exists>\n"
-        f.writelines(string.encode("utf-8"))
 
-        # check tier size
-        size = len(tiers)
-        string = "size = %d\n" %(size,)
-        f.writelines(string.encode("utf-8"))
+    def _segment(self, i):
+        """ Dict of segment 'i'...
+        """
+        name = _LABELS[self._labels[i]]
+        cdname = name
+        if i != 0:
+            cdname = _LABELS[self._labels[i - 1]] + "-" + cdname
+        if i < len(self._labels) - 1:
+            cdname = cdname + "+" + _LABELS[self._labels[i + 1]]
+        segment = {"name" : name,
+                   "starttime" : self._starttimes[i],
+                   "stoptime" : self._stoptimes[i],
+                   "duration" : self._stoptimes[i] - self._starttimes[i],
+                   "cdname" : cdname}
+        if self._modelnames is not None:
+            segment["modelname"] = _LABELS[self._modelnames[i]]
+            segment["score"] = self._scores[i]
+            segment["states"] = [self._state(j, i) for j in range(self._stateoffsets[i], self._stateoffsets[i + 1])]
+        return segment
+
+
+    def _state(self, j, i=None):
+        """ Dict of state 'j' (of segment 'i')...
+        """
+        if i is None:
+            i = bisect_right(self._stateoffsets, j) - 1
+        return {"name" : "_".join([_LABELS[self._modelnames[i]], _LABELS[self._statelabels[j]]]),
+                "starttime" : self._statestarttimes[j],
+                "stoptime" : self._statestoptimes[j],
+                "duration" : self._statestoptimes[j] - self._statestarttimes[j],
+                "score" : self._statescores[j]}
 
-        string = "item []:\n"
-        f.writelines(string.encode("utf-8"))
 
+    def _boundary(self, i):
+        """ Dict of the boundary between segments 'i' and 'i + 1'...
+        """
+        boundary = {"name" : _LABELS[self._labels[i]] + "_" + _LABELS[self._labels[i + 1]],
+                    "time" : self._stoptimes[i]}
+        if self._modelnames is not None:
+            boundary["simplescore"] = (self._scores[i] + self._scores[i + 1]) / 2.0
+        return boundary
 
-        tierkeys = list(tiers.keys())
-#        tierkeys.sort()
 
-        # # if "segment" exists, then write it first
-        # if "segment" in tierkeys:
-        #     tierkeys.remove("segment")
-        #     tierkeys.insert(0,"segment")
+    def _word(self, i):
+        """ Dict of word 'i'...
+        """
+        return {"name" : _LABELS[self._wordlabels[i]],
+                "starttime" : self._wordstarttimes[i],
+                "stoptime" : self._wordstoptimes[i],
+                "duration" : self._wordstoptimes[i] - self._wordstarttimes[i]}
 
 
-        # loop through tiers and write to file
-        items = 0
-        for i in tierkeys:
-            items = items + 1
+    def _getSegments(self):
+        """ Read-only sequence of segment dicts (see 'RecordView')...
+        """
+        return RecordView(len(self._labels), self._segment)
+    segments = property(_getSegments)
 
-            # item header
-            string = "\titem [%d]:\n" % (items,)
-            f.writelines(string.encode("utf-8"))
 
-            string = "\t\tclass = \"IntervalTier\"\n"
-            f.writelines(string.encode("utf-8"))
+    def _getBoundaries(self):
+        """ Read-only sequence of boundary dicts (see 'RecordView')...
+        """
+        return RecordView(max(len(self._labels) - 1, 0), self._boundary)
+    boundaries = property(_getBoundaries)
 
-            string = "\t\tname = \"%s\"\n" % (i,)
-            f.writelines(string.encode("utf-8"))
 
-            string = "\t\txmin = 0\n"
-            f.writelines(string.encode("utf-8"))
+    def _getStates(self):
+        """ Read-only sequence of state dicts of all segments (.rec
+            only)...
+        """
+        if self._modelnames is None:
+            raise AttributeError("'states' are only available for utterances loaded from .rec files")
+        return RecordView(len(self._statelabels), self._state)
+    states = property(_getStates)
 
-            entries = tiers[i]
-            x = len(entries)
 
-            xmax = float(entries[x-1][0])
-            string = "\t\txmax = %f\n" % (xmax,)
-            f.writelines(string.encode("utf-8"))
+    def _getWords(self):
+        """ Read-only sequence of word dicts (.rec only)...
+        """
+        if self._modelnames is None:
+            raise AttributeError("'words' are only available for utterances loaded from .rec files")
+        return RecordView(len(self._wordlabels), self._word)
+    words = property(_getWords)
 
-            string = "\t\tintervals: size = %d\n" % (x,)
-            f.writelines(string.encode("utf-8"))
 
-            prev_x = 0
+    def _getTiers(self):
+        """ Tiers (lists of [time, label] entries) as read from file,
+            built on first access...
+        """
+        if self._tiers is not None:
+            return self._tiers
 
-            # now for the entries
-            for c in range(0,x):
-                string = "\t\tintervals [%d]:\n" % (c+1,)
-                f.writelines(string.encode("utf-8"))
+        if self._modelnames is None:
+            self._tiers = OrderedDict()
+            for tiername, times, labelids in zip(self._tiernames, self._tiertimes, self._tierlabels):
+                self._tiers[tiername] = [[repr(time), _LABELS[labelid]] for time, labelid in zip(times, labelids)]
+        else:
+            modelnames = [_LABELS[labelid] for labelid in self._modelnames]
+            states = []
+            for i, modelname in enumerate(modelnames):
+                for j in range(self._stateoffsets[i], self._stateoffsets[i + 1]):
+                    states.append([str(htk_int_to_float(self._statestoptimes[j])),
+                                   "_".join([modelname, _LABELS[self._statelabels[j]]])])
+            segments = [[str(htk_int_to_float(stoptime)), modelname]
+                        for stoptime, modelname in zip(self._stoptimes, modelnames)]
+            words = [[str(htk_int_to_float(stoptime)), _LABELS[labelid]]
+                     for stoptime, labelid in zip(self._wordstoptimes, self._wordlabels)]
+            self._tiers = OrderedDict({"state" : states, "segment" : segments, "word" : words})
+        return self._tiers
+    tiers = property(_getTiers)
+
+
+    def _getEntries(self):
+        """ Entries of the main tier...
+        """
+        return self.tiers[self.maintier]
+    entries = property(_getEntries)
+    
+    
+    def _plainTiers(self):
+        """ The tiers as lists of (time, label) for writing (without
+            building 'tiers' if it is not needed)...
+        """
+        if self._tiers is not None or self._modelnames is not None:
+            return self.tiers
+        tiers = OrderedDict()
+        for tiername, times, labelids in zip(self._tiernames, self._tiertimes, self._tierlabels):
+            tiers[tiername] = list(zip(times, [_LABELS[labelid] for labelid in labelids]))
+        return tiers
 
-                string = "\t\t\txmin = %f\n" % (prev_x,)
-                f.writelines(string.encode("utf-8"))
 
-                xmax = float(entries[c][0])
-                string = "\t\t\txmax = %f\n" % (xmax,)
-                f.writelines(string.encode("utf-8"))
+    def saveLab(self, filepath=None):
+        """ Save local segment data to a Festival format (ESPS)
+            label file.
+        """
 
-                string = "\t\t\ttext = \"%s\"\n" % (entries[c][1])
-                f.writelines(string.encode("utf-8"))
+        if filepath is None:
+            filepath = self.name + "." + Utterance.LAB_EXT
 
-                prev_x = xmax
+        header = 'signal ' + self.name + '\nnfields 1\n#\n'
+        with open(filepath, "wb") as fh:
+            fh.write(Utterance._renderLab(self._plainTiers()[self.maintier], header).encode("utf-8"))
 
+    def saveTextgrid(self, filepath=None):
+        """ Save local segment data to a Praat TextGrid format
+            label file.
+        """
+        
+        if filepath is None:
+            filepath = self.name + "." + Utterance.TEXTGRID_EXT
 
-        f.close()
+        Utterance.writeTextgrid(filepath, self._plainTiers())
 
 
     def dumpPhoneSequence(self, delim="\n", destdir=None, destfilename=None):
@@ -848,128 +781,63 @@ class Utterance(object):
             outfh.write(outstr)
     
 
-    def writeTextgrid(cls, filepath, tiers):
-        """ Write segment data in 'tiers' to a Praat TextGrid format
-            label file.
-            Author: Aby Louw (jalouw@csir.co.za)
+    def _renderTextgrid(cls, tiers):
+        """ Render 'tiers' in Praat TextGrid format (a single string),
+            quotes in names and labels are doubled (as Praat)...
+            Based on code by: Aby Louw (jalouw@csir.co.za)
         """
-        
-        f = open(filepath, "w")
-
-        # header first
-        string = "File type = \"ooTextFile\"\n"
-        f.writelines(string.encode("utf-8"))
-
-        string = "Object class = \"TextGrid\"\n\n"
-        f.writelines(string.encode("utf-8"))
-
-
-        string = "xmin = 0\n"
-        f.writelines(string.encode("utf-8"))
-
-        xmax = 0
 
         # loop through tiers and look for max x
-        for k, v in tiers.items():
-            entries = v
-            x = len(entries)
-            if xmax < float(entries[x-1][0]):
-                xmax = float(entries[x-1][0])
-
-        string = "xmax = %f\n" % (xmax,)
-        f.writelines(string.encode("utf-8"))
-
-        string = "tiers? <exists>\n"
-        f.writelines(string.encode("utf-8"))
-
-        # check tier size
-        size = len(tiers)
-        string = "size = %d\n" %(size,)
-        f.writelines(string.encode("utf-8"))
-
-        string = "item []:\n"
-        f.writelines(string.encode("utf-8"))
-
-
-        tierkeys = list(tiers.keys())
-#        tierkeys.sort()
-
-        # # if "segment" exists, then write it first
-        # if "segment" in tierkeys:
-        #     tierkeys.remove("segment")
-        #     tierkeys.insert(0,"segment")
-
-
-        # loop through tiers and write to file
-        items = 0
-        for i in tierkeys:
-            items = items + 1
-
-            # item header
-            string = "\titem [%d]:\n" % (items,)
-            f.writelines(string.encode("utf-8"))
-
-            string = "\t\tclass = \"IntervalTier\"\n"
-            f.writelines(string.encode("utf-8"))
-
-            string = "\t\tname = \"%s\"\n" % (i,)
-            f.writelines(string.encode("utf-8"))
-
-            string = "\t\txmin = 0\n"
-            f.writelines(string.encode("utf-8"))
-
-            entries = tiers[i]
-            x = len(entries)
-
-            xmax = float(entries[x-1][0])
-            string = "\t\txmax = %f\n" % (xmax,)
-            f.writelines(string.encode("utf-8"))
-
-            string = "\t\tintervals: size = %d\n" % (x,)
-            f.writelines(string.encode("utf-8"))
+        xmax = 0
+        for entries in tiers.values():
+            if xmax < float(entries[-1][0]):
+                xmax = float(entries[-1][0])
 
+        # header first
+        parts = ['File type = "ooTextFile"\nObject class = "TextGrid"\n\n'
+                 'xmin = 0\nxmax = %f\ntiers? <exists>\nsize = %d\nitem []:\n' % (xmax, len(tiers))]
+
+        # loop through tiers
+        for item, tiername in enumerate(tiers):
+            entries = tiers[tiername]
+            parts.append('\titem [%d]:\n\t\tclass = "IntervalTier"\n\t\tname = "%s"\n'
+                         '\t\txmin = 0\n\t\txmax = %f\n\t\tintervals: size = %d\n'
+                         % (item + 1, tiername.replace('"', '""'), float(entries[-1][0]), len(entries)))
             prev_x = 0
+            for c, entry in enumerate(entries):
+                xmax = float(entry[0])
+                parts.append('\t\tintervals [%d]:\n\t\t\txmin = %f\n\t\t\txmax = %f\n\t\t\ttext = "%s"\n'
+                             % (c + 1, prev_x, xmax, entry[1].replace('"', '""')))
+                prev_x = xmax
 
-            # now for the entries
-            for c in range(0,x):
-                string = "\t\tintervals [%d]:\n" % (c+1,)
-                f.writelines(string.encode("utf-8"))
+        return "".join(parts)
+    _renderTextgrid = classmethod(_renderTextgrid)
 
-                string = "\t\t\txmin = %f\n" % (prev_x,)
-                f.writelines(string.encode("utf-8"))
 
-                xmax = float(entries[c][0])
-                string = "\t\t\txmax = %f\n" % (xmax,)
-                f.writelines(string.encode("utf-8"))
+    def writeTextgrid(cls, filepath, tiers):
+        """ Write segment data in 'tiers' to a Praat TextGrid format
+            label file (rendered to a single buffer and written at once).
+        """
+        
+        with open(filepath, "wb") as f:
+            f.write(Utterance._renderTextgrid(tiers).encode("utf-8"))
+    writeTextgrid = classmethod(writeTextgrid)
 
-                string = "\t\t\ttext = \"%s\"\n" % (entries[c][1])
-                f.writelines(string.encode("utf-8"))
-
-                prev_x = xmax
 
+    def _renderLab(cls, entries, header="#\n"):
+        """ Render 'entries' in Festival format (ESPS) after 'header'...
+        """
+        return header + "".join(["\t%f\t100\t%s\n" % (float(entry[0]), entry[1]) for entry in entries])
+    _renderLab = classmethod(_renderLab)
 
-        f.close()
-    writeTextgrid = classmethod(writeTextgrid)
         
     def writeLab(cls, filepath, entries):
         """ Write segment data in 'entries' to a Festival format (ESPS)
             label file.
-            Author: Aby Louw (jalouw@csir.co.za)
         """
-        fh = open(filepath, "w")
-
-        # write header
-        string = '#\n'
-        fh.writelines(string.encode("utf-8"))
-
-        # now write the data
-        x = len(entries)
 
-        for i in range(0,x):
-            string = "\t%f\t100\t%s\n" %(float(entries[i][0]), entries[i][1])
-            fh.writelines(string.encode("utf-8"))
-
-        fh.close()
+        with open(filepath, "wb") as fh:
+            fh.write(Utterance._renderLab(entries).encode("utf-8"))
     writeLab = classmethod(writeLab)
         
                             
@@ -989,28 +857,15 @@ class Utterance(object):
     def isComparable(cls, utt_a, utt_b):
         """ Determines whether two utterances can be compared...
         """
-        #check segments
-        if len(utt_a.segments) != len(utt_b.segments):
+        #check segments (boundaries follow from these)
+        if len(utt_a) != len(utt_b):
             print("Number of segments differ between: '%s' and '%s'" \
                   % (utt_a.name, utt_b.name))
             return False
-        else:
-            for seg_a, seg_b in zip(utt_a.segments, utt_b.segments):
-                if seg_a["name"] != seg_b["name"]:
-                    print("Segments differ in: '%s' and '%s'" \
-                          % (utt_a.name, utt_b.name))
-                    return False
-        #check boundaries
-        if len(utt_a.boundaries) != len(utt_b.boundaries):
-            print("Number of boundaries differ between: '%s' and '%s'" \
+        elif utt_a._labels != utt_b._labels:
+            print("Segments differ in: '%s' and '%s'" \
                   % (utt_a.name, utt_b.name))
             return False
-        else:
-            for bound_a, bound_b in zip(utt_a.boundaries, utt_b.boundaries):
-                if bound_a["name"] != bound_b["name"]:
-                    print("Boundaries differ in: '%s' and '%s'" \
-                          % (utt_a.name, utt_b.name))
-                    return False
 
         return True
     isComparable = classmethod(isComparable)
@@ -1022,23 +877,13 @@ class Utterance(object):
 
         ovrs = []
 
-        for seg_a, seg_b in zip(utt_a.segments, utt_b.segments):
-            maxstartval = 0
-            minstopval = 0
-            if seg_a["starttime"] > seg_b["starttime"]:
-                maxstartval = seg_a["starttime"]
-            else:
-                maxstartval = seg_b["starttime"]
-            if seg_a["stoptime"] < seg_b["stoptime"]:
-                minstopval = seg_a["stoptime"]
-            else:
-                minstopval = seg_b["stoptime"]
-
-            common_duration = minstopval - maxstartval
+        for start_a, stop_a, start_b, stop_b in zip(utt_a._starttimes, utt_a._stoptimes,
+                                                    utt_b._starttimes, utt_b._stoptimes):
+            common_duration = min(stop_a, stop_b) - max(start_a, start_b)
             if common_duration < 0: common_duration = 0
             
             try:
-                ovr = float(common_duration) / float(seg_a["duration"] + seg_b["duration"] - common_duration) * 100.0
+                ovr = float(common_duration) / float((stop_a - start_a) + (stop_b - start_b) - common_duration) * 100.0
             except ZeroDivisionError:
                 print("WARNING: Zero duration detected in '%s/%s'" % (utt_a.name, utt_b.name))
                 ovr = 0.0
@@ -1054,8 +899,7 @@ class Utterance(object):
             occurred before the 'ref_utt' boundary...
         """
 
-        return [x[0] - x[1] for x in list(zip([x["time"] for x in base_utt.boundaries],
-                                              [x["time"] for x in ref_utt.boundaries]))]
+        return [x[0] - x[1] for x in zip(base_utt._stoptimes[:-1], ref_utt._stoptimes[:-1])]
     boundaryDifferences = classmethod(boundaryDifferences)
         
     def getSegmentsWithComparison(self, refname=None):
@@ -1064,7 +908,7 @@ class Utterance(object):
         
         if len(self.segment_comparisons) == 0:
             #print "No comparisons have been made..."
-            return copy.deepcopy(self.segments)
+            return list(self.segments)
 
         if refname is None:
             refname = list(self.segment_comparisons.keys())[0]
@@ -1079,7 +923,7 @@ class Utterance(object):
         
         if len(self.boundary_comparisons) == 0:
             #print "No comparisons have been made..."
-            return copy.deepcopy(self.boundaries)
+            return list(self.boundaries)
 
         if refname is None:
             refname = list(self.boundary_comparisons.keys())[0]
@@ -1089,13 +933,67 @@ class Utterance(object):
                        self.boundary_comparisons[refname]))]
 
 
+def _load_utterance(args):
+    """ Load a single Utterance (for use in a process pool)...
+    """
+    filepath, maintier = args
+    return Utterance(filepath, maintier=maintier)
+
+
+def _convert_file(args):
+    """ Convert a single label file (for use in a process pool)...
+    """
+    inpath, outpath, maintier = args
+    utt = Utterance(inpath, maintier=maintier)
+    if outpath.endswith("." + Utterance.LAB_EXT):
+        utt.saveLab(outpath)
+    else:
+        utt.saveTextgrid(outpath)
+    return outpath
+
+
+def convert_files(indirpath, outdirpath, ext=Utterance.TEXTGRID_EXT, maintier="segment", numprocs=None):
+    """ Convert all supported label files in 'indirpath' to format
+        'ext' (TextGrid or lab) in 'outdirpath', using 'numprocs'
+        processes (default: number of CPUs for at least
+        MIN_POOL_FILES files)... Returns the paths written.
+    """
+
+    if ext not in [Utterance.TEXTGRID_EXT, Utterance.LAB_EXT]:
+        raise UnknownLabelfileFormatError("Cannot write format: " + ext)
+
+    filenames = []
+    for inext in Utterance.SUPPORTED_EXTS:
+        filenames.extend(type_files(os.listdir(indirpath), inext))
+    filenames.sort()
+    jobs = [(os.path.join(indirpath, filename),
+             os.path.join(outdirpath, parse_path(filename)[2] + "." + ext),
+             maintier) for filename in filenames]
+
+    if numprocs is None:
+        numprocs = multiprocessing.cpu_count() if len(jobs) >= MIN_POOL_FILES else 1
+    if numprocs > 1 and len(jobs) > 1 and not multiprocessing.current_process().daemon:
+        numprocs = min(numprocs, len(jobs))
+        pool = multiprocessing.Pool(numprocs)
+        try:
+            return pool.map(_convert_file, jobs, chunksize=max(1, len(jobs) // (numprocs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    return [_convert_file(job) for job in jobs]
+
+
 class Corpus(object):
     """ Manages sets of Utterances...
     """
 
-    def __init__(self, dirpath, name=None, maintier="segment"):
+    def __init__(self, dirpath, name=None, maintier="segment", numprocs=None, cache=False):
         """ Initialises a Corpus (set of Utterances) from a path containing
-            files representing Utterances...
+            files representing Utterances... Files are parsed using
+            'numprocs' processes (default: number of CPUs for at least
+            MIN_POOL_FILES files) and if 'cache' is set, parsed
+            utterances are kept in a cache file (CORPUS_CACHE) in
+            'dirpath' (unchanged files are not parsed again)...
         """
         
         if name is not None:
@@ -1105,15 +1003,18 @@ class Corpus(object):
         self.dirpath = dirpath
         self.utterances = []
         self.segment_frequencies = defaultdict(int)
+        self.segment_index = None
         self.comparisons = {}
+        self.comparison_arrays = {}
         self.mappings = {}
+        self._arrays = None
 
         self.wavpath = None
         self.dictionarylocation = None
         self.pronunconflicts = None
         self.pronunaddendum = None
 
-        self._loadUtterances(maintier=maintier)
+        self._loadUtterances(maintier=maintier, numprocs=numprocs, cache=cache)
 
 
     def __len__(self):
@@ -1125,9 +1026,14 @@ class Corpus(object):
         return self.utterances.__iter__()
 
 
-    def _loadUtterances(self, maintier="segment"):
+    def _loadUtterances(self, maintier="segment", numprocs=None, cache=False):
         """ Scans 'self.dirpath' and loads all supported files in order to
-            initialise 'self.utterances' and 'self.segment_frequencies'...
+            initialise 'self.utterances', 'self.segment_frequencies' and
+            'self.segment_index'...
+
+            Utterances are taken from the parse cache when the file's
+            path, mtime, size and 'maintier' match, the rest are parsed
+            (in parallel if 'numprocs' > 1)...
         """
 
         filenames = []
@@ -1138,16 +1044,115 @@ class Corpus(object):
             raise
 
         filenames.sort()   # Essential (when we test comparability...)
-        
-        for filename in filenames:
-            sys.stdout.write("Loading: " + filename + "\r")
-            self.utterances.append(Utterance(os.path.join(self.dirpath, filename), maintier=maintier))
+        filepaths = [os.path.join(self.dirpath, filename) for filename in filenames]
+
+        keys = {}
+        for filepath in filepaths:
+            filestat = os.stat(filepath)
+            keys[filepath] = (filestat.st_mtime, filestat.st_size, maintier)
+
+        loaded = {}
+        cached = {}
+        if cache:
+            cached = self._readCache()
+            for filepath, (key, utt) in cached.items():
+                if keys.get(filepath) == key:
+                    loaded[filepath] = utt
+        toparse = [filepath for filepath in filepaths if filepath not in loaded]
+
+        if numprocs is None:
+            numprocs = multiprocessing.cpu_count() if len(toparse) >= MIN_POOL_FILES else 1
+        if numprocs > 1 and len(toparse) > 1 and not multiprocessing.current_process().daemon:
+            numprocs = min(numprocs, len(toparse))
+            pool = multiprocessing.Pool(numprocs)
+            try:
+                parsed = pool.imap(_load_utterance, [(filepath, maintier) for filepath in toparse],
+                                   chunksize=max(1, len(toparse) // (numprocs * 4)))
+                for filepath, utt in zip(toparse, parsed):
+                    sys.stdout.write("Loading: " + utt.filename + "\r")
+                    loaded[filepath] = utt
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for filepath in toparse:
+                sys.stdout.write("Loading: " + os.path.basename(filepath) + "\r")
+                loaded[filepath] = Utterance(filepath, maintier=maintier)
         sys.stdout.write("\nDONE!\n")
 
-        for utt in self.utterances:
-            segmentlist = utt.segments
-            for segment in segmentlist:
-                self.segment_frequencies[segment["name"]] += 1
+        for filepath in filepaths:
+            self.utterances.append(loaded[filepath])
+        self._buildIndex()
+
+        #rewritten if files were (re)parsed or removed...
+        if cache and (toparse or set(cached) != set(filepaths)):
+            self._writeCache(dict((filepath, (keys[filepath], loaded[filepath])) for filepath in filepaths))
+
+
+    def _readCache(self):
+        """ Returns the cached utterances ({filepath: (key, utterance)}),
+            empty if there is no (usable) cache...
+        """
+        try:
+            with open(os.path.join(self.dirpath, CORPUS_CACHE), "rb") as infh:
+                version, utterances = pickle.load(infh)
+        except Exception:
+            return {}
+        if version != CORPUS_CACHE_VERSION:
+            return {}
+        return utterances
+
+
+    def _writeCache(self, utterances):
+        """ Write the parse cache (the corpus is still usable if the
+            directory is not writable)...
+        """
+        location = os.path.join(self.dirpath, CORPUS_CACHE)
+        templocation = location + ".%s" % os.getpid()
+        try:
+            with open(templocation, "wb") as outfh:
+                pickle.dump((CORPUS_CACHE_VERSION, utterances), outfh, pickle.HIGHEST_PROTOCOL)
+            os.rename(templocation, location)
+        except (IOError, OSError):
+            print("WARNING: Could not write corpus cache '%s'" % (location))
+
+    def _buildIndex(self):
+        """ Builds the inverted segment index: for all segments in the
+            corpus (in order, i.e. the flat segment index) the
+            utterance, position, label and left and right context
+            labels (-1 at utterance edges) as integer arrays and
+            'postings' mapping each label id to the flat indices of its
+            segments. Also counts 'self.segment_frequencies'...
+        """
+        index = {"utterances": array(str("i")),
+                 "positions": array(str("i")),
+                 "labels": array(str("i")),
+                 "left": array(str("i")),
+                 "right": array(str("i")),
+                 "postings": {}}
+        postings = index["postings"]
+        flatindex = 0
+        for uttindex, utt in enumerate(self.utterances):
+            labels = utt._labels
+            numsegs = len(labels)
+            index["utterances"].extend([uttindex] * numsegs)
+            index["positions"].extend(range(numsegs))
+            index["labels"].extend(labels)
+            if numsegs:
+                index["left"].append(-1)
+                index["left"].extend(labels[:-1])
+                index["right"].extend(labels[1:])
+                index["right"].append(-1)
+            for labelid in labels:
+                try:
+                    postings[labelid].append(flatindex)
+                except KeyError:
+                    postings[labelid] = array(str("i"), [flatindex])
+                flatindex += 1
+        for labelid in postings:
+            self.segment_frequencies[_LABELS[labelid]] += len(postings[labelid])
+        self.segment_index = index
+
 
     def addMapping(self, filepath, name=None):
         """ Loads a simple text file with segment name mappings...
@@ -1190,96 +1195,280 @@ class Corpus(object):
     isComparable = classmethod(isComparable)
 
 
+    def _timeArrays(self):
+        """ Columnar (NumPy) representation of all segments and
+            boundaries in the corpus (built once): times, indices into
+            the 'segnames'/'boundnames' lists and per utterance offsets...
+        """
+        if self._arrays is not None:
+            return self._arrays
+
+        segnames, boundnames = {}, {}    #label id (pair) -> index
+        starts, stops, segsyms, boundtimes, boundsyms = [], [], [], [], []
+        segoffsets, boundoffsets = [0], [0]
+        for utt in self.utterances:
+            labels = utt._labels
+            starts.extend(utt._starttimes)
+            stops.extend(utt._stoptimes)
+            segsyms.extend(segnames.setdefault(labelid, len(segnames)) for labelid in labels)
+            boundtimes.extend(utt._stoptimes[:-1])
+            boundsyms.extend(boundnames.setdefault(pair, len(boundnames)) for pair in zip(labels[:-1], labels[1:]))
+            segoffsets.append(len(starts))
+            boundoffsets.append(len(boundtimes))
+
+        self._arrays = {"starttime": np.array(starts, dtype=np.int64),
+                        "stoptime": np.array(stops, dtype=np.int64),
+                        "segsym": np.array(segsyms, dtype=np.int32),
+                        "segnames": [_LABELS[labelid] for labelid in sorted(segnames, key=segnames.get)],
+                        "segoffsets": segoffsets,
+                        "boundtime": np.array(boundtimes, dtype=np.int64),
+                        "boundsym": np.array(boundsyms, dtype=np.int32),
+                        "boundnames": [_LABELS[left] + "_" + _LABELS[right]
+                                       for left, right in sorted(boundnames, key=boundnames.get)],
+                        "boundoffsets": boundoffsets}
+        return self._arrays
+
+
     def compareWith(self, corpus):
-        """ Facilitates comparison of self with another corpus...
+        """ Facilitates comparison of self with another corpus... The
+            segment OVRs and boundary time differences are computed for
+            the whole corpus at once (needs numpy)...
         """
+        if np is None:
+            raise ImportError("numpy is needed to compare corpora...")
         
         if Corpus.isComparable(self, corpus):
             #do comparison....
             if corpus.name is not None:
-                self.comparisons[corpus.name] = corpus
+                refname = corpus.name
             else:
-                self.comparisons[corpus.dirpath] = corpus
-            
-            for base_utt, ref_utt in zip(self.utterances, corpus.utterances):
-                base_utt.compareWith(ref_utt, name=corpus.name)
-                
-            
+                refname = corpus.dirpath
+            base, ref = self._timeArrays(), corpus._timeArrays()
+
+            common = np.maximum(np.minimum(base["stoptime"], ref["stoptime"]) -
+                                np.maximum(base["starttime"], ref["starttime"]), 0)
+            union = (base["stoptime"] - base["starttime"]) + (ref["stoptime"] - ref["starttime"]) - common
+            zero = union == 0
+            if zero.any():
+                uttindices = np.searchsorted(base["segoffsets"], np.flatnonzero(zero), side="right") - 1
+                for i in np.unique(uttindices):
+                    print("WARNING: Zero duration detected in '%s/%s'" % (self.utterances[i].name,
+                                                                          corpus.utterances[i].name))
+            ovrs = np.where(zero, 0.0, common / np.where(zero, 1, union).astype(np.float64) * 100.0)
+            timediffs = base["boundtime"] - ref["boundtime"]
+
+            self.comparisons[refname] = corpus
+            self.comparison_arrays[refname] = {"ovr": ovrs, "timediff": timediffs}
+
+            #per utterance view (used by 'getFullUtt*Info')...
+            ovrs, timediffs = ovrs.tolist(), timediffs.tolist()
+            segoffsets, boundoffsets = base["segoffsets"], base["boundoffsets"]
+            for i, utt in enumerate(self.utterances):
+                utt.segment_comparisons[refname] = [{"ovr" : x} for x in ovrs[segoffsets[i]:segoffsets[i + 1]]]
+                utt.boundary_comparisons[refname] = [{"timediff" : x} for x in
+                                                         timediffs[boundoffsets[i]:boundoffsets[i + 1]]]
         else:
             raise ApplesWithPearsError("Corpora are not comparable...")
 
-    def boundaryRMSE(self, refname=None):
-        """ calculate the boundary RMSE...
-        """
 
+    def _comparisonArrays(self, refname=None):
+        """ The comparison arrays for 'refname' (None if no comparisons
+            have been made)...
+        """
         if len(self.comparisons) == 0:
             print("No comparisons have been made (use compareWith() method first)...")
-            return
+            return None
 
         if refname is None:
             refname = list(self.comparisons.keys())[0]
             #print "using comparison with: '%s' corpus" % (refname)
 
-        SE_sum = 0.0
-        count = 0
-        for utt in self.utterances:
-            diffs = [x["timediff"] for x in utt.boundary_comparisons[refname]]
-            fdiffs = [htk_int_to_float(x) for x in diffs]
-            SE_sum += sum([x**2 for x in fdiffs])
-            count += len(fdiffs)
+        return self.comparison_arrays[refname]
+
+
+    def _categories(self, names, mapname=None, boundaries=False):
+        """ Category index for each of the segment (or boundary) 'names'
+            and the list of categories according to mapping 'mapname'
+            (None if no mappings have been loaded)...
+        """
+        if len(self.mappings) == 0:
+            print("No mappings have been loaded (use addMapping() method first)...")
+            return None, None
+
+        if mapname is None:
+            mapname = list(self.mappings.keys())[0]
+            #print "using mapping: '%s'" % (mapname)
+        mapping = self.mappings[mapname]
+
+        categories = {}
+        indices = []
+        for name in names:
+            if boundaries:
+                ls, rs = name.split("_")
+                category = mapping[ls] + "_" + mapping[rs]
+            else:
+                category = mapping[name]
+            indices.append(categories.setdefault(category, len(categories)))
+        return np.array(indices, dtype=np.int32), sorted(categories, key=categories.get)
+
+
+    def categoryNames(self, category, mapname=None):
+        """ The segment names in 'category' according to mapping
+            'mapname' (e.g. for use as context in 'findSegments')...
+        """
+        if mapname is None:
+            mapname = list(self.mappings.keys())[0]
+        return [name for name, cat in self.mappings[mapname].items() if cat == category]
 
-        return sqrt(SE_sum / count)
+
+    def findSegments(self, names, left=None, right=None):
+        """ Flat indices (NumPy array) of segments with name in 'names'
+            (a name or list of names) and left and right context names
+            in 'left' and 'right' (None matches any context)...
+        """
+        if np is None:
+            raise ImportError("numpy is needed to query corpora...")
+
+        def labelids(names):
+            if isinstance(names, basestring):
+                names = [names]
+            return [_LABELIDS[name] for name in names if name in _LABELIDS]
+
+        index = self.segment_index
+        postings = [index["postings"][labelid] for labelid in labelids(names) if labelid in index["postings"]]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        flat = np.sort(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in postings])).astype(np.int64)
+        for context, key in [(left, "left"), (right, "right")]:
+            if context is not None:
+                contextlabels = np.frombuffer(index[key], dtype=np.int32)[flat]
+                flat = flat[np.isin(contextlabels, labelids(context))]
+        return flat
+
+
+    def querySegments(self, names, left=None, right=None, refname=None):
+        """ Finds segments (see 'findSegments') and returns a dict of
+            NumPy arrays for the matches: 'indices' (flat),
+            'utterances' (indices in 'self.utterances'), 'positions',
+            'starttimes' and 'durations' (HTK units), 'scores' (if all
+            utterances were loaded from .rec files) and given the
+            'refname' of a comparison: 'ovrs' and the 'leftdiffs' and
+            'rightdiffs' boundary time differences (NaN at utterance
+            edges)...
+        """
+        flat = self.findSegments(names, left, right)
+        index = self.segment_index
+        arrays = self._timeArrays()
+
+        result = {"indices": flat}
+        if len(flat):
+            result["utterances"] = np.frombuffer(index["utterances"], dtype=np.int32)[flat]
+            result["positions"] = np.frombuffer(index["positions"], dtype=np.int32)[flat]
+        else:
+            result["utterances"] = result["positions"] = np.zeros(0, dtype=np.int32)
+        result["starttimes"] = arrays["starttime"][flat]
+        result["durations"] = arrays["stoptime"][flat] - result["starttimes"]
+        if all(utt._modelnames is not None for utt in self.utterances):
+            result["scores"] = np.array([self.utterances[u]._scores[p]
+                                         for u, p in zip(result["utterances"], result["positions"])], dtype=np.float64)
+
+        if refname is not None:
+            comparison = self.comparison_arrays[refname]
+            result["ovrs"] = comparison["ovr"][flat]
+            segoffsets = np.asarray(arrays["segoffsets"])
+            numsegs = (segoffsets[1:] - segoffsets[:-1])[result["utterances"]]
+            #boundary before segment p in utterance u is boundoffsets[u] + p - 1...
+            rightbounds = np.asarray(arrays["boundoffsets"][:-1], dtype=np.int64)[result["utterances"]] + result["positions"]
+            for key, bounds, valid in [("leftdiffs", rightbounds - 1, result["positions"] > 0),
+                                       ("rightdiffs", rightbounds, result["positions"] < numsegs - 1)]:
+                diffs = np.empty(len(flat))
+                diffs.fill(np.nan)
+                diffs[valid] = comparison["timediff"][bounds[valid]]
+                result[key] = diffs
+        return result
+
+
+    def boundaryRMSE(self, refname=None):
+        """ calculate the boundary RMSE...
+        """
+
+        arrays = self._comparisonArrays(refname)
+        if arrays is None:
+            return
+
+        fdiffs = arrays["timediff"] / HTK_TIME_UNITS
+        return sqrt(float(np.mean(fdiffs ** 2)))
 
     def boundaryAccuracy(self, threshold=0.020, refname=None):  #threshold in seconds...
         """ calculates the boundary accuracy (i.e. percentage of 'correct' boundaries
             (i.e. boundaries that fall within threshold of reference boundary))...
+            If 'threshold' is a sequence, a list of accuracies (one per threshold)
+            is returned...
         """
 
-        if len(self.comparisons) == 0:
-            print("No comparisons have been made (use compareWith() method first)...")
+        arrays = self._comparisonArrays(refname)
+        if arrays is None:
             return
 
-        if refname is None:
-            refname = list(self.comparisons.keys())[0]
-            #print "using comparison with: '%s' corpus" % (refname)
-
-        correct_count = 0
-        count = 0
+        absdiffs = np.sort(np.abs(arrays["timediff"]) / HTK_TIME_UNITS)
+        #number of boundaries strictly within each threshold...
+        correct_counts = np.searchsorted(absdiffs, np.atleast_1d(threshold), side="left")
+        accuracies = (correct_counts / float(len(absdiffs)) * 100.0).tolist()
+        if np.ndim(threshold) == 0:
+            return accuracies[0]
+        return accuracies
+
+    def boundaryAccuracyByCategory(self, threshold=0.020, refname=None, mapname=None):
+        """ calculates the boundary accuracy per boundary category
+            (categories of the left and right segments according to
+            mapping 'mapname', see 'addMapping') as a dict... If
+            'threshold' is a sequence, values are lists (one accuracy per
+            threshold)...
+        """
 
-        for utt in self.utterances:
-            diffs = [x["timediff"] for x in utt.boundary_comparisons[refname]]
-            fdiffs = [htk_int_to_float(x) for x in diffs]
-            correct_count += sum([int(abs(x) < threshold) for x in fdiffs])
-            count += len(fdiffs)
+        arrays = self._comparisonArrays(refname)
+        if arrays is None:
+            return
+        symcategories, categories = self._categories(self._timeArrays()["boundnames"], mapname, boundaries=True)
+        if categories is None:
+            return
 
-        return float(correct_count) / float(count) * 100.0
+        bcategories = symcategories[self._timeArrays()["boundsym"]]
+        counts = np.bincount(bcategories, minlength=len(categories))
+        absdiffs = np.abs(arrays["timediff"]) / HTK_TIME_UNITS
+        accuracies = [np.bincount(bcategories, weights=(absdiffs < t), minlength=len(categories)) / counts * 100.0
+                      for t in np.atleast_1d(threshold)]
+        if np.ndim(threshold) == 0:
+            return dict(zip(categories, accuracies[0].tolist()))
+        return dict(zip(categories, np.array(accuracies).T.tolist()))
         
     def meanOVR(self, refname=None):
         """ calculate the average segment OVR...
         """
 
-        if len(self.comparisons) == 0:
-            print("No comparisons have been made (use compareWith() method first)...")
+        arrays = self._comparisonArrays(refname)
+        if arrays is None:
             return
 
-        if refname is None:
-            refname = list(self.comparisons.keys())[0]
-            #print "using comparison with: '%s' corpus" % (refname)
+        return float(np.mean(arrays["ovr"]))
 
-        OVR_sum = 0.0
-        count = 0
-        for utt in self.utterances:
-           ovrs = map(lambda x: x["ovr"], utt.segment_comparisons[refname])
-           OVR_sum += sum(ovrs)
-           count += len(ovrs)
-           
-        return OVR_sum / count
-
-        # allOVRs = []
-        # for utt in self.utterances:
-        #     allOVRs.extend([x["ovr"] for x in utt.segment_comparisons[refname]])
-        
-        # return numpy.mean(allOVRs), numpy.std(allOVRs)
+    def meanOVRByCategory(self, refname=None, mapname=None):
+        """ calculate the average segment OVR per segment category
+            (according to mapping 'mapname', see 'addMapping') as a
+            dict...
+        """
+
+        arrays = self._comparisonArrays(refname)
+        if arrays is None:
+            return
+        symcategories, categories = self._categories(self._timeArrays()["segnames"], mapname)
+        if categories is None:
+            return
+
+        scategories = symcategories[self._timeArrays()["segsym"]]
+        sums = np.bincount(scategories, weights=arrays["ovr"], minlength=len(categories))
+        counts = np.bincount(scategories, minlength=len(categories))
+        return dict(zip(categories, (sums / counts).tolist()))
     
     def getFullUttSegmentInfo(self, num, refname=None, mapname=None):
         """ Return as much info as possible about 'self.utterances[num].segments'...
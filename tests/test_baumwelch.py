@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the in-process embedded re-estimation engine
+    ('HALIGN_BaumWelch') on a synthetic corpus with known state
+    means...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import subprocess
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    from HALIGN_MMF import MMFModelSet
+    from HALIGN_Features import write_htk_params
+    from HALIGN_BaumWelch import native_herest
+
+HTK_USER = 9
+SAMPPERIOD = 100000
+#true means of the 3 emitting states of each model (2 dimensional)...
+MEANS = {"a": [[0.0, 0.0], [2.0, 4.0], [4.0, 0.0]],
+         "b": [[6.0, 3.0], [8.0, 0.0], [10.0, 5.0]]}
+STDDEV = 0.5
+TRANSCRIPTIONS = [["a", "b"], ["b", "a"], ["a", "b", "a"]]
+
+
+def which(name):
+    """ Location of executable 'name' on the PATH (or None)...
+    """
+    for dirpath in os.environ.get("PATH", "").split(os.pathsep):
+        location = os.path.join(dirpath, name)
+        if os.path.isfile(location) and os.access(location, os.X_OK):
+            return location
+    return None
+
+
+def format_hmm(name, means, variance=1.0):
+    transp = np.zeros((5, 5))
+    transp[0, 1] = 1.0
+    for i in range(1, 4):
+        transp[i, i] = 0.6
+        transp[i, i + 1] = 0.4
+    text = '~h "%s"\n<BEGINHMM>\n<NUMSTATES> 5\n' % (name)
+    for i, mean in enumerate(means):
+        text += "<STATE> %d\n<MEAN> 2\n %e %e\n<VARIANCE> 2\n %e %e\n" % (i + 2, mean[0], mean[1], variance, variance)
+    text += "<TRANSP> 5\n" + "".join("".join(" %e" % v for v in row) + "\n" for row in transp)
+    return text + "<ENDHMM>\n"
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestNativeHERest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        rng = np.random.RandomState(7)
+        featdir = os.path.join(self.tempdir, "feats")
+        os.mkdir(featdir)
+        self.featlocations = []
+        self.mlflocation = os.path.join(self.tempdir, "phones.mlf")
+        with codecs.open(self.mlflocation, "w", encoding="utf-8") as outfh:
+            outfh.write("#!MLF!#\n")
+            for u in range(24):
+                phones = TRANSCRIPTIONS[u % len(TRANSCRIPTIONS)]
+                frames = []
+                for phone in phones:
+                    for mean in MEANS[phone]:
+                        frames.extend(rng.normal(mean, STDDEV, (rng.randint(3, 9), 2)))
+                featlocation = os.path.join(featdir, "u%02d.usr" % (u))
+                write_htk_params(featlocation, np.array(frames), SAMPPERIOD, HTK_USER)
+                self.featlocations.append(featlocation)
+                outfh.write('"*/u%02d.lab"\n%s\n.\n' % (u, "\n".join(phones)))
+        self.phonelistlocation = os.path.join(self.tempdir, "phonelist")
+        with codecs.open(self.phonelistlocation, "w", encoding="utf-8") as outfh:
+            outfh.write("a\nb\n")
+        #initial models: means off by up to 1 standard deviation and too wide...
+        self.hmm0 = self._hmmdir(0)
+        with codecs.open(os.path.join(self.hmm0, "hmmdefs"), "w", encoding="utf-8") as outfh:
+            outfh.write("~o\n<VECSIZE> 2<USER>\n")
+            for name in sorted(MEANS):
+                outfh.write(format_hmm(name, np.array(MEANS[name]) + rng.uniform(-STDDEV, STDDEV, (3, 2)), 2.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _hmmdir(self, i):
+        hmmdir = os.path.join(self.tempdir, "hmm%s" % (i))
+        if not os.path.isdir(hmmdir):
+            os.mkdir(hmmdir)
+        return hmmdir
+
+    def _means(self, hmmdir):
+        modelset = MMFModelSet.fromModelDir(hmmdir)
+        return dict((name, np.array([state.mixtures[0].mean for state in modelset[name].emittingStates()]))
+                    for name in MEANS)
+
+    def test_convergence(self):
+        logprobs = []
+        for i in range(5):
+            logprobs.append(native_herest(self.featlocations, 2, self.mlflocation, self._hmmdir(i),
+                                          self._hmmdir(i + 1), self.phonelistlocation))
+        for before, after in zip(logprobs, logprobs[1:]):
+            self.assertTrue(after >= before - 1.0e-6, "log likelihood decreased: %s" % (logprobs))
+        self.assertTrue(logprobs[-1] > logprobs[0])
+        means = self._means(self._hmmdir(5))
+        for name in MEANS:
+            self.assertTrue(np.allclose(means[name], MEANS[name], atol=0.15), "%s: %s" % (name, means[name]))
+        modelset = MMFModelSet.fromModelDir(self._hmmdir(5))
+        for name in MEANS:
+            for state in modelset[name].emittingStates():
+                self.assertTrue(np.allclose(state.mixtures[0].variance, STDDEV ** 2, rtol=0.3))
+
+    def test_shards(self):
+        serial = native_herest(self.featlocations, 1, self.mlflocation, self.hmm0,
+                               self._hmmdir("serial"), self.phonelistlocation)
+        sharded = native_herest(self.featlocations, 3, self.mlflocation, self.hmm0,
+                                self._hmmdir("sharded"), self.phonelistlocation)
+        self.assertAlmostEqual(serial, sharded, places=6)
+        serialmeans = self._means(self._hmmdir("serial"))
+        shardedmeans = self._means(self._hmmdir("sharded"))
+        for name in MEANS:
+            self.assertTrue(np.allclose(serialmeans[name], shardedmeans[name], atol=1.0e-5))
+
+    @unittest.skipIf(which("HERest") is None, "HTK (HERest) is not on the PATH")
+    def test_herest(self):
+        native_herest(self.featlocations, 1, self.mlflocation, self.hmm0,
+                      self._hmmdir("native"), self.phonelistlocation)
+        scplocation = os.path.join(self.tempdir, "train.scp")
+        with codecs.open(scplocation, "w", encoding="utf-8") as outfh:
+            outfh.write("\n".join(self.featlocations) + "\n")
+        subprocess.check_call(["HERest", "-I", self.mlflocation, "-S", scplocation,
+                               "-H", os.path.join(self.hmm0, "hmmdefs"),
+                               "-M", self._hmmdir("herest"), self.phonelistlocation])
+        nativemeans = self._means(self._hmmdir("native"))
+        herestmeans = self._means(self._hmmdir("herest"))
+        for name in MEANS:
+            self.assertTrue(np.allclose(nativemeans[name], herestmeans[name], atol=1.0e-3),
+                            "%s: %s != %s" % (name, nativemeans[name], herestmeans[name]))
+
+
+if __name__ == "__main__":
+    unittest.main()
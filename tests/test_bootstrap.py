@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Concurrent bootstrapping ('bootstrap_phones') with stand-in HInit
+    and HRest tools: a failure kills the tools still running...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import stat
+import time
+import shutil
+import codecs
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+import HALIGN_Models
+
+#'slow' starts a long running child (like a tool under a shell) and
+#'fail' fails once it is running...
+FAKE_HINIT = """#!%s
+import sys, os, time, subprocess
+args = sys.argv[1:]
+phone = args[args.index("-l") + 1]
+pidlocation = %r
+if phone == "slow":
+    child = subprocess.Popen(["sleep", "60"])
+    with open(pidlocation + ".tmp", "w") as outfh:
+        outfh.write(str(child.pid))
+    os.rename(pidlocation + ".tmp", pidlocation)
+    sys.exit(child.wait())
+if phone == "fail":
+    while not os.path.exists(pidlocation):
+        time.sleep(0.01)
+    sys.exit(1)
+"""
+
+BOOTMLF = """#!MLF!#
+"*/u1.lab"
+0 100 slow
+100 200 slow
+200 300 fail
+300 400 ok
+.
+"""
+
+
+def alive(pid):
+    """ Process 'pid' exists and is not a zombie (Linux)...
+    """
+    try:
+        with open("/proc/%d/stat" % (pid)) as infh:
+            return infh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except IOError:
+        return False
+
+
+@unittest.skipIf(not os.path.isdir("/proc") or not hasattr(os, "killpg"), "needs /proc and process groups")
+class TestBootstrapFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.pidlocation = os.path.join(self.tempdir, "slow.pid")
+        self.hinit = os.path.join(self.tempdir, "HInit")
+        with open(self.hinit, "w") as outfh:
+            outfh.write(FAKE_HINIT % (sys.executable, self.pidlocation))
+        os.chmod(self.hinit, os.stat(self.hinit).st_mode | stat.S_IEXEC)
+        self.mlflocation = os.path.join(self.tempdir, "boot.mlf")
+        with codecs.open(self.mlflocation, "w", encoding="utf-8") as outfh:
+            outfh.write(BOOTMLF)
+        self.origbins = HALIGN_Models.HINIT_BIN, HALIGN_Models.HREST_BIN
+        HALIGN_Models.HINIT_BIN = self.hinit
+        HALIGN_Models.HREST_BIN = "true"
+
+    def tearDown(self):
+        HALIGN_Models.HINIT_BIN, HALIGN_Models.HREST_BIN = self.origbins
+        shutil.rmtree(self.tempdir)
+
+    def test_kill(self):
+        starttime = time.time()
+        with self.assertRaises(Exception) as context:
+            HALIGN_Models.bootstrap_phones(["slow", "fail", "ok"], 2, "proto", self.mlflocation, "train.scp",
+                                           self.tempdir, self.tempdir)
+        self.assertTrue("'fail'" in str(context.exception))
+        self.assertTrue(time.time() - starttime < 30.0)
+        with open(self.pidlocation) as infh:
+            pid = int(infh.read())
+        for i in range(100):
+            if not alive(pid):
+                break
+            time.sleep(0.05)
+        self.assertFalse(alive(pid))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the feature worker pool of the unit catalogue scripts
+    ('feature_pool'): failed files are listed in the manifest and left
+    out of the catalogue...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "voicetools"))
+
+import feature_pool
+
+BASENAMES = ["utt_a", "utt_b", "utt_c"]
+FAILING = "utt_b"
+UTT_EXT = "utt.pickle"
+
+
+def extract(args):
+    """ Stand-in feature extraction writing a feature file (fails for
+        FAILING)...
+    """
+    wavfilename, featdir = args
+    basename = os.path.splitext(os.path.basename(wavfilename))[0]
+    if basename == FAILING:
+        raise feature_pool.FeatureExtractionError("sig2fv returned 1: bad header")
+    with open(os.path.join(featdir, basename + ".lpc"), "w") as outfh:
+        outfh.write(basename)
+
+
+class TestFailedFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = mkdtemp()
+        os.chdir(self.tempdir)
+        for dirname in ["wavs", "utts", "lpc"]:
+            os.mkdir(dirname)
+        for basename in BASENAMES:
+            open(os.path.join("wavs", basename + ".wav"), "w").close()
+            open(os.path.join("utts", ".".join([basename, UTT_EXT])), "w").close()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def test_catalogue_without_failed(self):
+        featdir = os.path.join(self.tempdir, "lpc")
+        failures = {}
+        feature_pool.run_stage("EXTRACTING FEATURES", extract,
+                               [(basename, (wavfilename, featdir))
+                                for basename, wavfilename in feature_pool.feature_jobs("wavs")],
+                               None, failures)
+        feature_pool.write_failure_manifest(failures)
+        self.assertEqual(sorted(failures), [FAILING])
+        self.assertEqual(feature_pool.read_failure_manifest(), set([FAILING]))
+        self.assertEqual([basename for basename, wavfilename in feature_pool.feature_jobs("wavs", failures)],
+                         ["utt_a", "utt_c"])
+
+        #as 'make_units' (in a later run): all remaining utterances have features...
+        uttfilenames = feature_pool.catalogue_uttfiles(os.path.join(self.tempdir, "utts"), UTT_EXT)
+        catalogue = {}
+        for uttfilename in uttfilenames:
+            basename = os.path.basename(uttfilename)[:-len(UTT_EXT) - 1]
+            with open(os.path.join(featdir, basename + ".lpc")) as infh:
+                catalogue[basename] = infh.read()
+        self.assertEqual(catalogue, {"utt_a": "utt_a", "utt_c": "utt_c"})
+
+    def test_no_manifest(self):
+        self.assertEqual(feature_pool.read_failure_manifest(), set())
+        self.assertEqual(len(feature_pool.catalogue_uttfiles("utts", UTT_EXT)), len(BASENAMES))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the in-process HTK parameter file reader/writer and MFCC
+    front-end ('HALIGN_Features')...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import wave
+import struct
+import codecs
+import shutil
+import binascii
+import subprocess
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    from HALIGN_Features import (read_htk_params, write_htk_params, MFCCFrontEnd, parse_targetkind,
+                                 AudioFeatures, HTK_HEADER_FMT, HTK_COMPRESSED, HTK_CRC)
+
+#as in 'align_feats_example.conf'...
+FEATCONF = [("TARGETKIND", "MFCC_0_D_A_Z"),
+            ("TARGETRATE", "50000.0"),
+            ("SAVECOMPRESSED", "T"),
+            ("SAVEWITHCRC", "T"),
+            ("WINDOWSIZE", "100000.0"),
+            ("USEHAMMING", "T"),
+            ("PREEMCOEF", "0.97"),
+            ("NUMCHANS", "26"),
+            ("CEPLIFTER", "22"),
+            ("NUMCEPS", "12"),
+            ("ENORMALISE", "F")]
+
+
+def which(name):
+    """ Location of executable 'name' on the PATH (or None)...
+    """
+    for dirpath in os.environ.get("PATH", "").split(os.pathsep):
+        location = os.path.join(dirpath, name)
+        if os.path.isfile(location) and os.access(location, os.X_OK):
+            return location
+    return None
+
+
+def write_wav(location, seconds=0.5, samplerate=16000):
+    """ A deterministic 16-bit mono test signal (two tones and
+        noise)...
+    """
+    rng = np.random.RandomState(3)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    samples = 4000.0 * np.sin(2 * np.pi * 220.0 * t) + 2000.0 * np.sin(2 * np.pi * 1250.0 * t) + rng.normal(0.0, 300.0, len(t))
+    wavfh = wave.open(location, "wb")
+    try:
+        wavfh.setnchannels(1)
+        wavfh.setsampwidth(2)
+        wavfh.setframerate(samplerate)
+        wavfh.writeframes(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+    finally:
+        wavfh.close()
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestHTKParams(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        rng = np.random.RandomState(5)
+        self.params = (rng.normal(0.0, 1.0, (50, 6)) * [1.0, 10.0, 0.01, 100.0, 1.0, 1.0]).astype(np.float32)
+        self.params[:, 5] = 2.5     #constant column
+        self.parmkind = parse_targetkind("MFCC_0_D")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _roundtrip(self, compressed, crc):
+        location = os.path.join(self.tempdir, "test.mfc")
+        write_htk_params(location, self.params, 50000, self.parmkind, compressed=compressed, crc=crc)
+        return location, read_htk_params(location)
+
+    def test_plain(self):
+        for crc in [False, True]:
+            location, (params, sampperiod, parmkind) = self._roundtrip(False, crc)
+            self.assertTrue(np.array_equal(params, self.params))
+            self.assertEqual((sampperiod, parmkind), (50000, self.parmkind))
+
+    def test_compressed(self):
+        step = (self.params.max(axis=0) - self.params.min(axis=0)) / (2 * 32767)
+        for crc in [False, True]:
+            location, (params, sampperiod, parmkind) = self._roundtrip(True, crc)
+            self.assertEqual(params.shape, self.params.shape)
+            self.assertEqual((sampperiod, parmkind), (50000, self.parmkind))
+            error = np.abs(params - self.params)
+            self.assertTrue(np.all(error[:, :5] <= step[:5] * 1.01 + 1.0e-6 * np.abs(self.params[:, :5])))
+            self.assertTrue(np.all(params[:, 5] == 2.5))
+
+    def test_compressed_format(self):
+        """ Header, HTK's compression factors and truncation and CRC...
+        """
+        location, result = self._roundtrip(True, True)
+        with open(location, "rb") as infh:
+            data = infh.read()
+        numsamples, sampperiod, sampsize, parmkind = struct.unpack(str(HTK_HEADER_FMT), data[:12])
+        self.assertEqual((numsamples, sampsize), (len(self.params) + 4, 12))
+        self.assertEqual(parmkind, self.parmkind | HTK_COMPRESSED | HTK_CRC)
+        self.assertEqual(struct.unpack(str(">H"), data[-2:])[0], binascii.crc_hqx(data[12:-2], 0))
+        scale = np.frombuffer(data, dtype=">f4", count=6, offset=12)
+        offset = np.frombuffer(data, dtype=">f4", count=6, offset=36)
+        shorts = np.frombuffer(data, dtype=">i2", count=50 * 6, offset=60).reshape((50, 6))
+        xmax, xmin = self.params[:, 0].max(), self.params[:, 0].min()
+        a = np.float32(2 * 32767) / (xmax - xmin)
+        b = (xmax + xmin) * np.float32(32767) / (xmax - xmin)
+        self.assertEqual((scale[0], offset[0]), (a, b))
+        expected = [int(x) for x in self.params[:, 0] * a - b]     #C cast to short
+        self.assertEqual(list(shorts[:, 0]), expected)
+        self.assertTrue(np.abs(shorts[:, :5]).max() <= 32767)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestMFCCFrontEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.wavlocation = os.path.join(self.tempdir, "test.wav")
+        write_wav(self.wavlocation)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shape(self):
+        featlocation = os.path.join(self.tempdir, "native.mfc")
+        numframes = MFCCFrontEnd(FEATCONF).makeFeats(self.wavlocation, featlocation)
+        params, sampperiod, parmkind = read_htk_params(featlocation)
+        self.assertEqual(params.shape, (numframes, 39))
+        self.assertEqual(numframes, (8000 - 160) // 80 + 1)     #10ms windows every 5ms at 16kHz
+        self.assertEqual(parmkind, parse_targetkind("MFCC_0_D_A_Z"))
+        self.assertTrue(np.all(np.isfinite(params)))
+        #_Z: zero mean statics...
+        self.assertTrue(np.allclose(params[:, :13].mean(axis=0), 0.0, atol=1.0e-3))
+
+    @unittest.skipIf(which("HCopy") is None, "HTK (HCopy) is not on the PATH")
+    def test_hcopy(self):
+        """ Compare with HCopy using the same configuration (the
+            files are compressed, so allow one quantisation step)...
+        """
+        conflocation = os.path.join(self.tempdir, "hcopy.conf")
+        with codecs.open(conflocation, "w", encoding="utf-8") as outfh:
+            outfh.write("SOURCEFORMAT = WAVE\n" + "".join("%s = %s\n" % (k, v) for k, v in FEATCONF))
+        hcopylocation = os.path.join(self.tempdir, "hcopy.mfc")
+        subprocess.check_call(["HCopy", "-C", conflocation, self.wavlocation, hcopylocation])
+        nativelocation = os.path.join(self.tempdir, "native.mfc")
+        MFCCFrontEnd(FEATCONF).makeFeats(self.wavlocation, nativelocation)
+
+        htkparams, htkperiod, htkkind = read_htk_params(hcopylocation)
+        params, sampperiod, parmkind = read_htk_params(nativelocation)
+        self.assertEqual((sampperiod, parmkind), (htkperiod, htkkind))
+        self.assertEqual(params.shape, htkparams.shape)
+        step = (htkparams.max(axis=0) - htkparams.min(axis=0)) / (2 * 32767)
+        self.assertTrue(np.all(np.abs(params - htkparams) <= 2 * step + 1.0e-4),
+                        "max difference: %s" % (np.abs(params - htkparams).max(axis=0)))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestAudioFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.wavdir = os.path.join(self.tempdir, "wavs")
+        self.featdir = os.path.join(self.tempdir, "feats")
+        os.mkdir(self.wavdir)
+        os.mkdir(self.featdir)
+        for basename in ["u1", "u2", "u3"]:
+            write_wav(os.path.join(self.wavdir, basename + ".wav"), seconds=0.1)
+        self.conflocation = os.path.join(self.tempdir, "feats.conf")
+        with codecs.open(self.conflocation, "w", encoding="utf-8") as outfh:
+            outfh.write("[GLOBAL]\n" + "".join("%s: %s\n" % (k, v) for k, v in FEATCONF) + "[HCOPY]\nSOURCEFORMAT: WAVE\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_orphans(self):
+        AudioFeatures(self.wavdir, self.conflocation).makeFeats(self.featdir, frontend="native")
+        self.assertEqual(sorted(fn for fn in os.listdir(self.featdir) if fn.endswith(".mfc")),
+                         ["u1.mfc", "u2.mfc", "u3.mfc"])
+        #a wav removed between runs leaves no stale features for training...
+        os.remove(os.path.join(self.wavdir, "u2.wav"))
+        features = AudioFeatures(self.wavdir, self.conflocation)
+        self.assertEqual(features.outdatedFeats(self.featdir, "native"), [])
+        features.makeFeats(self.featdir, frontend="native")
+        self.assertEqual(sorted(fn for fn in os.listdir(self.featdir) if fn.endswith(".mfc")),
+                         ["u1.mfc", "u3.mfc"])
+
+
+if __name__ == "__main__":
+    unittest.main()
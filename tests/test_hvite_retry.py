@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Adaptive pruning in 'sharded_hvite' with a stand-in HVite that
+    (like the real one) only reports failed utterances on stderr...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import stat
+import struct
+import shutil
+import codecs
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+import HALIGN_Models
+from HALIGN_Run import METRICS
+
+#utterance basename: narrowest beam that decodes it (None: never)...
+NEEDED_BEAMS = {"easy": 100.0, "medium": 250.0, "hard": 1000.0, "broken": None}
+
+FAKE_HVITE = """#!%s
+import sys, os
+args = sys.argv[1:]
+opts = dict((a, b) for a, b in zip(args, args[1:]) if a.startswith("-"))
+beam = float(opts.get("-t", "0.0"))
+needed = %r
+entries = []
+for line in open(opts["-S"]):
+    featlocation = line.strip()
+    basename = os.path.basename(featlocation).rsplit(".", 1)[0]
+    sys.stdout.write("File: %%s\\n" %% featlocation)
+    if needed[basename] is None or (beam != 0.0 and beam < needed[basename]):
+        sys.stderr.write("WARNING [-8031]  ProcessFile: No tokens survived to final node of network at beam %%s\\n" %% beam)
+        continue
+    entries.append((basename, "0 100000 sil -10.0\\n.\\n"))
+if "-i" in opts:
+    with open(opts["-i"], "w") as outfh:
+        outfh.write("#!MLF!#\\n")
+        for basename, body in entries:
+            outfh.write('"*/%%s.rec"\\n%%s' %% (basename, body))
+else:
+    for basename, body in entries:
+        with open(os.path.join(opts["-l"], basename + ".rec"), "w") as outfh:
+            outfh.write(body.replace(".\\n", ""))
+"""
+
+
+class TestBeamRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.hvite = os.path.join(self.tempdir, "HVite")
+        with open(self.hvite, "w") as outfh:
+            outfh.write(FAKE_HVITE % (sys.executable, NEEDED_BEAMS))
+        os.chmod(self.hvite, os.stat(self.hvite).st_mode | stat.S_IEXEC)
+        self.featlocations = []
+        for i, basename in enumerate(sorted(NEEDED_BEAMS)):
+            featlocation = os.path.join(self.tempdir, basename + ".mfc")
+            with open(featlocation, "wb") as outfh:
+                outfh.write(struct.pack(str(">iihh"), 10 * (i + 1), 100000, 4, 6))
+            self.featlocations.append(featlocation)
+        self.labeldir = os.path.join(self.tempdir, "labels")
+        os.mkdir(self.labeldir)
+        self.origbin = HALIGN_Models.HVITE_BIN
+        HALIGN_Models.HVITE_BIN = self.hvite
+        METRICS.reset()
+
+    def tearDown(self):
+        HALIGN_Models.HVITE_BIN = self.origbin
+        shutil.rmtree(self.tempdir)
+
+    def _location(self, basename):
+        return os.path.join(self.tempdir, basename + ".mfc")
+
+    def _check(self, failed):
+        self.assertEqual(failed, [self._location("broken")])
+
+    def test_mlf(self):
+        outmlflocation = os.path.join(self.tempdir, "out.mlf")
+        failed = HALIGN_Models.sharded_hvite(self.featlocations, 2, ["-i", "dummy"], [],
+                                             outmlflocation, beams=HALIGN_Models.HVITE_BEAMS)
+        self._check(failed)
+        self.assertEqual(HALIGN_Models.mlf_basenames(outmlflocation), set(["easy", "medium", "hard"]))
+        with codecs.open(outmlflocation, encoding="utf-8") as infh:
+            keys = [line.strip() for line in infh if line.startswith('"')]
+        self.assertEqual(keys, ['"*/easy.rec"', '"*/hard.rec"', '"*/medium.rec"'])
+
+    def test_labeldir(self):
+        #stale labels from an earlier run must not hide a failure...
+        with open(os.path.join(self.labeldir, "broken.rec"), "w") as outfh:
+            outfh.write("0 100000 sil -10.0\n")
+        failed = HALIGN_Models.sharded_hvite(self.featlocations, 2, ["-l", self.labeldir], [],
+                                             None, beams=HALIGN_Models.HVITE_BEAMS)
+        self._check(failed)
+        self.assertEqual(sorted(os.listdir(self.labeldir)), ["easy.rec", "hard.rec", "medium.rec"])
+
+    def test_metrics(self):
+        METRICS.startOperation("forcedAlignment")
+        HALIGN_Models.sharded_hvite(self.featlocations, 2, ["-l", self.labeldir], [],
+                                    None, beams=HALIGN_Models.HVITE_BEAMS)
+        record = METRICS.openoperation
+        METRICS.endOperation()
+        self.assertEqual(record["failed"], 1)
+        self.assertEqual(record["widened"], {self._location("medium"): "300.0",
+                                             self._location("hard"): "0.0"})
+
+    def test_without_beams(self):
+        failed = HALIGN_Models.sharded_hvite(self.featlocations, 3, ["-t", "150.0", "-l", self.labeldir], [])
+        self.assertEqual(sorted(failed), sorted([self._location(bn) for bn in ["medium", "hard", "broken"]]))
+
+    def test_serial_options(self):
+        #options as built by reAlignment/forcedAlignment...
+        options = ["-T", "1", "-a", "-y lab", "-m", "-l", '"*"', "-I", "words.mlf"]
+        self.assertEqual(HALIGN_Models.hvite_label_location(options), (None, "lab"))
+        outmlflocation = os.path.join(self.tempdir, "missing.mlf")
+        self.assertEqual(HALIGN_Models.missing_hvite_outputs(self.featlocations, options, outmlflocation),
+                         self.featlocations)
+        options = ["-T", "1", "-f", "-m", "-l", self.labeldir, "-I", "words.mlf"]
+        self.assertEqual(HALIGN_Models.hvite_label_location(options), (self.labeldir, "rec"))
+        with open(os.path.join(self.labeldir, "easy.rec"), "w") as outfh:
+            outfh.write("0 100000 sil -10.0\n")
+        self.assertEqual(HALIGN_Models.missing_hvite_outputs(self.featlocations, options),
+                         [fn for fn in self.featlocations if not fn.endswith("easy.mfc")])
+
+
+if __name__ == "__main__":
+    unittest.main()
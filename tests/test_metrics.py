@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the run metrics shared by the HAlign modules
+    ('HALIGN_Run.METRICS')...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import json
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+from HALIGN_Run import METRICS, stage, measured
+
+
+class Process(object):
+    """ Stand-in process with nested stages and an operation run by
+        several threads (as the sharded tools report commands)...
+    """
+    def __init__(self, metrics_location):
+        self.metrics_location = metrics_location
+        self.iteration = 0
+        self.saved = []
+
+    def outer(self):
+        self.inner()
+        self.saved.append(os.path.exists(self.metrics_location))
+        self.inner()
+    outer = stage(outer)
+
+    def inner(self):
+        self.train()
+    inner = stage(inner)
+
+    def train(self):
+        threads = [threading.Thread(target=self.shard) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.iteration += 1
+    train = measured(train)
+
+    def shard(self):
+        for i in range(50):
+            METRICS.addCommand("HERest", 0.0)
+            METRICS.update(numframes=i)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        METRICS.reset()
+
+    def tearDown(self):
+        METRICS.reset()
+        shutil.rmtree(self.tempdir)
+
+    def test_stages(self):
+        location = os.path.join(self.tempdir, "metrics.json")
+        process = Process(location)
+        process.outer()
+        #only saved once the outermost stage is closed...
+        self.assertEqual(process.saved, [False])
+        with open(location) as infh:
+            stages = json.load(infh)["stages"]
+        self.assertEqual([record["name"] for record in stages], ["outer"])
+        self.assertEqual(stages[0]["commands"], 2 * 8 * 50)
+        self.assertEqual([(record["name"], record["iteration"], record["commands"]) for record in stages[0]["operations"]],
+                         [("train", 1, 8 * 50), ("train", 2, 8 * 50)])
+        self.assertEqual((METRICS.openstage, METRICS.openoperation, METRICS.depth), (None, None, {"stage": 0, "operation": 0}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for reading and writing HTK Master Macro Files
+    ('HALIGN_MMF'): tied parameters are written back as macro
+    references...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    from HALIGN_MMF import MMFModelSet
+
+MACROS = """~o
+<VECSIZE> 2<USER>
+~v "varFloor1"
+<VARIANCE> 2
+ 1.0e-02 1.0e-02
+~v "V_shared"
+<VARIANCE> 2
+ 2.0e+00 3.0e+00
+~u "U_shared"
+<MEAN> 2
+ 5.0e-01 -5.0e-01
+~m "M_shared"
+<MEAN> 2
+ 1.0e+00 2.0e+00
+~v "V_shared"
+~t "T_shared"
+<TRANSP> 5
+ 0 1 0 0 0
+ 0 0.6 0.4 0 0
+ 0 0 0.6 0.4 0
+ 0 0 0 0.6 0.4
+ 0 0 0 0 0
+"""
+
+HMMDEFS = """~s "S_shared"
+~u "U_shared"
+<VARIANCE> 2
+ 1.0e+00 1.0e+00
+~h "a"
+<BEGINHMM>
+<NUMSTATES> 5
+<STATE> 2
+~m "M_shared"
+<STATE> 3
+<NUMMIXES> 2
+<MIXTURE> 1 4.0e-01
+~m "M_shared"
+<MIXTURE> 2 6.0e-01
+<MEAN> 2
+ 3.0e+00 4.0e+00
+~v "V_shared"
+<STATE> 4
+~s "S_shared"
+~t "T_shared"
+<ENDHMM>
+~h "b"
+<BEGINHMM>
+<NUMSTATES> 5
+<STATE> 2
+~u "U_shared"
+~v "V_shared"
+<STATE> 3
+~m "M_shared"
+<STATE> 4
+~s "S_shared"
+~t "T_shared"
+<ENDHMM>
+"""
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestTiedRoundTrip(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.hmmdirs = [os.path.join(self.tempdir, "hmm%d" % (i)) for i in range(3)]
+        for hmmdir in self.hmmdirs:
+            os.mkdir(hmmdir)
+        for filename, text in [("macros", MACROS), ("hmmdefs", HMMDEFS)]:
+            with codecs.open(os.path.join(self.hmmdirs[0], filename), "w", encoding="utf-8") as outfh:
+                outfh.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _read(self, hmmdir, filename):
+        with codecs.open(os.path.join(hmmdir, filename), encoding="utf-8") as infh:
+            return infh.read()
+
+    def test_references(self):
+        modelset = MMFModelSet.fromModelDir(self.hmmdirs[0])
+        modelset.save(self.hmmdirs[1])
+        hmmdefs = self._read(self.hmmdirs[1], "hmmdefs")
+        #tied parameters are referenced, not expanded in each model...
+        self.assertEqual(hmmdefs.count('~m "M_shared"'), 3)
+        self.assertEqual(hmmdefs.count('~u "U_shared"'), 2)
+        self.assertEqual(hmmdefs.count('~v "V_shared"'), 2)
+        self.assertEqual(hmmdefs.count('~s "S_shared"'), 3)
+        self.assertEqual(hmmdefs.count("<MEAN>"), 1)
+        self.assertEqual(hmmdefs.count("<VARIANCE>"), 1)
+        self.assertEqual(self._read(self.hmmdirs[1], "macros").count('~v "V_shared"'), 2)
+
+        reloaded = MMFModelSet.fromModelDir(self.hmmdirs[1])
+        for name in ["a", "b"]:
+            for before, after in zip(modelset[name].emittingStates(), reloaded[name].emittingStates()):
+                self.assertEqual(len(before.mixtures), len(after.mixtures))
+                for mixbefore, mixafter in zip(before.mixtures, after.mixtures):
+                    self.assertEqual((mixbefore.macro, mixbefore.meanmacro, mixbefore.variancemacro),
+                                     (mixafter.macro, mixafter.meanmacro, mixafter.variancemacro))
+                    self.assertAlmostEqual(mixbefore.weight, mixafter.weight)
+                    self.assertTrue(np.allclose(mixbefore.mean, mixafter.mean))
+                    self.assertTrue(np.allclose(mixbefore.variance, mixafter.variance))
+        self.assertEqual(reloaded["b"].states[2].mixtures[0].meanmacro, "U_shared")
+        self.assertEqual(reloaded["a"].states[3].mixtures[1].variancemacro, "V_shared")
+
+        #write -> parse -> write is the identity...
+        reloaded.save(self.hmmdirs[2])
+        for filename in ["macros", "hmmdefs"]:
+            self.assertEqual(self._read(self.hmmdirs[1], filename), self._read(self.hmmdirs[2], filename))
+
+
+if __name__ == "__main__":
+    unittest.main()
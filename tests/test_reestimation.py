@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the re-estimation schedule shared by the HAlign processes
+    ('reestimate_until_converged')...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+from HALIGN_Models import reestimate_until_converged, parse_herest_logprob
+
+
+class Passes(object):
+    """ Stand-in re-estimation returning the values in 'logprobs' in
+        turn...
+    """
+    def __init__(self, logprobs):
+        self.logprobs = list(logprobs)
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.logprobs[self.count - 1]
+
+
+class TestReestimateUntilConverged(unittest.TestCase):
+
+    def test_fixed(self):
+        passes = Passes([-60.0, -55.0, -54.99])
+        self.assertEqual(reestimate_until_converged(passes, "fixed", 3, 3, 0.001), [-60.0, -55.0, -54.99])
+
+    def test_converged(self):
+        passes = Passes([-60.0, -55.0, -54.99, -54.98, -54.97])
+        self.assertEqual(reestimate_until_converged(passes, "converge", 2, 5, 0.001), [-60.0, -55.0, -54.99])
+
+    def test_minimum(self):
+        passes = Passes([-60.0, -59.999, -59.998, -59.997])
+        self.assertEqual(len(reestimate_until_converged(passes, "converge", 3, 4, 0.001)), 3)
+
+    def test_unknown(self):
+        #unparsed HERest output (None) does not count as converged...
+        passes = Passes([-60.0, None, -59.999, -59.998, -59.997])
+        self.assertEqual(reestimate_until_converged(passes, "converge", 2, 5, 0.001), [-60.0, None, -59.999, -59.998])
+        self.assertEqual(parse_herest_logprob(b"ERROR [+7321]"), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for label file parsing in 'speechlabels'...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import speechlabels
+
+#HVite output (-o N -f -m) with a raw UTF-8 and an HTK escaped word...
+REC = ("0 50000 s2 -60.5 SIL -56.5 SILENCE\n"
+       "50000 1000000 s4 -56.5\n"
+       "1000000 1500000 s2 -72.0 j+a -58.0 ša\n"
+       "1500000 2000000 s3 -48.0\n"
+       "2000000 2500000 s2 -55.0 j-a -54.0\n"
+       "\n"
+       "2500000 3000000 s2 -88.0 r+e -88.0 \\305\\241e\n"
+       "3000000 3500000 s3 -66.0\n").encode("utf-8")
+
+#as written by Praat (long and short text formats) with an interval
+#and a point tier, an empty interval and a quoted label...
+LONG_TEXTGRID = """File type = "ooTextFile"
+Object class = "TextGrid"
+
+xmin = 0 
+xmax = 1.5 
+tiers? <exists> 
+size = 2 
+item []: 
+    item [1]:
+        class = "IntervalTier" 
+        name = "segment" 
+        xmin = 0 
+        xmax = 1.5 
+        intervals: size = 3 
+        intervals [1]:
+            xmin = 0 
+            xmax = 0.25 
+            text = "" 
+        intervals [2]:
+            xmin = 0.25 
+            xmax = 1.125 
+            text = "ša ""x"" 2" 
+        intervals [3]:
+            xmin = 1.125 
+            xmax = 1.5 
+            text = "pau" 
+    item [2]:
+        class = "TextTier" 
+        name = "tones" 
+        xmin = 0 
+        xmax = 1.5 
+        points: size = 2 
+        points [1]:
+            number = 0.5 
+            mark = "H*" 
+        points [2]:
+            number = 1e-1 
+            mark = "L" 
+"""
+SHORT_TEXTGRID = """File type = "ooTextFile"
+Object class = "TextGrid"
+
+0
+1.5
+<exists>
+2
+"IntervalTier"
+"segment"
+0
+1.5
+3
+0
+0.25
+""
+0.25
+1.125
+"ša ""x"" 2"
+1.125
+1.5
+"pau"
+"TextTier"
+"tones"
+0
+1.5
+2
+0.5
+"H*"
+1e-1
+"L"
+"""
+
+
+def write_lab(location, segments):
+    """ Write a Festival (ESPS) label file of (end time, label)
+        segments...
+    """
+    with open(location, "w") as outfh:
+        outfh.write("#\n" + "".join("%.3f 125 %s\n" % (endtime, label) for endtime, label in segments))
+
+
+class TestRec(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.reclocation = os.path.join(self.tempdir, "utt.rec")
+        with open(self.reclocation, "wb") as outfh:
+            outfh.write(REC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_words(self):
+        utt = speechlabels.Utterance(self.reclocation)
+        self.assertEqual([(word["name"], word["starttime"], word["stoptime"]) for word in utt.words],
+                         [("SILENCE", 0, 1000000), ("ša", 1000000, 2500000), ("še", 2500000, 3500000)])
+
+    def test_segments(self):
+        utt = speechlabels.Utterance(self.reclocation)
+        self.assertEqual([(seg["name"], seg["modelname"], seg["score"], seg["stoptime"]) for seg in utt.segments],
+                         [("SIL", "SIL", -56.5, 1000000), ("j", "j+a", -58.0, 2000000),
+                          ("a", "j-a", -54.0, 2500000), ("r", "r+e", -88.0, 3500000)])
+        self.assertEqual(len(utt.states), 7)
+        self.assertEqual(utt.states[-1]["name"], "r+e_s3")
+
+    def test_views(self):
+        utt = speechlabels.Utterance(self.reclocation)
+        segments = list(utt.segments)
+        self.assertEqual(len(utt.segments), 4)
+        self.assertEqual([utt.segments[i] for i in range(-4, 4)], segments + segments)
+        self.assertEqual(utt.segments[1:3], segments[1:3])
+        self.assertEqual(utt.segments[1]["cdname"], "SIL-j+a")
+        self.assertEqual(utt.segments[2]["states"], [utt.states[4]])
+        self.assertEqual([state["starttime"] for state in utt.states], [0, 50000, 1000000, 1500000,
+                                                                         2000000, 2500000, 3000000])
+        self.assertEqual([boundary["name"] for boundary in utt.boundaries], ["SIL_j", "j_a", "a_r"])
+        self.assertEqual(utt.boundaries[-1]["simplescore"], -71.0)
+        self.assertRaises(IndexError, lambda: utt.segments[4])
+        self.assertRaises(IndexError, lambda: utt.words[-4])
+        def assign():
+            utt.segments[0] = segments[1]
+        self.assertRaises(TypeError, assign)
+        #changes to the dicts are not kept...
+        utt.segments[0]["name"] = "X"
+        self.assertEqual(utt.segments[0]["name"], "SIL")
+
+    def test_bad_line(self):
+        with open(self.reclocation, "ab") as outfh:
+            outfh.write(b"3500000 4000000 s4\n")
+        self.assertRaises(speechlabels.FileParseError, speechlabels.Utterance, self.reclocation)
+
+
+class TestTextgrid(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, filename, text):
+        location = os.path.join(self.tempdir, filename)
+        with codecs.open(location, "w", encoding="utf-8") as outfh:
+            outfh.write(text)
+        return location
+
+    def test_parse(self):
+        for text in [LONG_TEXTGRID, SHORT_TEXTGRID]:
+            tiers = speechlabels.Utterance.parseTextgrid(self._write("utt.TextGrid", text))
+            self.assertEqual(list(tiers), ["segment", "tones"])
+            self.assertEqual(list(tiers["segment"][0]), [0.25, 1.125, 1.5])
+            self.assertEqual(tiers["segment"][1], ["", 'ša "x" 2', "pau"])
+            self.assertEqual((list(tiers["tones"][0]), tiers["tones"][1]), ([0.5, 0.1], ["H*", "L"]))
+            tiers = speechlabels.Utterance.parseTextgrid(self._write("utt.TextGrid", text), discard_empty=True)
+            self.assertEqual(tiers["segment"][1], ['ša "x" 2', "pau"])
+
+    def test_bad(self):
+        location = self._write("utt.TextGrid", LONG_TEXTGRID.replace("intervals: size = 3", "intervals: size = 4"))
+        self.assertRaises(speechlabels.FileParseError, speechlabels.Utterance.parseTextgrid, location)
+        location = self._write("utt.TextGrid", LONG_TEXTGRID.replace('"TextGrid"', '"Sound"'))
+        self.assertRaises(speechlabels.FileParseError, speechlabels.Utterance.parseTextgrid, location)
+
+    def test_roundtrip(self):
+        utt = speechlabels.Utterance(self._write("utt.TextGrid", LONG_TEXTGRID))
+        self.assertEqual(utt.segmentNames(), ["", 'ša "x" 2', "pau"])
+        firstlocation = os.path.join(self.tempdir, "first.TextGrid")
+        secondlocation = os.path.join(self.tempdir, "second.TextGrid")
+        utt.saveTextgrid(firstlocation)
+        tiers, entries = speechlabels.Utterance.readTextgrid(firstlocation)
+        self.assertEqual(tiers["segment"], [["0.25", ""], ["1.125", 'ša "x" 2'], ["1.5", "pau"]])
+        speechlabels.Utterance.writeTextgrid(secondlocation, tiers)
+        with open(firstlocation, "rb") as first:
+            with open(secondlocation, "rb") as second:
+                self.assertEqual(first.read(), second.read())
+
+
+class TestCorpusCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        for name, labels in [("u1", ["pau", "a", "pau"]), ("u2", ["pau", "b", "pau"])]:
+            write_lab(os.path.join(self.tempdir, name + ".lab"), zip([0.1, 0.2, 0.3], labels))
+        self.cachelocation = os.path.join(self.tempdir, speechlabels.CORPUS_CACHE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _names(self, corpus):
+        return [(utt.name, utt.segmentNames()) for utt in corpus]
+
+    def _cached(self, corpus):
+        return sorted(os.path.basename(filepath) for filepath in corpus._readCache())
+
+    def test_default(self):
+        speechlabels.Corpus(self.tempdir)
+        self.assertFalse(os.path.exists(self.cachelocation))
+
+    def test_unchanged(self):
+        location = os.path.join(self.tempdir, "u1.lab")
+        os.utime(location, (1000000000, 1000000000))
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual(self._cached(corpus), ["u1.lab", "u2.lab"])
+        #same size and mtime: taken from the cache...
+        write_lab(location, zip([0.1, 0.2, 0.3], ["pau", "x", "pau"]))
+        os.utime(location, (1000000000, 1000000000))
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual(self._names(corpus), [("u1", ["pau", "a", "pau"]), ("u2", ["pau", "b", "pau"])])
+
+    def test_modified(self):
+        speechlabels.Corpus(self.tempdir, cache=True)
+        write_lab(os.path.join(self.tempdir, "u2.lab"), zip([0.1, 0.2, 0.3, 0.4], ["pau", "b", "c", "pau"]))
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual(self._names(corpus), [("u1", ["pau", "a", "pau"]), ("u2", ["pau", "b", "c", "pau"])])
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual(self._names(corpus)[1], ("u2", ["pau", "b", "c", "pau"]))
+
+    def test_deleted(self):
+        speechlabels.Corpus(self.tempdir, cache=True)
+        os.remove(os.path.join(self.tempdir, "u1.lab"))
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual(self._names(corpus), [("u2", ["pau", "b", "pau"])])
+        self.assertEqual(self._cached(corpus), ["u2.lab"])
+
+    def test_added(self):
+        speechlabels.Corpus(self.tempdir, cache=True)
+        write_lab(os.path.join(self.tempdir, "u3.lab"), zip([0.1, 0.2], ["pau", "pau"]))
+        corpus = speechlabels.Corpus(self.tempdir, cache=True)
+        self.assertEqual([utt.name for utt in corpus], ["u1", "u2", "u3"])
+        self.assertEqual(self._cached(corpus), ["u1.lab", "u2.lab", "u3.lab"])
+
+
+#boundary time differences (base - reference): 0, -20ms (exactly the
+#default threshold), 10ms and -20ms, 0, 25ms...
+BASE = {"u1": [(0.1, "pau"), (0.3, "a"), (0.6, "b"), (0.8, "pau")],
+        "u2": [(0.2, "pau"), (0.4, "b"), (0.7, "a"), (0.9, "pau")]}
+REFERENCE = {"u1": [(0.1, "pau"), (0.32, "a"), (0.59, "b"), (0.8, "pau")],
+             "u2": [(0.22, "pau"), (0.4, "b"), (0.675, "a"), (0.9, "pau")]}
+MAPPING = {"pau": "S", "a": "V", "b": "C", "x": "N"}    #'N' does not occur
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestCorpusComparison(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        corpora = []
+        for name, utts in [("base", BASE), ("reference", REFERENCE)]:
+            dirpath = os.path.join(self.tempdir, name)
+            os.mkdir(dirpath)
+            for uttname, segments in utts.items():
+                write_lab(os.path.join(dirpath, uttname + ".lab"), segments)
+            corpora.append(speechlabels.Corpus(dirpath, name=name))
+        self.base, self.reference = corpora
+        self.base.compareWith(self.reference)
+        maplocation = os.path.join(self.tempdir, "categories.map")
+        with open(maplocation, "w") as outfh:
+            outfh.write("#name category\n" + "".join("%s %s\n" % item for item in sorted(MAPPING.items())))
+        self.base.addMapping(maplocation, "categories")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _boundaries(self):
+        """ Per boundary dicts (per utterance loops)...
+        """
+        return [boundary for num in range(len(self.base)) for boundary in self.base.getFullUttBoundaryInfo(num)]
+
+    def test_boundary_accuracy(self):
+        self.assertEqual([b["timediff"] for b in self._boundaries()], [0, -200000, 100000, -200000, 0, 250000])
+        for threshold in [0.0, 0.01, 0.02, 0.0201, 0.025, 0.03]:
+            #previous implementation: strictly within 'threshold'...
+            fdiffs = [speechlabels.htk_int_to_float(b["timediff"]) for b in self._boundaries()]
+            expected = sum(int(abs(x) < threshold) for x in fdiffs) / float(len(fdiffs)) * 100.0
+            self.assertAlmostEqual(self.base.boundaryAccuracy(threshold), expected)
+        self.assertAlmostEqual(self.base.boundaryAccuracy(), 50.0)
+        for accuracy, expected in zip(self.base.boundaryAccuracy([0.02, 0.0201]), [50.0, 500.0 / 6]):
+            self.assertAlmostEqual(accuracy, expected)
+
+    def test_boundary_accuracy_by_category(self):
+        accuracies = self.base.boundaryAccuracyByCategory()
+        self.assertEqual(accuracies, {"S_V": 100.0, "V_C": 0.0, "C_S": 100.0, "S_C": 0.0, "C_V": 100.0, "V_S": 0.0})
+        bythreshold = self.base.boundaryAccuracyByCategory([0.02, 0.03])
+        self.assertEqual(sorted(bythreshold), sorted(accuracies))
+        for category in accuracies:
+            boundaries = [b for b in self._boundaries() if b["category"] == category]
+            self.assertEqual(bythreshold[category],
+                             [sum(abs(b["timediff"]) < t * speechlabels.HTK_TIME_UNITS for b in boundaries)
+                              / float(len(boundaries)) * 100.0 for t in [0.02, 0.03]])
+
+    def test_ovr_by_category(self):
+        segments = [segment for num in range(len(self.base)) for segment in self.base.getFullUttSegmentInfo(num)]
+        means = self.base.meanOVRByCategory()
+        self.assertEqual(sorted(means), ["C", "S", "V"])        #no empty categories
+        for category in means:
+            ovrs = [segment["ovr"] for segment in segments if segment["category"] == category]
+            self.assertAlmostEqual(means[category], sum(ovrs) / len(ovrs))
+        self.assertAlmostEqual(self.base.meanOVR(), sum(segment["ovr"] for segment in segments) / len(segments))
+        #a 200ms segment ending 20ms before the reference...
+        self.assertAlmostEqual(segments[1]["ovr"], 200.0 / 220.0 * 100.0)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestSegmentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        utts = {"u1": [(0.1, "pau"), (0.2, "a"), (0.3, "b"), (0.4, "a"), (0.5, "pau")],
+                "u2": [(0.1, "b"), (0.3, "a"), (0.4, "c")],
+                "u3": [(0.2, "a")]}
+        for uttname, segments in utts.items():
+            write_lab(os.path.join(self.tempdir, uttname + ".lab"), segments)
+        self.corpus = speechlabels.Corpus(self.tempdir)
+        speechlabels.intern_label("unused")     #known label not in the corpus...
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _scan(self, names, left=None, right=None):
+        """ Flat indices found by a linear scan over all segments...
+        """
+        def matches(name, context):
+            return context is None or name in ([context] if isinstance(context, type("")) else context)
+        found = []
+        flat = 0
+        for utt in self.corpus:
+            labels = utt.segmentNames()
+            for p, label in enumerate(labels):
+                if (matches(label, names) and matches(labels[p - 1] if p > 0 else None, left) and
+                    matches(labels[p + 1] if p < len(labels) - 1 else None, right)):
+                    found.append(flat)
+                flat += 1
+        return found
+
+    def test_find(self):
+        self.assertEqual(self.corpus.findSegments("a").tolist(), [1, 3, 6, 8])
+        self.assertEqual(self.corpus.findSegments("missing").tolist(), [])
+        self.assertEqual(self.corpus.findSegments("unused").tolist(), [])
+        self.assertEqual(self.corpus.findSegments("a", left="b", right="c").tolist(), [6])
+        for names in ["a", "b", "pau", ["a", "c"], ["a", "missing"], "missing"]:
+            for left in [None, "b", ["pau", "b"], "missing", []]:
+                for right in [None, "a", ["pau", "c"], "missing"]:
+                    self.assertEqual(self.corpus.findSegments(names, left, right).tolist(),
+                                     self._scan(names, left, right), (names, left, right))
+        self.assertEqual(dict(self.corpus.segment_frequencies), {"pau": 2, "a": 4, "b": 2, "c": 1})
+
+    def test_query(self):
+        result = self.corpus.querySegments("a", right="pau")
+        self.assertEqual(result["utterances"].tolist(), [0])
+        self.assertEqual(result["positions"].tolist(), [3])
+        self.assertEqual(result["starttimes"].tolist(), [3000000])
+        self.assertEqual(result["durations"].tolist(), [1000000])
+        result = self.corpus.querySegments("missing")
+        self.assertEqual([len(result[key]) for key in ["indices", "utterances", "positions", "durations"]], [0] * 4)
+
+        self.corpus.compareWith(speechlabels.Corpus(self.tempdir, name="same"))
+        result = self.corpus.querySegments("a", refname="same")
+        self.assertEqual(result["ovrs"].tolist(), [100.0] * 4)
+        #no left/right boundary at utterance edges ('u3' is a single segment)...
+        self.assertEqual(np.isnan(result["leftdiffs"]).tolist(), [False, False, False, True])
+        self.assertEqual(np.isnan(result["rightdiffs"]).tolist(), [False, False, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
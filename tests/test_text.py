@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the compact (memory-mapped) pronunciation dictionary and
+    the transcription store and label edits in 'HALIGN_Text'...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import subprocess
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+from HALIGN_Text import (PronunciationDictionary, TranscriptionStore, TranscriptionSet,
+                         expand_labels, triphone_labels)
+
+ENTRIES = [("zebra", ["z", "e", "b", "r", "a"]),
+           ("ša", ["S", "a"]),
+           ("abba", ["a", "b", "a"]),
+           ("abba", ["a", "b", "@"]),
+           ("Alpha", ["a", "l", "f", "a"]),
+           ("b", ["b", "i"]),
+           ("še", ["S", "e"])]
+
+#timed entry with a second (word) level and scores, an empty and an
+#untimed entry...
+MLF = """#!MLF!#
+"*/u1.lab"
+0 1000000 sil -50.0 SIL -50.0
+1000000 1500000 S -20.0 ša -40.0
+1500000 2000000 a -20.0
+2000000 2600000 sil -30.0 SIL -30.0
+.
+"*/u2.lab"
+.
+"/data/u3.rec"
+sil
+b
+i
+sil
+.
+"""
+WORDMLF = """#!MLF!#
+"*/w1.lab"
+zebra
+ša
+.
+"*/w2.lab"
+.
+"*/w3.lab"
+abba
+b
+.
+"*/w4.lab"
+še
+abba
+.
+"""
+#monophones (word boundary 'sp' between words) and triphones (as HLEd
+#'WB sil', 'WB sp', 'NB sp', 'TC')...
+MONOPHONES = {"t1": ["sil", "k", "a", "sp", "t", "sil", "d", "o", "g", "sil"],
+              "t2": ["k", "a", "sp", "t"],
+              "t3": ["a"],
+              "t4": []}
+TRIPHONES = {"t1": ["sil", "k+a", "k-a+t", "sp", "a-t", "sil", "d+o", "d-o+g", "o-g", "sil"],
+             "t2": ["k+a", "k-a+t", "sp", "a-t"],
+             "t3": ["a"],
+             "t4": []}
+
+
+def which(name):
+    """ Location of executable 'name' on the PATH (or None)...
+    """
+    for dirpath in os.environ.get("PATH", "").split(os.pathsep):
+        location = os.path.join(dirpath, name)
+        if os.path.isfile(location) and os.access(location, os.X_OK):
+            return location
+    return None
+
+
+def read_mlf(location):
+    """ Dict based MLF reader (as before the transcription store):
+        list of (key, labels) ignoring times...
+    """
+    labelsets = []
+    with codecs.open(location, encoding="utf-8") as infh:
+        for line in infh:
+            line = line.strip()
+            if not line or line == "#!MLF!#":
+                continue
+            if line.startswith('"'):
+                labels = []
+                labelsets.append((os.path.basename(line.strip('"')).split(".")[0], labels))
+            elif line != ".":
+                tokens = line.split()
+                for i in range(min(2, len(tokens) - 1)):
+                    if not tokens[0].lstrip("-").isdigit():
+                        break
+                    tokens = tokens[1:]
+                labels.append(tokens[0])
+    return labelsets
+
+
+def write_mlf(location, labelsets):
+    """ Dict based MLF writer (as before the transcription store)...
+    """
+    with codecs.open(location, "w", encoding="utf-8") as outfh:
+        outfh.write("#!MLF!#\n" + "".join("\"*/%s.lab\"\n" % (key) + "".join(label + "\n" for label in labels) + ".\n"
+                                         for key, labels in labelsets))
+
+
+def read_text(location):
+    with codecs.open(location, encoding="utf-8") as infh:
+        return infh.read()
+
+
+class TestCompactDictionary(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.dictlocation = os.path.join(self.tempdir, "main.dict")
+        with codecs.open(self.dictlocation, "w", encoding="utf-8") as outfh:
+            outfh.write("".join("%s %s\n" % (word, " ".join(pronun)) for word, pronun in ENTRIES))
+        self.simple = PronunciationDictionary(self.dictlocation)
+        self.cdictlocation = os.path.join(self.tempdir, "main.cdict")
+        self.simple.writeCompact(self.cdictlocation)
+        self.compact = PronunciationDictionary(self.cdictlocation)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lookup(self):
+        self.assertEqual(len(self.compact), len(self.simple))
+        self.assertEqual(self.compact.entries.decoded, {})
+        self.assertEqual(self.compact["abba"], [["a", "b", "a"], ["a", "b", "@"]])
+        self.assertEqual(list(self.compact.entries.decoded), ["abba"])
+        for word in self.simple:
+            self.assertTrue(word in self.compact)
+            self.assertEqual(self.compact[word], self.simple[word])
+        for word in ["", "a", "abb", "zebras", "Ša", "s"]:
+            self.assertFalse(word in self.compact)
+            self.assertRaises(KeyError, self.compact.__getitem__, word)
+
+    def test_inventories(self):
+        self.assertEqual(list(self.compact), sorted(self.simple.entrynames))
+        self.assertEqual(self.compact.getWordSet(), self.simple.getWordSet())
+        self.assertEqual(self.compact.getPhoneSet(), self.simple.getPhoneSet())
+        self.assertEqual(self.compact.entrynames[-1], "še")
+        self.assertEqual(self.compact.entrynames[1:3], sorted(self.simple.entrynames)[1:3])
+
+    def test_changes(self):
+        self.compact["ba"] = ["b", "a"]
+        self.compact["abba"] = ["a", "b", "b", "a"]
+        del self.compact["zebra"]
+        self.assertEqual(self.compact["abba"], [["a", "b", "a"], ["a", "b", "@"], ["a", "b", "b", "a"]])
+        self.assertFalse("zebra" in self.compact)
+        self.assertTrue("ba" in self.compact)
+        self.assertEqual(len(self.compact.entries), 6)
+        self.assertEqual(len(self.compact), len(ENTRIES) + 1)     #pronunciations
+        self.assertEqual(sorted(self.compact), sorted(["Alpha", "abba", "b", "ba", "ša", "še"]))
+        self.assertEqual(self.compact.getPhoneSet(), ["@", "S", "a", "b", "e", "f", "i", "l"])
+        self.compact["zebra"] = ["z", "i", "b", "r", "a"]
+        self.assertEqual(self.compact["zebra"], [["z", "i", "b", "r", "a"]])
+
+        outlocation = os.path.join(self.tempdir, "out.cdict")
+        self.compact.writeCompact(outlocation)
+        reloaded = PronunciationDictionary(outlocation)
+        self.assertEqual(list(reloaded), sorted(self.compact.entries))
+        for word in reloaded:
+            self.assertEqual(reloaded[word], self.compact[word])
+
+
+class TestTranscriptionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.mlflocation = self._write("in.mlf", MLF)
+        self.wordmlflocation = self._write("words.mlf", WORDMLF)
+        self.dictlocation = self._write("main.dict", "".join("%s %s\n" % (word, " ".join(pronun))
+                                                             for word, pronun in ENTRIES))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, filename, text):
+        location = os.path.join(self.tempdir, filename)
+        with codecs.open(location, "w", encoding="utf-8") as outfh:
+            outfh.write(text)
+        return location
+
+    def test_load(self):
+        store = TranscriptionStore.fromMLF(self.mlflocation)
+        self.assertEqual(store.keys(), ["u1", "u2", "u3"])
+        self.assertEqual(store.labels("u1"), ["sil", "S", "a", "sil"])     #first level
+        self.assertEqual(store["u2"], "")
+        self.assertEqual(store["u3"], "sil b i sil")
+        self.assertEqual(store.times("u1"), ([0.0, 1000000.0, 1500000.0, 2000000.0],
+                                             [1000000.0, 1500000.0, 2000000.0, 2600000.0]))
+        self.assertEqual(store.times("u2"), ([], []))
+        self.assertEqual(store.times("u3"), None)
+
+    def test_roundtrip_times(self):
+        store = TranscriptionStore.fromMLF(self.mlflocation)
+        outlocation = os.path.join(self.tempdir, "timed.mlf")
+        store.writeMLF(outlocation, keys=["u1", "u2"], times=True)
+        self.assertEqual(read_text(outlocation), "#!MLF!#\n"
+                         "\"*/u1.lab\"\n0 1000000 sil\n1000000 1500000 S\n1500000 2000000 a\n2000000 2600000 sil\n.\n"
+                         "\"*/u2.lab\"\n.\n")
+        reloaded = TranscriptionStore.fromMLF(outlocation)
+        for key in reloaded:
+            self.assertEqual(reloaded.labels(key), store.labels(key))
+            self.assertEqual(reloaded.times(key), store.times(key))
+        self.assertRaises(Exception, store.writeMLF, outlocation, times=True)    #'u3' has no times
+
+    def test_roundtrip_labels(self):
+        store = TranscriptionStore.fromMLF(self.mlflocation)
+        outlocation = os.path.join(self.tempdir, "out.mlf")
+        reflocation = os.path.join(self.tempdir, "ref.mlf")
+        store.writeMLF(outlocation)
+        write_mlf(reflocation, read_mlf(self.mlflocation))
+        self.assertEqual(read_text(outlocation), read_text(reflocation))
+        againlocation = os.path.join(self.tempdir, "again.mlf")
+        TranscriptionStore.fromMLF(outlocation).writeMLF(againlocation)
+        self.assertEqual(read_text(againlocation), read_text(outlocation))
+
+    def test_rewrite(self):
+        dictionary = PronunciationDictionary(self.dictlocation)
+        outlocation = os.path.join(self.tempdir, "phones.mlf")
+        reflocation = os.path.join(self.tempdir, "ref.mlf")
+        phones = TranscriptionSet.wordToPhoneMLF(self.wordmlflocation, None, outlocation, dictionary=dictionary)
+        labelsets = [(key, [phone for word in words for phone in dictionary[word][0]])
+                     for key, words in read_mlf(self.wordmlflocation)]
+        write_mlf(reflocation, labelsets)
+        self.assertEqual(read_text(outlocation), read_text(reflocation))
+        self.assertEqual(phones, set(phone for key, labels in labelsets for phone in labels))
+        store = TranscriptionStore.fromMLF(self.wordmlflocation).rewrite(lambda word: [word.upper()] * 2)
+        self.assertEqual(store.items(), [(key, " ".join(word.upper() for word in words for i in range(2)))
+                                         for key, words in read_mlf(self.wordmlflocation)])
+
+    def test_keyswith(self):
+        store = TranscriptionStore.fromMLF(self.wordmlflocation)
+        words = dict(read_mlf(self.wordmlflocation))
+        for symbols in [["abba"], ["ša", "b"], ["missing"], [], ["abba", "missing"]]:
+            self.assertEqual(store.keysWith(symbols), [key for key in store if set(words[key]) & set(symbols)])
+        transcriptions = TranscriptionSet(self.wordmlflocation, "WORD")
+        self.assertEqual(transcriptions.variantUtterances(PronunciationDictionary(self.dictlocation)), ["w3", "w4"])
+
+
+class TestLabelEdits(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.monomlflocation = os.path.join(self.tempdir, "mono.mlf")
+        write_mlf(self.monomlflocation, sorted(MONOPHONES.items()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_expand(self):
+        dictlocation = os.path.join(self.tempdir, "main.dict")
+        with codecs.open(dictlocation, "w", encoding="utf-8") as outfh:
+            outfh.write("".join("%s %s\n" % (word, " ".join(pronun)) for word, pronun in ENTRIES + [("sp", ["sp"])]))
+        dictionary = PronunciationDictionary(dictlocation)
+        self.assertEqual(expand_labels(["abba", "sp", "b"], dictionary), ["a", "b", "a", "sp", "b", "i"])
+        self.assertEqual(expand_labels(["abba", "sp", "b"], dictionary, delete=("sp",)), ["a", "b", "a", "b", "i"])
+        self.assertRaises(Exception, expand_labels, ["abba", "missing"], dictionary)
+
+    def test_triphones(self):
+        for key in MONOPHONES:
+            self.assertEqual(triphone_labels(MONOPHONES[key], ("sil", "sp"), ("sp",)), TRIPHONES[key])
+        #word internal ('WB sp' without 'NB sp') and monophones only separated by 'sil'...
+        self.assertEqual(triphone_labels(MONOPHONES["t2"], ("sil", "sp")), ["k+a", "k-a", "sp", "t"])
+        self.assertEqual(triphone_labels(["sil", "k", "a", "t", "sil"], ("sil",)), ["sil", "k+a", "k-a+t", "a-t", "sil"])
+
+    def test_triphone_mlf(self):
+        outlocation = os.path.join(self.tempdir, "tri.mlf")
+        triphones = TranscriptionSet.monophoneToTriphoneMLF(self.monomlflocation, outlocation, "sil", "sp")
+        self.assertEqual(read_mlf(outlocation), sorted(TRIPHONES.items()))
+        self.assertEqual(triphones, set(label for labels in TRIPHONES.values() for label in labels))
+
+    @unittest.skipIf(which("HLEd") is None, "HTK (HLEd) is not on the PATH")
+    def test_hled(self):
+        outlocation = os.path.join(self.tempdir, "tri.mlf")
+        hledlocation = os.path.join(self.tempdir, "hled.mlf")
+        TranscriptionSet.monophoneToTriphoneMLF(self.monomlflocation, outlocation, "sil", "sp")
+        ledlocation = os.path.join(self.tempdir, "mktri.led")
+        with open(ledlocation, "w") as outfh:
+            outfh.write("WB sil\nWB sp\nNB sp\nTC\n")
+        subprocess.check_call(["HLEd", "-l", "*", "-i", hledlocation, ledlocation, self.monomlflocation])
+        self.assertEqual(read_mlf(outlocation), read_mlf(hledlocation))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the in-process decision tree state clustering engine
+    ('HALIGN_Tying') on synthetic statistics...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    from HALIGN_MMF import MMFModelSet
+    from HALIGN_Tying import log_likelihood, _grow_tree, StateTree, native_tie_states
+
+VARFLOOR = 1.0e-6
+#state means of the triphones of 'a' depend on the left context only...
+LEFTMEANS = {"x": 0.0, "y": 5.0}
+TRIPHONES = ["x-a+x", "x-a+y", "y-a+x", "y-a+y"]
+OCC = 100.0
+
+
+def pairwise_clusters(tree, threshold):
+    """ Reference leaf merge: exhaustive search over all pairs in each
+        round...
+    """
+    clusters = [list(leaf[0]) for leaf in tree.leaves(threshold)]
+    sums = [tree.sums(cluster) for cluster in clusters]
+    logliks = [float(log_likelihood(occ, first, second, tree.varfloor)) for occ, first, second in sums]
+    while len(clusters) > 1:
+        bestdecrease, bestpair = None, None
+        for i in range(len(clusters)):
+            for j in range(i + 1, len(clusters)):
+                merged = [a + b for a, b in zip(sums[i], sums[j])]
+                decrease = logliks[i] + logliks[j] - float(log_likelihood(merged[0], merged[1], merged[2], tree.varfloor))
+                if bestdecrease is None or decrease < bestdecrease:
+                    bestdecrease, bestpair = decrease, (i, j)
+        if bestdecrease >= threshold:
+            break
+        i, j = bestpair
+        sums[i] = tuple(a + b for a, b in zip(sums[i], sums[j]))
+        logliks[i] = float(log_likelihood(sums[i][0], sums[i][1], sums[i][2], tree.varfloor))
+        clusters[i].extend(clusters[j])
+        del clusters[j], sums[j], logliks[j]
+    return clusters
+
+
+def format_triphone(name, mean):
+    text = '~h "%s"\n<BEGINHMM>\n<NUMSTATES> 5\n' % (name)
+    for statenum in range(2, 5):
+        text += "<STATE> %d\n<MEAN> 2\n %e %e\n<VARIANCE> 2\n 1.0 1.0\n" % (statenum, mean, mean + statenum)
+    return text + '~t "T_a"\n<ENDHMM>\n'
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestStateTree(unittest.TestCase):
+
+    def _stats(self, means, occ):
+        """ Occupancy weighted sums of states with unit variance...
+        """
+        means = np.asarray(means, dtype=np.float64)
+        occ = np.asarray(occ, dtype=np.float64)
+        return occ, occ[:, np.newaxis] * means, occ[:, np.newaxis] * (means ** 2 + 1.0)
+
+    def test_grow(self):
+        occ, first, second = self._stats([[0.0], [0.1], [5.0], [5.1]], [10.0, 10.0, 10.0, 10.0])
+        answers = np.array([[True, False, True, False],     #uninformative
+                            [True, True, False, False]])    #separates the means
+        nodes = _grow_tree((occ, first, second, answers, 0.0, 10.0, VARFLOOR))
+        self.assertEqual(nodes[0][1], 1)
+        self.assertEqual(sorted(nodes[nodes[0][3]][0]), [0, 1])
+        self.assertEqual(sorted(nodes[nodes[0][4]][0]), [2, 3])
+        self.assertTrue(nodes[0][2] > 10.0)
+        for node in nodes[1:]:
+            self.assertTrue(node[1] is None)
+        #minimum occupancy prevents all splits...
+        nodes = _grow_tree((occ, first, second, answers, 25.0, 10.0, VARFLOOR))
+        self.assertEqual(len(nodes), 1)
+
+    def test_clusters(self):
+        rng = np.random.RandomState(3)
+        numstates = 60
+        occ, first, second = self._stats(rng.normal(0.0, 2.0, (numstates, 3)), rng.uniform(1.0, 20.0, numstates))
+        answers = rng.uniform(size=(40, numstates)) < 0.5
+        nodes = _grow_tree((occ, first, second, answers, 5.0, 0.0, VARFLOOR))
+        tree = StateTree("ST_", None, None, [[("s%d" % (i), 2)] for i in range(numstates)], [],
+                         nodes, occ, first, second, VARFLOOR)
+        for threshold in [0.0, 5.0, 20.0, 1.0e6]:
+            clusters = tree.clusters(threshold)
+            self.assertEqual(clusters, pairwise_clusters(tree, threshold))
+            self.assertEqual(sorted(sum(clusters, [])), list(range(numstates)))
+        self.assertEqual(len(tree.clusters(1.0e6)), 1)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestNativeTieStates(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.prev_dir = os.path.join(self.tempdir, "hmm0")
+        self.output_dir = os.path.join(self.tempdir, "hmm1")
+        os.mkdir(self.prev_dir)
+        os.mkdir(self.output_dir)
+        with codecs.open(os.path.join(self.prev_dir, "hmmdefs"), "w", encoding="utf-8") as outfh:
+            outfh.write("~o\n<VECSIZE> 2<USER>\n")
+            outfh.write('~t "T_a"\n<TRANSP> 5\n 0 1 0 0 0\n 0 0.6 0.4 0 0\n 0 0 0.6 0.4 0\n 0 0 0 0.6 0.4\n 0 0 0 0 0\n')
+            for name in TRIPHONES:
+                outfh.write(format_triphone(name, LEFTMEANS[name[0]]))
+        self.phonelistlocation = self._write("triphones", "".join(name + "\n" for name in TRIPHONES))
+        self.statslocation = self._write("stats", "".join('%d "%s" %d %s %s %s\n' % (i + 1, name, 30, OCC, OCC, OCC)
+                                                          for i, name in enumerate(TRIPHONES)))
+        self.fulllistlocation = self._write("fulllist", "".join(name + "\n" for name in TRIPHONES + ["x-a+z"]))
+        self.tiedlistlocation = os.path.join(self.tempdir, "tiedlist")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, filename, text):
+        location = os.path.join(self.tempdir, filename)
+        with codecs.open(location, "w", encoding="utf-8") as outfh:
+            outfh.write(text)
+        return location
+
+    def test_tie(self):
+        commands = ["RO 0.0 %s" % (self.statslocation),
+                    'QS "L_x" { x-* }',
+                    'QS "R_x" { *+x }']
+        for statenum in range(2, 5):
+            commands.append('TB 50.0 "ST_a_%d_" {(*-a+*).state[%d]}' % (statenum, statenum))
+        commands.extend(["AU %s" % (self.fulllistlocation), "CO %s" % (self.tiedlistlocation)])
+        native_tie_states(self.prev_dir, self.output_dir, self.phonelistlocation, commands)
+
+        modelset = MMFModelSet.fromModelDir(self.output_dir, self.tiedlistlocation)
+        self.assertEqual(len(modelset.states), 6)
+        #models only differing in the right context are merged (sharing 'T_a')...
+        self.assertEqual(sorted(modelset.hmms), ["x-a+x", "y-a+x"])
+        for name in TRIPHONES + ["x-a+z"]:
+            self.assertTrue(name in modelset)
+            for statenum, state in enumerate(modelset[name].emittingStates()):
+                mean = LEFTMEANS[name[0]]
+                self.assertTrue(np.allclose(state.mixtures[0].mean, [mean, mean + statenum + 2]))
+                self.assertTrue(np.allclose(state.mixtures[0].variance, 1.0))
+        self.assertEqual(modelset.logical["x-a+z"], "x-a+x")
+
+
+if __name__ == "__main__":
+    unittest.main()
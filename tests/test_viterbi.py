@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the in-process forced aligner ('HALIGN_Viterbi'): align a
+    synthetic utterance, write the .rec and read it back with
+    'speechlabels'...
+"""
+from __future__ import unicode_literals, division, print_function # Py2
+
+import os
+import sys
+import codecs
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "modules"))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import speechlabels
+if np is not None:
+    from HALIGN_Features import read_htk_params, write_htk_params
+    from HALIGN_Viterbi import ViterbiAligner
+
+HTK_USER = 9
+SAMPPERIOD = 50000
+#means of the emitting states (1 dimensional features)...
+MEANS = {"sil": [-30.0, -20.0, -10.0], "s": [10.0, 20.0, 30.0], "a": [40.0, 50.0, 60.0]}
+#(model, frames per state) of the synthetic utterance...
+SEGMENTS = [("sil", [2, 2, 2]), ("s", [3, 4, 2]), ("a", [5, 3, 4]), ("sil", [2, 3, 2])]
+WORDS = [("SILENCE", ["sil"]), ("ša", ["s", "a", "sp"]), ("SILENCE", ["sil"])]
+
+MMF_HMM = """~h "%s"
+<BEGINHMM>
+<NUMSTATES> 5
+%s<TRANSP> 5
+ 0.0 1.0 0.0 0.0 0.0
+ 0.0 0.6 0.4 0.0 0.0
+ 0.0 0.0 0.6 0.4 0.0
+ 0.0 0.0 0.0 0.6 0.4
+ 0.0 0.0 0.0 0.0 0.0
+<ENDHMM>
+"""
+MMF_SP = """~h "sp"
+<BEGINHMM>
+<NUMSTATES> 3
+<STATE> 2
+<MEAN> 1
+ 0.0
+<VARIANCE> 1
+ 1.0
+<TRANSP> 3
+ 0.0 0.5 0.5
+ 0.0 0.6 0.4
+ 0.0 0.0 0.0
+<ENDHMM>
+"""
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestViterbiAligner(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        with codecs.open(os.path.join(self.tempdir, "hmmdefs"), "w", encoding="utf-8") as outfh:
+            outfh.write("~o\n<VECSIZE> 1<USER>\n")
+            for name in sorted(MEANS):
+                states = "".join("<STATE> %d\n<MEAN> 1\n %e\n<VARIANCE> 1\n 1.0\n" % (i + 2, mean)
+                                 for i, mean in enumerate(MEANS[name]))
+                outfh.write(MMF_HMM % (name, states))
+            outfh.write(MMF_SP)
+        rng = np.random.RandomState(11)
+        frames = []
+        for name, durations in SEGMENTS:
+            for mean, duration in zip(MEANS[name], durations):
+                frames.extend(rng.normal(mean, 0.5, duration))
+        self.featlocation = os.path.join(self.tempdir, "utt.usr")
+        write_htk_params(self.featlocation, np.array(frames)[:, np.newaxis], SAMPPERIOD, HTK_USER)
+        self.aligner = ViterbiAligner.fromModelDir(self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_rec(self):
+        entries = self.aligner.align(self.featlocation, WORDS)
+        reclocation = os.path.join(self.tempdir, "utt.rec")
+        self.aligner.writeRec(entries, reclocation)
+        utt = speechlabels.Utterance(reclocation)
+
+        boundaries = np.cumsum([0] + [sum(durations) for name, durations in SEGMENTS]) * SAMPPERIOD
+        self.assertEqual([(seg["name"], seg["starttime"], seg["stoptime"]) for seg in utt.segments],
+                         [(name, int(start), int(stop)) for (name, durations), start, stop
+                          in zip(SEGMENTS, boundaries, boundaries[1:])])
+        self.assertEqual([(word["name"], word["starttime"], word["stoptime"]) for word in utt.words],
+                         [("SILENCE", 0, int(boundaries[1])), ("ša", int(boundaries[1]), int(boundaries[3])),
+                          ("SILENCE", int(boundaries[3]), int(boundaries[4]))])
+
+        statedurations = [duration for name, durations in SEGMENTS for duration in durations]
+        self.assertEqual([state["duration"] for state in utt.states], [d * SAMPPERIOD for d in statedurations])
+        self.assertEqual([state["name"] for state in utt.states[:3]], ["sil_s2", "sil_s3", "sil_s4"])
+
+        #scores are per-frame averages written with 6 decimals...
+        modelentries = [entry for entry in entries if len(entry) > 4]
+        for seg, entry in zip(utt.segments, modelentries):
+            self.assertEqual(seg["modelname"], entry[4])
+            self.assertAlmostEqual(seg["score"], entry[5], places=5)
+        for state, entry in zip(utt.states, entries):
+            self.assertAlmostEqual(state["score"], entry[3], places=5)
+            self.assertTrue(state["score"] < 0.0)
+
+    def test_array_input(self):
+        """ Features given as an array give the same alignment as the
+            file...
+        """
+        feats, sampperiod, parmkind = read_htk_params(self.featlocation)
+        self.assertEqual(self.aligner.align(feats, WORDS, sampperiod), self.aligner.align(self.featlocation, WORDS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Worker pool and failure bookkeeping for the feature extraction
+    stages of the unit catalogue scripts ('ttslab_make_halfphones.py'
+    and 'ttslab_make_wordunits.py'): files that failed are listed in
+    FAILED_MANIFEST and left out of the catalogue...
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+import time
+import codecs
+import subprocess
+import multiprocessing
+from glob import glob
+
+WAV_EXT = "wav"
+
+FAILED_MANIFEST = "failed_feats.txt"  #files that failed in make_features (and why)
+DEF_NUMPROCS = 0                       #0: number of CPUs
+DEF_MEM_PER_PROC = 512                 #MB of available memory needed per worker process
+
+########################################
+## FUNCTIONS
+
+class FeatureExtractionError(Exception):
+    pass
+
+def run_cmd(cmdstring):
+    """ Run an external tool, raising FeatureExtractionError (with its
+        output) if it fails...
+    """
+    p = subprocess.Popen(cmdstring, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    if p.returncode != 0:
+        raise FeatureExtractionError("%s returned %s: %s" % (cmdstring.split()[0], p.returncode,
+                                                             output.decode("utf-8", "replace").strip()))
+
+def available_memory():
+    """ Available memory in MB (None if unknown)...
+    """
+    try:
+        with open("/proc/meminfo") as infh:
+            for line in infh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    try:
+        return os.sysconf(str("SC_AVPHYS_PAGES")) * os.sysconf(str("SC_PAGE_SIZE")) // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def num_workers(featconfig):
+    """ Number of worker processes for make_features: NUMPROCS in the
+        [PARALLEL] section (0: number of CPUs) but no more than
+        available memory allows at MEM_PER_PROC (MB) each...
+    """
+    numprocs = DEF_NUMPROCS
+    mem_per_proc = DEF_MEM_PER_PROC
+    if featconfig.has_option("PARALLEL", "NUMPROCS"):
+        numprocs = int(featconfig.get("PARALLEL", "NUMPROCS"))
+    if featconfig.has_option("PARALLEL", "MEM_PER_PROC"):
+        mem_per_proc = int(featconfig.get("PARALLEL", "MEM_PER_PROC"))
+    if numprocs <= 0:
+        numprocs = multiprocessing.cpu_count()
+    availmem = available_memory()
+    if availmem is not None:
+        numprocs = max(1, min(numprocs, availmem // mem_per_proc))
+    return numprocs
+
+def _run_task(args):
+    """ Run 'func' on 'funcargs' (in a worker process), returns a
+        description of the failure or None...
+    """
+    func, funcargs = args
+    try:
+        func(funcargs)
+    except Exception as e:
+        return "%s: %s" % (e.__class__.__name__, e)
+    return None
+
+def run_stage(stagename, func, jobs, pool=None, failures=None):
+    """ Run 'func' for each of 'jobs' ((basename, args) tuples) on 'pool'
+        (serially if None), reporting progress. Failures are added to
+        'failures' (basename -> (stagename, reason))...
+    """
+    tasks = [(func, args) for basename, args in jobs]
+    if pool is None:
+        results = (_run_task(task) for task in tasks)
+    else:
+        results = pool.imap(_run_task, tasks)
+    starttime = time.time()
+    numfailed = 0
+    for done, failure in enumerate(results, 1):
+        if failure is not None:
+            numfailed += 1
+            if failures is not None:
+                failures[jobs[done - 1][0]] = (stagename, failure)
+        eta = (time.time() - starttime) / done * (len(jobs) - done)
+        sys.stdout.write("\r%s: %d/%d done, %d failed, ETA %dm%02ds " % (stagename, done, len(jobs), numfailed,
+                                                                          eta // 60, eta % 60))
+        sys.stdout.flush()
+    print()
+
+def write_failure_manifest(failures):
+    """ Write 'failures' (basename -> (stagename, reason)) to FAILED_MANIFEST...
+    """
+    with codecs.open(FAILED_MANIFEST, "w", encoding="utf-8") as outfh:
+        for basename in sorted(failures):
+            stagename, reason = failures[basename]
+            outfh.write("%s\t%s\t%s\n" % (basename, stagename, " ".join(reason.split())))
+
+def read_failure_manifest():
+    """ Basenames listed in FAILED_MANIFEST (empty if there is none)...
+    """
+    failed = set()
+    if os.path.isfile(FAILED_MANIFEST):
+        with codecs.open(FAILED_MANIFEST, encoding="utf-8") as infh:
+            for line in infh:
+                if line.strip():
+                    failed.add(line.split("\t")[0])
+    return failed
+
+def catalogue_uttfiles(utt_dir, utt_ext):
+    """ Utterance files in 'utt_dir' to build the catalogue from,
+        skipping (with a warning) those of which feature extraction
+        failed (listed in FAILED_MANIFEST)...
+    """
+    failed = read_failure_manifest()
+    uttfilenames = []
+    for uttfilename in sorted(glob(os.path.join(utt_dir, ".".join(["*", utt_ext])))):
+        basename = os.path.basename(uttfilename)[:-len(utt_ext) - 1]
+        if basename in failed:
+            print("WARNING: skipping '%s' (no features, see '%s')" % (basename, FAILED_MANIFEST))
+        else:
+            uttfilenames.append(uttfilename)
+    return uttfilenames
+
+def feature_jobs(wav_dir, failures=None):
+    """ (basename, wavfilename) for each wavefile not in 'failures'...
+    """
+    jobs = []
+    for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT])))):
+        basename = os.path.splitext(os.path.basename(wavfilename))[0]
+        if failures is None or basename not in failures:
+            jobs.append((basename, wavfilename))
+    return jobs
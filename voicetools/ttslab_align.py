@@ -17,12 +17,13 @@ import re
 import signal
 import shutil
 from tempfile import mkstemp, mkdtemp
+from time import strftime
 from glob import glob
 from collections import defaultdict
 
 import ttslab
 from ttslab.waveform import Waveform
-from HAlign2 import GenHAlign, GenHAlignRealign
+from HAlign2 import GenHAlign, GenHAlignRealign, GenHAlignIncremental
 import speechlabels as sl
 
 #sometimes the limit needs to be increased to pickle large utts...
@@ -33,9 +34,12 @@ TRANSCR_FILE = "utts.data"
 HALIGNCONF_FILE = "halign.conf"
 WAV_DIR = "wavs"
 HALIGNWORK_DIR = "halign"
+HALIGNINCRWORK_DIR = "halign_incremental"
+HALIGNFINALMODELS_DIR = "finalmodels"
 HALIGNINPUT_SUBDIR = "input"
 HALIGNINPUTTRANSCR_DIR = "trancr"
 TEXTGRID_DIR = "textgrids"
+TEXTGRID_EXT = "TextGrid"
 ALIGNED_UTT_DIR = "utts"
 LAB_EXT = "lab"
 DICT_EXT = "dict"
@@ -331,10 +335,28 @@ def complete_utt_from_textgrid(voice, sc_utt, utt):
 
 ########################################
 ## BATCH FUNCTIONS
-def make_halign_input(voice, utts, halign_working_dir):
+def last_wordinstance(dictlocation):
+    """ Highest utterance number of the word instances
+        ('<word>_<number>') in a dictionary made by
+        'make_halign_input' (-1 if there are none)...
+    """
+    last = -1
+    with codecs.open(dictlocation, encoding="utf-8") as infh:
+        for line in infh:
+            linelist = line.split()
+            if linelist and "_" in linelist[0]:
+                number = linelist[0].rsplit("_", 1)[1]
+                if number.isdigit():
+                    last = max(last, int(number))
+    return last
+
+
+def make_halign_input(voice, utts, halign_working_dir, firstindex=0):
     """ Make 2-tier HAlign source from utts...
 
         Makes dict with variants if alternative utts found in utts.
+        Word instances are numbered from 'firstindex' (to extend the
+        dictionary of a previous run).
 
         TODO HERE: seperate SILs at the start of words...DEMITASSE
     """
@@ -343,7 +365,7 @@ def make_halign_input(voice, utts, halign_working_dir):
     transcrdir = os.path.join(halign_working_dir, HALIGNINPUT_SUBDIR, HALIGNINPUTTRANSCR_DIR)
     outdictfilelocation = os.path.join(halign_working_dir, HALIGNINPUT_SUBDIR, "wordinstances" + "." + DICT_EXT)
 
-    for i, utt in enumerate(utts):
+    for i, utt in enumerate(utts, firstindex):
         tiers = get_2tiers_from_utt(voice, utt)
         #add words to dict...
         for item in tiers:
@@ -502,6 +524,61 @@ def to_textgrid(voice):
     #os.remove(pronundict_location)
 
 
+def to_textgrid_incremental(voice):
+    """ Align only the utterances without a TextGrid in the textgrids
+        dir (e.g. newly added recordings), reusing the models (and
+        dictionary) of a previous 'to_textgrid' run, and add the
+        resulting TextGrids (including Syllables) to the textgrids
+        dir...
+    """
+    #create necessary output dirs...
+    CWD = os.getcwd()
+    wav_dir                  = os.path.join(CWD, WAV_DIR)
+    transcr_location         = os.path.join(CWD, ETC_DIR, TRANSCR_FILE)
+    halign_config_location   = os.path.join(CWD, ETC_DIR, HALIGNCONF_FILE)
+
+    previous_models_dir      = os.path.join(CWD, HALIGNWORK_DIR, HALIGNFINALMODELS_DIR)
+    halign_working_dir       = os.path.join(CWD, "_".join([HALIGNINCRWORK_DIR, strftime("%Y%m%d%H%M%S")]))
+    halign_input_transcr_dir = os.path.join(halign_working_dir, HALIGNINPUT_SUBDIR, HALIGNINPUTTRANSCR_DIR)
+    textgrid_dir             = os.path.join(CWD, TEXTGRID_DIR)
+
+    #get silence phone..
+    silence_phone = voice.phoneset.features["silence_phone"]
+
+    #select new utterances...
+    transcriptions = load_transcriptions_schemefile(transcr_location)
+    aligned = set([os.path.basename(fn)[:-len(TEXTGRID_EXT) - 1]
+                   for fn in glob(os.path.join(textgrid_dir, "*." + TEXTGRID_EXT))])
+    newtranscriptions = dict([(uttname, transcriptions[uttname])
+                              for uttname in transcriptions if uttname not in aligned])
+    if not newtranscriptions:
+        print("No new utterances to align...")
+        return
+    print("Aligning %s new utterances (%s already aligned)..." % (len(newtranscriptions), len(aligned)))
+
+    os.makedirs(halign_input_transcr_dir)
+
+    #start alignment process..
+    utts = make_base_utts(voice, newtranscriptions)
+
+    #word instances continue after those in the previous dictionary (merged with this one)...
+    firstindex = last_wordinstance(os.path.join(previous_models_dir, ".".join([GenHAlign.MAINDICT_BN, DICT_EXT]))) + 1
+    halign_input_transcr_dir, pronundict_location = make_halign_input(voice, utts, halign_working_dir, firstindex)
+
+    GenHAlignIncremental(halign_config_location,
+                         overrides={"SOURCE:ORTHOGRAPHIC_TRANSCRIPTIONS" : halign_input_transcr_dir,
+                                    "SOURCE:PRONUNCIATION_DICTIONARY" : pronundict_location,
+                                    "SOURCE:AUDIO" : wav_dir,
+                                    "SOURCE:PREVIOUS_MODELS" : previous_models_dir,
+                                    "SOURCE:EXISTING_TEXTGRIDS" : textgrid_dir,
+                                    "PARMS:WORKING_DIR" : halign_working_dir,
+                                    "PARMS:SILENCE_PHONE" : silence_phone})
+
+    alignments = sl.Corpus(os.path.join(halign_working_dir, "textgrids"))
+
+    add_sylls_to_textgrids(voice, alignments, textgrid_dir)
+
+
 def from_textgrid(voice):
     """ Create aligned Utterances by synthesising to Word level from
         the orthography and filling in further SylStructure from the
@@ -590,6 +667,8 @@ def main():
             auto(voice)
         elif proc == "to_textgrid":
             to_textgrid(voice)
+        elif proc == "to_textgrid_incremental":
+            to_textgrid_incremental(voice)
         elif proc == "from_textgrid":
             from_textgrid(voice)
         elif proc == "alignments_from_textgrid":
@@ -597,7 +676,7 @@ def main():
         else:
             raise CLIException
     except CLIException:
-        print("USAGE: ttslab_align.py [VOICEFILE] [auto | to_textgrid | from_textgrid | alignments_from_textgrid]")
+        print("USAGE: ttslab_align.py [VOICEFILE] [auto | to_textgrid | to_textgrid_incremental | from_textgrid | alignments_from_textgrid]")
     
 
 if __name__ == "__main__":
@@ -12,8 +12,8 @@ __email__ = "dvn.demitasse@gmail.com"
 
 import os
 import sys
+import multiprocessing
 from collections import defaultdict
-from glob import glob
 import copy
 from tempfile import mkstemp
 from ConfigParser import ConfigParser
@@ -27,6 +27,8 @@ import ttslab
 import ttslab.hrg as hrg
 ttslab.extend(hrg.Utterance, "ufuncs_analysis")
 from ttslab.trackfile import Track
+from feature_pool import (FAILED_MANIFEST, FeatureExtractionError, run_cmd, num_workers,
+                          run_stage, write_failure_manifest, feature_jobs, catalogue_uttfiles)
 
 SAVE_COMPLETE_UTTS = True
 #sometimes the limit needs to be increased to pickle large utts...
@@ -62,11 +64,12 @@ WINDOWFACTOR = 1
 
 def make_units(voice, utt_dir):
     """ Run 'maketargetunits' process on Utterances to create Unit
-        level to generate structure for adding acoustic features...
+        level to generate structure for adding acoustic features
+        (utterances listed in FAILED_MANIFEST are skipped)...
     """
     print("MAKING UNITS..")
     utts = []
-    for uttfilename in sorted(glob(os.path.join(utt_dir, ".".join(["*", UTT_EXT])))):
+    for uttfilename in catalogue_uttfiles(utt_dir, UTT_EXT):
         print(uttfilename)
         utt = ttslab.fromfile(uttfilename)
         utt = voice.synthesizer(utt, "targetunits")     #DEMITASSE voice needs resynth method..
@@ -183,15 +186,15 @@ def extract_pitchmarks(args):
     wavfilename, minpitch, maxpitch, defstep, pm_dir= args
 
     basename = os.path.splitext(os.path.basename(wavfilename))[0]
-    print(basename)
         
     pme = PMExtractor(minpitch, maxpitch, defstep)
     pme.get_pmarks(wavfilename)
     pme.write_est_file(os.path.join(pm_dir, ".".join([basename, PM_EXT])))
 
-def make_pitchmarks(featconfig, wav_dir):
-    """ Make 'filled' pitchmarks for future pitch-synchronous feature
-        extraction...
+def pitchmark_settings(featconfig):
+    """ Settings for 'filled' pitchmarks for future pitch-synchronous
+        feature extraction (arguments following the wavefile for
+        'extract_pitchmarks')...
     """
 
     minpitch = int(featconfig.get("PITCH", "MIN"))
@@ -199,12 +202,8 @@ def make_pitchmarks(featconfig, wav_dir):
     defstep =  1 / float(featconfig.get("PITCH", "DEFAULT"))
     
     pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    os.mkdir(pm_dir)
 
-    print("MAKING PITCHMARKS...")
-    map(extract_pitchmarks,
-        [(wavfilename, minpitch, maxpitch, defstep, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+    return (minpitch, maxpitch, defstep, pm_dir)
 ########## PITCHMARKS
 
 ########## LPCs
@@ -229,8 +228,7 @@ def extract_lpcs(args):
                           window_factor,
                           "-window_type",
                           window_type])
-    print(cmdstring)
-    os.system(cmdstring)
+    run_cmd(cmdstring)
 
     # Extract the residual
     cmdstring = " ".join([SIGFILTER_BIN,
@@ -241,12 +239,12 @@ def extract_lpcs(args):
                           "-lpcfilter",
                           os.path.join(lpc_dir, ".".join([basename, LPC_EXT])),
                           "-inv_filter"])
-    print(cmdstring)
-    os.system(cmdstring)
+    run_cmd(cmdstring)
 
 
-def make_lpcs(featconfig, wav_dir):
-    """ Make lpcs and residuals for synthesis units..
+def lpc_settings(featconfig):
+    """ Settings for lpcs and residuals for synthesis units (arguments
+        following the wavefile for 'extract_lpcs')..
     """
     
     lpc_order = featconfig.get("SIG2FV_LPC", "LPC_ORDER")
@@ -256,12 +254,8 @@ def make_lpcs(featconfig, wav_dir):
 
     lpc_dir = os.path.join(os.getcwd(), LPC_DIR)
     pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    os.mkdir(lpc_dir)
 
-    print("MAKING LPCS...")
-    map(extract_lpcs,
-        [(wavfilename, lpc_order, preemph_coef, window_factor, window_type, lpc_dir, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+    return (lpc_order, preemph_coef, window_factor, window_type, lpc_dir, pm_dir)
 
 ########## LPCs
 
@@ -270,7 +264,6 @@ def extract_f0s(args):
     wavfilename, praatscript, pm_dir, f0_dir = args
 
     basename = os.path.splitext(os.path.basename(wavfilename))[0]
-    print(basename)
 
     pmfile = os.path.join(pm_dir, ".".join([basename, PM_EXT]))
     f0file = os.path.join(f0_dir, ".".join([basename, F0_EXT]))
@@ -280,30 +273,29 @@ def extract_f0s(args):
     f0file_writer.get_praat_f0(praatscript, wavfilename)
     f0file_writer.make_festival_f0(f0file)
 
-def make_f0s(featconfig, wav_dir):
-    """ Make f0s for incorporation in join costs..
+def make_praatscript(featconfig):
+    """ Make the Praat script for f0 extraction, returns (fd, path) to
+        be closed and removed once done...
     """
 
-    f0_dir = os.path.join(os.getcwd(), F0_DIR)
-    os.mkdir(f0_dir)
-    pm_dir = os.path.join(os.getcwd(), PM_DIR)
-
     psc_writer = F0_PSCWriter()
     psc_writer.min_pitch = int(featconfig.get("PITCH", "MIN"))
     psc_writer.max_pitch = int(featconfig.get("PITCH", "MAX"))
     psc_writer.default_pitch = int(featconfig.get("PITCH", "DEFAULT"))
 
-    #make the Praat script...
     fd, praatscript = mkstemp()
     psc_writer.create_praat_script(praatscript)
+    return fd, praatscript
 
-    print("MAKING F0s...")
-    map(extract_f0s,
-        [(wavfilename, praatscript, pm_dir, f0_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+def f0_settings(praatscript):
+    """ Settings for f0s for incorporation in join costs (arguments
+        following the wavefile for 'extract_f0s')..
+    """
+
+    f0_dir = os.path.join(os.getcwd(), F0_DIR)
+    pm_dir = os.path.join(os.getcwd(), PM_DIR)
 
-    os.close(fd)
-    os.remove(praatscript)
+    return (praatscript, pm_dir, f0_dir)
 ########## F0s
 
 ########## MCEPs
@@ -331,20 +323,16 @@ def extract_mceps(args):
                           os.path.join(mcep_dir, ".".join([basename, MCEP_EXT])),
                           "-pm",
                           os.path.join(pm_dir, ".".join([basename, PM_EXT]))])
-    print(cmdstring)
-    os.system(cmdstring)
+    run_cmd(cmdstring)
 
 
-def make_joincoefs(featconfig, wav_dir):
-    """ Make joincoefs...
+def mcep_settings(featconfig):
+    """ Settings for mceps used in joincoefs (arguments following the
+        wavefile for 'extract_mceps')...
     """
     
     mcep_dir = os.path.join(os.getcwd(), MCEP_DIR)
-    os.mkdir(mcep_dir)
-    join_dir = os.path.join(os.getcwd(), JOIN_DIR)
-    os.mkdir(join_dir)
     pm_dir = os.path.join(os.getcwd(), PM_DIR)
-    f0_dir = os.path.join(os.getcwd(), F0_DIR)
 
     fbank_order = featconfig.get("SIG2FV_MCEP", "FBANK_ORDER")
     melcep_order = featconfig.get("SIG2FV_MCEP", "MELCEP_ORDER")
@@ -352,11 +340,17 @@ def make_joincoefs(featconfig, wav_dir):
     preemph_coef = featconfig.get("SIG2FV_MCEP", "PREEMPH_COEF")
     window_factor = featconfig.get("SIG2FV_MCEP", "WINDOW_FACTOR")
     window_type = featconfig.get("SIG2FV_MCEP", "WINDOW_TYPE")
-    
-    print("MAKING JOINCOEFS...")
-    map(extract_mceps,
-        [(wavfilename, fbank_order, window_factor, preemph_coef, melcep_order, window_type, melcep_coefs, mcep_dir, pm_dir)
-         for wavfilename in sorted(glob(os.path.join(wav_dir, ".".join(["*", WAV_EXT]))))])
+
+    return (fbank_order, window_factor, preemph_coef, melcep_order, window_type, melcep_coefs, mcep_dir, pm_dir)
+
+def make_joincoefs(basenames):
+    """ Make joincoefs from the mceps and f0s of 'basenames' (needs
+        all files for the normalisation)...
+    """
+
+    mcep_dir = os.path.join(os.getcwd(), MCEP_DIR)
+    f0_dir = os.path.join(os.getcwd(), F0_DIR)
+    join_dir = os.path.join(os.getcwd(), JOIN_DIR)
 
     print("NORMALISING AND JOINING F0 AND MCEPS...")
     #Normalising mceps and f0s:
@@ -364,10 +358,10 @@ def make_joincoefs(featconfig, wav_dir):
     lower = -1.0
 
     mceptracks = {}
-    for fn in glob(os.path.join(mcep_dir, ".".join(["*", MCEP_EXT]))):
+    for basename in basenames:
         t = Track()
-        t.load_track(fn)
-        mceptracks[os.path.basename(fn)] = t
+        t.load_track(os.path.join(mcep_dir, ".".join([basename, MCEP_EXT])))
+        mceptracks[basename] = t
 
     allmcepvecs = np.concatenate([mceptracks[tn].values for tn in sorted(mceptracks)])
     mcepmean = allmcepvecs.mean(0)
@@ -376,10 +370,10 @@ def make_joincoefs(featconfig, wav_dir):
         mceptracks[k].values = (mceptracks[k].values - mcepmean) / (4 * mcepstd) * (upper - lower)
 
     f0tracks = {}
-    for fn in glob(os.path.join(f0_dir, ".".join(["*", F0_EXT]))):
+    for basename in basenames:
         t = Track()
-        t.load_track(fn)
-        f0tracks[os.path.basename(fn)] = t
+        t.load_track(os.path.join(f0_dir, ".".join([basename, F0_EXT])))
+        f0tracks[basename] = t
 
     #allf0vecs = np.concatenate([f0tracks[tn].values for tn in sorted(f0tracks)])
     allf0vecs = np.concatenate([f0tracks[tn].values[f0tracks[tn].values.nonzero()] for tn in sorted(f0tracks)])
@@ -389,14 +383,29 @@ def make_joincoefs(featconfig, wav_dir):
         f0tracks[k].values = (f0tracks[k].values - f0mean) / (4 * f0std) * (upper - lower)
 
     #Add f0 to mcep track:
-    for k1, k2 in zip(sorted(mceptracks), sorted(f0tracks)):
-        mceptracks[k1].values = np.concatenate((mceptracks[k1].values, f0tracks[k2].values), 1)
+    for basename in basenames:
+        mceptracks[basename].values = np.concatenate((mceptracks[basename].values, f0tracks[basename].values), 1)
 
-    for fn in mceptracks:
-        basename = os.path.splitext(os.path.basename(fn))[0]
-        ttslab.tofile(mceptracks[fn], os.path.join(join_dir, basename + "." + JOIN_EXT))
+    for basename in basenames:
+        ttslab.tofile(mceptracks[basename], os.path.join(join_dir, basename + "." + JOIN_EXT))
 ########## MCEPs
 
+def extract_features(args):
+    """ Take a single wavefile through all feature extraction:
+        pitchmarks, then lpcs and residual, f0 and mceps (which all
+        need the pitchmarks)...
+    """
+    wavfilename, pmsettings, lpcsettings, f0settings, mcepsettings = args
+
+    for stepname, extract, settings in [("pitchmarks", extract_pitchmarks, pmsettings),
+                                        ("lpcs", extract_lpcs, lpcsettings),
+                                        ("f0s", extract_f0s, f0settings),
+                                        ("mceps", extract_mceps, mcepsettings)]:
+        try:
+            extract((wavfilename,) + settings)
+        except Exception as e:
+            raise FeatureExtractionError("%s: %s: %s" % (stepname, e.__class__.__name__, e))
+
 
 def save_complete_utts(utts):
     """ Save Utterances to file...
@@ -443,25 +452,43 @@ def make_unit_catalogue(utts):
 def make_features(featconfig):
     """pitchmark extraction, f0 extraction, lpc and residual
        calculation as well as mcep extraction and adding of f0 to mcep
-       tracks to form joincoefs.
+       tracks to form joincoefs. Each file is taken through all
+       extraction steps by one of a pool of workers (see
+       'num_workers'), only the joincoef normalisation waits for all
+       files. Files that fail are listed in FAILED_MANIFEST.
     """
-    try:
-        import multiprocessing
-        POOL = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        def map(f, i):
-            return POOL.map(f, i, chunksize=1)
-    except ImportError:
-        pass
+    numprocs = num_workers(featconfig)
+    print("USING %s WORKER PROCESSES..." % numprocs)
+    pool = None
+    if numprocs > 1:
+        pool = multiprocessing.Pool(processes=numprocs)
 
     wav_dir = os.path.join(os.getcwd(), WAV_DIR)
+    failures = {}
+    for dirname in [PM_DIR, LPC_DIR, F0_DIR, MCEP_DIR, JOIN_DIR]:
+        os.mkdir(os.path.join(os.getcwd(), dirname))
+    fd, praatscript = make_praatscript(featconfig)
+    settings = (pitchmark_settings(featconfig),
+                lpc_settings(featconfig),
+                f0_settings(praatscript),
+                mcep_settings(featconfig))
 
-    make_pitchmarks(featconfig, wav_dir)
-    
-    make_lpcs(featconfig, wav_dir)
-
-    make_f0s(featconfig, wav_dir)
-
-    make_joincoefs(featconfig, wav_dir)
+    try:
+        run_stage("EXTRACTING FEATURES", extract_features,
+                  [(basename, (wavfilename,) + settings)
+                   for basename, wavfilename in feature_jobs(wav_dir)],
+                  pool, failures)
+
+        make_joincoefs([basename for basename, wavfilename in feature_jobs(wav_dir, failures)])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        os.close(fd)
+        os.remove(praatscript)
+        write_failure_manifest(failures)
+        if failures:
+            print("WARNING: %s files failed (see '%s')" % (len(failures), FAILED_MANIFEST))
 
 
 def make_catalogue(voice):
@@ -8,6 +8,7 @@ __email__ = "dvn.demitasse@gmail.com"
 import sys, os
 import copy
 from glob import glob
+import numpy as np
 import pylab as pl
 #sometimes the limit needs to be increased to pickle large utts...
 sys.setrecursionlimit(10000) #default is generally 1000
@@ -30,18 +31,17 @@ def parse_logl_from_recs(u, ul, phoneset, absl=False):
     phmap = phoneset.map
     
     assert u["file_id"] == ul.name
-    temp = None
-    segs = []
-    for seg in ul.segments:
-        if seg["name"] == closure_phone:
-            temp = [seg["duration"] / frameperiod, seg["score"]]
-        else:
-            if temp:
-                duration = temp[0] + seg["duration"] / frameperiod
-                score = (temp[0] * temp[1] + seg["duration"] / frameperiod * seg["score"]) / duration
-                segs.append([seg["name"], duration, score])
-            else:
-                segs.append([seg["name"], seg["duration"] / frameperiod, seg["score"]])
+    recarrays = ul.recArrays()
+    names = ul.segmentNames()
+    #closures are merged into the following segment (groups are
+    #numbered by the non-closure segments preceding each segment)...
+    closure = np.array([name == closure_phone for name in names], dtype=bool)
+    groups = np.cumsum(~closure) - ~closure
+    numsegs = int((~closure).sum())
+    numframes = recarrays["segment_durations"] / frameperiod
+    groupframes = np.bincount(groups, weights=numframes, minlength=numsegs + 1)[:numsegs]
+    groupscores = np.bincount(groups, weights=numframes * recarrays["segment_scores"], minlength=numsegs + 1)[:numsegs] / groupframes
+    segs = list(zip([name for name, isclosure in zip(names, closure) if not isclosure], groupframes.tolist(), groupscores.tolist()))
     usegs = u.get_relation("Segment").as_list()
     assert len(segs) == len(usegs)
     #add log likelihood scores to segments:
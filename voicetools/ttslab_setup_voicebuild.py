@@ -143,6 +143,12 @@ BOOT_TRANSCRIPTIONS:
 BOOT_TRANSCRIPTIONS_MAP: 
 BOOT_AUDIO: 
 
+#incremental alignment ('GenHAlignIncremental' method): the
+#'finalmodels' dir of a previous run and the dir of existing TextGrids
+#(audio files already aligned are skipped)...
+PREVIOUS_MODELS: 
+EXISTING_TEXTGRIDS: 
+
 #general
 FEATS_CONFIG: %s
 HMM_PROTOTYPE: %s
@@ -151,6 +157,48 @@ HMM_PROTOTYPE: %s
 WORKING_DIR:
 SILENCE_PHONE:
 SILENCE_WORD:
+# Number of HTK processes to run concurrently (1 -> serial; 0 -> all
+# available cores)...
+NUM_PROCESSES: 1
+
+# Embedded re-estimation engine: 'herest' (HTK's HERest) or 'native'
+# (in-process Baum-Welch, needs numpy; features must be stored in
+# the target parameter kind)...
+REESTIMATION_ENGINE: herest
+
+# Feature extraction front-end: 'hcopy' (HTK's HCopy) or 'native'
+# (in-process MFCC computation, needs numpy; MFCC based TARGETKINDs
+# only)...
+FEATURE_FRONTEND: hcopy
+
+# State tying engine: 'hhed' (HTK's HHEd) or 'native' (in-process
+# decision tree clustering, needs numpy)...
+TYING_ENGINE: hhed
+
+# Beam pruning in HERest and HVite: 'fixed' (a single pass with wide
+# beams) or 'adaptive' (a tight beam first, only utterances that fail
+# are rerun with progressively wider beams; these are listed in the
+# metrics report)...
+PRUNING_MODE: fixed
+
+# Re-estimation schedule: 'fixed' (fixed number of HERest passes per
+# stage) or 'converge' (iterate until the relative improvement in
+# average log prob per frame drops below CONVERGENCE_THRESHOLD, within
+# MIN_ITERATIONS and MAX_ITERATIONS)...
+REESTIMATION_SCHEDULE: fixed
+CONVERGENCE_THRESHOLD: 0.001
+MIN_ITERATIONS: 2
+MAX_ITERATIONS: 8
+
+# Passes of embedded re-estimation on the new data only before
+# aligning with the 'GenHAlignIncremental' method (0 -> align with the
+# previous models as they are)...
+ADAPTATION_ITERATIONS: 0
+
+# Realignment in the 'GenHAlignRealign' method: 'full' (all utterances)
+# or 'variants' (only utterances containing words with alternative
+# pronunciations, the results replace their entries in the phone MLF)...
+REALIGNMENT: full
 
 
 [SWITCHES]
@@ -206,6 +254,12 @@ PREEMPH_COEF: 0.95
 WINDOW_FACTOR: 3
 WINDOW_TYPE: hamming
 
+[PARALLEL]
+#Worker processes for feature extraction (0: number of CPUs), limited
+#so that each has MEM_PER_PROC megabytes of available memory..
+NUMPROCS: 0
+MEM_PER_PROC: 512
+
 """
     with codecs.open(os.path.join(etc_dir, "feats.conf"), "w", encoding="utf-8") as outfh:
         outfh.write(default_feats_config)